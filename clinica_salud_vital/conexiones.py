@@ -0,0 +1,117 @@
+"""
+Archivo: conexiones.py
+Ubicación: Proyecto principal (clinica_salud_vital)
+
+DESCRIPCIÓN GENERAL:
+--------------------
+Perfiles de conexión a PostgreSQL (`BASE_DATOS_CONEXIONES` en settings).
+
+Sin configuración, Django abre una conexión nueva al comienzo de cada petición y la
+cierra al terminar; con PostgreSQL eso (TCP, autenticación, arranque del proceso del
+servidor) es buena parte de la latencia de las peticiones cortas de la API. Perfiles:
+
+- `nueva`: el comportamiento anterior, una conexión por petición.
+- `persistente`: cada proceso (o hilo) del servidor reutiliza su conexión entre
+  peticiones durante `edad_maxima` segundos (`CONN_MAX_AGE`). Con
+  `verificar=True` (`CONN_HEALTH_CHECKS`) la conexión se verifica antes de reutilizarla
+  en una petición nueva, así que un reinicio de PostgreSQL no deja errores.
+  Funciona con psycopg2.
+- `pool`: pool de conexiones de psycopg 3 compartido por los hilos de cada proceso
+  (`OPTIONS['pool']`, Django 5.1+). Requiere `pip install "psycopg[binary,pool]"`.
+  `pool` admite las opciones de `psycopg_pool.ConnectionPool`: `min_size`,
+  `max_size`, `timeout` (segundos de espera por una conexión libre), `max_idle`,
+  `max_lifetime`, ... La verificación usa `ConnectionPool.check_connection`.
+
+`estadisticas()` entrega el perfil en uso, las estadísticas del pool (si lo hay) y las
+conexiones abiertas en el servidor (comando `python manage.py estadisticas_conexiones`);
+`python manage.py benchmark_conexiones` compara peticiones por segundo entre perfiles.
+
+Este módulo se importa desde settings: no debe importar modelos ni tocar la base de
+datos al cargarse.
+"""
+
+from importlib.util import find_spec
+
+from django.core.exceptions import ImproperlyConfigured
+
+NUEVA = 'nueva'
+PERSISTENTE = 'persistente'
+POOL = 'pool'
+PERFILES = (NUEVA, PERSISTENTE, POOL)
+
+
+def pool_disponible():
+    """
+    `True` si están instalados psycopg 3 y psycopg_pool.
+    """
+    return find_spec('psycopg') is not None and find_spec('psycopg_pool') is not None
+
+
+def perfil_conexiones(base, perfil, edad_maxima=600, verificar=True, pool=None):
+    """
+    Copia de `base` (una entrada de `DATABASES`) configurada según `perfil`.
+    """
+    if perfil not in PERFILES:
+        raise ImproperlyConfigured(
+            f'BASE_DATOS_CONEXIONES="{perfil}" no es válido. Perfiles: {", ".join(PERFILES)}.'
+        )
+    base = {**base, 'OPTIONS': dict(base.get('OPTIONS', {}))}
+    base['OPTIONS'].pop('pool', None)
+    base['CONN_HEALTH_CHECKS'] = verificar
+
+    if perfil == NUEVA:
+        base['CONN_MAX_AGE'] = 0
+    elif perfil == PERSISTENTE:
+        base['CONN_MAX_AGE'] = edad_maxima
+    else:
+        if not pool_disponible():
+            raise ImproperlyConfigured(
+                'BASE_DATOS_CONEXIONES="pool" requiere psycopg 3 con el pool: '
+                'pip install "psycopg[binary,pool]".'
+            )
+        # El pool reemplaza a las conexiones persistentes: Django exige CONN_MAX_AGE = 0.
+        base['CONN_MAX_AGE'] = 0
+        base['OPTIONS']['pool'] = dict(pool or {}) or True
+    return base
+
+
+def perfil_en_uso(settings_dict):
+    """
+    Perfil que corresponde a una entrada de `DATABASES` ya configurada.
+    """
+    if settings_dict.get('OPTIONS', {}).get('pool'):
+        return POOL
+    if settings_dict.get('CONN_MAX_AGE'):
+        return PERSISTENTE
+    return NUEVA
+
+
+def estadisticas(alias='default'):
+    """
+    `{perfil, edad_maxima, verificar, pool, servidor}` de la conexión `alias`.
+
+    `pool` son las estadísticas de psycopg_pool (`None` sin pool); `servidor` cuenta las
+    conexiones de clientes a esta base de datos por estado (`active`, `idle`, ...) según
+    `pg_stat_activity` (`None` con otros motores).
+    """
+    from django.db import connections
+
+    conexion = connections[alias]
+    datos = {
+        'perfil': perfil_en_uso(conexion.settings_dict),
+        'edad_maxima': conexion.settings_dict.get('CONN_MAX_AGE'),
+        'verificar': conexion.settings_dict.get('CONN_HEALTH_CHECKS'),
+        'pool': None,
+        'servidor': None,
+    }
+    if datos['perfil'] == POOL:
+        datos['pool'] = conexion.pool.get_stats()
+    if conexion.vendor == 'postgresql':
+        with conexion.cursor() as cursor:
+            cursor.execute(
+                "SELECT coalesce(state, 'desconocido'), count(*) FROM pg_stat_activity "
+                "WHERE datname = current_database() AND backend_type = 'client backend' "
+                "GROUP BY 1 ORDER BY 1"
+            )
+            datos['servidor'] = dict(cursor.fetchall())
+    return datos
@@ -5,6 +5,8 @@ Sistema de gestión médica para Salud Vital Ltda.
 
 from pathlib import Path
 
+from .conexiones import perfil_conexiones
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -75,6 +77,21 @@ DATABASES = {
         "PORT": "5432",
     }
 }
+
+# Conexiones a PostgreSQL (ver clinica_salud_vital/conexiones.py):
+# 'nueva' -> una conexión por petición; 'persistente' -> cada proceso reutiliza su conexión
+# hasta BASE_DATOS_EDAD_MAXIMA segundos; 'pool' -> pool de psycopg 3 con las opciones de
+# BASE_DATOS_POOL (requiere pip install "psycopg[binary,pool]"). Con BASE_DATOS_VERIFICAR
+# la conexión se verifica antes de reutilizarla.
+BASE_DATOS_CONEXIONES = 'persistente'
+BASE_DATOS_EDAD_MAXIMA = 600
+BASE_DATOS_VERIFICAR = True
+BASE_DATOS_POOL = {'min_size': 2, 'max_size': 10, 'timeout': 10}
+DATABASES['default'] = perfil_conexiones(
+    DATABASES['default'], BASE_DATOS_CONEXIONES, edad_maxima=BASE_DATOS_EDAD_MAXIMA,
+    verificar=BASE_DATOS_VERIFICAR, pool=BASE_DATOS_POOL,
+)
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -109,13 +126,87 @@ REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
     'DEFAULT_FILTER_BACKENDS': [
         'django_filters.rest_framework.DjangoFilterBackend',
-        'rest_framework.filters.SearchFilter',
+        # ?search= con índice de texto completo (ver gestion_clinica/busqueda.py).
+        'gestion_clinica.busqueda.BusquedaTextoFilter',
         'rest_framework.filters.OrderingFilter',
     ],
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
+    # Cursor (?despues= / ?antes=) con conteo opcional; ?page=N sigue disponible
+    # (ver gestion_clinica/paginacion_api.py).
+    'DEFAULT_PAGINATION_CLASS': 'gestion_clinica.paginacion_api.PaginacionAPI',
     'PAGE_SIZE': 10,
 }
 
+# Paginación de la API: tamaño máximo para ?page_size=, cálculo de `count` por defecto
+# ('estimado', 'exacto' o 'no') y bajo qué estimación se cuenta de forma exacta.
+API_TAMANO_PAGINA_MAXIMO = 500
+API_CONTEO = 'estimado'
+API_CONTEO_EXACTO_HASTA = 1000
+
+# Máximo de elementos por petición en los endpoints de carga masiva /api/<recurso>/lote/
+# (ver gestion_clinica/carga_masiva.py).
+API_LOTE_MAXIMO = 1000
+
+# Máximo de ids por petición en la lectura por ids ?ids=1,2,3 (ver LecturaPorIdsMixin
+# en gestion_clinica/mixins.py).
+API_IDS_MAXIMO = 100
+
+# Sincronización incremental (?cambios_desde=): segundos de antigüedad mínima de los cambios
+# entregados, para no saltarse transacciones confirmadas tarde (ver gestion_clinica/sincronizacion.py).
+API_SINCRONIZACION_MARGEN = 5
+# Días que se conservan las marcas de eliminación (RegistroEliminado); las más antiguas las
+# borra la tarea programada purgar_eliminados (python manage.py ejecutar_tareas).
+API_SINCRONIZACION_RETENCION_DIAS = 90
+
+# Filas por bloque que lee el cursor del servidor en /api/<recurso>/exportar/
+# (ver gestion_clinica/exportacion.py).
+API_EXPORTACION_BLOQUE = 2000
+
+# Exportación columnar para análisis (python manage.py exportar_analitica, /api/analitica/):
+# directorio de salida y procesos escritores (None = cantidad de CPUs). Parquet requiere
+# pyarrow (opcional); ver gestion_clinica/analitica.py.
+ANALITICA_DIRECTORIO = BASE_DIR / 'analitica'
+ANALITICA_PROCESOS = None
+
+# Cantidad de médicos por especialidad y medicamentos por laboratorio en la API:
+# False -> COUNT anotado en el queryset; True -> columnas almacenadas (ver gestion_clinica/contadores.py).
+CONTADORES_REFERENCIA_ALMACENADOS = False
+
+# Caché de Django: métricas del tablero y datos de referencia. Con varios procesos usar un
+# backend compartido para que la invalidación llegue a todos, por ejemplo:
+#   'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+#   'LOCATION': BASE_DIR / 'cache',
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'salud-vital',
+    },
+}
+
+# Segundos máximos que se conservan en caché las respuestas y opciones de especialidades,
+# laboratorios y medicamentos (se invalidan al guardar; ver gestion_clinica/cache_referencia.py).
+CACHE_REFERENCIA_TTL = 3600
+
+# Segundos que la página de inicio reutiliza las métricas del tablero desde la caché
+# (se invalidan al guardar; ver gestion_clinica/metricas.py).
+METRICAS_TABLERO_TTL = 60
+
+# Agenda de los médicos (ver gestion_clinica/agenda.py): días (0 = lunes) y bloques de atención
+# de cada jornada, para los médicos sin horarios propios (HorarioAtencion). None = sin restricción.
+AGENDA_JORNADAS = {
+    'COMPLETA': {'dias': [0, 1, 2, 3, 4], 'bloques': [('08:00', '13:00'), ('14:00', '18:00')]},
+    'PARCIAL': {'dias': [0, 1, 2, 3, 4], 'bloques': [('08:00', '13:00')]},
+    'TURNO': None,
+}
+
+# Tareas programadas (python manage.py ejecutar_tareas, ver gestion_clinica/tareas.py): filas por
+# lote de los barridos, segundos de pausa entre lotes, minutos sin avance tras los que una
+# ejecución EN_CURSO se da por abandonada, y horas desde el fin de una consulta AGENDADA para
+# marcarla NO_ASISTIO.
+TAREAS_TAMANO_LOTE = 500
+TAREAS_PAUSA_LOTES = 0.05
+TAREAS_ABANDONO_MINUTOS = 30
+TAREAS_GRACIA_CONSULTAS = 24
+
 # drf-spectacular settings para documentación
 SPECTACULAR_SETTINGS = {
     'TITLE': 'API Clínica Salud Vital',
@@ -43,7 +43,7 @@ proporcionando una interfaz completa para la gestión clínica sin necesidad de
 from django.contrib import admin
 from .models import (
     Especialidad, Paciente, Medico, ConsultaMedica,
-    Tratamiento, Medicamento, RecetaMedica, Laboratorio
+    Tratamiento, Medicamento, RecetaMedica, Laboratorio, HorarioAtencion
 )
 
 
@@ -79,6 +79,14 @@ class PacienteAdmin(admin.ModelAdmin):
     ordering = ['apellido_paterno', 'apellido_materno', 'nombre']
 
 
+class HorarioAtencionInline(admin.TabularInline):
+    """
+    Bloques de atención propios del médico (reemplazan los de su jornada; ver agenda.py).
+    """
+    model = HorarioAtencion
+    extra = 0
+
+
 @admin.register(Medico)
 class MedicoAdmin(admin.ModelAdmin):
     """
@@ -88,6 +96,7 @@ class MedicoAdmin(admin.ModelAdmin):
     list_filter = ['especialidad', 'jornada', 'activo']
     search_fields = ['rut', 'nombre', 'apellido_paterno', 'apellido_materno', 'numero_registro']
     ordering = ['apellido_paterno', 'apellido_materno', 'nombre']
+    inlines = [HorarioAtencionInline]
 
 
 
@@ -96,7 +105,7 @@ class ConsultaMedicaAdmin(admin.ModelAdmin):
     """
     Configuración del admin para ConsultaMedica.
     """
-    list_display = ['id', 'paciente', 'medico', 'fecha_hora', 'estado']
+    list_display = ['id', 'paciente', 'medico', 'fecha_hora', 'duracion', 'estado']
     list_filter = ['estado', 'medico__especialidad', 'fecha_hora']
     search_fields = ['paciente__nombre', 'medico__nombre', 'diagnostico']
     ordering = ['-fecha_hora']
@@ -0,0 +1,260 @@
+"""
+Archivo: agenda.py
+Ubicación: Aplicación 'gestion_clinica'
+
+DESCRIPCIÓN GENERAL:
+--------------------
+Agenda de los médicos: duración de las consultas, horario de atención y detección de
+consultas superpuestas.
+
+Cada `ConsultaMedica` ocupa el intervalo `[fecha_hora, fecha_fin)`, con `fecha_fin =
+fecha_hora + duracion` (minutos, `DURACION_MAXIMA_CONSULTA` como máximo) calculado en
+`save()`. Solo las consultas `AGENDADA` ocupan la agenda: cancelar una consulta libera
+su bloque.
+
+HORARIO DE ATENCIÓN:
+--------------------
+Un médico atiende en los bloques de su jornada (`AGENDA_JORNADAS` en settings; por
+ejemplo, `COMPLETA` de lunes a viernes 08:00-13:00 y 14:00-18:00) o, si tiene
+`HorarioAtencion` propios, solo en esos. Una jornada `None` no restringe el horario.
+
+SUPERPOSICIONES:
+----------------
+- Validación (formularios, API, carga masiva): `errores_agenda()` busca una consulta
+  superpuesta con el índice (medico, fecha_hora). Como ninguna consulta dura más de
+  `DURACION_MAXIMA_CONSULTA`, basta leer las que empiezan entre `inicio - máximo` y
+  `fin`: el costo es O(log n) aunque el historial del médico crezca.
+- Garantía: la base de datos rechaza dos consultas AGENDADAS superpuestas del mismo
+  médico aunque se guarden a la vez desde dos peticiones, sin bloqueos en la aplicación:
+    * PostgreSQL: `ExclusionConstraint` `RESTRICCION_AGENDA` en `ConsultaMedica.Meta`
+      (médico igual y `tstzrange(fecha_hora, fecha_fin, '[)')` solapado, con
+      `btree_gist`). La segunda transacción espera a la primera y falla si esta se
+      confirma. La migración 0010 resuelve las superposiciones previas acortando la
+      consulta anterior o, si no queda un bloque mínimo, cancelando la siguiente.
+    * SQLite: triggers `BEFORE INSERT/UPDATE` con la misma consulta acotada
+      (`preparar_agenda_sqlite`); SQLite serializa las escrituras.
+  `ConsultaMedica.save()` convierte ese error en `ConflictoAgenda` (un `IntegrityError`).
+
+Las validaciones solo se aplican a consultas nuevas o cuyo médico, fecha, duración o
+estado cambió, para que editar el diagnóstico de una consulta antigua no falle.
+"""
+
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import DURACION_MAXIMA_CONSULTA, RESTRICCION_AGENDA, ConsultaMedica, HorarioAtencion
+
+AGENDADA = 'AGENDADA'
+# Campos que cambian el lugar de una consulta en la agenda.
+CAMPOS_AGENDA = ('medico_id', 'fecha_hora', 'duracion', 'estado')
+MENSAJE_FUERA_DE_HORARIO = 'La consulta está fuera del horario de atención del médico.'
+
+JORNADAS_POR_DEFECTO = {
+    'COMPLETA': {'dias': [0, 1, 2, 3, 4], 'bloques': [('08:00', '13:00'), ('14:00', '18:00')]},
+    'PARCIAL': {'dias': [0, 1, 2, 3, 4], 'bloques': [('08:00', '13:00')]},
+    'TURNO': None,
+}
+
+
+def _hora(valor):
+    return valor if isinstance(valor, time) else time.fromisoformat(valor)
+
+
+# -----------------------------
+# Horario de atención
+# -----------------------------
+
+def _horario_jornada(jornada):
+    config = getattr(settings, 'AGENDA_JORNADAS', JORNADAS_POR_DEFECTO).get(jornada)
+    if config is None:
+        return None
+    bloques = [(_hora(inicio), _hora(fin)) for inicio, fin in config['bloques']]
+    return {dia: bloques for dia in config['dias']}
+
+
+def horarios_por_medico(medicos):
+    """
+    `{medico_id: {dia_semana: [(hora_inicio, hora_fin), ...]}}` (o `None` si el médico no
+    tiene restricción de horario) para `medicos`, con una consulta.
+    """
+    medicos = {medico.pk: medico for medico in medicos}
+    propios = {}
+    for bloque in HorarioAtencion.objects.filter(medico_id__in=medicos).order_by('hora_inicio'):
+        propios.setdefault(bloque.medico_id, {}).setdefault(bloque.dia_semana, []).append(
+            (bloque.hora_inicio, bloque.hora_fin)
+        )
+    return {
+        pk: propios[pk] if pk in propios else _horario_jornada(medico.jornada)
+        for pk, medico in medicos.items()
+    }
+
+
+def bloques_del_dia(horario, fecha):
+    """
+    Bloques de atención de `horario` en `fecha`, como pares de datetimes en la zona
+    horaria actual (lista vacía si no atiende ese día, `None` si no hay restricción).
+    """
+    if horario is None:
+        return None
+    zona = timezone.get_current_timezone()
+    return [
+        (timezone.make_aware(datetime.combine(fecha, inicio), zona),
+         timezone.make_aware(datetime.combine(fecha, fin), zona))
+        for inicio, fin in horario.get(fecha.weekday(), [])
+    ]
+
+
+def dentro_de_horario(horario, inicio, fin):
+    bloques = bloques_del_dia(horario, timezone.localtime(inicio).date())
+    if bloques is None:
+        return True
+    return any(desde <= inicio and fin <= hasta for desde, hasta in bloques)
+
+
+# -----------------------------
+# Superposiciones
+# -----------------------------
+
+def superpuestas(medico_id, inicio, fin, excluir=()):
+    """
+    Consultas AGENDADAS de `medico_id` que se superponen con `[inicio, fin)`.
+    """
+    return ConsultaMedica.objects.filter(
+        condicion_superposicion(medico_id, inicio, fin), estado=AGENDADA,
+    ).exclude(pk__in=[pk for pk in excluir if pk is not None])
+
+
+def condicion_superposicion(medico_id, inicio, fin):
+    # La cota inferior (ninguna consulta dura más del máximo) mantiene el rango del índice acotado.
+    return Q(
+        medico_id=medico_id,
+        fecha_hora__gt=inicio - timedelta(minutes=DURACION_MAXIMA_CONSULTA),
+        fecha_hora__lt=fin,
+        fecha_fin__gt=inicio,
+    )
+
+
+def requiere_validacion(consulta):
+    """
+    `True` si `consulta` está AGENDADA y es nueva o cambió su lugar en la agenda.
+    """
+    if consulta.estado != AGENDADA:
+        return False
+    if consulta.pk is None:
+        return True
+    return any(consulta.valor_original(campo) != getattr(consulta, campo) for campo in CAMPOS_AGENDA)
+
+
+def _intervalo(consulta):
+    return consulta.fecha_hora, consulta.fecha_hora + timedelta(minutes=consulta.duracion)
+
+
+def _mensaje_superposicion(otra):
+    hora = timezone.localtime(otra.fecha_hora)
+    return f'El médico ya tiene la consulta N° {otra.pk} agendada el {hora:%d/%m/%Y a las %H:%M}.'
+
+
+def errores_agenda(consulta):
+    """
+    `{'fecha_hora': [mensajes]}` si `consulta` (guardada o no) queda fuera del horario de
+    su médico o se superpone con otra consulta agendada; `{}` si no.
+    """
+    if not requiere_validacion(consulta):
+        return {}
+    inicio, fin = _intervalo(consulta)
+    mensajes = []
+    horario = horarios_por_medico([consulta.medico])[consulta.medico_id]
+    if not dentro_de_horario(horario, inicio, fin):
+        mensajes.append(MENSAJE_FUERA_DE_HORARIO)
+    otra = (
+        superpuestas(consulta.medico_id, inicio, fin, excluir=[consulta.pk])
+        .only('pk', 'fecha_hora').order_by('fecha_hora').first()
+    )
+    if otra is not None:
+        mensajes.append(_mensaje_superposicion(otra))
+    return {'fecha_hora': mensajes} if mensajes else {}
+
+
+def errores_lote(consultas):
+    """
+    Como `errores_agenda` para un lote (`[(indice, consulta), ...]`, ver `carga_masiva.py`),
+    incluidas las superposiciones entre consultas del mismo lote: `{indice: errores}`.
+    Usa una consulta para los horarios y una para las consultas existentes.
+    """
+    por_validar = [(indice, c) for indice, c in consultas if requiere_validacion(c)]
+    if not por_validar:
+        return {}
+    horarios = horarios_por_medico({c.medico_id: c.medico for _, c in por_validar}.values())
+
+    condicion = Q()
+    for _, consulta in por_validar:
+        condicion |= condicion_superposicion(consulta.medico_id, *_intervalo(consulta))
+    # Las consultas del lote que ya existían se evalúan con sus datos nuevos.
+    del_lote = [c.pk for _, c in consultas if c.pk is not None]
+    existentes = list(
+        ConsultaMedica.objects.filter(condicion, estado=AGENDADA)
+        .exclude(pk__in=del_lote).only('pk', 'medico_id', 'fecha_hora', 'fecha_fin')
+    )
+    validar = {id(consulta) for _, consulta in por_validar}
+
+    errores = {}
+    anteriores = []  # (medico_id, inicio, fin) de las consultas agendadas ya vistas del lote
+    for indice, consulta in consultas:
+        if consulta.estado != AGENDADA:
+            continue
+        inicio, fin = _intervalo(consulta)
+        if id(consulta) in validar:
+            mensajes = []
+            if not dentro_de_horario(horarios[consulta.medico_id], inicio, fin):
+                mensajes.append(MENSAJE_FUERA_DE_HORARIO)
+            otra = next((
+                e for e in existentes
+                if e.medico_id == consulta.medico_id and e.fecha_hora < fin and e.fecha_fin > inicio
+            ), None)
+            if otra is not None:
+                mensajes.append(_mensaje_superposicion(otra))
+            elif any(m == consulta.medico_id and i < fin and f > inicio for m, i, f in anteriores):
+                mensajes.append('Se superpone con otra consulta del mismo médico en este lote.')
+            if mensajes:
+                errores[indice] = {'fecha_hora': mensajes}
+                continue
+        anteriores.append((consulta.medico_id, inicio, fin))
+    return errores
+
+
+# -----------------------------
+# SQLite
+# -----------------------------
+
+def _sql_triggers_sqlite():
+    tabla = ConsultaMedica._meta.db_table
+    superposicion = (
+        f"SELECT RAISE(ABORT, '{RESTRICCION_AGENDA}') WHERE EXISTS ("
+        f"SELECT 1 FROM \"{tabla}\" c WHERE c.medico_id = NEW.medico_id AND c.estado = 'AGENDADA' "
+        f"AND c.fecha_hora > datetime(NEW.fecha_hora, '-{DURACION_MAXIMA_CONSULTA + 1} minutes') "
+        f"AND c.fecha_hora < NEW.fecha_fin AND c.fecha_fin > NEW.fecha_hora AND c.id IS NOT NEW.id);"
+    )
+    return [
+        f"CREATE TRIGGER IF NOT EXISTS \"{RESTRICCION_AGENDA}_ai\" BEFORE INSERT ON \"{tabla}\" "
+        f"WHEN NEW.estado = 'AGENDADA' BEGIN {superposicion} END",
+        f"CREATE TRIGGER IF NOT EXISTS \"{RESTRICCION_AGENDA}_au\" BEFORE UPDATE ON \"{tabla}\" "
+        f"WHEN NEW.estado = 'AGENDADA' BEGIN {superposicion} END",
+    ]
+
+
+def preparar_agenda_sqlite(alias='default'):
+    """
+    Crea en SQLite los triggers equivalentes a la restricción de exclusión de PostgreSQL.
+    Se llama tras cada `migrate`, porque las migraciones que reconstruyen la tabla en
+    SQLite eliminan sus triggers. No hace nada en otros motores.
+    """
+    conexion = connections[alias]
+    if conexion.vendor != 'sqlite':
+        return
+    with conexion.cursor() as cursor:
+        for sql in _sql_triggers_sqlite():
+            cursor.execute(sql)
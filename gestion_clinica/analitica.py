@@ -0,0 +1,435 @@
+"""
+Archivo: analitica.py
+Ubicación: Aplicación 'gestion_clinica'
+
+DESCRIPCIÓN GENERAL:
+--------------------
+Exportación columnar para análisis (notebooks, pandas, DuckDB, Spark).
+
+Descargar consultas, tratamientos, recetas y medicamentos como JSON desde la API es
+demasiado lento para análisis. `exportar()` escribe cada tabla en archivos Parquet
+particionados por mes, con el esquema de particiones de Hive que entienden
+`pyarrow.dataset`, `pandas.read_parquet` y DuckDB:
+
+    <ANALITICA_DIRECTORIO>/
+        manifiesto.json
+        consultas/mes=2025-01/parte.parquet      (por mes de fecha_hora)
+        tratamientos/mes=2025-01/parte.parquet   (por mes de fecha_inicio)
+        recetas/mes=2025-01/parte.parquet        (por mes de fecha_emision)
+        medicamentos/parte.parquet               (catálogo, sin particionar)
+
+Cada partición la escribe un proceso de un `ProcessPoolExecutor`
+(`ANALITICA_PROCESOS`), leyendo sus filas con un cursor del servidor y escribiéndolas
+por bloques, así que la memoria de cada proceso no depende del tamaño del mes.
+
+EJECUCIONES INCREMENTALES:
+--------------------------
+`manifiesto.json` guarda, por partición, la cantidad de filas, la mayor
+`fecha_modificacion` con que se escribió y una huella (`relaciones`) de los valores
+exportados desde tablas relacionadas (el nombre de la especialidad, del medicamento,
+etc.): SHA-1 de los grupos `(clave foránea, valores exportados, filas)` de la
+partición. La huella no usa la `fecha_modificacion` de esas tablas, que cambia por
+motivos que no se exportan (el stock de un medicamento con cada receta, los contadores
+de una especialidad al contratar un médico). Cada ejecución calcula esos valores para
+todas las particiones con dos consultas agrupadas por tabla y solo reescribe las que
+cambiaron (filas nuevas, modificadas o eliminadas, o un valor relacionado distinto);
+las particiones que quedaron vacías se borran. `completa=True` reescribe todo.
+
+DEPENDENCIAS:
+-------------
+El formato Parquet requiere `pyarrow` (opcional: `pip install pyarrow`). Sin él se
+puede usar `formato='csv'` (un CSV por partición, mismo esquema de carpetas).
+Se usa desde el comando `python manage.py exportar_analitica` y desde la API
+(`/api/analitica/`, ver `views.py`). `POST /api/analitica/exportar/` no exporta dentro de
+la petición: solicita la tarea `exportar_analitica` (ver `tareas.py`), que ejecuta
+`python manage.py ejecutar_tareas` en su propio proceso.
+"""
+
+import csv
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Count, DateField, Max, Value
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from .models import ConsultaMedica, Medicamento, RecetaMedica, Tratamiento
+from .tareas import tarea
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # pragma: no cover - depende del entorno
+    pyarrow = None
+
+PARQUET = 'parquet'
+CSV = 'csv'
+FORMATOS = (PARQUET, CSV)
+ARCHIVO_MANIFIESTO = 'manifiesto.json'
+SIN_PARTICION = ''
+BLOQUE_FILAS = 10000
+
+
+class ExportacionNoDisponible(Exception):
+    """
+    El formato pedido no se puede escribir en este entorno (p. ej. falta `pyarrow`).
+    """
+
+
+class TablaAnalitica:
+    """
+    Tabla exportable: modelo, campo de fecha que define la partición mensual (o `None`)
+    y columnas adicionales obtenidas de relaciones (`{columna: ruta ORM}`).
+    """
+
+    def __init__(self, modelo, campo_fecha=None, relaciones=None):
+        self.modelo = modelo
+        self.campo_fecha = campo_fecha
+        self.relaciones = relaciones or {}
+
+    @property
+    def es_fecha_hora(self):
+        campo = self.modelo._meta.get_field(self.campo_fecha)
+        return campo.get_internal_type() == 'DateTimeField'
+
+    def columnas(self):
+        """
+        `[(columna, ruta ORM, campo Django)]`: columnas propias (sin las de búsqueda) y
+        las de `relaciones`.
+        """
+        propias = [
+            (campo.attname, campo.attname, campo)
+            for campo in self.modelo._meta.concrete_fields
+            if campo.name not in getattr(self.modelo, 'campos_busqueda', ())
+        ]
+        adicionales = []
+        for columna, ruta in self.relaciones.items():
+            modelo, *camino, final = [self.modelo] + ruta.split('__')
+            for paso in camino:
+                modelo = modelo._meta.get_field(paso).related_model
+            adicionales.append((columna, ruta, modelo._meta.get_field(final)))
+        return propias + adicionales
+
+    def rutas_relacionadas(self):
+        """
+        Rutas ORM que definen las columnas de `relaciones`: la clave foránea de la que
+        parte cada una (dos medicamentos que intercambian nombres cambian las filas
+        aunque los nombres sigan siendo los mismos) y el valor exportado.
+        """
+        rutas = set(self.relaciones.values())
+        for ruta in self.relaciones.values():
+            rutas.add(self.modelo._meta.get_field(ruta.split('__')[0]).attname)
+        return sorted(rutas)
+
+    def queryset(self):
+        return self.modelo.objects.order_by()
+
+
+TABLAS = {
+    'consultas': TablaAnalitica(ConsultaMedica, 'fecha_hora', {
+        'especialidad': 'medico__especialidad__nombre',
+    }),
+    'tratamientos': TablaAnalitica(Tratamiento, 'fecha_inicio', {
+        'paciente_id': 'consulta__paciente_id',
+        'medico_id': 'consulta__medico_id',
+    }),
+    'recetas': TablaAnalitica(RecetaMedica, 'fecha_emision', {
+        'medicamento': 'medicamento__nombre',
+        'principio_activo': 'medicamento__principio_activo',
+    }),
+    'medicamentos': TablaAnalitica(Medicamento, relaciones={
+        'laboratorio': 'laboratorio__nombre',
+    }),
+}
+
+
+def directorio():
+    return str(getattr(settings, 'ANALITICA_DIRECTORIO', os.path.join(settings.BASE_DIR, 'analitica')))
+
+
+def parquet_disponible():
+    return pyarrow is not None
+
+
+# -----------------------------
+# Particiones
+# -----------------------------
+
+def _inicio_mes(valor):
+    return valor.strftime('%Y-%m') if valor is not None else SIN_PARTICION
+
+
+def _iso(valor):
+    return valor.isoformat() if valor else None
+
+
+def _con_mes(tabla, qs):
+    if tabla.campo_fecha is None:
+        return qs.annotate(mes=Value(None, output_field=DateField()))
+    opciones = {'tzinfo': timezone.get_current_timezone()} if tabla.es_fecha_hora else {}
+    return qs.annotate(mes=TruncMonth(tabla.campo_fecha, **opciones))
+
+
+def huellas_relaciones(tabla):
+    """
+    `{particion: SHA-1}` de los valores que la tabla exporta desde sus relaciones, con
+    una consulta agrupada por mes y por esos valores (`{}` si no tiene relaciones).
+    """
+    rutas = tabla.rutas_relacionadas()
+    if not rutas:
+        return {}
+    grupos = (_con_mes(tabla, tabla.queryset())
+              .values('mes', *rutas)
+              .annotate(filas=Count('pk'))
+              .order_by('mes', *rutas))
+    huellas = {}
+    for grupo in grupos.iterator(chunk_size=BLOQUE_FILAS):
+        particion = _inicio_mes(grupo.pop('mes'))
+        huella = huellas.setdefault(particion, hashlib.sha1())
+        huella.update(repr([grupo[ruta] for ruta in rutas] + [grupo['filas']]).encode('utf-8'))
+    return {particion: huella.hexdigest() for particion, huella in huellas.items()}
+
+
+def resumen_particiones(tabla):
+    """
+    `{particion: {'filas', 'modificacion', 'relaciones'}}` de una tabla, con una consulta
+    agrupada y la de `huellas_relaciones()`.
+    """
+    filas = (_con_mes(tabla, tabla.queryset())
+             .values('mes')
+             .annotate(filas=Count('pk'), modificacion=Max('fecha_modificacion')))
+    huellas = huellas_relaciones(tabla)
+    return {
+        _inicio_mes(fila['mes']): {
+            'filas': fila['filas'],
+            'modificacion': _iso(fila['modificacion']),
+            'relaciones': huellas.get(_inicio_mes(fila['mes'])),
+        }
+        # Sin partición, la consulta no agrupa y devuelve una fila aunque no haya datos.
+        for fila in filas if fila['filas']
+    }
+
+
+def _rango_mes(tabla, particion):
+    anio, mes = (int(parte) for parte in particion.split('-'))
+    inicio = date(anio, mes, 1)
+    fin = date(anio + (mes == 12), mes % 12 + 1, 1)
+    if tabla.es_fecha_hora:
+        zona = timezone.get_current_timezone()
+        inicio = timezone.make_aware(datetime.combine(inicio, datetime.min.time()), zona)
+        fin = timezone.make_aware(datetime.combine(fin, datetime.min.time()), zona)
+    return {f'{tabla.campo_fecha}__gte': inicio, f'{tabla.campo_fecha}__lt': fin}
+
+
+def ruta_particion(base, clave_tabla, particion, formato):
+    carpeta = os.path.join(base, clave_tabla)
+    if particion != SIN_PARTICION:
+        carpeta = os.path.join(carpeta, f'mes={particion}')
+    return os.path.join(carpeta, f'parte.{formato}')
+
+
+# -----------------------------
+# Escritura de una partición (se ejecuta en los procesos del pool)
+# -----------------------------
+
+_TIPOS_ARROW = {
+    'AutoField': 'int64', 'BigAutoField': 'int64', 'IntegerField': 'int64',
+    'BigIntegerField': 'int64', 'PositiveIntegerField': 'int64', 'ForeignKey': 'int64',
+    'BooleanField': 'bool_', 'DateField': 'date32',
+}
+
+
+def _esquema_arrow(columnas):
+    campos = []
+    for nombre, _, campo in columnas:
+        tipo = campo.get_internal_type()
+        if tipo == 'DateTimeField':
+            tipo_arrow = pyarrow.timestamp('us', tz='UTC')
+        else:
+            tipo_arrow = getattr(pyarrow, _TIPOS_ARROW.get(tipo, 'string'))()
+        campos.append(pyarrow.field(nombre, tipo_arrow))
+    return pyarrow.schema(campos)
+
+
+def _bloques(filas, tamano=BLOQUE_FILAS):
+    bloque = []
+    for fila in filas:
+        bloque.append(fila)
+        if len(bloque) >= tamano:
+            yield bloque
+            bloque = []
+    if bloque:
+        yield bloque
+
+
+def _escribir_parquet(ruta, columnas, filas):
+    esquema = _esquema_arrow(columnas)
+    with pyarrow.parquet.ParquetWriter(ruta, esquema, compression='snappy') as escritor:
+        for bloque in _bloques(filas):
+            datos = {nombre: [fila[i] for fila in bloque] for i, (nombre, _, _) in enumerate(columnas)}
+            escritor.write_table(pyarrow.Table.from_pydict(datos, schema=esquema))
+
+
+def _escribir_csv(ruta, columnas, filas):
+    with open(ruta, 'w', newline='', encoding='utf-8') as archivo:
+        escritor = csv.writer(archivo)
+        escritor.writerow([nombre for nombre, _, _ in columnas])
+        for fila in filas:
+            escritor.writerow(['' if v is None else v.isoformat() if hasattr(v, 'isoformat') else v
+                               for v in fila])
+
+
+def escribir_particion(clave_tabla, particion, base, formato):
+    """
+    Escribe una partición completa (reemplazo atómico del archivo) y devuelve la
+    cantidad de filas escritas. Se ejecuta en un proceso del pool.
+    """
+    tabla = TABLAS[clave_tabla]
+    columnas = tabla.columnas()
+    qs = tabla.queryset()
+    if particion != SIN_PARTICION:
+        qs = qs.filter(**_rango_mes(tabla, particion))
+    filas = qs.order_by('pk').values_list(*[ruta for _, ruta, _ in columnas]).iterator(chunk_size=BLOQUE_FILAS)
+
+    ruta = ruta_particion(base, clave_tabla, particion, formato)
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    temporal = f'{ruta}.tmp'
+    contador = _Contador(filas)
+    if formato == PARQUET:
+        _escribir_parquet(temporal, columnas, contador)
+    else:
+        _escribir_csv(temporal, columnas, contador)
+    os.replace(temporal, ruta)
+    return contador.total
+
+
+class _Contador:
+    def __init__(self, filas):
+        self.filas = filas
+        self.total = 0
+
+    def __iter__(self):
+        for fila in self.filas:
+            self.total += 1
+            yield fila
+
+
+def _inicializar_proceso():
+    # Con 'spawn' (macOS/Windows) el proceso hijo arranca sin Django configurado.
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+
+
+# -----------------------------
+# Orquestación
+# -----------------------------
+
+def leer_manifiesto(base=None):
+    ruta = os.path.join(base or directorio(), ARCHIVO_MANIFIESTO)
+    if not os.path.exists(ruta):
+        return {'formato': None, 'tablas': {}}
+    with open(ruta, encoding='utf-8') as archivo:
+        return json.load(archivo)
+
+
+def _guardar_manifiesto(base, manifiesto):
+    ruta = os.path.join(base, ARCHIVO_MANIFIESTO)
+    with open(f'{ruta}.tmp', 'w', encoding='utf-8') as archivo:
+        json.dump(manifiesto, archivo, indent=2, sort_keys=True)
+    os.replace(f'{ruta}.tmp', ruta)
+
+
+def _eliminar_particion(base, clave_tabla, particion, formato):
+    ruta = ruta_particion(base, clave_tabla, particion, formato)
+    if os.path.exists(ruta):
+        os.remove(ruta)
+    if particion != SIN_PARTICION:
+        shutil.rmtree(os.path.dirname(ruta), ignore_errors=True)
+
+
+def exportar(tablas=None, formato=PARQUET, procesos=None, completa=False, base=None, al_escribir=None):
+    """
+    Exporta `tablas` (claves de `TABLAS`, todas por defecto) y devuelve
+    `{tabla: {'escritas': [...], 'eliminadas': [...], 'sin_cambios': n}}`.
+    `al_escribir(tabla, particion, filas)` se llama tras escribir cada partición.
+
+    `procesos=1` escribe en el mismo proceso (sin pool). Lanza `ExportacionNoDisponible`
+    si se pide Parquet sin `pyarrow` instalado, y `KeyError` si una tabla no existe.
+    """
+    if formato not in FORMATOS:
+        raise ExportacionNoDisponible(f'Formatos válidos: {", ".join(FORMATOS)}.')
+    if formato == PARQUET and not parquet_disponible():
+        raise ExportacionNoDisponible('El formato Parquet requiere pyarrow (pip install pyarrow).')
+
+    base = base or directorio()
+    tablas = list(tablas or TABLAS)
+    os.makedirs(base, exist_ok=True)
+    manifiesto = leer_manifiesto(base)
+    if manifiesto.get('formato') != formato:
+        # Cambiar de formato obliga a reescribir todo.
+        completa = True
+        manifiesto = {'formato': formato, 'tablas': {}}
+
+    pendientes, informe = [], {}
+    for clave in tablas:
+        tabla = TABLAS[clave]
+        actual = resumen_particiones(tabla)
+        anterior = {} if completa else manifiesto['tablas'].get(clave, {})
+        if completa:
+            shutil.rmtree(os.path.join(base, clave), ignore_errors=True)
+        cambiadas = [p for p, resumen in actual.items() if anterior.get(p) != resumen]
+        eliminadas = [p for p in anterior if p not in actual]
+        for particion in eliminadas:
+            _eliminar_particion(base, clave, particion, formato)
+        pendientes += [(clave, particion) for particion in sorted(cambiadas)]
+        manifiesto['tablas'][clave] = actual
+        informe[clave] = {
+            'escritas': sorted(cambiadas), 'eliminadas': sorted(eliminadas),
+            'sin_cambios': len(actual) - len(cambiadas),
+        }
+
+    _ejecutar(pendientes, base, formato, procesos, al_escribir)
+    manifiesto['generado'] = timezone.now().isoformat()
+    _guardar_manifiesto(base, manifiesto)
+    return informe
+
+
+def _ejecutar(pendientes, base, formato, procesos, al_escribir=None):
+    al_escribir = al_escribir or (lambda clave, particion, filas: None)
+    procesos = procesos or getattr(settings, 'ANALITICA_PROCESOS', None) or os.cpu_count() or 1
+    procesos = min(procesos, len(pendientes))
+    if procesos <= 1:
+        for clave, particion in pendientes:
+            al_escribir(clave, particion, escribir_particion(clave, particion, base, formato))
+        return
+
+    # Los procesos hijos no deben heredar conexiones abiertas: cada uno abre la suya.
+    connections.close_all()
+    metodo = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else None
+    with ProcessPoolExecutor(max_workers=procesos, initializer=_inicializar_proceso,
+                             mp_context=multiprocessing.get_context(metodo)) as pool:
+        futuros = [(clave, particion, pool.submit(escribir_particion, clave, particion, base, formato))
+                   for clave, particion in pendientes]
+        for clave, particion, futuro in futuros:
+            al_escribir(clave, particion, futuro.result())
+
+
+# -----------------------------
+# Tarea a pedido (POST /api/analitica/exportar/)
+# -----------------------------
+
+@tarea('exportar_analitica', cada=None)
+def exportar_solicitada(avance, ahora, tablas=None, formato=PARQUET):
+    """
+    Actualiza la exportación analítica solicitada desde la API (un lote por partición).
+    """
+    exportar(tablas=tablas, formato=formato, al_escribir=lambda clave, particion, filas: avance.lote(filas))
@@ -4,3 +4,12 @@ from django.apps import AppConfig
 class GestionClinicaConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'gestion_clinica'
+
+    def ready(self):
+        # Registra los receptores de señales (contadores y datos derivados).
+        from django.db.models.signals import post_migrate
+
+        from . import signals
+
+        post_migrate.connect(signals.preparar_busqueda_tras_migrar, sender=self)
+        post_migrate.connect(signals.preparar_agenda_tras_migrar, sender=self)
@@ -0,0 +1,210 @@
+"""
+Archivo: autocompletar.py
+Ubicación: Aplicación 'gestion_clinica'
+
+DESCRIPCIÓN GENERAL:
+--------------------
+Sugerencias por prefijo para los campos de texto de los filtros (`filters.py`).
+
+Antes, los filtros armaban un `<select>` con todos los valores distintos de la columna
+(`SELECT DISTINCT` sobre la tabla completa en cada request). Ahora el filtro es un
+campo de texto y el navegador pide sugerencias a medida que el usuario escribe:
+
+    GET /api/autocompletar/paciente-rut/?q=12.3   →   {"resultados": ["12.345.678-9", ...]}
+
+Cada consulta filtra con `UPPER(campo) LIKE 'PREFIJO%'`, que PostgreSQL resuelve con
+los índices de prefijo creados en la migración `0005_indices_prefijo`, y devuelve
+como máximo `LIMITE_SUGERENCIAS` valores.
+
+Solo se pueden consultar los campos registrados en `CAMPOS_AUTOCOMPLETAR`.
+
+SELECTORES CON BÚSQUEDA REMOTA:
+-------------------------------
+Los formularios que eligen un paciente o un médico ya no cargan un `<select>` con
+todos los registros activos. En su lugar muestran un campo de búsqueda que consulta:
+
+    GET /api/buscar/pacientes/?q=muñ   →   {"resultados": [{"id": 7, "texto": "..."}, ...]}
+
+La búsqueda compara por prefijo contra el RUT o contra `nombre_normalizado`
+("apellidos nombre" sin tildes, ver `normalizacion.py`), solo entre registros
+activos, y devuelve como máximo `LIMITE_RESULTADOS_BUSQUEDA` filas. Ambas
+comparaciones usan índices parciales de la migración `0006_busqueda_personas`.
+Las entidades disponibles están registradas en `BUSQUEDAS`; además de pacientes y
+médicos, los formularios de tratamiento y receta buscan consultas y tratamientos por
+número o por el RUT/apellidos del paciente (widget `SelectorRemoto` de `forms.py`).
+"""
+
+from django.db.models import Q
+from django.urls import reverse, reverse_lazy
+from django.utils import timezone
+
+from .models import ConsultaMedica, Especialidad, Laboratorio, Medico, Paciente, Tratamiento
+from .normalizacion import normalizar_rut, normalizar_texto
+
+LIMITE_SUGERENCIAS = 10
+LIMITE_RESULTADOS_BUSQUEDA = 20
+MIN_CARACTERES = 2
+
+# clave pública -> (modelo, campo)
+CAMPOS_AUTOCOMPLETAR = {
+    'paciente-nombre': (Paciente, 'nombre'),
+    'paciente-apellido': (Paciente, 'apellido_paterno'),
+    'paciente-rut': (Paciente, 'rut'),
+    'especialidad-nombre': (Especialidad, 'nombre'),
+    'laboratorio-pais': (Laboratorio, 'pais'),
+}
+
+
+def sugerencias(clave, prefijo, limite=LIMITE_SUGERENCIAS):
+    """
+    Devuelve hasta `limite` valores distintos del campo `clave` que comienzan con `prefijo`.
+    Lanza `KeyError` si la clave no está registrada.
+    """
+    modelo, campo = CAMPOS_AUTOCOMPLETAR[clave]
+    prefijo = (prefijo or '').strip()
+    if len(prefijo) < MIN_CARACTERES:
+        return []
+    return list(
+        modelo.objects.filter(**{f'{campo}__istartswith': prefijo})
+        .order_by(campo)
+        .values_list(campo, flat=True)
+        .distinct()[:limite]
+    )
+
+
+def atributos_widget(clave):
+    """
+    Atributos HTML para un `<input>` que consulta las sugerencias de `clave`
+    (los usa `static/autocompletar.js`).
+    """
+    return {
+        'data-autocompletar': reverse_lazy('autocompletar', args=[clave]),
+        'autocomplete': 'off',
+        'class': 'form-control',
+    }
+
+
+# -----------------------------
+# Selectores con búsqueda remota
+# -----------------------------
+
+def _filtro_persona(q, prefijo=''):
+    """
+    Prefijo de `nombre_normalizado` o, si el texto parece un RUT, prefijo del RUT.
+    `prefijo` permite aplicar el filtro a través de una relación ('paciente__').
+    """
+    condicion = Q(**{f'{prefijo}nombre_normalizado__startswith': normalizar_texto(q)})
+    if q[:1].isdigit():
+        condicion |= (Q(**{f'{prefijo}rut__startswith': q})
+                      | Q(**{f'{prefijo}rut__startswith': normalizar_rut(q)}))
+    return condicion
+
+
+def _filtro_por_id_o_paciente(prefijo):
+    def filtro(q):
+        condicion = _filtro_persona(q, prefijo)
+        if q.isdigit():
+            condicion |= Q(pk=int(q))
+        return condicion
+    return filtro
+
+
+class Busqueda:
+    """
+    Entidad disponible para los selectores remotos.
+
+    - `base()`: queryset con las filas elegibles, el orden y solo las columnas que
+      usa `etiqueta` (también lo usa el formulario para validar la opción elegida).
+    - `filtro(q)`: condición `Q` para el texto ingresado.
+    - `etiqueta(obj)`: texto visible de cada opción.
+    """
+
+    def __init__(self, base, filtro, etiqueta):
+        self.base = base
+        self.filtro = filtro
+        self.etiqueta = etiqueta
+
+
+_PERSONA = ('nombre', 'apellido_paterno', 'apellido_materno')
+
+
+def _con_prefijo(prefijo, campos):
+    return [f'{prefijo}__{campo}' for campo in campos]
+
+
+def _pacientes():
+    return (Paciente.objects.filter(activo=True)
+            .only('rut', *_PERSONA, 'nombre_normalizado')
+            .order_by('nombre_normalizado', 'id'))
+
+
+def _medicos():
+    return (Medico.objects.filter(activo=True)
+            .select_related('especialidad')
+            .only(*_PERSONA, 'nombre_normalizado', 'especialidad__nombre')
+            .order_by('nombre_normalizado', 'id'))
+
+
+def _consultas_realizadas():
+    return (ConsultaMedica.objects.filter(estado='REALIZADA', paciente__activo=True)
+            .select_related('paciente', 'medico')
+            .only('fecha_hora', 'paciente', *_con_prefijo('paciente', _PERSONA),
+                  'medico', *_con_prefijo('medico', _PERSONA))
+            .order_by('-fecha_hora', '-id'))
+
+
+def _tratamientos_activos():
+    return (Tratamiento.objects.filter(activo=True)
+            .select_related('consulta__paciente', 'consulta__medico')
+            .only('consulta', 'consulta__paciente', *_con_prefijo('consulta__paciente', _PERSONA),
+                  'consulta__medico', *_con_prefijo('consulta__medico', _PERSONA))
+            .order_by('-fecha_inicio', '-id'))
+
+
+def _etiqueta_consulta(c):
+    fecha = timezone.localtime(c.fecha_hora).strftime('%d/%m/%Y %H:%M')
+    return f"Consulta #{c.id} · {c.paciente.nombre_completo} con {c.medico.nombre_completo} · {fecha}"
+
+
+def _etiqueta_tratamiento(t):
+    return (f"Tratamiento #{t.id} · {t.consulta.paciente.nombre_completo} "
+            f"({t.consulta.medico.nombre_completo})")
+
+
+BUSQUEDAS = {
+    'pacientes': Busqueda(_pacientes, _filtro_persona,
+                          lambda p: f"{p.nombre_completo} · {p.rut}"),
+    'medicos': Busqueda(_medicos, _filtro_persona,
+                        lambda m: f"{m.nombre_completo} · {m.especialidad.nombre}"),
+    # Consultas y tratamientos: por número (#id) o por RUT/apellidos del paciente.
+    'consultas': Busqueda(_consultas_realizadas, _filtro_por_id_o_paciente('paciente__'),
+                          _etiqueta_consulta),
+    'tratamientos': Busqueda(_tratamientos_activos, _filtro_por_id_o_paciente('consulta__paciente__'),
+                             _etiqueta_tratamiento),
+}
+
+
+def buscar(clave, q, limite=LIMITE_RESULTADOS_BUSQUEDA):
+    """
+    Devuelve hasta `limite` diccionarios `{'id', 'texto'}` de la entidad `clave` que
+    coinciden con `q`. Lanza `KeyError` si la entidad no está registrada.
+    """
+    busqueda = BUSQUEDAS[clave]
+    q = (q or '').strip()
+    if len(q) < MIN_CARACTERES:
+        return []
+    filas = busqueda.base().filter(busqueda.filtro(q))[:limite]
+    return [{'id': obj.pk, 'texto': busqueda.etiqueta(obj)} for obj in filas]
+
+
+def contexto_selector(clave, seleccionado=None):
+    """
+    Contexto para `templates/includes/selector_remoto.html`: URL de búsqueda y, si hay
+    un objeto ya elegido, su id y etiqueta (es la única opción que se renderiza).
+    """
+    etiqueta = BUSQUEDAS[clave].etiqueta
+    return {
+        'url': reverse('buscar_entidad', args=[clave]),
+        'valor': seleccionado.pk if seleccionado is not None else '',
+        'texto': etiqueta(seleccionado) if seleccionado is not None else '',
+    }
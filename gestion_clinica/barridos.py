@@ -0,0 +1,86 @@
+"""
+Archivo: barridos.py
+Ubicación: Aplicación 'gestion_clinica'
+
+DESCRIPCIÓN GENERAL:
+--------------------
+Barridos nocturnos de estado (tareas programadas, ver `tareas.py`):
+
+- `consultas_no_asistio`: las consultas que siguen AGENDADAS
+  `TAREAS_GRACIA_CONSULTAS` horas después de su fin pasan a NO_ASISTIO. Sin esto quedan
+  AGENDADAS para siempre.
+- `tratamientos_vencidos`: los tratamientos activos cuya `fecha_fin` ya pasó se
+  desactivan, para que no sigan apareciendo en el selector de tratamientos de
+  `RecetaMedicaForm` ni en `?activo=true`.
+- `purgar_eliminados`: borra las marcas de eliminación de la sincronización incremental
+  con más de `API_SINCRONIZACION_RETENCION_DIAS` días (ver `sincronizacion.py`).
+
+Los dos primeros son `UPDATE` por lotes (`actualizar_por_lotes()`), que leen las filas por índice
+(`consulta_estado_fecha_idx`, `tratamiento_vencimiento_idx`). `QuerySet.update()` no
+dispara señales, así que cada lote actualiza sus datos derivados: `fecha_modificacion`
+(sincronización incremental, ETag), las métricas del tablero por día y estado
+(`metricas.py`) y el mapa de ocupación de la agenda (`disponibilidad.py`).
+"""
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models.functions import Now
+from django.utils import timezone
+
+from . import disponibilidad, metricas, sincronizacion
+from .agenda import AGENDADA
+from .models import ConsultaMedica, Tratamiento
+from .tareas import actualizar_por_lotes, tarea
+
+NO_ASISTIO = 'NO_ASISTIO'
+
+
+@tarea('consultas_no_asistio', cada=timedelta(days=1))
+def marcar_consultas_no_asistio(avance, ahora):
+    """
+    Marca NO_ASISTIO las consultas AGENDADAS que terminaron hace más de
+    TAREAS_GRACIA_CONSULTAS horas.
+    """
+    corte = ahora - timedelta(hours=getattr(settings, 'TAREAS_GRACIA_CONSULTAS', 24))
+    # fecha_hora < fecha_fin: la condición sobre fecha_hora acota el rango del índice.
+    vencidas = ConsultaMedica.objects.filter(estado=AGENDADA, fecha_hora__lt=corte, fecha_fin__lt=corte)
+
+    def actualizar_derivados(filas):
+        deltas, dias = {}, set()
+        for fila in filas:
+            fecha = timezone.localdate(fila['fecha_hora'])
+            for estado, delta in ((AGENDADA, -1), (NO_ASISTIO, 1)):
+                clave = metricas.clave_consultas_dia(fecha, estado)
+                deltas[clave] = deltas.get(clave, 0) + delta
+            dias.update(
+                (fila['medico_id'], dia)
+                for dia, _ in disponibilidad.tramos_por_dia(fila['fecha_hora'], fila['fecha_fin'])
+            )
+        metricas.sumar(deltas)
+        disponibilidad.actualizar(dias)
+
+    return actualizar_por_lotes(
+        vencidas, {'estado': NO_ASISTIO, 'fecha_modificacion': Now()}, avance,
+        orden='fecha_hora', campos=('medico_id', 'fecha_fin'), al_actualizar=actualizar_derivados,
+    )
+
+
+@tarea('tratamientos_vencidos', cada=timedelta(days=1))
+def desactivar_tratamientos_vencidos(avance, ahora):
+    """
+    Desactiva los tratamientos activos cuya fecha de término ya pasó.
+    """
+    vencidos = Tratamiento.objects.filter(activo=True, fecha_fin__lt=timezone.localdate(ahora))
+    return actualizar_por_lotes(
+        vencidos, {'activo': False, 'fecha_modificacion': Now()}, avance, orden='fecha_fin',
+    )
+
+
+@tarea('purgar_eliminados', cada=timedelta(days=1))
+def purgar_marcas_eliminacion(avance, ahora):
+    """
+    Borra las marcas de eliminación con más de API_SINCRONIZACION_RETENCION_DIAS días.
+    """
+    antes_de = ahora - timedelta(days=getattr(settings, 'API_SINCRONIZACION_RETENCION_DIAS', 90))
+    return sincronizacion.purgar_eliminados(antes_de, tamano=avance.tamano, al_borrar=avance.lote)
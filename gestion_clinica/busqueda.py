@@ -0,0 +1,213 @@
+"""
+Archivo: busqueda.py
+Ubicación: Aplicación 'gestion_clinica'
+
+DESCRIPCIÓN GENERAL:
+--------------------
+Buscador de texto completo para el parámetro `?search=` de la API.
+
+El `SearchFilter` estándar de DRF traduce `?search=` a una cadena de
+`campo ILIKE '%texto%' OR ...` sobre cada campo de `search_fields`, que ningún índice
+puede resolver: cada búsqueda recorre la tabla completa. `BusquedaTextoFilter` ocupa
+el mismo lugar en `DEFAULT_FILTER_BACKENDS` y, para los modelos con columna
+`texto_busqueda` (Paciente, Medico y Medicamento), busca sobre esa columna:
+
+- `texto_busqueda` guarda los términos ya normalizados (minúsculas, sin tildes, RUT
+  compactado; ver `normalizacion.documento_busqueda()`) y se recalcula en `save()`.
+- La consulta del usuario se parte en los mismos términos y cada uno se compara por
+  prefijo: "muñoz jo" encuentra "Muñoz Soto José", "12.345" encuentra el RUT 12345678-9.
+- Los resultados se ordenan por relevancia y luego por el orden por defecto del modelo.
+
+MOTORES:
+--------
+- PostgreSQL: `to_tsvector('simple', texto_busqueda) @@ to_tsquery('munoz:* & jo:*')`,
+  resuelto con un índice GIN (migración `0007_busqueda_texto_completo`) y ordenado
+  con `ts_rank`. Si la extensión `pg_trgm` está instalada, se suman las coincidencias
+  aproximadas por trigramas (errores de tipeo), también con índice GIN.
+- SQLite (desarrollo local): tabla virtual FTS5 `<tabla>_fts` sincronizada por
+  triggers y ordenada con `bm25`. Se crea (o se repara) después de cada `migrate`
+  con `preparar_fts_sqlite()`, porque SQLite pierde los triggers al reconstruir una tabla.
+- Otros motores: `texto_busqueda LIKE '%termino%'` por cada término (sin índice).
+
+Los modelos sin `texto_busqueda` siguen usando `search_fields` como siempre.
+
+MANTENIMIENTO:
+--------------
+`bulk_create()` y `QuerySet.update()` no ejecutan `save()`: después de usarlos hay que
+llamar a `reindexar(queryset)`. Los cambios de nombre de una especialidad o de un
+laboratorio se propagan automáticamente por señales (ver `signals.py`).
+"""
+
+from functools import lru_cache
+
+from django.contrib.postgres.lookups import TrigramWordSimilar
+from django.contrib.postgres.search import (
+    SearchQuery, SearchRank, SearchVector, TrigramWordSimilarity,
+)
+from django.db import connections
+from django.db.models import F, FloatField, Q
+from django.db.models.expressions import RawSQL
+from rest_framework.filters import SearchFilter
+
+from .normalizacion import terminos_busqueda
+from .paginacion import expresiones_orden, ordenamiento_keyset
+
+CAMPO_TEXTO = 'texto_busqueda'
+CONFIGURACION_FTS = 'simple'
+LOTE_REINDEXAR = 2000
+
+TABLAS_BUSQUEDA = [
+    'gestion_clinica_paciente',
+    'gestion_clinica_medico',
+    'gestion_clinica_medicamento',
+]
+
+
+def tiene_texto_busqueda(modelo):
+    return any(campo.name == CAMPO_TEXTO for campo in modelo._meta.concrete_fields)
+
+
+@lru_cache(maxsize=None)
+def trigramas_disponibles(alias='default'):
+    """
+    Indica si la extensión `pg_trgm` está instalada (se consulta una vez por proceso).
+    """
+    conexion = connections[alias]
+    if conexion.vendor != 'postgresql':
+        return False
+    with conexion.cursor() as cursor:
+        cursor.execute("SELECT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm')")
+        return cursor.fetchone()[0]
+
+
+def _orden_por_defecto(modelo):
+    return expresiones_orden(ordenamiento_keyset(modelo))
+
+
+def _buscar_postgresql(queryset, terminos):
+    vector = SearchVector(CAMPO_TEXTO, config=CONFIGURACION_FTS)
+    consulta = SearchQuery(
+        ' & '.join(f'{termino}:*' for termino in terminos),
+        search_type='raw', config=CONFIGURACION_FTS,
+    )
+    condicion = Q(documento_busqueda=consulta)
+    relevancia = SearchRank(vector, consulta)
+
+    if trigramas_disponibles(queryset.db):
+        texto = ' '.join(terminos)
+        condicion |= TrigramWordSimilar(F(CAMPO_TEXTO), texto)
+        relevancia = relevancia + TrigramWordSimilarity(texto, CAMPO_TEXTO)
+
+    return (queryset.alias(documento_busqueda=vector)
+            .filter(condicion)
+            .annotate(relevancia=relevancia))
+
+
+def _buscar_sqlite(queryset, terminos):
+    tabla = queryset.model._meta.db_table
+    fts = f'{tabla}_fts'
+    # Los términos solo contienen [a-z0-9] (ver terminos_busqueda), no requieren escape.
+    consulta = ' '.join(f'"{termino}"*' for termino in terminos)
+    return (queryset
+            .filter(pk__in=RawSQL(f'SELECT rowid FROM "{fts}" WHERE "{fts}" MATCH %s', [consulta]))
+            .annotate(relevancia=RawSQL(
+                f'SELECT -bm25("{fts}") FROM "{fts}" WHERE "{fts}" MATCH %s AND rowid = "{tabla}"."id"',
+                [consulta], output_field=FloatField(),
+            )))
+
+
+def _buscar_generico(queryset, terminos):
+    condicion = Q()
+    for termino in terminos:
+        condicion &= Q(**{f'{CAMPO_TEXTO}__contains': termino})
+    return queryset.filter(condicion)
+
+
+def buscar_texto(queryset, texto):
+    """
+    Filtra `queryset` (de un modelo con `texto_busqueda`) por `texto` y lo ordena por
+    relevancia. Todos los términos deben coincidir (por prefijo).
+    """
+    terminos = terminos_busqueda(texto)
+    if not terminos:
+        return queryset
+
+    vendor = connections[queryset.db].vendor
+    if vendor == 'postgresql':
+        queryset = _buscar_postgresql(queryset, terminos)
+    elif vendor == 'sqlite':
+        queryset = _buscar_sqlite(queryset, terminos)
+    else:
+        return _buscar_generico(queryset, terminos)
+    return queryset.order_by('-relevancia', *_orden_por_defecto(queryset.model))
+
+
+def _sql_fts5(tabla):
+    fts = f'{tabla}_fts'
+    borrar = f"INSERT INTO \"{fts}\"(\"{fts}\", rowid, texto_busqueda) VALUES ('delete', old.id, old.texto_busqueda);"
+    insertar = f'INSERT INTO "{fts}"(rowid, texto_busqueda) VALUES (new.id, new.texto_busqueda);'
+    return [
+        f'CREATE VIRTUAL TABLE IF NOT EXISTS "{fts}" USING fts5('
+        f'texto_busqueda, content="{tabla}", content_rowid="id")',
+        f'CREATE TRIGGER IF NOT EXISTS "{fts}_ai" AFTER INSERT ON "{tabla}" BEGIN {insertar} END',
+        f'CREATE TRIGGER IF NOT EXISTS "{fts}_ad" AFTER DELETE ON "{tabla}" BEGIN {borrar} END',
+        f'CREATE TRIGGER IF NOT EXISTS "{fts}_au" AFTER UPDATE ON "{tabla}" BEGIN {borrar} {insertar} END',
+    ]
+
+
+def preparar_fts_sqlite(alias='default'):
+    """
+    Crea las tablas FTS5 y sus triggers en SQLite si faltan, y en ese caso reconstruye
+    el índice desde `texto_busqueda`. No hace nada en otros motores.
+    """
+    conexion = connections[alias]
+    if conexion.vendor != 'sqlite':
+        return
+    with conexion.cursor() as cursor:
+        for tabla in TABLAS_BUSQUEDA:
+            fts = f'{tabla}_fts'
+            cursor.execute(
+                "SELECT COUNT(*) FROM sqlite_master WHERE name IN (%s, %s, %s, %s)",
+                [fts, f'{fts}_ai', f'{fts}_ad', f'{fts}_au'],
+            )
+            if cursor.fetchone()[0] == 4:
+                continue
+            for sql in _sql_fts5(tabla):
+                cursor.execute(sql)
+            cursor.execute(f"INSERT INTO \"{fts}\"(\"{fts}\") VALUES ('rebuild')")
+
+
+def reindexar(queryset):
+    """
+    Recalcula `texto_busqueda` (y demás `campos_busqueda`) de las filas de `queryset`,
+    para datos escritos sin pasar por `save()`. Devuelve la cantidad de filas.
+    """
+    modelo = queryset.model
+    # Los documentos incluyen el nombre de la especialidad / laboratorio.
+    relaciones = [campo.name for campo in modelo._meta.concrete_fields if campo.many_to_one]
+    lote, total = [], 0
+    for obj in queryset.select_related(*relaciones).order_by('pk').iterator(chunk_size=LOTE_REINDEXAR):
+        obj.actualizar_campos_busqueda()
+        lote.append(obj)
+        if len(lote) >= LOTE_REINDEXAR:
+            modelo.objects.bulk_update(lote, list(modelo.campos_busqueda))
+            total += len(lote)
+            lote = []
+    if lote:
+        modelo.objects.bulk_update(lote, list(modelo.campos_busqueda))
+        total += len(lote)
+    return total
+
+
+class BusquedaTextoFilter(SearchFilter):
+    """
+    Reemplazo de `rest_framework.filters.SearchFilter` (mismo parámetro `?search=`).
+    Usa el buscador de texto completo en los modelos con `texto_busqueda` y el
+    comportamiento estándar (`search_fields`) en el resto.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        if not tiene_texto_busqueda(queryset.model):
+            return super().filter_queryset(request, queryset, view)
+        texto = ' '.join(self.get_search_terms(request))
+        return buscar_texto(queryset, texto)
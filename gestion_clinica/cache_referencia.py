@@ -0,0 +1,186 @@
+"""
+Archivo: cache_referencia.py
+Ubicación: Aplicación 'gestion_clinica'
+
+DESCRIPCIÓN GENERAL:
+--------------------
+Caché de los datos de referencia (especialidades, laboratorios y medicamentos).
+
+Estas tablas se leen en casi todas las peticiones (formularios, filtros, API) pero
+cambian pocas veces por semana. Aquí se guardan en la caché de Django (`CACHES` en
+settings) las respuestas de sus endpoints de la API (`CacheReferenciaMixin` en
+`mixins.py`) y las opciones de los `<select>` de los formularios (`usar_opciones_cacheadas`).
+
+VERSIONES POR MODELO:
+---------------------
+Cada modelo tiene una clave de versión en la caché (`ref:version:<modelo>`) y cada
+entrada se guarda bajo las versiones actuales de los modelos de los que depende su grupo
+(`GRUPOS`). Al guardar o eliminar una fila, `signals.py` incrementa la versión de su
+modelo: las entradas anteriores dejan de leerse (y expiran solas) sin tener que
+buscarlas ni borrarlas. Como la versión vive en la caché compartida, la invalidación
+llega a todos los procesos (con un backend compartido: archivo, Redis, Memcached; la
+caché en memoria local es por proceso).
+
+La versión se incrementa al guardar y de nuevo al confirmarse la transacción, para que
+otro proceso no vuelva a guardar datos anteriores bajo la versión nueva mientras la
+transacción sigue abierta. Las escrituras que no disparan señales (`QuerySet.update`,
+SQL directo) deben llamar a `invalidar()`; como resguardo, las entradas expiran a los
+`CACHE_REFERENCIA_TTL` segundos (1 hora por defecto).
+
+El stock de los medicamentos cambia con cada receta, pero solo lo muestra la API de
+medicamentos: los movimientos de stock (`stock.py`) incrementan una versión propia,
+`STOCK`, de la que depende solo `api-medicamentos`, en vez de la de `Medicamento`.
+
+ESTADÍSTICAS:
+-------------
+Cada grupo cuenta aciertos y fallos en la misma caché (`estadisticas()`, comando
+`python manage.py estadisticas_cache`).
+"""
+
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Especialidad, Laboratorio, Medicamento, Medico
+
+PREFIJO = 'ref'
+# Versión de `Medicamento.stock_disponible`, aparte de la del modelo.
+STOCK = 'stock'
+
+# grupo -> modelos (o `STOCK`) de los que dependen sus entradas.
+GRUPOS = {
+    # `cantidad_medicos` cambia con los médicos; `cantidad_medicamentos`, con los medicamentos.
+    'api-especialidades': (Especialidad, Medico),
+    'api-laboratorios': (Laboratorio, Medicamento),
+    # `?search=` busca también por el nombre del laboratorio.
+    'api-medicamentos': (Medicamento, Laboratorio, STOCK),
+    'opciones-especialidades': (Especialidad,),
+    'opciones-medicamentos': (Medicamento,),
+}
+
+MODELOS = {modelo for modelos in GRUPOS.values() for modelo in modelos if modelo is not STOCK}
+
+ACIERTOS = 'aciertos'
+FALLOS = 'fallos'
+
+
+def _ttl():
+    return getattr(settings, 'CACHE_REFERENCIA_TTL', 3600)
+
+
+def _clave_version(modelo):
+    etiqueta = modelo if modelo is STOCK else modelo._meta.label_lower
+    return f'{PREFIJO}:version:{etiqueta}'
+
+
+def _clave_contador(grupo, tipo):
+    return f'{PREFIJO}:estadisticas:{grupo}:{tipo}'
+
+
+# -----------------------------
+# Versiones
+# -----------------------------
+
+def version(modelo):
+    """
+    Versión actual de `modelo`. Si la clave no existe (caché vacía o expulsada) se crea
+    con la hora actual en nanosegundos, para no volver a una versión ya usada.
+    """
+    clave = _clave_version(modelo)
+    actual = cache.get(clave)
+    if actual is None:
+        cache.add(clave, time.time_ns(), timeout=None)
+        actual = cache.get(clave)
+    return actual
+
+
+def _incrementar(modelo):
+    try:
+        cache.incr(_clave_version(modelo))
+    except ValueError:
+        cache.set(_clave_version(modelo), time.time_ns(), timeout=None)
+
+
+def invalidar(modelo):
+    """
+    Invalida las entradas que dependen de `modelo` (o de `STOCK`), ahora y al
+    confirmarse la transacción.
+    """
+    _incrementar(modelo)
+    transaction.on_commit(lambda: _incrementar(modelo))
+
+
+# -----------------------------
+# Lectura
+# -----------------------------
+
+def _contar(grupo, tipo):
+    clave = _clave_contador(grupo, tipo)
+    try:
+        cache.incr(clave)
+    except ValueError:
+        if not cache.add(clave, 1, timeout=None):
+            cache.incr(clave)
+
+
+def obtener(grupo, clave, calcular):
+    """
+    Valor de `clave` en `grupo` desde la caché o, si no está, `calcular()` (que debe
+    devolver datos serializables con pickle; `None` no se guarda). Devuelve `(valor, acierto)`.
+    """
+    versiones = '.'.join(str(version(modelo)) for modelo in GRUPOS[grupo])
+    resumen = hashlib.sha1(clave.encode('utf-8')).hexdigest()
+    clave_cache = f'{PREFIJO}:{grupo}:{versiones}:{resumen}'
+
+    valor = cache.get(clave_cache)
+    if valor is not None:
+        _contar(grupo, ACIERTOS)
+        return valor, True
+    _contar(grupo, FALLOS)
+    valor = calcular()
+    if valor is not None:
+        cache.set(clave_cache, valor, _ttl())
+    return valor, False
+
+
+def usar_opciones_cacheadas(campo, grupo):
+    """
+    Reemplaza las opciones del `<select>` de un `ModelChoiceField` por `(pk, etiqueta)`
+    tomados de la caché. La validación del valor enviado sigue usando `campo.queryset`.
+    """
+    queryset = campo.queryset
+    opciones, _ = obtener(
+        grupo, str(queryset.query),
+        lambda: [(obj.pk, campo.label_from_instance(obj)) for obj in queryset],
+    )
+    vacia = [('', campo.empty_label)] if campo.empty_label is not None else []
+    campo.widget.choices = vacia + opciones
+
+
+# -----------------------------
+# Estadísticas
+# -----------------------------
+
+def estadisticas():
+    """
+    `{grupo: {aciertos, fallos, tasa_aciertos}}` acumulados desde el último reinicio.
+    """
+    resultado = {}
+    for grupo in GRUPOS:
+        contadores = cache.get_many([_clave_contador(grupo, ACIERTOS), _clave_contador(grupo, FALLOS)])
+        aciertos = contadores.get(_clave_contador(grupo, ACIERTOS), 0)
+        fallos = contadores.get(_clave_contador(grupo, FALLOS), 0)
+        total = aciertos + fallos
+        resultado[grupo] = {
+            ACIERTOS: aciertos,
+            FALLOS: fallos,
+            'tasa_aciertos': round(aciertos / total, 3) if total else None,
+        }
+    return resultado
+
+
+def reiniciar_estadisticas():
+    cache.delete_many([_clave_contador(grupo, tipo) for grupo in GRUPOS for tipo in (ACIERTOS, FALLOS)])
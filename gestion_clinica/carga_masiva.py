@@ -0,0 +1,360 @@
+"""
+Archivo: carga_masiva.py
+Ubicación: Aplicación 'gestion_clinica'
+
+DESCRIPCIÓN GENERAL:
+--------------------
+Carga masiva (crear / actualizar / *upsert*) para los endpoints `POST /api/<recurso>/lote/`
+(ver `CargaMasivaMixin` en `mixins.py`).
+
+Las integraciones (agenda, farmacia) enviaban cada consulta o receta en su propio
+request, con su propia transacción y, por cada fila, una consulta por clave foránea y
+por campo único durante la validación. `procesar_lote()` recibe una lista de objetos y:
+
+1) Precarga en una consulta por relación todas las claves foráneas del lote
+   (`RelacionPrecargadaField` en `serializers.py`).
+2) Valida cada elemento con una sola instancia del serializador; los campos únicos
+   (RUT, número de registro) se verifican para todo el lote con una consulta por campo.
+3) Busca las filas existentes por la clave del lote en una sola consulta:
+   - `id` (consultas, recetas): elementos con `id` actualizan esa fila, sin `id` se crean.
+   - `rut` (pacientes) / `numero_registro` (médicos): *upsert*, se actualiza la fila con
+     esa clave o se crea una nueva.
+4) Escribe los elementos válidos en una transacción con `bulk_update` / `bulk_create`
+   (`ON CONFLICT DO UPDATE` en los *upsert*, por si otra petición creó la fila entretanto).
+
+Cada elemento informa su propio resultado (`creado`, `actualizado` o `error` con sus
+mensajes); los elementos con error no impiden guardar los demás.
+
+DATOS DERIVADOS:
+----------------
+`bulk_create` / `bulk_update` no ejecutan `save()` ni señales, así que aquí se
+recalculan explícitamente los campos de búsqueda (`actualizar_campos_busqueda()`), las
+métricas del tablero (`metricas.deltas_guardado()`), los contadores de médicos por
+especialidad (`contadores.py`), `fecha_modificacion` (`sincronizacion.py`), la versión
+de la caché de referencia (`cache_referencia.py`), el fin de las consultas (`fecha_fin`),
+el mapa de ocupación de la agenda (`disponibilidad.py`) y el stock de los medicamentos
+de las recetas con su libro de movimientos (`stock.py`) y su consumo diario (`consumo.py`).
+
+La agenda de las consultas (horario del médico y superposiciones, también entre
+consultas del mismo lote) se valida para todo el lote con `agenda.errores_lote()`.
+El stock de las recetas se asigna dentro de la transacción, elemento por elemento en el
+orden del lote (`stock.reservar_lote()`): las que no alcanzan stock quedan con error y
+las demás se guardan.
+
+Los campos que no vienen en un elemento conservan su valor actual al actualizar y
+toman su valor por defecto al crear.
+"""
+
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import IntegrityError, transaction
+from rest_framework import serializers
+from rest_framework.validators import UniqueValidator
+
+from . import agenda, cache_referencia, consumo, disponibilidad, metricas, stock
+from .contadores import recalcular_medicos_por_especialidad
+from .models import (
+    CamposBusquedaMixin, ConflictoAgenda, ConsultaMedica, Medico, RecetaMedica, SeguimientoCambiosMixin,
+)
+from .serializers import RelacionPrecargadaField
+
+CLAVE_ID = 'id'
+TAMANO_ESCRITURA = 500
+
+CREADO = 'creado'
+ACTUALIZADO = 'actualizado'
+ERROR = 'error'
+
+
+class LoteInvalido(Exception):
+    """
+    El cuerpo de la petición no es un lote procesable (no es una lista o es demasiado grande).
+    """
+
+
+def tamano_maximo():
+    return getattr(settings, 'API_LOTE_MAXIMO', 1000)
+
+
+class ResultadoLote:
+    """
+    Resultado por elemento, en el mismo orden en que llegaron.
+    """
+
+    def __init__(self, cantidad):
+        self.resultados = [None] * cantidad
+
+    def error(self, indice, errores):
+        self.resultados[indice] = {'indice': indice, 'estado': ERROR, 'errores': errores}
+
+    def guardado(self, indice, estado, pk):
+        self.resultados[indice] = {'indice': indice, 'estado': estado, 'id': pk}
+
+    def total(self, estado):
+        return sum(1 for r in self.resultados if r['estado'] == estado)
+
+    def como_dict(self):
+        return {
+            'creados': self.total(CREADO),
+            'actualizados': self.total(ACTUALIZADO),
+            'errores': self.total(ERROR),
+            'resultados': self.resultados,
+        }
+
+
+# -----------------------------
+# Validación
+# -----------------------------
+
+def _preparar_serializador(serializer_class, elementos, contexto):
+    """
+    Instancia única del serializador para validar todo el lote, con las claves
+    foráneas precargadas y sin los validadores de unicidad (ver `_errores_unicidad`).
+    """
+    serializador = serializer_class(context=contexto)
+    precargadas = {}
+    for nombre, campo in serializador.fields.items():
+        campo.validators = [v for v in campo.validators if not isinstance(v, UniqueValidator)]
+        if not isinstance(campo, RelacionPrecargadaField) or campo.read_only:
+            continue
+        modelo_pk = campo.get_queryset().model._meta.pk
+        valores = set()
+        for elemento in elementos:
+            try:
+                valores.add(modelo_pk.to_python(elemento.get(nombre)))
+            except DjangoValidationError:
+                continue
+        precargadas[nombre] = campo.get_queryset().in_bulk(valores - {None})
+    contexto[RelacionPrecargadaField.CLAVE_CONTEXTO] = precargadas
+    return serializador
+
+
+def _campos_unicos(modelo):
+    return [
+        campo.name for campo in modelo._meta.concrete_fields
+        if campo.unique and not campo.primary_key
+    ]
+
+
+def _errores_unicidad(modelo, validos, destinos):
+    """
+    Verifica los campos únicos para todo el lote: una consulta por campo, más los
+    valores repetidos dentro del mismo lote. `destinos` indica la fila que actualizará
+    cada elemento (o `None` si se creará).
+    """
+    errores = {}
+    for nombre in _campos_unicos(modelo):
+        valores = {datos[nombre] for datos in validos.values() if nombre in datos}
+        if not valores:
+            continue
+        ocupados = dict(
+            modelo.objects.filter(**{f'{nombre}__in': valores}).values_list(nombre, 'pk')
+        )
+        vistos = set()
+        for indice, datos in validos.items():
+            if nombre not in datos:
+                continue
+            valor = datos[nombre]
+            duenio = ocupados.get(valor)
+            destino = destinos.get(indice)
+            if valor in vistos:
+                errores.setdefault(indice, {})[nombre] = ['Valor repetido dentro del lote.']
+            elif duenio is not None and (destino is None or duenio != destino.pk):
+                errores.setdefault(indice, {})[nombre] = [
+                    f'Ya existe {modelo._meta.verbose_name} con este {nombre}.'
+                ]
+            vistos.add(valor)
+    return errores
+
+
+# -----------------------------
+# Procesamiento
+# -----------------------------
+
+def procesar_lote(serializer_class, elementos, clave=CLAVE_ID, contexto=None):
+    """
+    Valida y guarda `elementos` (lista de diccionarios) con `serializer_class`.
+    `clave` es el campo con que se identifican las filas existentes. Devuelve un
+    `ResultadoLote`; lanza `LoteInvalido` si `elementos` no es una lista válida.
+    """
+    if not isinstance(elementos, list):
+        raise LoteInvalido('Se esperaba una lista de objetos.')
+    if len(elementos) > tamano_maximo():
+        raise LoteInvalido(f'El lote admite como máximo {tamano_maximo()} elementos.')
+
+    modelo = serializer_class.Meta.model
+    resultado = ResultadoLote(len(elementos))
+    objetos = [e if isinstance(e, dict) else {} for e in elementos]
+    serializador = _preparar_serializador(serializer_class, objetos, dict(contexto or {}))
+
+    validos = {}
+    for indice, elemento in enumerate(elementos):
+        if not isinstance(elemento, dict):
+            resultado.error(indice, {'non_field_errors': ['Se esperaba un objeto.']})
+            continue
+        try:
+            validos[indice] = serializador.run_validation(elemento)
+        except serializers.ValidationError as exc:
+            resultado.error(indice, exc.detail)
+
+    destinos = _resolver_destinos(modelo, clave, objetos, validos, resultado)
+    for indice, errores in _errores_unicidad(modelo, validos, destinos).items():
+        validos.pop(indice)
+        resultado.error(indice, errores)
+
+    nuevos, actualizados = [], []
+    for indice, datos in validos.items():
+        existente = destinos.get(indice)
+        obj = existente if existente is not None else modelo()
+        for campo, valor in datos.items():
+            setattr(obj, campo, valor)
+        if isinstance(obj, CamposBusquedaMixin):
+            obj.actualizar_campos_busqueda()
+        if modelo is ConsultaMedica:
+            obj.actualizar_fecha_fin()
+        (actualizados if existente is not None else nuevos).append((indice, obj))
+
+    if modelo is ConsultaMedica:
+        errores = agenda.errores_lote(sorted(nuevos + actualizados, key=lambda par: par[0]))
+        for indice, errores_elemento in errores.items():
+            validos.pop(indice)
+            resultado.error(indice, errores_elemento)
+        nuevos = [(i, obj) for i, obj in nuevos if i not in errores]
+        actualizados = [(i, obj) for i, obj in actualizados if i not in errores]
+
+    try:
+        for indice, errores_elemento in _guardar(modelo, clave, nuevos, actualizados, validos).items():
+            resultado.error(indice, errores_elemento)
+    except IntegrityError as exc:
+        if ConflictoAgenda.corresponde(exc):
+            raise LoteInvalido(
+                'Otra petición agendó consultas en los mismos horarios; no se guardó el lote.'
+            ) from exc
+        raise
+    for indice, obj in nuevos:
+        resultado.guardado(indice, CREADO, obj.pk)
+    for indice, obj in actualizados:
+        resultado.guardado(indice, ACTUALIZADO, obj.pk)
+    return resultado
+
+
+def _resolver_destinos(modelo, clave, objetos, validos, resultado):
+    """
+    `{indice: fila existente o None}` para los elementos válidos, con una consulta.
+    Descarta (con error) los `id` inválidos o inexistentes y las claves repetidas en el lote.
+    """
+    if clave == CLAVE_ID:
+        valores = {}
+        for indice in list(validos):
+            try:
+                valores[indice] = modelo._meta.pk.to_python(objetos[indice].get(CLAVE_ID))
+            except DjangoValidationError:
+                validos.pop(indice)
+                resultado.error(indice, {CLAVE_ID: ['Identificador inválido.']})
+        existentes = modelo.objects.in_bulk({v for v in valores.values() if v is not None})
+    else:
+        valores = {indice: datos.get(clave) for indice, datos in validos.items()}
+        existentes = modelo.objects.in_bulk(
+            {v for v in valores.values() if v is not None}, field_name=clave
+        )
+
+    destinos, vistos = {}, set()
+    for indice, valor in valores.items():
+        if valor is not None and valor in vistos:
+            error = {clave: ['Valor repetido dentro del lote.']}
+        elif clave == CLAVE_ID and valor is not None and valor not in existentes:
+            error = {CLAVE_ID: [f'No existe {modelo._meta.verbose_name} con id {valor}.']}
+        else:
+            error = None
+        if error:
+            validos.pop(indice)
+            resultado.error(indice, error)
+            continue
+        if valor is not None:
+            vistos.add(valor)
+        destinos[indice] = existentes.get(valor)
+    return destinos
+
+
+def _campos_auto_now(modelo):
+    return [campo for campo in modelo._meta.concrete_fields if getattr(campo, 'auto_now', False)]
+
+
+def _campos_escritos(modelo, datos_por_indice, indices):
+    campos = set()
+    for indice in indices:
+        campos.update(datos_por_indice[indice])
+    if issubclass(modelo, CamposBusquedaMixin):
+        campos.update(modelo.campos_busqueda)
+    # `fecha_modificacion` (ver sincronizacion.py).
+    campos.update(campo.name for campo in _campos_auto_now(modelo))
+    if modelo is ConsultaMedica:
+        campos.add('fecha_fin')
+    return sorted(campos)
+
+
+def _guardar(modelo, clave, nuevos, actualizados, validos):
+    """
+    Escribe el lote en una transacción. Devuelve `{indice: errores}` de las recetas que
+    no se guardaron por falta de stock (ver `stock.reservar_lote()`), que se quitan de
+    `nuevos` y `actualizados`.
+    """
+    if not nuevos and not actualizados:
+        return {}
+    with transaction.atomic():
+        rechazados, reservas = {}, []
+        if modelo is RecetaMedica:
+            rechazados, reservas = stock.reservar_lote(sorted(nuevos + actualizados, key=lambda par: par[0]))
+            nuevos[:] = [(i, obj) for i, obj in nuevos if i not in rechazados]
+            actualizados[:] = [(i, obj) for i, obj in actualizados if i not in rechazados]
+        objetos = [obj for _, obj in actualizados] + [obj for _, obj in nuevos]
+        creadas = [False] * len(actualizados) + [True] * len(nuevos)
+        deltas = metricas.deltas_guardado(objetos, creadas)
+        especialidades, dias = set(), set()
+        if modelo is ConsultaMedica:
+            for obj in objetos:
+                dias |= disponibilidad.dias_afectados(obj)
+        if modelo is Medico:
+            for obj in objetos:
+                especialidades.update({obj.valor_original('especialidad_id'), obj.especialidad_id})
+
+        if actualizados:
+            # bulk_update no ejecuta pre_save(): los campos auto_now se asignan aquí.
+            for _, obj in actualizados:
+                for campo in _campos_auto_now(modelo):
+                    campo.pre_save(obj, add=False)
+            modelo.objects.bulk_update(
+                [obj for _, obj in actualizados],
+                _campos_escritos(modelo, validos, [i for i, _ in actualizados]),
+                batch_size=TAMANO_ESCRITURA,
+            )
+        if nuevos:
+            opciones = {}
+            if clave != CLAVE_ID:
+                opciones = dict(
+                    update_conflicts=True, unique_fields=[clave],
+                    update_fields=[c for c in _campos_escritos(modelo, validos, [i for i, _ in nuevos])
+                                   if c != clave],
+                )
+            modelo.objects.bulk_create(
+                [obj for _, obj in nuevos], batch_size=TAMANO_ESCRITURA, **opciones
+            )
+        metricas.sumar(deltas)
+        if reservas:
+            stock.registrar_lote(reservas)
+            deltas_consumo = {}
+            for receta, movimientos in reservas:
+                for dia_medicamento, cantidad in consumo.deltas(receta.fecha_emision, movimientos).items():
+                    deltas_consumo[dia_medicamento] = deltas_consumo.get(dia_medicamento, 0) + cantidad
+            consumo.registrar(deltas_consumo)
+        if especialidades:
+            recalcular_medicos_por_especialidad(especialidades)
+        if dias:
+            disponibilidad.actualizar(dias)
+        if modelo in cache_referencia.MODELOS:
+            cache_referencia.invalidar(modelo)
+
+    for obj in objetos:
+        if isinstance(obj, SeguimientoCambiosMixin):
+            obj.actualizar_valores_cargados()
+    return rechazados
@@ -0,0 +1,144 @@
+"""
+Archivo: condicional.py
+Ubicación: Aplicación 'gestion_clinica'
+
+DESCRIPCIÓN GENERAL:
+--------------------
+GET condicional (`ETag` / `Last-Modified`) para el listado y el detalle de la API
+(ver `GetCondicionalMixin` en `mixins.py`).
+
+Las pantallas de recepción y los terminales de farmacia consultan la misma página
+(`/api/consultas/?estado=AGENDADA`) cada pocos segundos y descargan la respuesta
+completa aunque no haya cambiado. Ahora, antes de serializar, se calculan los
+validadores con una sola consulta, de una de dos formas según el conteo pedido
+(`?contar=`, ver `paginacion_api.py`):
+
+- Sin conteo exacto (`estimado` o `no`, lo habitual): la última `fecha_modificacion`
+  de la tabla completa y de cada tabla unida por el plan de carga (por ejemplo, el
+  nombre del paciente en `paciente_nombre`), y la última marca de eliminación del
+  modelo (`RegistroEliminado`). Cada valor es una lectura del índice
+  `(fecha_modificacion, id)`: no recorre las filas filtradas. Cualquier cambio en esas
+  tablas cambia los validadores, incluso uno que no afecte a esta página.
+- Con `?contar=exacto`: `COUNT(*)` y `MAX(fecha_modificacion)` de la tabla y de las
+  unidas sobre el queryset filtrado; el `COUNT` se reutiliza como `count` de la
+  primera página, así que no se cuenta dos veces.
+
+Con eso se arma un `ETag` débil (incluye también el serializador, el formato y los
+parámetros de la petición) y `Last-Modified`. Si el cliente envía `If-None-Match` o
+`If-Modified-Since` y nada cambió, la respuesta es `304 Not Modified` sin cuerpo: no se
+leen las filas ni se serializan.
+
+LIMITACIONES:
+-------------
+Como `fecha_modificacion` (ver `sincronizacion.py`), las escrituras que no pasan por
+`save()` deben actualizar esa columna para que los validadores cambien.
+"""
+
+import hashlib
+
+from django.db.models import Count, Max, Subquery
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+from .models import RegistroEliminado
+from .sincronizacion import etiqueta_modelo
+
+CAMPO_MODIFICACION = 'fecha_modificacion'
+
+
+class Validadores:
+    """
+    `etag` (entre comillas, débil), `ultima_modificacion` (timestamp o `None`) y
+    `total` de filas del queryset (`None` si no se contó).
+    """
+
+    def __init__(self, etag, ultima_modificacion, total):
+        self.etag = etag
+        self.ultima_modificacion = ultima_modificacion
+        self.total = total
+
+    def aplicar(self, respuesta):
+        """
+        Agrega `ETag`, `Last-Modified` y `Cache-Control: no-cache` (revalidar siempre).
+        """
+        respuesta['ETag'] = self.etag
+        if self.ultima_modificacion is not None:
+            respuesta['Last-Modified'] = http_date(self.ultima_modificacion)
+        respuesta['Cache-Control'] = 'private, no-cache'
+        patch_vary_headers(respuesta, ['Accept'])
+        return respuesta
+
+
+def _rutas_con_prefijos(relaciones):
+    rutas = set()
+    for ruta in relaciones:
+        partes = ruta.split('__')
+        rutas.update('__'.join(partes[:n]) for n in range(1, len(partes) + 1))
+    return sorted(rutas)
+
+
+def _modelo_relacionado(modelo, ruta):
+    for paso in ruta.split('__'):
+        modelo = modelo._meta.get_field(paso).related_model
+    return modelo
+
+
+def _ultima(queryset, campo):
+    return Subquery(queryset.order_by(f'-{campo}').values(campo)[:1])
+
+
+def _fechas_filtradas(queryset, rutas):
+    # COUNT y MAX sobre las filas del queryset (y sus filas unidas).
+    agregados = {'total': Count('pk'), 'm': Max(CAMPO_MODIFICACION)}
+    for indice, ruta in enumerate(rutas):
+        agregados[f'm{indice}'] = Max(f'{ruta}__{CAMPO_MODIFICACION}')
+    datos = queryset.order_by().aggregate(**agregados)
+    return datos['total'], [datos['m'], *(datos[f'm{indice}'] for indice in range(len(rutas)))]
+
+
+def _fechas_tablas(modelo, rutas):
+    # Última modificación de cada tabla completa y última eliminación, por índice.
+    subconsultas = {
+        f'm{indice}': _ultima(_modelo_relacionado(modelo, ruta)._base_manager.all(), CAMPO_MODIFICACION)
+        for indice, ruta in enumerate(rutas)
+    }
+    subconsultas['eliminado'] = _ultima(
+        RegistroEliminado.objects.filter(modelo=etiqueta_modelo(modelo)), 'fecha_eliminacion',
+    )
+    fila = (
+        modelo._base_manager.order_by(f'-{CAMPO_MODIFICACION}').annotate(**subconsultas)
+        .values(CAMPO_MODIFICACION, *subconsultas).first()
+    )
+    if fila is None:
+        return [None] * (len(rutas) + 2)
+    return [fila[CAMPO_MODIFICACION], *(fila[f'm{indice}'] for indice in range(len(rutas))), fila['eliminado']]
+
+
+def calcular_validadores(queryset, relaciones=(), variante='', contar=True):
+    """
+    Validadores de `queryset` con una consulta. `relaciones` son rutas `select_related`
+    cuyas tablas también afectan la respuesta; `variante` distingue representaciones
+    de la misma URL (serializador, formato, parámetros). Con `contar=False` no recorre
+    el queryset (ver el docstring del módulo) y `total` queda en `None`.
+    """
+    rutas = _rutas_con_prefijos(relaciones)
+    if contar:
+        total, fechas = _fechas_filtradas(queryset, rutas)
+    else:
+        total, fechas = None, _fechas_tablas(queryset.model, rutas)
+
+    presentes = [fecha for fecha in fechas if fecha is not None]
+    # Resolución de segundos, como las fechas HTTP.
+    ultima = int(max(presentes).timestamp()) if presentes else None
+
+    firma = repr((variante, total, [f.isoformat() if f else None for f in fechas]))
+    etag = quote_etag(hashlib.sha1(firma.encode('utf-8')).hexdigest())
+    return Validadores(f'W/{etag}', ultima, total)
+
+
+def respuesta_no_modificada(request, etag, ultima_modificacion):
+    """
+    `304` (o `412` con `If-Match` / `If-Unmodified-Since`) si las cabeceras
+    condicionales de `request` (HttpRequest de Django) lo indican; si no, `None`.
+    """
+    return get_conditional_response(request, etag=etag, last_modified=ultima_modificacion)
@@ -0,0 +1,160 @@
+"""
+Archivo: consumo.py
+Ubicación: Aplicación 'gestion_clinica'
+
+DESCRIPCIÓN GENERAL:
+--------------------
+Consumo de medicamentos y proyección de los días de stock restantes
+(`GET /api/stock/proyeccion/`).
+
+Saber qué medicamentos están por agotarse exigía sumar `cantidad_total` de todas las
+recetas de cada uno. En su lugar se mantiene `ConsumoDiario`: las unidades recetadas
+por medicamento y día de emisión, actualizadas en la misma transacción que la receta.
+
+MANTENCIÓN:
+-----------
+- `signals.py` llama a `registrar()` con los movimientos de stock de la receta (ver
+  `stock.py`): emitir suma `cantidad_total` al día de emisión, editar suma la
+  diferencia y eliminar la resta. La carga masiva de recetas hace lo mismo para el lote.
+- `registrar()` crea las filas que falten (`INSERT ... ON CONFLICT DO NOTHING`) y suma
+  las diferencias en un UPDATE. Las filas de un medicamento solo se escriben mientras
+  la transacción tiene bloqueada la fila del medicamento (el UPDATE del stock), así que
+  las escrituras concurrentes no se pierden.
+- `reconstruir()` (comando `python manage.py reconstruir_consumo`) recalcula todo desde
+  las recetas, por ejemplo tras escribirlas con SQL directo.
+
+PROYECCIÓN:
+-----------
+La tasa de consumo de un medicamento es lo recetado en los últimos `ventana` días
+dividido por `ventana`, y sus días restantes, `stock_disponible / tasa` (0 si no tiene
+stock, sin proyección si no se recetó en la ventana). `proyeccion()` lo calcula para
+todos los medicamentos activos en una sola consulta: un JOIN acotado por fecha con
+`ConsumoDiario` (a lo más `ventana` filas por medicamento), agregado y ordenado por la
+base de datos, sin recorrer recetas ni consultar medicamento por medicamento.
+"""
+
+from datetime import timedelta
+from math import floor
+
+from django.db import transaction
+from django.db.models import Case, F, FilteredRelation, FloatField, Q, Sum, Value, When
+from django.db.models.functions import Cast, Coalesce
+from django.utils import timezone
+
+from .models import ConsumoDiario, Medicamento, MovimientoStock, RecetaMedica
+
+VENTANA_POR_DEFECTO = 30
+VENTANA_MAXIMA = 365
+LIMITE_POR_DEFECTO = 50
+LIMITE_MAXIMO = 500
+
+
+# -----------------------------
+# Mantención
+# -----------------------------
+
+def deltas(fecha, movimientos):
+    """
+    `{(medicamento_id, fecha): unidades}` consumidas por los movimientos de stock de una
+    receta emitida el día `fecha` (lo que descuenta del stock, lo suma al consumo).
+    """
+    total = {}
+    for movimiento in movimientos:
+        if movimiento.motivo == MovimientoStock.AJUSTE:
+            continue
+        clave = (movimiento.medicamento_id, fecha)
+        total[clave] = total.get(clave, 0) - movimiento.cantidad
+    return total
+
+
+def registrar(deltas_consumo):
+    """
+    Suma `deltas_consumo` (ver `deltas()`) a `ConsumoDiario`.
+    """
+    deltas_consumo = {clave: cantidad for clave, cantidad in deltas_consumo.items() if cantidad}
+    if not deltas_consumo:
+        return
+    with transaction.atomic():
+        ConsumoDiario.objects.bulk_create(
+            [ConsumoDiario(medicamento_id=medicamento_id, fecha=fecha)
+             for medicamento_id, fecha in deltas_consumo],
+            ignore_conflicts=True,
+        )
+        condiciones = {
+            (medicamento_id, fecha): Q(medicamento_id=medicamento_id, fecha=fecha)
+            for medicamento_id, fecha in deltas_consumo
+        }
+        filtro = Q()
+        for condicion in condiciones.values():
+            filtro |= condicion
+        ConsumoDiario.objects.filter(filtro).update(cantidad=Case(
+            *[When(condiciones[clave], then=F('cantidad') + Value(cantidad))
+              for clave, cantidad in deltas_consumo.items()],
+            default=F('cantidad'),
+        ))
+
+
+def reconstruir():
+    """
+    Recalcula `ConsumoDiario` desde las recetas. Devuelve la cantidad de filas escritas.
+    """
+    filas = [
+        ConsumoDiario(medicamento_id=medicamento_id, fecha=fecha, cantidad=cantidad)
+        for medicamento_id, fecha, cantidad in
+        RecetaMedica.objects.order_by().values('medicamento_id', 'fecha_emision')
+        .annotate(total=Sum('cantidad_total')).values_list('medicamento_id', 'fecha_emision', 'total')
+    ]
+    with transaction.atomic():
+        ConsumoDiario.objects.all().delete()
+        ConsumoDiario.objects.bulk_create(filas, batch_size=1000)
+    return len(filas)
+
+
+# -----------------------------
+# Proyección
+# -----------------------------
+
+def proyeccion(ventana=VENTANA_POR_DEFECTO, dias_maximos=None, limite=LIMITE_POR_DEFECTO, hoy=None):
+    """
+    Medicamentos activos ordenados por días de stock restantes (los que se agotan antes
+    primero; los que no se recetaron en la ventana, al final). Con `dias_maximos`, solo
+    los que se agotan dentro de ese plazo. Una consulta.
+    """
+    hoy = hoy or timezone.localdate()
+    desde = hoy - timedelta(days=ventana - 1)
+    consumido = Coalesce(Sum('consumo_ventana__cantidad'), 0)
+    dias_restantes = Case(
+        When(stock_disponible__lte=0, then=Value(0.0)),
+        When(consumido__gt=0, then=Cast('stock_disponible', FloatField()) * ventana / F('consumido')),
+        output_field=FloatField(),
+    )
+    medicamentos = (
+        Medicamento.objects.filter(activo=True)
+        .annotate(consumo_ventana=FilteredRelation(
+            'consumos', condition=Q(consumos__fecha__gte=desde, consumos__fecha__lte=hoy),
+        ))
+        .annotate(consumido=consumido)
+        .annotate(dias_restantes=dias_restantes)
+    )
+    if dias_maximos is not None:
+        medicamentos = medicamentos.filter(dias_restantes__lte=dias_maximos)
+    filas = (
+        medicamentos
+        .order_by(F('dias_restantes').asc(nulls_last=True), 'nombre', 'id')
+        .values('id', 'nombre', 'presentacion', 'stock_disponible', 'consumido', 'dias_restantes')
+    )[:limite]
+
+    resultados = []
+    for fila in filas:
+        dias = fila['dias_restantes']
+        resultados.append({
+            'medicamento': fila['id'],
+            'nombre': fila['nombre'],
+            'presentacion': fila['presentacion'],
+            'stock_disponible': fila['stock_disponible'],
+            'consumo_ventana': fila['consumido'],
+            'consumo_diario': round(fila['consumido'] / ventana, 3),
+            'dias_restantes': None if dias is None else round(dias, 1),
+            'fecha_agotamiento': None if dias is None else hoy + timedelta(days=floor(dias)),
+        })
+    return resultados
@@ -0,0 +1,90 @@
+"""
+Archivo: contadores.py
+Ubicación: Aplicación 'gestion_clinica'
+
+DESCRIPCIÓN GENERAL:
+--------------------
+Cantidad de médicos activos por especialidad y de medicamentos activos por laboratorio.
+
+Estas cifras se muestran en cada fila de `/api/especialidades/` y `/api/laboratorios/`.
+Calcularlas con un `COUNT(*)` por fila convierte un listado en N+1 consultas, por lo
+que se ofrecen dos estrategias:
+
+1) **Anotación** (por defecto): el ViewSet agrega `Count(...)` al queryset y todo el
+   listado se resuelve en una sola consulta agrupada.
+2) **Contadores almacenados** (`CONTADORES_REFERENCIA_ALMACENADOS = True` en settings):
+   se leen las columnas `Especialidad.total_medicos_activos` y
+   `Laboratorio.total_medicamentos_activos`, sin JOIN ni agrupación.
+
+Las columnas se mantienen siempre (en ambos modos) desde `signals.py`: cada vez que se
+guarda o elimina un médico o medicamento se recalcula el contador de la especialidad o
+laboratorio afectado (y del anterior, si se reasignó). Las operaciones masivas que no
+disparan señales (`QuerySet.update`, `bulk_create`) deben llamar a `recalcular_*`.
+"""
+
+from django.conf import settings
+from django.db.models import Count, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce, Now
+
+from .models import Especialidad, Laboratorio, Medico, Medicamento
+
+
+def usar_contadores_almacenados():
+    return getattr(settings, 'CONTADORES_REFERENCIA_ALMACENADOS', False)
+
+
+def anotar_cantidad_medicos(queryset):
+    """
+    Anota `cantidad_medicos_activos` en un queryset de Especialidad.
+    """
+    return queryset.annotate(
+        cantidad_medicos_activos=Count('medicos', filter=Q(medicos__activo=True))
+    )
+
+
+def anotar_cantidad_medicamentos(queryset):
+    """
+    Anota `cantidad_medicamentos_activos` en un queryset de Laboratorio.
+    """
+    return queryset.annotate(
+        cantidad_medicamentos_activos=Count('medicamentos', filter=Q(medicamentos__activo=True))
+    )
+
+
+def _conteo_activos(modelo, campo_fk):
+    return Coalesce(Subquery(
+        modelo.objects.filter(**{campo_fk: OuterRef('pk'), 'activo': True})
+        .order_by()
+        .values(campo_fk)
+        .annotate(total=Count('pk'))
+        .values('total')
+    ), 0)
+
+
+def recalcular_medicos_por_especialidad(especialidad_ids=None):
+    """
+    Recalcula `total_medicos_activos` con un único UPDATE, solo en las filas cuyo
+    valor cambió (también avanza su `fecha_modificacion`, ver sincronizacion.py).
+    Sin `especialidad_ids` recalcula todas las especialidades.
+    """
+    qs = Especialidad.objects.all()
+    if especialidad_ids is not None:
+        qs = qs.filter(pk__in=[pk for pk in especialidad_ids if pk is not None])
+    conteo = _conteo_activos(Medico, 'especialidad')
+    return qs.exclude(total_medicos_activos=conteo).update(
+        total_medicos_activos=conteo, fecha_modificacion=Now(),
+    )
+
+
+def recalcular_medicamentos_por_laboratorio(laboratorio_ids=None):
+    """
+    Recalcula `total_medicamentos_activos` igual que `recalcular_medicos_por_especialidad`.
+    Sin `laboratorio_ids` recalcula todos los laboratorios.
+    """
+    qs = Laboratorio.objects.all()
+    if laboratorio_ids is not None:
+        qs = qs.filter(pk__in=[pk for pk in laboratorio_ids if pk is not None])
+    conteo = _conteo_activos(Medicamento, 'laboratorio')
+    return qs.exclude(total_medicamentos_activos=conteo).update(
+        total_medicamentos_activos=conteo, fecha_modificacion=Now(),
+    )
@@ -0,0 +1,310 @@
+"""
+Archivo: disponibilidad.py
+Ubicación: Aplicación 'gestion_clinica'
+
+DESCRIPCIÓN GENERAL:
+--------------------
+Búsqueda de horarios libres (`GET /api/agenda/disponibles/`): las primeras horas en que
+algún médico activo de una especialidad puede atender una consulta de cierta duración
+dentro de un rango de fechas.
+
+Recorrer `consulta_lista` (o leer las consultas de todos los médicos del rango) no
+escala: 200 médicos durante 60 días son decenas de miles de consultas. En su lugar,
+cada médico tiene por día una fila `OcupacionAgenda` con un mapa de bits de la jornada:
+
+- El día (hora local) se divide en `BLOQUES_DIA` bloques de `MINUTOS_BLOQUE` minutos;
+  el bit `i` indica que el bloque `i` está ocupado por una consulta AGENDADA
+  (36 bytes por médico y día). Una consulta marca todos los bloques que toca, incluso
+  parcialmente, así que un bloque libre en el mapa está libre de verdad.
+- El horario de atención (ver `agenda.py`) se convierte en una máscara por bloque
+  de atención y día de la semana.
+- Los inicios posibles de una consulta de `n` bloques son los bits `i` tales que
+  `i .. i+n-1` están libres y dentro del mismo bloque de atención: se calculan con
+  unos pocos `AND` y desplazamientos sobre enteros, sin recorrer minuto a minuto.
+
+La búsqueda lee los médicos (una consulta), sus horarios (una consulta) y los mapas
+por tramos (`DIAS_POR_TRAMO` días y luego el doble cada vez: 60 días son a lo más
+4 lecturas), deteniéndose apenas junta `limite` horarios; nunca lee la tabla de
+consultas. Los días de un tramo se concatenan en un solo entero por médico, así que
+el costo en Python es de unas pocas operaciones por médico y tramo. Los horarios se ofrecen alineados a `MINUTOS_BLOQUE` y, para un
+mismo médico, sin superponerse entre sí.
+
+MANTENCIÓN DEL MAPA:
+--------------------
+- `signals.py` llama a `actualizar()` al guardar o eliminar una consulta cuyo médico,
+  fecha, duración o estado cambió; la carga masiva lo llama para todo el lote.
+- `actualizar()` recalcula los días afectados desde las consultas AGENDADAS (lectura
+  acotada por el índice (medico, fecha_hora)) después de bloquear sus filas
+  (`SELECT ... FOR UPDATE`): dos escrituras simultáneas del mismo médico y día se
+  serializan y la segunda ve las consultas de la primera.
+- `reconstruir()` (comando `python manage.py reconstruir_ocupacion`) recalcula todos
+  los mapas, por ejemplo tras escribir consultas con SQL directo o `QuerySet.update()`.
+"""
+
+import math
+from datetime import datetime, time, timedelta
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .agenda import AGENDADA, CAMPOS_AGENDA, condicion_superposicion, horarios_por_medico
+from .models import ConsultaMedica, Medico, OcupacionAgenda
+
+MINUTOS_BLOQUE = 5
+BLOQUES_DIA = 24 * 60 // MINUTOS_BLOQUE
+BYTES_DIA = BLOQUES_DIA // 8
+DIA_COMPLETO = (1 << BLOQUES_DIA) - 1
+VACIO = bytes(BYTES_DIA)
+
+DIAS_POR_TRAMO = 7
+DIAS_MAXIMOS_BUSQUEDA = 90
+LIMITE_POR_DEFECTO = 10
+LIMITE_MAXIMO = 100
+
+
+# -----------------------------
+# Mapas de bits
+# -----------------------------
+
+def a_bytes(mapa):
+    return mapa.to_bytes(BYTES_DIA, 'little')
+
+
+def de_bytes(datos):
+    # PostgreSQL devuelve memoryview; SQLite, bytes.
+    return int.from_bytes(bytes(datos), 'little')
+
+
+def _mascara(primero, ultimo):
+    """Bits `[primero, ultimo)` encendidos."""
+    if ultimo <= primero:
+        return 0
+    return ((1 << (ultimo - primero)) - 1) << primero
+
+
+def _segundos(valor):
+    return valor.hour * 3600 + valor.minute * 60 + valor.second + valor.microsecond / 1e6
+
+
+def _bloque_desde(valor):
+    """Primer bloque que empieza en `valor` o después (hora local)."""
+    return math.ceil(_segundos(valor) / (MINUTOS_BLOQUE * 60))
+
+
+def tramos_por_dia(inicio, fin):
+    """
+    `[(fecha, máscara)]` de los bloques que toca `[inicio, fin)` en cada día local.
+    """
+    desde, hasta = timezone.localtime(inicio), timezone.localtime(fin)
+    tramos = []
+    fecha = desde.date()
+    while fecha <= hasta.date():
+        primero = int(_segundos(desde) // (MINUTOS_BLOQUE * 60)) if fecha == desde.date() else 0
+        ultimo = _bloque_desde(hasta) if fecha == hasta.date() else BLOQUES_DIA
+        if ultimo > primero:
+            tramos.append((fecha, _mascara(primero, ultimo)))
+        fecha += timedelta(days=1)
+    return tramos
+
+
+def mapas_por_dia(intervalos):
+    """
+    `{(medico_id, fecha): mapa}` de `intervalos` (`(medico_id, inicio, fin)`).
+    """
+    mapas = {}
+    for medico_id, inicio, fin in intervalos:
+        for fecha, mascara in tramos_por_dia(inicio, fin):
+            mapas[medico_id, fecha] = mapas.get((medico_id, fecha), 0) | mascara
+    return mapas
+
+
+def _limites_dia(fecha):
+    zona = timezone.get_current_timezone()
+    return (timezone.make_aware(datetime.combine(fecha, time.min), zona),
+            timezone.make_aware(datetime.combine(fecha + timedelta(days=1), time.min), zona))
+
+
+# -----------------------------
+# Mantención
+# -----------------------------
+
+def dias_afectados(consulta, eliminada=False):
+    """
+    `{(medico_id, fecha)}` cuyos mapas pueden cambiar al guardar (o eliminar) `consulta`:
+    los días que ocupaba según los valores leídos de la base de datos y los que ocupa ahora.
+    """
+    cambio = any(consulta.valor_original(campo) != getattr(consulta, campo) for campo in CAMPOS_AGENDA)
+    if not (cambio or eliminada):
+        return set()
+    pares = set()
+    antes = (consulta.valor_original('medico_id'), consulta.valor_original('estado'),
+             consulta.valor_original('fecha_hora'), consulta.valor_original('fecha_fin'))
+    ahora = (consulta.medico_id, consulta.estado, consulta.fecha_hora, consulta.fecha_fin)
+    for medico_id, estado, inicio, fin in (antes, ahora):
+        if estado == AGENDADA and None not in (medico_id, inicio, fin):
+            pares.update((medico_id, fecha) for fecha, _ in tramos_por_dia(inicio, fin))
+    return pares
+
+
+def actualizar(pares):
+    """
+    Recalcula los mapas de `pares` (`(medico_id, fecha)`) desde las consultas AGENDADAS.
+    """
+    pares = sorted(pares)
+    if not pares:
+        return
+    filtro_filas = Q()
+    filtro_consultas = Q()
+    for medico_id, fecha in pares:
+        filtro_filas |= Q(medico_id=medico_id, fecha=fecha)
+        filtro_consultas |= condicion_superposicion(medico_id, *_limites_dia(fecha))
+
+    with transaction.atomic():
+        OcupacionAgenda.objects.bulk_create(
+            [OcupacionAgenda(medico_id=medico_id, fecha=fecha, bloques=VACIO) for medico_id, fecha in pares],
+            ignore_conflicts=True,
+        )
+        # Se bloquea antes de leer las consultas: una escritura concurrente del mismo
+        # día espera aquí y, al continuar, ve las consultas ya confirmadas.
+        filas = list(
+            OcupacionAgenda.objects.select_for_update().filter(filtro_filas).order_by('medico_id', 'fecha')
+        )
+        mapas = mapas_por_dia(
+            ConsultaMedica.objects.filter(filtro_consultas, estado=AGENDADA)
+            .values_list('medico_id', 'fecha_hora', 'fecha_fin')
+        )
+        for fila in filas:
+            fila.bloques = a_bytes(mapas.get((fila.medico_id, fila.fecha), 0))
+        OcupacionAgenda.objects.bulk_update(filas, ['bloques'])
+
+
+def reconstruir(desde=None):
+    """
+    Recalcula todos los mapas (o los de `desde` en adelante). Devuelve las filas escritas.
+    """
+    consultas = ConsultaMedica.objects.filter(estado=AGENDADA)
+    filas = OcupacionAgenda.objects.all()
+    if desde is not None:
+        consultas = consultas.filter(fecha_fin__gt=_limites_dia(desde)[0])
+        filas = filas.filter(fecha__gte=desde)
+    mapas = mapas_por_dia(consultas.values_list('medico_id', 'fecha_hora', 'fecha_fin').iterator())
+    nuevas = [
+        OcupacionAgenda(medico_id=medico_id, fecha=fecha, bloques=a_bytes(mapa))
+        for (medico_id, fecha), mapa in sorted(mapas.items())
+        if desde is None or fecha >= desde
+    ]
+    with transaction.atomic():
+        filas.delete()
+        OcupacionAgenda.objects.bulk_create(nuevas, batch_size=1000)
+    return len(nuevas)
+
+
+# -----------------------------
+# Búsqueda
+# -----------------------------
+
+def _clave_horario(horario):
+    # Los médicos con la misma jornada comparten el cálculo de sus máscaras.
+    return None if horario is None else tuple(sorted((dia, tuple(tramos)) for dia, tramos in horario.items()))
+
+
+def _semana(clave, bloques):
+    """
+    `{dia_semana: (atención, inicios válidos)}` en bytes: bloques de atención del día y
+    bloques donde cabe una consulta de `bloques` bloques sin salir de su bloque de atención.
+    """
+    horario = dict(clave) if clave is not None else {dia: [(time.min, None)] for dia in range(7)}
+    semana = {}
+    for dia, tramos in horario.items():
+        atencion = inicios = 0
+        for hora_inicio, hora_fin in tramos:
+            primero = _bloque_desde(hora_inicio)
+            ultimo = BLOQUES_DIA if hora_fin is None else int(_segundos(hora_fin) // (MINUTOS_BLOQUE * 60))
+            atencion |= _mascara(primero, ultimo)
+            inicios |= _mascara(primero, ultimo - bloques + 1)
+        semana[dia] = (a_bytes(atencion), a_bytes(inicios))
+    return semana
+
+
+def _mascaras_tramo(semana, fechas):
+    """`(atención, inicios válidos)` de los días `fechas` concatenados (ver `horarios_libres`)."""
+    dias = [semana.get(fecha.weekday(), (VACIO, VACIO)) for fecha in fechas]
+    return (int.from_bytes(b''.join(dia[0] for dia in dias), 'little'),
+            int.from_bytes(b''.join(dia[1] for dia in dias), 'little'))
+
+
+def _corridas(libres, bloques):
+    """Bits `i` tales que `i .. i+bloques-1` están encendidos en `libres`."""
+    corridas, ancho = libres, 1
+    while ancho < bloques:
+        # Duplicando el ancho: O(log n) operaciones para una consulta de n bloques.
+        paso = min(ancho, bloques - ancho)
+        corridas &= corridas >> paso
+        ancho += paso
+    return corridas
+
+
+def _primeros(posibles, bloques):
+    """Bits encendidos de `posibles`, de menor a mayor, separados por al menos `bloques`."""
+    while posibles:
+        indice = (posibles & -posibles).bit_length() - 1
+        yield indice
+        posibles &= ~_mascara(0, indice + bloques)
+
+
+def horarios_libres(especialidad, desde, hasta, duracion=30, limite=LIMITE_POR_DEFECTO, ahora=None):
+    """
+    Los primeros `limite` horarios libres (`{medico, inicio, fin}`, por hora de inicio)
+    para una consulta de `duracion` minutos con un médico activo de `especialidad`,
+    entre las fechas `desde` y `hasta` (inclusive) y no antes de `ahora`.
+    """
+    ahora = timezone.localtime(ahora or timezone.now())
+    desde = max(desde, ahora.date())
+    medicos = list(
+        Medico.objects.filter(especialidad=especialidad, activo=True)
+        .only('pk', 'jornada', 'nombre', 'apellido_paterno', 'apellido_materno').order_by('pk')
+    )
+    if not medicos or desde > hasta:
+        return []
+    bloques = -(-duracion // MINUTOS_BLOQUE)
+    claves = {pk: _clave_horario(horario) for pk, horario in horarios_por_medico(medicos).items()}
+    semanas = {clave: _semana(clave, bloques) for clave in set(claves.values())}
+    medicos = [(medico.pk, claves[medico.pk], medico) for medico in medicos]
+    zona = timezone.get_current_timezone()
+
+    resultados = []
+    tramo, dias = desde, DIAS_POR_TRAMO
+    while tramo <= hasta and len(resultados) < limite:
+        fin_tramo = min(tramo + timedelta(days=dias - 1), hasta)
+        fechas = [tramo + timedelta(days=n) for n in range((fin_tramo - tramo).days + 1)]
+        indices = {fecha: n for n, fecha in enumerate(fechas)}
+        ocupacion = {pk: [VACIO] * len(fechas) for pk, _, _ in medicos}
+        for medico_id, fecha, datos in OcupacionAgenda.objects.filter(
+            medico__especialidad=especialidad, medico__activo=True, fecha__range=(tramo, fin_tramo),
+        ).order_by().values_list('medico_id', 'fecha', 'bloques'):
+            ocupacion[medico_id][indices[fecha]] = datos
+        # Cada médico se evalúa para todo el tramo de una vez: el día `n` ocupa los bits
+        # `n * BLOQUES_DIA ...`, así que un bit es también un instante (día, bloque).
+        mascaras = {clave: _mascaras_tramo(semana, fechas) for clave, semana in semanas.items()}
+        no_antes = _mascara(0, _bloque_desde(ahora)) if tramo == ahora.date() else 0
+        pendientes = limite - len(resultados)
+        candidatos = []
+        for pk, clave, medico in medicos:
+            atencion, inicios = mascaras[clave]
+            ocupado = int.from_bytes(b''.join(ocupacion[pk]), 'little') | no_antes
+            posibles = _corridas(atencion & ~ocupado, bloques) & inicios
+            for n, posicion in enumerate(_primeros(posibles, bloques)):
+                if n == pendientes:
+                    break
+                candidatos.append((posicion, pk, medico))
+        candidatos.sort(key=lambda candidato: candidato[:2])
+        for posicion, _, medico in candidatos[:pendientes]:
+            dia, indice = divmod(posicion, BLOQUES_DIA)
+            inicio = timezone.make_aware(
+                datetime.combine(fechas[dia], time.min) + timedelta(minutes=indice * MINUTOS_BLOQUE), zona
+            )
+            resultados.append({'medico': medico, 'inicio': inicio, 'fin': inicio + timedelta(minutes=duracion)})
+        # Tramos crecientes: lo habitual es encontrar horarios en la primera semana.
+        tramo, dias = fin_tramo + timedelta(days=1), dias * 2
+    return resultados
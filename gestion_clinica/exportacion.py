@@ -0,0 +1,118 @@
+"""
+Archivo: exportacion.py
+Ubicación: Aplicación 'gestion_clinica'
+
+DESCRIPCIÓN GENERAL:
+--------------------
+Exportación en *streaming* de tablas grandes (`GET /api/<recurso>/exportar/`, ver
+`ExportacionMixin` en `mixins.py`).
+
+Recorrer la API JSON página por página para exportar miles de consultas es lento y
+obliga a armar cada página en memoria. Aquí las filas se leen con
+`QuerySet.iterator(chunk_size=...)` (cursor del lado del servidor en PostgreSQL) y se
+escriben a la respuesta (`StreamingHttpResponse`) a medida que llegan, así que la
+memoria usada no depende de la cantidad de filas.
+
+FORMATOS (`?formato=`):
+-----------------------
+- `ndjson` (por defecto): un objeto JSON por línea, con los mismos campos que la API.
+- `csv`: una columna por campo; los campos anidados (`consulta_info`, ...) se aplanan
+  como `consulta_info.paciente`.
+
+Se usa `?formato=` y no `?format=` porque DRF reserva `format` para elegir el renderer.
+Los filtros, la búsqueda y el orden del listado (`ConsultaMedicaFilter`,
+`RecetaMedicaFilter`, `?search=`, `?ordering=`) se aplican igual que en el listado.
+"""
+
+import csv
+import json
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from rest_framework.utils.encoders import JSONEncoder
+
+PARAM_FORMATO = 'formato'
+NDJSON = 'ndjson'
+CSV = 'csv'
+FORMATOS = {
+    NDJSON: 'application/x-ndjson',
+    CSV: 'text/csv; charset=utf-8',
+}
+
+
+class FormatoInvalido(ValueError):
+    """
+    El formato pedido no está en `FORMATOS`.
+    """
+
+
+def tamano_bloque():
+    return getattr(settings, 'API_EXPORTACION_BLOQUE', 2000)
+
+
+def _filas(queryset, serializador):
+    # Una sola instancia del serializador para todas las filas.
+    for obj in queryset.iterator(chunk_size=tamano_bloque()):
+        yield serializador.to_representation(obj)
+
+
+def _ndjson(filas):
+    codificador = JSONEncoder(ensure_ascii=False)
+    for fila in filas:
+        yield codificador.encode(fila) + '\n'
+
+
+def _aplanar(fila, prefijo=''):
+    plana = {}
+    for clave, valor in fila.items():
+        if isinstance(valor, dict):
+            plana.update(_aplanar(valor, f'{prefijo}{clave}.'))
+        elif isinstance(valor, list):
+            plana[f'{prefijo}{clave}'] = json.dumps(valor, cls=JSONEncoder, ensure_ascii=False)
+        else:
+            plana[f'{prefijo}{clave}'] = valor
+    return plana
+
+
+class _Eco:
+    """
+    "Archivo" para `csv.writer` que devuelve la línea escrita en vez de guardarla.
+    """
+
+    def write(self, valor):
+        return valor
+
+
+def _csv(filas, columnas_sin_filas):
+    escritor = csv.writer(_Eco())
+    columnas = None
+    for fila in filas:
+        plana = _aplanar(fila)
+        if columnas is None:
+            columnas = list(plana)
+            yield escritor.writerow(columnas)
+        yield escritor.writerow(['' if plana.get(c) is None else plana.get(c) for c in columnas])
+    if columnas is None:
+        yield escritor.writerow(columnas_sin_filas)
+
+
+def respuesta_exportacion(queryset, serializador, formato, nombre):
+    """
+    `StreamingHttpResponse` con las filas de `queryset` representadas con `serializador`.
+    Lanza `FormatoInvalido` si `formato` no es `ndjson` ni `csv`.
+    """
+    formato = formato or NDJSON
+    if formato not in FORMATOS:
+        raise FormatoInvalido(f'Formatos válidos: {", ".join(FORMATOS)}.')
+
+    filas = _filas(queryset, serializador)
+    if formato == CSV:
+        contenido = _csv(filas, list(serializador.fields))
+    else:
+        contenido = _ndjson(filas)
+
+    respuesta = StreamingHttpResponse(contenido, content_type=FORMATOS[formato])
+    fecha = timezone.localdate().strftime('%Y%m%d')
+    respuesta['Content-Disposition'] = f'attachment; filename="{nombre}-{fecha}.{formato}"'
+    return respuesta
@@ -24,7 +24,8 @@ ESTRUCTURA DEL ARCHIVO:
 -----------------------
 - Cada clase hereda de `django_filters.FilterSet`.
 - Dentro de cada clase se definen los filtros específicos por tipo de dato:
-    • `CharFilter` → para texto (con `icontains` para búsquedas insensibles a mayúsculas).  
+    • `CharFilter` → para texto (con `icontains` para búsquedas insensibles a mayúsculas,
+      o `istartswith` + autocompletado por prefijo, ver `autocompletar.py`).  
     • `BooleanFilter` → para valores booleanos.  
     • `ChoiceFilter` → para campos con opciones predefinidas.  
     • `DateFilter` → para filtrar por fechas (por ejemplo: fecha_desde / fecha_hasta).  
@@ -47,6 +48,8 @@ Estos filtros hacen que la API sea flexible, eficiente y totalmente configurable
 específicas sobre pacientes, médicos, consultas, tratamientos y recetas médicas.
 """
 import django_filters
+from django import forms
+from .autocompletar import atributos_widget
 from .models import (
     Especialidad, Paciente, Medico, ConsultaMedica,
     Tratamiento, Medicamento, RecetaMedica, Laboratorio
@@ -57,19 +60,16 @@ class EspecialidadFilter(django_filters.FilterSet):
     """
     Filtro para búsqueda de especialidades.
     """
-    nombre = django_filters.ChoiceFilter(choices=[], label='Nombre')
+    nombre = django_filters.CharFilter(
+        lookup_expr='istartswith', label='Nombre',
+        widget=forms.TextInput(attrs=atributos_widget('especialidad-nombre')),
+    )
     activa = django_filters.BooleanFilter()
     
     class Meta:
         model = Especialidad
         fields = ['nombre', 'activa']
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        nombres = (self.queryset.values_list('nombre', flat=True)
-                                .distinct()
-                                .order_by('nombre'))
-        self.filters['nombre'].extra['choices'] = [('', 'Todos')] + [(n, n) for n in nombres]
     def filter_activo(self, queryset, name, value):
         if value == 'true':  return queryset.filter(activo=True)
         if value == 'false': return queryset.filter(activo=False)
@@ -82,21 +82,17 @@ class EspecialidadFilter(django_filters.FilterSet):
 # filters.py
 
 class LaboratorioFilter(django_filters.FilterSet):
-    pais = django_filters.ChoiceFilter(choices=[], label='País')
+    # Las sugerencias se piden al escribir (autocompletar.py), no al construir el filtro.
+    pais = django_filters.CharFilter(
+        lookup_expr='istartswith', label='País',
+        widget=forms.TextInput(attrs=atributos_widget('laboratorio-pais')),
+    )
     activo = django_filters.ChoiceFilter(choices=[('', 'Todos'), ('true','Sí'), ('false','No')], method='filter_activo')
 
     class Meta:
         model = Laboratorio
         fields = ['pais', 'activo']
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        # construir choices dinámicamente desde la BD (orden alfabético)
-        paises = (self.queryset.values_list('pais', flat=True)
-                               .distinct()
-                               .order_by('pais'))
-        self.filters['pais'].extra['choices'] = [('', 'Todos')] + [(p, p) for p in paises]
-
     def filter_activo(self, queryset, name, value):
         if value == 'true':  return queryset.filter(activo=True)
         if value == 'false': return queryset.filter(activo=False)
@@ -105,35 +101,28 @@ class LaboratorioFilter(django_filters.FilterSet):
 class PacienteFilter(django_filters.FilterSet):
     """
     Filtro para búsqueda de pacientes.
+
+    Nombre, apellido y RUT se filtran por prefijo; las sugerencias se cargan al escribir
+    desde `/api/autocompletar/<campo>/`, por lo que construir el filtro no consulta la BD.
     """
-    nombre = django_filters.ChoiceFilter(choices=[], label='nombre')
-    apellido = django_filters.ChoiceFilter(choices=[], label='apellido')
-    rut = django_filters.ChoiceFilter(choices=[], label='rut')
+    nombre = django_filters.CharFilter(
+        lookup_expr='istartswith', label='nombre',
+        widget=forms.TextInput(attrs=atributos_widget('paciente-nombre')),
+    )
+    apellido = django_filters.CharFilter(
+        field_name='apellido_paterno', lookup_expr='istartswith', label='apellido',
+        widget=forms.TextInput(attrs=atributos_widget('paciente-apellido')),
+    )
+    rut = django_filters.CharFilter(
+        lookup_expr='istartswith', label='rut',
+        widget=forms.TextInput(attrs=atributos_widget('paciente-rut')),
+    )
+    prevision = django_filters.ChoiceFilter(choices=Paciente.PREVISION_CHOICES, empty_label='Todas')
     
     class Meta:
         model = Paciente
         fields = ['nombre', 'apellido', 'rut', 'prevision', 'activo']
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        # opcional: clases Bootstrap
-        nombre = (self.queryset.values_list('nombre', flat=True)
-                                 .distinct()
-                                 .order_by('nombre'))
-        apellido = (self.queryset.values_list('apellido_paterno', flat=True)
-                                   .distinct()
-                                   .order_by('apellido_paterno'))
-        rut = (self.queryset.values_list('rut', flat=True)
-                             .distinct()
-                             .order_by('rut'))
-        prevision = (self.queryset.values_list('prevision', flat=True)
-                                   .distinct()
-                                    .order_by('prevision'))
-        self.filters['nombre'].extra['choices'] = [('', 'Todos')] + [(n, n) for n in nombre]
-        self.filters['apellido'].extra['choices'] = [('', 'Todos')] + [(a, a) for a in apellido]
-        self.filters['rut'].extra['choices'] = [('', 'Todos')] + [(r, r) for r in rut]
-        self.filters['prevision'].extra['choices'] = [('', 'Todas')] + list(Paciente.PREVISION_CHOICES)
-        
 
     def filter_activo(self, queryset, name, value):
         if value == 'true':  return queryset.filter(activo=True)
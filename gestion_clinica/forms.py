@@ -1,8 +1,21 @@
+from copy import copy
+from datetime import timedelta
+
 from django import forms
 from django.core.exceptions import ValidationError
+from django.db import models
+from django.template.loader import render_to_string
+from django.utils import timezone
+from django.utils.safestring import mark_safe
+from .agenda import errores_agenda
+from .autocompletar import BUSQUEDAS, contexto_selector
+from .cache_referencia import usar_opciones_cacheadas
+from . import consumo
+from .disponibilidad import DIAS_MAXIMOS_BUSQUEDA, LIMITE_MAXIMO, LIMITE_POR_DEFECTO
 from .models import (
     Especialidad, Paciente, Medico, ConsultaMedica,
-    Tratamiento, Medicamento, RecetaMedica, Laboratorio
+    Tratamiento, Medicamento, RecetaMedica, Laboratorio,
+    DURACION_MAXIMA_CONSULTA
 )
 
 
@@ -13,6 +26,58 @@ DATE_INPUT_KW = {"type": "date"}
 DATETIME_INPUT_KW = {"type": "datetime-local"}
 
 
+# -----------------------------
+# Selección con búsqueda remota
+# -----------------------------
+class SelectorRemoto(forms.Widget):
+    """
+    Campo de búsqueda + `<input type="hidden">` con el id elegido.
+
+    A diferencia de `Select`, no recorre el queryset: solo carga (con una consulta)
+    la opción seleccionada para mostrar su etiqueta. Las demás se piden a
+    `/api/buscar/<clave>/` mientras el usuario escribe (ver `autocompletar.py`).
+    """
+    template_name = 'includes/selector_remoto.html'
+
+    def __init__(self, clave, placeholder='', attrs=None):
+        super().__init__(attrs)
+        self.clave = clave
+        self.placeholder = placeholder
+
+    def objeto_seleccionado(self, value):
+        if value in (None, ''):
+            return None
+        if isinstance(value, models.Model):
+            return value
+        try:
+            return BUSQUEDAS[self.clave].base().filter(pk=value).first()
+        except (TypeError, ValueError):
+            return None
+
+    def id_for_label(self, id_):
+        return f'{id_}-buscar' if id_ else id_
+
+    def render(self, name, value, attrs=None, renderer=None):
+        attrs = self.build_attrs(self.attrs, attrs)
+        return mark_safe(render_to_string(self.template_name, {
+            'nombre': name,
+            'id_campo': attrs.get('id', name),
+            'selector': contexto_selector(self.clave, self.objeto_seleccionado(value)),
+            'placeholder': self.placeholder,
+        }))
+
+
+class SeleccionRemotaField(forms.ModelChoiceField):
+    """
+    `ModelChoiceField` para tablas grandes: valida contra `BUSQUEDAS[clave].base()`
+    (una consulta por id en el POST) y se muestra con `SelectorRemoto`.
+    """
+
+    def __init__(self, clave, placeholder='', **kwargs):
+        kwargs.setdefault('widget', SelectorRemoto(clave, placeholder))
+        super().__init__(queryset=BUSQUEDAS[clave].base(), **kwargs)
+
+
 class EspecialidadForm(forms.ModelForm):
     class Meta:
         model = Especialidad
@@ -51,6 +116,7 @@ class MedicoForm(forms.ModelForm):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.fields['especialidad'].queryset = Especialidad.objects.filter(activa=True)
+        usar_opciones_cacheadas(self.fields['especialidad'], 'opciones-especialidades')
         # opcional: clases Bootstrap
         self.fields['especialidad'].widget.attrs.setdefault('class', 'form-select')
 
@@ -66,10 +132,13 @@ class LaboratorioForm(forms.ModelForm):
         return nombre   
 
 class ConsultaMedicaForm(forms.ModelForm):
+    paciente = SeleccionRemotaField('pacientes', placeholder='RUT o apellidos del paciente')
+    medico = SeleccionRemotaField('medicos', placeholder='RUT o apellidos del médico')
+
     class Meta:
         model = ConsultaMedica
         fields = [
-            'paciente', 'medico', 'fecha_hora', 'motivo_consulta',
+            'paciente', 'medico', 'fecha_hora', 'duracion', 'motivo_consulta',
             'diagnostico', 'observaciones', 'estado'
         ]
         widgets = {
@@ -79,13 +148,24 @@ class ConsultaMedicaForm(forms.ModelForm):
             'observaciones': forms.Textarea(attrs={'rows': 3}),
         }
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.fields['paciente'].queryset = Paciente.objects.filter(activo=True)
-        self.fields['medico'].queryset = Medico.objects.filter(activo=True)
+    def clean(self):
+        cleaned = super().clean()
+        if self.errors:
+            return cleaned
+        # Horario del médico y consultas superpuestas (ver agenda.py).
+        consulta = copy(self.instance)
+        for campo in ('paciente', 'medico', 'fecha_hora', 'duracion', 'estado'):
+            setattr(consulta, campo, cleaned.get(campo))
+        for campo, mensajes in errores_agenda(consulta).items():
+            for mensaje in mensajes:
+                self.add_error(campo, mensaje)
+        return cleaned
 
 
 class TratamientoForm(forms.ModelForm):
+    # Solo consultas REALIZADAS de pacientes activos (ver BUSQUEDAS['consultas']).
+    consulta = SeleccionRemotaField('consultas', placeholder='N° de consulta, RUT o apellidos del paciente')
+
     class Meta:
         model = Tratamiento
         fields = ['consulta', 'descripcion', 'fecha_inicio', 'fecha_fin', 'indicaciones', 'activo']
@@ -96,11 +176,6 @@ class TratamientoForm(forms.ModelForm):
             'indicaciones': forms.Textarea(attrs={'rows': 3}),
         }
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        # Por tu lógica actual, solo consultas REALIZADAS para crear/editar tratamientos
-        self.fields['consulta'].queryset = ConsultaMedica.objects.filter(estado='REALIZADA', paciente__activo=True)
-
     def clean(self):
         cleaned = super().clean()
         ini = cleaned.get('fecha_inicio')
@@ -128,6 +203,9 @@ class MedicamentoForm(forms.ModelForm):
 
 
 class RecetaMedicaForm(forms.ModelForm):
+    # Solo tratamientos activos (ver BUSQUEDAS['tratamientos']).
+    tratamiento = SeleccionRemotaField('tratamientos', placeholder='N° de tratamiento, RUT o apellidos del paciente')
+
     class Meta:
         model = RecetaMedica
         fields = [
@@ -140,11 +218,57 @@ class RecetaMedicaForm(forms.ModelForm):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.fields['tratamiento'].queryset = Tratamiento.objects.filter(activo=True)
-        self.fields['medicamento'].queryset = Medicamento.objects.filter(activo=True)
+        # El catálogo de medicamentos es acotado: un <select> normal, pero con una sola
+        # consulta de las columnas que forman la etiqueta.
+        medicamento = self.fields['medicamento']
+        medicamento.queryset = (Medicamento.objects.filter(activo=True)
+                                .only('nombre', 'presentacion', 'concentracion'))
+        medicamento.label_from_instance = lambda m: f"{m.nombre} — {m.presentacion} ({m.concentracion})"
+        usar_opciones_cacheadas(medicamento, 'opciones-medicamentos')
+        medicamento.widget.attrs.setdefault('class', 'form-select')
 
     def clean_cantidad_total(self):
         cant = self.cleaned_data['cantidad_total']
         if cant is None or cant < 1:
             raise ValidationError("La cantidad total debe ser ≥ 1.")
         return cant
+
+
+class HorariosLibresForm(forms.Form):
+    """
+    Parámetros de `GET /api/agenda/disponibles/` (ver disponibilidad.py).
+    Sin `desde`, desde hoy; sin `hasta`, 30 días desde `desde`.
+    """
+    especialidad = forms.ModelChoiceField(queryset=Especialidad.objects.filter(activa=True))
+    desde = forms.DateField(required=False)
+    hasta = forms.DateField(required=False)
+    duracion = forms.IntegerField(required=False, min_value=5, max_value=DURACION_MAXIMA_CONSULTA)
+    limite = forms.IntegerField(required=False, min_value=1, max_value=LIMITE_MAXIMO)
+
+    def clean(self):
+        cleaned = super().clean()
+        desde = cleaned.get('desde') or timezone.localdate()
+        hasta = cleaned.get('hasta') or desde + timedelta(days=30)
+        if hasta < desde:
+            self.add_error('hasta', "La fecha final no puede ser anterior a la inicial.")
+        elif (hasta - desde).days >= DIAS_MAXIMOS_BUSQUEDA:
+            self.add_error('hasta', f"El rango admite como máximo {DIAS_MAXIMOS_BUSQUEDA} días.")
+        cleaned['desde'], cleaned['hasta'] = desde, hasta
+        cleaned['duracion'] = cleaned.get('duracion') or 30
+        cleaned['limite'] = cleaned.get('limite') or LIMITE_POR_DEFECTO
+        return cleaned
+
+
+class ProyeccionStockForm(forms.Form):
+    """
+    Parámetros de `GET /api/stock/proyeccion/` (ver consumo.py).
+    """
+    ventana = forms.IntegerField(required=False, min_value=1, max_value=consumo.VENTANA_MAXIMA)
+    dias_maximos = forms.IntegerField(required=False, min_value=0)
+    limite = forms.IntegerField(required=False, min_value=1, max_value=consumo.LIMITE_MAXIMO)
+
+    def clean(self):
+        cleaned = super().clean()
+        cleaned['ventana'] = cleaned.get('ventana') or consumo.VENTANA_POR_DEFECTO
+        cleaned['limite'] = cleaned.get('limite') or consumo.LIMITE_POR_DEFECTO
+        return cleaned
@@ -0,0 +1,112 @@
+"""
+Archivo: benchmark_carga_masiva.py
+Ubicación: gestion_clinica/management/commands
+
+DESCRIPCIÓN GENERAL:
+--------------------
+Mide el rendimiento de la carga masiva de consultas: la misma cantidad de consultas
+enviada como un `POST /api/consultas/` por consulta y como lotes a
+`POST /api/consultas/lote/` (ver `carga_masiva.py`).
+
+Todo se ejecuta dentro de una transacción que se revierte al terminar, así que no deja
+datos en la base de datos (las secuencias de ids sí avanzan).
+
+Uso:
+    python manage.py benchmark_carga_masiva --cantidad 2000 --tamano-lote 500
+"""
+
+import time
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from gestion_clinica.models import Especialidad, Medico, Paciente
+
+
+class _Revertir(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Compara POST individuales con la carga masiva /api/consultas/lote/.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cantidad', type=int, default=1000,
+                            help='Consultas a enviar en cada modo (por defecto 1000).')
+        parser.add_argument('--tamano-lote', type=int, default=500,
+                            help='Consultas por petición en el modo lote (por defecto 500).')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self._medir(options['cantidad'], options['tamano_lote'])
+                raise _Revertir
+        except _Revertir:
+            pass
+
+    def _datos(self, cantidad):
+        especialidad = Especialidad.objects.create(nombre='Benchmark carga masiva')
+        medico = Medico.objects.create(
+            rut='99999999-9', nombre='Bench', apellido_paterno='Mark', apellido_materno='Lote',
+            especialidad=especialidad, telefono='900000000', email='bench@clinica.cl',
+            numero_registro='BENCH-LOTE', fecha_ingreso=date(2020, 1, 1), jornada='TURNO',
+        )
+        paciente = Paciente.objects.create(
+            rut='99999998-7', nombre='Bench', apellido_paterno='Mark', apellido_materno='Lote',
+            fecha_nacimiento=date(1990, 1, 1), telefono='900000000', direccion='Benchmark',
+        )
+        inicio = timezone.now()
+        return [
+            {
+                'paciente': paciente.pk, 'medico': medico.pk,
+                'fecha_hora': (inicio + timedelta(minutes=15 * n)).isoformat(), 'duracion': 15,
+                'motivo_consulta': f'Benchmark {n}',
+            }
+            for n in range(cantidad)
+        ]
+
+    def _medir(self, cantidad, tamano_lote):
+        # 'localhost' se permite con ALLOWED_HOSTS vacío y DEBUG=True.
+        host = next((h.lstrip('.') for h in settings.ALLOWED_HOSTS if h != '*'), 'localhost')
+        cliente = APIClient(SERVER_NAME=host)
+        # Horarios distintos en cada modo: la agenda rechaza consultas superpuestas.
+        datos = self._datos(2 * cantidad)
+        elementos = datos[:cantidad]
+
+        url = reverse('consulta-api-list')
+        with CaptureQueriesContext(connection) as consultas:
+            inicio = time.perf_counter()
+            for elemento in elementos:
+                respuesta = cliente.post(url, elemento, format='json')
+                if respuesta.status_code != 201:
+                    raise CommandError(respuesta.content.decode())
+            individual = time.perf_counter() - inicio
+        self._informar('Individual', cantidad, cantidad, individual, len(consultas))
+
+        url = reverse('consulta-api-lote')
+        elementos = datos[cantidad:]
+        lotes = [elementos[i:i + tamano_lote] for i in range(0, cantidad, tamano_lote)]
+        with CaptureQueriesContext(connection) as consultas:
+            inicio = time.perf_counter()
+            for lote in lotes:
+                respuesta = cliente.post(url, lote, format='json')
+                if respuesta.status_code != 200:
+                    raise CommandError(respuesta.content.decode())
+            masivo = time.perf_counter() - inicio
+        self._informar('Lote', cantidad, len(lotes), masivo, len(consultas))
+
+        if masivo:
+            self.stdout.write(self.style.SUCCESS(f'Aceleración: {individual / masivo:.1f}x'))
+
+    def _informar(self, modo, cantidad, peticiones, segundos, consultas_sql):
+        por_segundo = cantidad / segundos if segundos else float('inf')
+        self.stdout.write(
+            f'{modo:<10} {cantidad} consultas en {peticiones} peticiones: '
+            f'{segundos:.2f} s ({por_segundo:.0f} consultas/s, {consultas_sql} consultas SQL)'
+        )
@@ -0,0 +1,139 @@
+"""
+Archivo: benchmark_conexiones.py
+Ubicación: gestion_clinica/management/commands
+
+DESCRIPCIÓN GENERAL:
+--------------------
+Compara peticiones por segundo de la API con cada perfil de conexión a la base de
+datos (`nueva`, `persistente` y, si psycopg 3 está instalado, `pool`; ver
+`clinica_salud_vital/conexiones.py`).
+
+Cada hilo simula un *worker* del servidor (gunicorn, uWSGI): atiende sus peticiones una
+tras otra con el mismo `WSGIHandler` de producción, así que las señales de inicio y fin
+de petición abren, reutilizan o devuelven la conexión según el perfil, como en un
+despliegue real. Solo hace peticiones GET (no modifica datos). Al terminar se restaura
+la configuración de `DATABASES`.
+
+Uso:
+    python manage.py benchmark_conexiones --peticiones 1000 --hilos 4 --url /api/pacientes/
+"""
+
+import threading
+import time
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.test import RequestFactory
+
+from clinica_salud_vital.conexiones import (
+    NUEVA, PERFILES, PERSISTENTE, POOL, perfil_conexiones, perfil_en_uso, pool_disponible,
+)
+
+
+class Command(BaseCommand):
+    help = 'Compara peticiones por segundo con y sin conexiones persistentes o pool.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='/api/pacientes/',
+                            help='Ruta a pedir (por defecto /api/pacientes/).')
+        parser.add_argument('--peticiones', type=int, default=500,
+                            help='Peticiones por perfil (por defecto 500).')
+        parser.add_argument('--hilos', type=int, default=4,
+                            help='Workers simultáneos (por defecto 4).')
+        parser.add_argument('--perfiles', default=','.join(PERFILES),
+                            help='Perfiles a comparar, separados por comas.')
+
+    def handle(self, *args, **options):
+        perfiles = [p.strip() for p in options['perfiles'].split(',') if p.strip()]
+        desconocidos = set(perfiles) - set(PERFILES)
+        if desconocidos:
+            raise CommandError(f'Perfiles desconocidos: {", ".join(sorted(desconocidos))}.')
+        if POOL in perfiles and not pool_disponible():
+            self.stdout.write(self.style.WARNING(
+                'Se omite "pool": requiere pip install "psycopg[binary,pool]".'
+            ))
+            perfiles.remove(POOL)
+
+        config = connections.settings['default']
+        original = dict(config)
+        resultados = {}
+        try:
+            for perfil in perfiles:
+                self._aplicar(config, perfil_conexiones(
+                    original, perfil,
+                    edad_maxima=getattr(settings, 'BASE_DATOS_EDAD_MAXIMA', 600),
+                    verificar=getattr(settings, 'BASE_DATOS_VERIFICAR', True),
+                    pool=getattr(settings, 'BASE_DATOS_POOL', None),
+                ))
+                resultados[perfil] = self._medir(options['url'], options['peticiones'], options['hilos'])
+                self._informar(perfil, options['peticiones'], *resultados[perfil])
+        finally:
+            self._aplicar(config, original)
+
+        if NUEVA in resultados:
+            base = resultados[NUEVA][0]
+            for perfil in (PERSISTENTE, POOL):
+                if perfil in resultados and resultados[perfil][0]:
+                    self.stdout.write(self.style.SUCCESS(
+                        f'Aceleración {perfil}: {base / resultados[perfil][0]:.1f}x'
+                    ))
+
+    def _aplicar(self, config, nuevo):
+        if perfil_en_uso(config) == POOL:
+            connections['default'].close_pool()
+        # Mismo diccionario: lo comparten las conexiones que abrirán los hilos.
+        config.clear()
+        config.update(nuevo)
+
+    def _medir(self, url, peticiones, hilos):
+        # 'localhost' se permite con ALLOWED_HOSTS vacío y DEBUG=True.
+        host = next((h.lstrip('.') for h in settings.ALLOWED_HOSTS if h != '*'), 'localhost')
+        fabrica = RequestFactory(SERVER_NAME=host)
+        manejador = WSGIHandler()
+        abiertas = []
+        errores = []
+
+        def contar(sender, connection, **kwargs):
+            abiertas.append(connection.alias)
+
+        def worker(cantidad):
+            try:
+                for _ in range(cantidad):
+                    estado = []
+                    respuesta = manejador(fabrica.get(url).environ, lambda s, h: estado.append(s))
+                    b''.join(respuesta)
+                    respuesta.close()
+                    if not estado[0].startswith('200'):
+                        errores.append(estado[0])
+            finally:
+                connections.close_all()
+
+        cantidades = [peticiones // hilos + (1 if n < peticiones % hilos else 0) for n in range(hilos)]
+        trabajadores = [threading.Thread(target=worker, args=(c,)) for c in cantidades if c]
+        connection_created.connect(contar)
+        try:
+            inicio = time.perf_counter()
+            for trabajador in trabajadores:
+                trabajador.start()
+            for trabajador in trabajadores:
+                trabajador.join()
+            segundos = time.perf_counter() - inicio
+        finally:
+            connection_created.disconnect(contar)
+        if errores:
+            raise CommandError(f'{len(errores)} peticiones fallaron a {url} (primera: {errores[0]}).')
+        if perfil_en_uso(connections.settings['default']) == POOL:
+            # Con pool, `connection_created` se emite en cada préstamo de una conexión.
+            return segundos, connections['default'].pool.get_stats().get('connections_num', 0)
+        return segundos, len(abiertas)
+
+    def _informar(self, perfil, peticiones, segundos, abiertas):
+        por_segundo = peticiones / segundos if segundos else float('inf')
+        self.stdout.write(
+            f'{perfil:<12} {peticiones} peticiones en {segundos:.2f} s '
+            f'({por_segundo:.0f} peticiones/s, {abiertas} conexiones abiertas)'
+        )
+
@@ -0,0 +1,144 @@
+"""
+Archivo: benchmark_disponibilidad.py
+Ubicación: gestion_clinica/management/commands
+
+DESCRIPCIÓN GENERAL:
+--------------------
+Mide la búsqueda de horarios libres (`GET /api/agenda/disponibles/`, ver
+`disponibilidad.py`) con una especialidad de `--medicos` médicos de jornada completa
+y sus agendas ocupadas al `--ocupacion` durante `--dias` días.
+
+Para cada duración pedida informa la mediana, el percentil 95 y el máximo de
+`--repeticiones` peticiones y las consultas SQL de cada una. Con duraciones largas
+(240 minutos) casi no hay horarios libres y la búsqueda recorre el rango completo:
+es el peor caso.
+
+Todo se ejecuta dentro de una transacción que se revierte al terminar, así que no deja
+datos en la base de datos (las secuencias de ids sí avanzan).
+
+Uso:
+    python manage.py benchmark_disponibilidad --medicos 200 --dias 60 --ocupacion 0.9
+"""
+
+import random
+import statistics
+import time
+from datetime import date, datetime, timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from gestion_clinica.agenda import horarios_por_medico
+from gestion_clinica.disponibilidad import reconstruir
+from gestion_clinica.models import ConsultaMedica, Especialidad, Medico, Paciente
+
+OBJETIVO_MS = 50
+
+
+class _Revertir(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Mide la búsqueda de horarios libres de /api/agenda/disponibles/.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--medicos', type=int, default=200,
+                            help='Médicos activos de la especialidad (por defecto 200).')
+        parser.add_argument('--dias', type=int, default=60,
+                            help='Días del rango de búsqueda (por defecto 60).')
+        parser.add_argument('--ocupacion', type=float, default=0.9,
+                            help='Fracción de bloques de 30 minutos ocupados (por defecto 0.9).')
+        parser.add_argument('--duraciones', default='30,60,240',
+                            help='Duraciones a buscar, en minutos, separadas por comas.')
+        parser.add_argument('--repeticiones', type=int, default=30,
+                            help='Peticiones por duración (por defecto 30).')
+
+    def handle(self, *args, **options):
+        if not 0 <= options['ocupacion'] <= 1:
+            raise CommandError('--ocupacion debe estar entre 0 y 1.')
+        try:
+            with transaction.atomic():
+                self._medir(options)
+                raise _Revertir
+        except _Revertir:
+            pass
+
+    def _datos(self, cantidad_medicos, dias, ocupacion):
+        especialidad = Especialidad.objects.create(nombre='Benchmark disponibilidad')
+        medicos = Medico.objects.bulk_create([
+            Medico(
+                rut=f'BD-{n}', nombre='Bench', apellido_paterno='Mark', apellido_materno=str(n),
+                especialidad=especialidad, telefono='900000000', email=f'bench{n}@clinica.cl',
+                numero_registro=f'BENCH-DISP-{n}', fecha_ingreso=date(2020, 1, 1), jornada='COMPLETA',
+            )
+            for n in range(cantidad_medicos)
+        ])
+        paciente = Paciente.objects.create(
+            rut='99999997-5', nombre='Bench', apellido_paterno='Mark', apellido_materno='Disp',
+            fecha_nacimiento=date(1990, 1, 1), telefono='900000000', direccion='Benchmark',
+        )
+        hoy = timezone.localdate()
+        desde = hoy + timedelta(days=7 - hoy.weekday())  # próximo lunes
+        horarios = horarios_por_medico(medicos)
+        azar = random.Random(1)
+        consultas = []
+        for medico in medicos:
+            for dia in range(dias):
+                fecha = desde + timedelta(days=dia)
+                for hora_inicio, hora_fin in (horarios[medico.pk] or {}).get(fecha.weekday(), []):
+                    inicio = timezone.make_aware(datetime.combine(fecha, hora_inicio))
+                    fin = timezone.make_aware(datetime.combine(fecha, hora_fin))
+                    while inicio + timedelta(minutes=30) <= fin:
+                        if azar.random() < ocupacion:
+                            consultas.append(ConsultaMedica(
+                                paciente=paciente, medico=medico, fecha_hora=inicio, duracion=30,
+                                fecha_fin=inicio + timedelta(minutes=30), motivo_consulta='Benchmark',
+                            ))
+                        inicio += timedelta(minutes=30)
+        ConsultaMedica.objects.bulk_create(consultas, batch_size=5000)
+        return especialidad, desde, len(consultas)
+
+    def _medir(self, options):
+        self.stdout.write('Preparando datos...')
+        especialidad, desde, consultas = self._datos(options['medicos'], options['dias'], options['ocupacion'])
+        inicio = time.perf_counter()
+        filas = reconstruir(desde)
+        self.stdout.write(
+            f'{options["medicos"]} médicos, {consultas} consultas; mapa de ocupación '
+            f'({filas} filas) en {time.perf_counter() - inicio:.2f} s'
+        )
+
+        # 'localhost' se permite con ALLOWED_HOSTS vacío y DEBUG=True.
+        host = next((h.lstrip('.') for h in settings.ALLOWED_HOSTS if h != '*'), 'localhost')
+        cliente = Client(SERVER_NAME=host)
+        url = reverse('agenda_disponibles')
+        hasta = desde + timedelta(days=options['dias'] - 1)
+        for duracion in [int(d) for d in options['duraciones'].split(',') if d.strip()]:
+            parametros = {
+                'especialidad': especialidad.pk, 'desde': desde.isoformat(),
+                'hasta': hasta.isoformat(), 'duracion': duracion,
+            }
+            tiempos = []
+            for _ in range(options['repeticiones']):
+                with CaptureQueriesContext(connection) as sql:
+                    inicio = time.perf_counter()
+                    respuesta = cliente.get(url, parametros)
+                    tiempos.append((time.perf_counter() - inicio) * 1000)
+                if respuesta.status_code != 200:
+                    raise CommandError(respuesta.content.decode())
+            self._informar(duracion, tiempos, len(sql), len(respuesta.json()['resultados']))
+
+    def _informar(self, duracion, tiempos, consultas_sql, encontrados):
+        tiempos.sort()
+        p95 = tiempos[min(len(tiempos) - 1, int(len(tiempos) * 0.95))]
+        estilo = self.style.SUCCESS if p95 < OBJETIVO_MS else self.style.WARNING
+        self.stdout.write(estilo(
+            f'{duracion:>4} min: mediana {statistics.median(tiempos):.1f} ms, p95 {p95:.1f} ms, '
+            f'máximo {tiempos[-1]:.1f} ms ({consultas_sql} consultas SQL, {encontrados} horarios)'
+        ))
@@ -0,0 +1,87 @@
+"""
+Archivo: ejecutar_tareas.py
+Ubicación: gestion_clinica/management/commands
+
+DESCRIPCIÓN GENERAL:
+--------------------
+Ejecuta las tareas programadas (ver `tareas.py` y `barridos.py`) e informa el avance de
+cada lote (filas y filas por segundo).
+
+- Sin argumentos: las tareas vencidas y las solicitadas (p. ej. `POST /api/analitica/exportar/`),
+  una vez (para cron, por ejemplo cada noche).
+- Con nombres: esas tareas, aunque no hayan vencido.
+- `--continuo`: proceso propio que cada `--intervalo` segundos ejecuta las vencidas.
+- `--lista`: tareas registradas con su última ejecución completada.
+
+Uso:
+    python manage.py ejecutar_tareas [consultas_no_asistio tratamientos_vencidos]
+    python manage.py ejecutar_tareas --continuo --intervalo 300
+"""
+
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from gestion_clinica.tareas import TareaEnCurso, ejecutar, pendientes, tareas_registradas, ultimas_completadas
+
+
+class Command(BaseCommand):
+    help = 'Ejecuta las tareas programadas (barridos de estado de consultas y tratamientos).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('nombres', nargs='*', help='Tareas a ejecutar (por defecto, las vencidas).')
+        parser.add_argument('--lista', action='store_true', help='Lista las tareas registradas.')
+        parser.add_argument('--continuo', action='store_true',
+                            help='No termina: ejecuta las tareas vencidas cada --intervalo segundos.')
+        parser.add_argument('--intervalo', type=int, default=60,
+                            help='Segundos entre revisiones con --continuo (por defecto 60).')
+        parser.add_argument('--lote', type=int, help='Filas por lote (por defecto TAREAS_TAMANO_LOTE).')
+        parser.add_argument('--pausa', type=float, help='Segundos entre lotes (por defecto TAREAS_PAUSA_LOTES).')
+
+    def handle(self, *args, **options):
+        registradas = tareas_registradas()
+        if options['lista']:
+            ultimas = ultimas_completadas()
+            for nombre, registrada in registradas.items():
+                ultima = ultimas.get(nombre)
+                cuando = timezone.localtime(ultima).strftime('%d/%m/%Y %H:%M') if ultima else 'nunca'
+                frecuencia = f'cada {registrada.cada}' if registrada.cada else 'a pedido'
+                self.stdout.write(f'{nombre:<24} {frecuencia} (última: {cuando}) {registrada.descripcion}')
+            return
+        desconocidas = set(options['nombres']) - set(registradas)
+        if desconocidas:
+            raise CommandError(f'Tareas desconocidas: {", ".join(sorted(desconocidas))}.')
+        if options['lote'] is not None and options['lote'] < 1:
+            raise CommandError('--lote debe ser mayor que 0.')
+
+        if not options['continuo']:
+            self._ejecutar(options['nombres'] or pendientes(), options)
+            return
+        while True:
+            self._ejecutar(pendientes(), options)
+            time.sleep(options['intervalo'])
+
+    def _ejecutar(self, nombres, options):
+        if not nombres:
+            self.stdout.write('No hay tareas pendientes.')
+        for nombre in nombres:
+            self.stdout.write(f'{nombre}...')
+            try:
+                ejecucion = ejecutar(nombre, tamano=options['lote'], pausa=options['pausa'],
+                                     informar=self._informar)
+            except TareaEnCurso as exc:
+                self.stdout.write(self.style.WARNING(str(exc)))
+                continue
+            except Exception as exc:
+                self.stdout.write(self.style.ERROR(f'{nombre} falló: {exc!r}'))
+                continue
+            segundos = (ejecucion.fin - ejecucion.inicio).total_seconds()
+            self.stdout.write(self.style.SUCCESS(
+                f'{nombre}: {ejecucion.filas} filas en {ejecucion.lotes} lotes ({segundos:.1f} s)'
+            ))
+
+    def _informar(self, avance):
+        self.stdout.write(
+            f'  lote {avance.lotes}: {avance.filas} filas ({avance.filas_por_segundo:.0f} filas/s)'
+        )
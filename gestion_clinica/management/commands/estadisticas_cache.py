@@ -0,0 +1,35 @@
+"""
+Archivo: estadisticas_cache.py
+Ubicación: gestion_clinica/management/commands
+
+DESCRIPCIÓN GENERAL:
+--------------------
+Muestra los aciertos y fallos de la caché de datos de referencia por grupo
+(ver `cache_referencia.py`). Con `--reiniciar` pone los contadores en cero.
+
+Uso:
+    python manage.py estadisticas_cache
+    python manage.py estadisticas_cache --reiniciar
+"""
+
+from django.core.management.base import BaseCommand
+
+from gestion_clinica.cache_referencia import estadisticas, reiniciar_estadisticas
+
+
+class Command(BaseCommand):
+    help = 'Muestra los aciertos y fallos de la caché de datos de referencia.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reiniciar', action='store_true',
+                            help='Pone los contadores en cero después de mostrarlos.')
+
+    def handle(self, *args, **options):
+        for grupo, datos in estadisticas().items():
+            tasa = '-' if datos['tasa_aciertos'] is None else f'{datos["tasa_aciertos"]:.1%}'
+            self.stdout.write(
+                f'{grupo:<25} {datos["aciertos"]:>8} aciertos {datos["fallos"]:>8} fallos  {tasa}'
+            )
+        if options['reiniciar']:
+            reiniciar_estadisticas()
+            self.stdout.write(self.style.SUCCESS('Estadísticas reiniciadas.'))
@@ -0,0 +1,39 @@
+"""
+Archivo: estadisticas_conexiones.py
+Ubicación: gestion_clinica/management/commands
+
+DESCRIPCIÓN GENERAL:
+--------------------
+Muestra el perfil de conexión a la base de datos (`BASE_DATOS_CONEXIONES`), las
+estadísticas del pool si se usa el perfil `pool` y las conexiones abiertas en
+PostgreSQL por estado (ver `clinica_salud_vital/conexiones.py`).
+
+Uso:
+    python manage.py estadisticas_conexiones
+"""
+
+from django.core.management.base import BaseCommand
+
+from clinica_salud_vital.conexiones import estadisticas
+
+
+class Command(BaseCommand):
+    help = 'Muestra el perfil de conexión, las estadísticas del pool y las conexiones abiertas.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default',
+                            help='Alias de la base de datos (por defecto "default").')
+
+    def handle(self, *args, **options):
+        datos = estadisticas(options['database'])
+        self.stdout.write(f'Perfil:       {datos["perfil"]}')
+        self.stdout.write(f'CONN_MAX_AGE: {datos["edad_maxima"]}')
+        self.stdout.write(f'Verificación: {"sí" if datos["verificar"] else "no"}')
+        if datos['pool'] is not None:
+            self.stdout.write('Pool:')
+            for clave, valor in sorted(datos['pool'].items()):
+                self.stdout.write(f'  {clave:<22} {valor}')
+        if datos['servidor'] is not None:
+            self.stdout.write('Conexiones en el servidor:')
+            for estado, cantidad in datos['servidor'].items():
+                self.stdout.write(f'  {estado:<22} {cantidad}')
@@ -0,0 +1,52 @@
+"""
+Archivo: exportar_analitica.py
+Ubicación: gestion_clinica/management/commands
+
+DESCRIPCIÓN GENERAL:
+--------------------
+Escribe (o actualiza) la exportación columnar para análisis: Parquet particionado por
+mes de consultas, tratamientos, recetas y medicamentos (ver `analitica.py`).
+
+Por defecto solo reescribe las particiones que cambiaron desde la ejecución anterior,
+así que se puede programar cada noche (o cada hora) con cron.
+
+Uso:
+    python manage.py exportar_analitica
+    python manage.py exportar_analitica --tabla consultas --tabla recetas --procesos 4
+    python manage.py exportar_analitica --completa --formato csv --destino /datos/analitica
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from gestion_clinica.analitica import FORMATOS, PARQUET, TABLAS, ExportacionNoDisponible, exportar
+
+
+class Command(BaseCommand):
+    help = 'Exporta las tablas clínicas a archivos columnares particionados por mes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tabla', action='append', choices=list(TABLAS), dest='tablas',
+                            help='Tabla a exportar (se puede repetir; por defecto todas).')
+        parser.add_argument('--formato', choices=FORMATOS, default=PARQUET)
+        parser.add_argument('--procesos', type=int, default=None,
+                            help='Procesos escritores (por defecto ANALITICA_PROCESOS o la cantidad de CPUs).')
+        parser.add_argument('--completa', action='store_true',
+                            help='Reescribe todas las particiones, no solo las que cambiaron.')
+        parser.add_argument('--destino', default=None,
+                            help='Directorio de salida (por defecto ANALITICA_DIRECTORIO).')
+
+    def handle(self, *args, **options):
+        try:
+            informe = exportar(
+                tablas=options['tablas'], formato=options['formato'], procesos=options['procesos'],
+                completa=options['completa'], base=options['destino'],
+            )
+        except ExportacionNoDisponible as exc:
+            raise CommandError(str(exc))
+
+        for tabla, datos in informe.items():
+            self.stdout.write(
+                f"{tabla}: {len(datos['escritas'])} particiones escritas, "
+                f"{len(datos['eliminadas'])} eliminadas, {datos['sin_cambios']} sin cambios"
+            )
+        self.stdout.write(self.style.SUCCESS('Exportación analítica completada.'))
@@ -0,0 +1,28 @@
+"""
+Archivo: reconciliar_metricas.py
+Ubicación: gestion_clinica/management/commands
+
+DESCRIPCIÓN GENERAL:
+--------------------
+Recalcula desde las tablas las métricas del tablero de inicio (ver `metricas.py`)
+y corrige las que se hayan desfasado por operaciones masivas sin señales.
+
+Uso (programarlo periódicamente, p. ej. cada noche con cron):
+    python manage.py reconciliar_metricas
+"""
+
+from django.core.management.base import BaseCommand
+
+from gestion_clinica.metricas import reconciliar
+
+
+class Command(BaseCommand):
+    help = 'Recalcula las métricas del tablero de inicio y corrige las desfasadas.'
+
+    def handle(self, *args, **options):
+        diferencias = reconciliar()
+        for clave, (almacenado, real) in sorted(diferencias.items()):
+            self.stdout.write(f'{clave}: {almacenado} -> {real}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Métricas reconciliadas ({len(diferencias)} corregidas).'
+        ))
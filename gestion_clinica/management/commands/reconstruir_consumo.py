@@ -0,0 +1,25 @@
+"""
+Archivo: reconstruir_consumo.py
+Ubicación: gestion_clinica/management/commands
+
+DESCRIPCIÓN GENERAL:
+--------------------
+Recalcula desde las recetas el consumo diario de cada medicamento que usa la
+proyección de stock (ver `consumo.py`). Necesario solo si se escribieron recetas sin
+`save()` ni carga masiva (SQL directo, `QuerySet.update()`).
+
+Uso:
+    python manage.py reconstruir_consumo
+"""
+
+from django.core.management.base import BaseCommand
+
+from gestion_clinica.consumo import reconstruir
+
+
+class Command(BaseCommand):
+    help = 'Recalcula el consumo diario de los medicamentos.'
+
+    def handle(self, *args, **options):
+        filas = reconstruir()
+        self.stdout.write(self.style.SUCCESS(f'Consumo reconstruido ({filas} días con recetas).'))
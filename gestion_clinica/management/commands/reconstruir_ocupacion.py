@@ -0,0 +1,36 @@
+"""
+Archivo: reconstruir_ocupacion.py
+Ubicación: gestion_clinica/management/commands
+
+DESCRIPCIÓN GENERAL:
+--------------------
+Recalcula desde las consultas AGENDADAS el mapa de ocupación de la agenda que usa la
+búsqueda de horarios libres (ver `disponibilidad.py`). Necesario solo si se escribieron
+consultas sin `save()` ni carga masiva (SQL directo, `QuerySet.update()`).
+
+Uso:
+    python manage.py reconstruir_ocupacion [--desde 2025-03-01]
+"""
+
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from gestion_clinica.disponibilidad import reconstruir
+
+
+class Command(BaseCommand):
+    help = 'Recalcula el mapa de ocupación de la agenda de los médicos.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--desde', help='Solo los días desde esta fecha (AAAA-MM-DD).')
+
+    def handle(self, *args, **options):
+        desde = None
+        if options['desde']:
+            try:
+                desde = date.fromisoformat(options['desde'])
+            except ValueError:
+                raise CommandError('--desde debe tener el formato AAAA-MM-DD.')
+        filas = reconstruir(desde)
+        self.stdout.write(self.style.SUCCESS(f'Ocupación reconstruida ({filas} días con consultas).'))
@@ -0,0 +1,264 @@
+"""
+Archivo: metricas.py
+Ubicación: Aplicación 'gestion_clinica'
+
+DESCRIPCIÓN GENERAL:
+--------------------
+Métricas del tablero de inicio (`home`): pacientes, médicos y especialidades activos,
+consultas totales y consultas del día por estado.
+
+Antes, cada carga de la página de inicio ejecutaba un `COUNT(*)` completo por métrica.
+Ahora cada cifra es una fila de `MetricaTablero` que se ajusta de forma incremental
+(`valor = valor + delta`) desde `signals.py` cada vez que se guarda o elimina un
+paciente, médico, especialidad o consulta. La página de inicio lee esas pocas filas
+por clave primaria (o directamente desde la caché), así que su costo no depende del
+tamaño de las tablas.
+
+CLAVES:
+-------
+- `pacientes_activos`, `medicos_activos`, `especialidades_activas`, `consultas_total`.
+- `consultas_dia:<AAAA-MM-DD>:<ESTADO>`: consultas de un día (hora local) por estado.
+  Agregar una métrica nueva por estado o por día no requiere recorrer la tabla.
+
+RECONCILIACIÓN:
+---------------
+Las operaciones que no disparan señales (`bulk_create`, `QuerySet.update`, SQL directo)
+dejan las métricas desfasadas, salvo que apliquen `sumar(deltas_guardado(...))` como
+los endpoints de carga masiva. `reconciliar()` (comando
+`python manage.py reconciliar_metricas`) las recalcula desde cero; se recomienda
+programarlo periódicamente (por ejemplo, cada noche con cron).
+
+CACHÉ:
+------
+El resultado de `metricas_tablero()` se guarda en la caché de Django durante
+`METRICAS_TABLERO_TTL` segundos (60 por defecto) y se invalida al confirmarse la
+transacción que modificó alguna métrica.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import ConsultaMedica, Especialidad, Medico, MetricaTablero, Paciente
+
+PACIENTES_ACTIVOS = 'pacientes_activos'
+MEDICOS_ACTIVOS = 'medicos_activos'
+ESPECIALIDADES_ACTIVAS = 'especialidades_activas'
+CONSULTAS_TOTAL = 'consultas_total'
+PREFIJO_CONSULTAS_DIA = 'consultas_dia:'
+
+CLAVES_FIJAS = [PACIENTES_ACTIVOS, MEDICOS_ACTIVOS, ESPECIALIDADES_ACTIVAS, CONSULTAS_TOTAL]
+
+
+def clave_consultas_dia(fecha, estado):
+    return f'{PREFIJO_CONSULTAS_DIA}{fecha.isoformat()}:{estado}'
+
+
+def _clave_cache(fecha):
+    return f'tablero:metricas:{fecha.isoformat()}'
+
+
+def _ttl():
+    return getattr(settings, 'METRICAS_TABLERO_TTL', 60)
+
+
+# -----------------------------
+# Lectura
+# -----------------------------
+
+def _leer(hoy):
+    estados = ConsultaMedica.ESTADO_CHOICES
+    claves_dia = {codigo: clave_consultas_dia(hoy, codigo) for codigo, _ in estados}
+    valores = dict(
+        MetricaTablero.objects.filter(clave__in=CLAVES_FIJAS + list(claves_dia.values()))
+        .values_list('clave', 'valor')
+    )
+    consultas_hoy = [
+        {'estado': codigo, 'etiqueta': etiqueta, 'total': valores.get(claves_dia[codigo], 0)}
+        for codigo, etiqueta in estados
+    ]
+    return {
+        'total_pacientes': valores.get(PACIENTES_ACTIVOS, 0),
+        'total_medicos': valores.get(MEDICOS_ACTIVOS, 0),
+        'total_especialidades': valores.get(ESPECIALIDADES_ACTIVAS, 0),
+        'total_consultas': valores.get(CONSULTAS_TOTAL, 0),
+        'consultas_hoy': consultas_hoy,
+        'total_consultas_hoy': sum(fila['total'] for fila in consultas_hoy),
+    }
+
+
+def metricas_tablero():
+    """
+    Métricas para `home.html`: desde la caché o, si no están, con una sola consulta
+    por clave primaria sobre `MetricaTablero`.
+    """
+    hoy = timezone.localdate()
+    datos = cache.get(_clave_cache(hoy))
+    if datos is None:
+        datos = _leer(hoy)
+        cache.set(_clave_cache(hoy), datos, _ttl())
+    return datos
+
+
+def invalidar_cache():
+    cache.delete(_clave_cache(timezone.localdate()))
+
+
+# -----------------------------
+# Actualización incremental
+# -----------------------------
+
+def sumar(deltas):
+    """
+    Aplica `{clave: delta}` con `UPDATE ... SET valor = valor + delta` (sin leer antes),
+    creando la fila si aún no existe.
+    """
+    deltas = {clave: delta for clave, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    for clave, delta in deltas.items():
+        if not MetricaTablero.objects.filter(clave=clave).update(valor=F('valor') + delta):
+            MetricaTablero.objects.get_or_create(clave=clave)
+            MetricaTablero.objects.filter(clave=clave).update(valor=F('valor') + delta)
+    transaction.on_commit(invalidar_cache)
+
+
+def _activo(instancia, campo, creado=False, eliminado=False):
+    """
+    `(antes, ahora)` del indicador `campo`. Si la instancia no se leyó de la base de
+    datos (y no es nueva), se desconoce el valor anterior y se asume sin cambios.
+    """
+    actual = getattr(instancia, campo)
+    antes = False if creado else instancia.valor_original(campo, actual)
+    ahora = False if eliminado else actual
+    return antes, ahora
+
+
+def deltas_activo(clave, instancia, campo, creado=False, eliminado=False):
+    antes, ahora = _activo(instancia, campo, creado, eliminado)
+    return {clave: int(bool(ahora)) - int(bool(antes))}
+
+
+def delta_activo(clave, instancia, campo, creado=False, eliminado=False):
+    sumar(deltas_activo(clave, instancia, campo, creado, eliminado))
+
+
+def _bucket_consulta(fecha_hora, estado):
+    if fecha_hora is None or estado is None:
+        return None
+    return clave_consultas_dia(timezone.localdate(fecha_hora), estado)
+
+
+def deltas_consulta(instancia, creado=False, eliminado=False):
+    """
+    Cambios en el total de consultas y en los contadores diarios por estado.
+    """
+    deltas = {CONSULTAS_TOTAL: 1 if creado else -1 if eliminado else 0}
+
+    ahora = None if eliminado else _bucket_consulta(instancia.fecha_hora, instancia.estado)
+    if creado:
+        antes = None
+    else:
+        antes = _bucket_consulta(
+            instancia.valor_original('fecha_hora', instancia.fecha_hora),
+            instancia.valor_original('estado', instancia.estado),
+        )
+    if antes != ahora:
+        if antes:
+            deltas[antes] = deltas.get(antes, 0) - 1
+        if ahora:
+            deltas[ahora] = deltas.get(ahora, 0) + 1
+    return deltas
+
+
+def delta_consulta(instancia, creado=False, eliminado=False):
+    sumar(deltas_consulta(instancia, creado, eliminado))
+
+
+# Modelo -> (clave de la métrica, campo que indica "activo").
+ACTIVOS_POR_MODELO = {
+    Paciente: (PACIENTES_ACTIVOS, 'activo'),
+    Medico: (MEDICOS_ACTIVOS, 'activo'),
+    Especialidad: (ESPECIALIDADES_ACTIVAS, 'activa'),
+}
+
+
+def deltas_guardado(instancias, creadas):
+    """
+    Suma los cambios de métricas de varias instancias guardadas sin señales
+    (`bulk_create` / `bulk_update`, ver `carga_masiva.py`). `creadas` indica, para
+    cada instancia, si es nueva. Deben calcularse antes de refrescar sus valores originales.
+    """
+    total = {}
+    for instancia, creada in zip(instancias, creadas):
+        if isinstance(instancia, ConsultaMedica):
+            deltas = deltas_consulta(instancia, creado=creada)
+        elif type(instancia) in ACTIVOS_POR_MODELO:
+            clave, campo = ACTIVOS_POR_MODELO[type(instancia)]
+            deltas = deltas_activo(clave, instancia, campo, creado=creada)
+        else:
+            continue
+        for clave, delta in deltas.items():
+            total[clave] = total.get(clave, 0) + delta
+    return total
+
+
+# -----------------------------
+# Reconciliación
+# -----------------------------
+
+def valores_reales():
+    """
+    Recalcula todas las métricas desde las tablas (recorre las tablas completas).
+    """
+    valores = {
+        PACIENTES_ACTIVOS: Paciente.objects.filter(activo=True).count(),
+        MEDICOS_ACTIVOS: Medico.objects.filter(activo=True).count(),
+        ESPECIALIDADES_ACTIVAS: Especialidad.objects.filter(activa=True).count(),
+        CONSULTAS_TOTAL: ConsultaMedica.objects.count(),
+    }
+    por_dia = (
+        ConsultaMedica.objects.order_by()
+        .annotate(dia=TruncDate('fecha_hora', tzinfo=timezone.get_current_timezone()))
+        .values('dia', 'estado')
+        .annotate(total=Count('id'))
+    )
+    for fila in por_dia:
+        valores[clave_consultas_dia(fila['dia'], fila['estado'])] = fila['total']
+    return valores
+
+
+@transaction.atomic
+def reconciliar():
+    """
+    Sobrescribe las métricas con sus valores reales y elimina las claves diarias que
+    ya no corresponden a ninguna consulta. Devuelve `{clave: (almacenado, real)}`
+    con las métricas que estaban desfasadas.
+    """
+    reales = valores_reales()
+    almacenados = dict(
+        MetricaTablero.objects.select_for_update().values_list('clave', 'valor')
+    )
+    diferencias = {
+        clave: (almacenados.get(clave), valor)
+        for clave, valor in reales.items()
+        if almacenados.get(clave) != valor
+    }
+    obsoletas = [
+        clave for clave in almacenados
+        if clave.startswith(PREFIJO_CONSULTAS_DIA) and clave not in reales
+    ]
+    for clave in obsoletas:
+        diferencias[clave] = (almacenados[clave], 0)
+
+    MetricaTablero.objects.filter(clave__in=obsoletas).delete()
+    MetricaTablero.objects.bulk_create(
+        [MetricaTablero(clave=clave, valor=valor) for clave, (_, valor) in diferencias.items()
+         if clave not in obsoletas],
+        update_conflicts=True, unique_fields=['clave'], update_fields=['valor', 'actualizado'],
+    )
+    transaction.on_commit(invalidar_cache)
+    return diferencias
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.7 on 2026-10-16 22:48
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def _conteo_activos(modelo, campo_fk):
+    return Coalesce(Subquery(
+        modelo.objects.filter(**{campo_fk: OuterRef('pk'), 'activo': True})
+        .order_by()
+        .values(campo_fk)
+        .annotate(total=Count('pk'))
+        .values('total')
+    ), 0)
+
+
+def poblar_contadores(apps, schema_editor):
+    Especialidad = apps.get_model('gestion_clinica', 'Especialidad')
+    Laboratorio = apps.get_model('gestion_clinica', 'Laboratorio')
+    Medico = apps.get_model('gestion_clinica', 'Medico')
+    Medicamento = apps.get_model('gestion_clinica', 'Medicamento')
+
+    Especialidad.objects.update(total_medicos_activos=_conteo_activos(Medico, 'especialidad'))
+    Laboratorio.objects.update(total_medicamentos_activos=_conteo_activos(Medicamento, 'laboratorio'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestion_clinica', '0002_laboratorio_alter_medicamento_laboratorio'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='especialidad',
+            name='total_medicos_activos',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='laboratorio',
+            name='total_medicamentos_activos',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(poblar_contadores, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 5.2.7 on 2026-10-16 22:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestion_clinica', '0003_contadores_referencia'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='consultamedica',
+            index=models.Index(fields=['medico', 'fecha_hora'], name='consulta_medico_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='consultamedica',
+            index=models.Index(fields=['paciente', 'fecha_hora'], name='consulta_paciente_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='consultamedica',
+            index=models.Index(fields=['estado', 'fecha_hora'], name='consulta_estado_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='consultamedica',
+            index=models.Index(fields=['-fecha_hora', '-id'], name='consulta_fecha_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='medicamento',
+            index=models.Index(fields=['nombre', 'id'], name='medicamento_orden_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='medicamento',
+            index=models.Index(condition=models.Q(('activo', True)), fields=['nombre', 'id'], name='medicamento_activo_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='medico',
+            index=models.Index(fields=['apellido_paterno', 'apellido_materno', 'nombre', 'id'], name='medico_orden_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='medico',
+            index=models.Index(condition=models.Q(('activo', True)), fields=['apellido_paterno', 'apellido_materno', 'nombre', 'id'], name='medico_activo_orden_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='paciente',
+            index=models.Index(fields=['apellido_paterno', 'apellido_materno', 'nombre', 'id'], name='paciente_orden_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='paciente',
+            index=models.Index(condition=models.Q(('activo', True)), fields=['apellido_paterno', 'apellido_materno', 'nombre', 'id'], name='paciente_activo_orden_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recetamedica',
+            index=models.Index(fields=['-fecha_emision', '-id'], name='receta_fecha_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tratamiento',
+            index=models.Index(fields=['-fecha_inicio', '-id'], name='tratamiento_fecha_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tratamiento',
+            index=models.Index(condition=models.Q(('activo', True)), fields=['-fecha_inicio', '-id'], name='tratamiento_activo_idx'),
+        ),
+    ]
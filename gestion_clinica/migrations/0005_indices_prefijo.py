@@ -0,0 +1,39 @@
+from django.db import migrations
+
+# (nombre del índice, tabla, columna) para las búsquedas por prefijo de autocompletar.py.
+INDICES_PREFIJO = [
+    ('paciente_nombre_prefijo_idx', 'gestion_clinica_paciente', 'nombre'),
+    ('paciente_apellido_prefijo_idx', 'gestion_clinica_paciente', 'apellido_paterno'),
+    ('paciente_rut_prefijo_idx', 'gestion_clinica_paciente', 'rut'),
+    ('especialidad_nombre_prefijo_idx', 'gestion_clinica_especialidad', 'nombre'),
+    ('laboratorio_pais_prefijo_idx', 'gestion_clinica_laboratorio', 'pais'),
+]
+
+
+def crear_indices(apps, schema_editor):
+    # Django traduce `campo__istartswith` a `UPPER(campo::text) LIKE UPPER('x%')`.
+    # En PostgreSQL el índice debe usar `text_pattern_ops` para servir a LIKE con
+    # cualquier collation; los demás motores usan el operador por defecto.
+    q = schema_editor.quote_name
+    opclase = ' text_pattern_ops' if schema_editor.connection.vendor == 'postgresql' else ''
+    for nombre, tabla, columna in INDICES_PREFIJO:
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {q(nombre)} ON {q(tabla)} (UPPER({q(columna)}){opclase})'
+        )
+
+
+def eliminar_indices(apps, schema_editor):
+    q = schema_editor.quote_name
+    for nombre, _, _ in INDICES_PREFIJO:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {q(nombre)}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestion_clinica', '0004_indices_filtros_orden'),
+    ]
+
+    operations = [
+        migrations.RunPython(crear_indices, eliminar_indices),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.2.7 on 2026-10-16 22:52
+
+from django.db import migrations, models
+
+from gestion_clinica.normalizacion import normalizar_texto
+
+
+def poblar_nombre_normalizado(apps, schema_editor):
+    for nombre_modelo in ('Paciente', 'Medico'):
+        modelo = apps.get_model('gestion_clinica', nombre_modelo)
+        lote = []
+        for obj in modelo.objects.only('nombre', 'apellido_paterno', 'apellido_materno').iterator(chunk_size=2000):
+            obj.nombre_normalizado = normalizar_texto(
+                f"{obj.apellido_paterno} {obj.apellido_materno} {obj.nombre}"
+            )
+            lote.append(obj)
+            if len(lote) >= 2000:
+                modelo.objects.bulk_update(lote, ['nombre_normalizado'])
+                lote = []
+        if lote:
+            modelo.objects.bulk_update(lote, ['nombre_normalizado'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestion_clinica', '0005_indices_prefijo'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='medico',
+            name='nombre_normalizado',
+            field=models.CharField(blank=True, editable=False, max_length=310),
+        ),
+        migrations.AddField(
+            model_name='paciente',
+            name='nombre_normalizado',
+            field=models.CharField(blank=True, editable=False, max_length=310),
+        ),
+        migrations.RunPython(poblar_nombre_normalizado, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='medico',
+            index=models.Index(condition=models.Q(('activo', True)), fields=['nombre_normalizado'], name='medico_busqueda_idx', opclasses=['varchar_pattern_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='medico',
+            index=models.Index(condition=models.Q(('activo', True)), fields=['rut'], name='medico_rut_busqueda_idx', opclasses=['varchar_pattern_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='paciente',
+            index=models.Index(condition=models.Q(('activo', True)), fields=['nombre_normalizado'], name='paciente_busqueda_idx', opclasses=['varchar_pattern_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='paciente',
+            index=models.Index(condition=models.Q(('activo', True)), fields=['rut'], name='paciente_rut_busqueda_idx', opclasses=['varchar_pattern_ops']),
+        ),
+    ]
@@ -0,0 +1,108 @@
+# Generated by Django 5.2.7 on 2026-10-16 22:58
+
+from django.db import migrations, models, transaction
+
+from gestion_clinica.normalizacion import documento_busqueda, normalizar_texto
+
+TABLAS_BUSQUEDA = [
+    'gestion_clinica_paciente',
+    'gestion_clinica_medico',
+    'gestion_clinica_medicamento',
+]
+
+
+def _documento(nombre_modelo, obj):
+    if nombre_modelo == 'Medicamento':
+        return documento_busqueda(obj.nombre, obj.principio_activo, obj.laboratorio.nombre)
+    nombre = normalizar_texto(f"{obj.apellido_paterno} {obj.apellido_materno} {obj.nombre}")
+    if nombre_modelo == 'Medico':
+        return documento_busqueda(nombre, obj.rut, obj.especialidad.nombre)
+    return documento_busqueda(nombre, obj.rut)
+
+
+def poblar_texto_busqueda(apps, schema_editor):
+    relaciones = {'Medico': ['especialidad'], 'Medicamento': ['laboratorio'], 'Paciente': []}
+    for nombre_modelo, select in relaciones.items():
+        modelo = apps.get_model('gestion_clinica', nombre_modelo)
+        lote = []
+        for obj in modelo.objects.select_related(*select).iterator(chunk_size=2000):
+            obj.texto_busqueda = _documento(nombre_modelo, obj)
+            lote.append(obj)
+            if len(lote) >= 2000:
+                modelo.objects.bulk_update(lote, ['texto_busqueda'])
+                lote = []
+        if lote:
+            modelo.objects.bulk_update(lote, ['texto_busqueda'])
+
+
+def _instalar_pg_trgm(schema_editor):
+    # pg_trgm es opcional: solo se usa si el servidor la ofrece y el usuario puede instalarla.
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT EXISTS (SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm')")
+        if not cursor.fetchone()[0]:
+            return False
+        try:
+            with transaction.atomic(using=schema_editor.connection.alias):
+                cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        except Exception:
+            return False
+    return True
+
+
+def crear_indices_busqueda(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    q = schema_editor.quote_name
+    if vendor == 'postgresql':
+        trigramas = _instalar_pg_trgm(schema_editor)
+        for tabla in TABLAS_BUSQUEDA:
+            # Misma expresión que genera SearchVector('texto_busqueda', config='simple').
+            schema_editor.execute(
+                f"CREATE INDEX IF NOT EXISTS {q(tabla + '_fts_idx')} ON {q(tabla)} "
+                f"USING gin (to_tsvector('simple'::regconfig, COALESCE(texto_busqueda, '')))"
+            )
+            if trigramas:
+                schema_editor.execute(
+                    f"CREATE INDEX IF NOT EXISTS {q(tabla + '_trgm_idx')} ON {q(tabla)} "
+                    f"USING gin (texto_busqueda gin_trgm_ops)"
+                )
+    # SQLite: las tablas FTS5 se crean tras cada `migrate` (ver busqueda.preparar_fts_sqlite),
+    # porque las migraciones que reconstruyen una tabla en SQLite eliminan sus triggers.
+
+
+def eliminar_indices_busqueda(apps, schema_editor):
+    q = schema_editor.quote_name
+    for tabla in TABLAS_BUSQUEDA:
+        if schema_editor.connection.vendor == 'sqlite':
+            for sufijo in ('_ai', '_ad', '_au'):
+                schema_editor.execute(f'DROP TRIGGER IF EXISTS "{tabla}_fts{sufijo}"')
+            schema_editor.execute(f'DROP TABLE IF EXISTS "{tabla}_fts"')
+        else:
+            schema_editor.execute(f"DROP INDEX IF EXISTS {q(tabla + '_fts_idx')}")
+            schema_editor.execute(f"DROP INDEX IF EXISTS {q(tabla + '_trgm_idx')}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestion_clinica', '0006_busqueda_personas'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='medicamento',
+            name='texto_busqueda',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='medico',
+            name='texto_busqueda',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='paciente',
+            name='texto_busqueda',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.RunPython(poblar_texto_busqueda, migrations.RunPython.noop),
+        migrations.RunPython(crear_indices_busqueda, eliminar_indices_busqueda),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.2.7 on 2026-10-16 23:01
+
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+
+def poblar_metricas(apps, schema_editor):
+    # Mismo cálculo que metricas.valores_reales(), con los modelos históricos.
+    modelo = lambda nombre: apps.get_model('gestion_clinica', nombre)
+    ConsultaMedica = modelo('ConsultaMedica')
+    valores = {
+        'pacientes_activos': modelo('Paciente').objects.filter(activo=True).count(),
+        'medicos_activos': modelo('Medico').objects.filter(activo=True).count(),
+        'especialidades_activas': modelo('Especialidad').objects.filter(activa=True).count(),
+        'consultas_total': ConsultaMedica.objects.count(),
+    }
+    por_dia = (
+        ConsultaMedica.objects.order_by()
+        .annotate(dia=TruncDate('fecha_hora', tzinfo=timezone.get_current_timezone()))
+        .values('dia', 'estado')
+        .annotate(total=Count('id'))
+    )
+    for fila in por_dia:
+        valores[f"consultas_dia:{fila['dia'].isoformat()}:{fila['estado']}"] = fila['total']
+
+    MetricaTablero = modelo('MetricaTablero')
+    MetricaTablero.objects.bulk_create(
+        [MetricaTablero(clave=clave, valor=valor) for clave, valor in valores.items()]
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestion_clinica', '0007_busqueda_texto_completo'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MetricaTablero',
+            fields=[
+                ('clave', models.CharField(max_length=60, primary_key=True, serialize=False)),
+                ('valor', models.BigIntegerField(default=0)),
+                ('actualizado', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Métrica del Tablero',
+                'verbose_name_plural': 'Métricas del Tablero',
+                'ordering': ['clave'],
+            },
+        ),
+        migrations.RunPython(poblar_metricas, migrations.RunPython.noop),
+    ]
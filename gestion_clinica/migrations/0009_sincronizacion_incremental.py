@@ -0,0 +1,103 @@
+# Generated by Django 5.2.7 on 2026-10-16 23:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestion_clinica', '0008_metricas_tablero'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RegistroEliminado',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('modelo', models.CharField(max_length=100)),
+                ('objeto_id', models.BigIntegerField()),
+                ('fecha_eliminacion', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Registro Eliminado',
+                'verbose_name_plural': 'Registros Eliminados',
+                'ordering': ['fecha_eliminacion'],
+            },
+        ),
+        migrations.AddField(
+            model_name='consultamedica',
+            name='fecha_modificacion',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='especialidad',
+            name='fecha_modificacion',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='laboratorio',
+            name='fecha_modificacion',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='medicamento',
+            name='fecha_modificacion',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='medico',
+            name='fecha_modificacion',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='paciente',
+            name='fecha_modificacion',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='recetamedica',
+            name='fecha_modificacion',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='tratamiento',
+            name='fecha_modificacion',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddIndex(
+            model_name='consultamedica',
+            index=models.Index(fields=['fecha_modificacion', 'id'], name='consulta_modificacion_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='especialidad',
+            index=models.Index(fields=['fecha_modificacion', 'id'], name='especialidad_modificacion_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='laboratorio',
+            index=models.Index(fields=['fecha_modificacion', 'id'], name='laboratorio_modificacion_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='medicamento',
+            index=models.Index(fields=['fecha_modificacion', 'id'], name='medicamento_modificacion_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='medico',
+            index=models.Index(fields=['fecha_modificacion', 'id'], name='medico_modificacion_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='paciente',
+            index=models.Index(fields=['fecha_modificacion', 'id'], name='paciente_modificacion_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recetamedica',
+            index=models.Index(fields=['fecha_modificacion', 'id'], name='receta_modificacion_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tratamiento',
+            index=models.Index(fields=['fecha_modificacion', 'id'], name='tratamiento_modificacion_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='registroeliminado',
+            index=models.Index(fields=['modelo', 'fecha_eliminacion', 'id'], name='eliminado_modelo_fecha_idx'),
+        ),
+    ]
@@ -0,0 +1,131 @@
+# Generated by Django 5.2.7 on 2026-10-17 00:05
+
+import datetime
+
+import django.contrib.postgres.fields.ranges
+import django.core.validators
+import django.db.models.deletion
+import gestion_clinica.models
+from django.contrib.postgres.operations import BtreeGistExtension
+from django.db import migrations, models
+from django.db.models import F
+
+RESTRICCION = 'consulta_agenda_sin_superposicion'
+DURACION_MINIMA = 5
+LOTE = 1000
+
+
+def poblar_fecha_fin(apps, schema_editor):
+    ConsultaMedica = apps.get_model('gestion_clinica', 'ConsultaMedica')
+    ConsultaMedica.objects.update(fecha_fin=F('fecha_hora') + datetime.timedelta(minutes=30))
+
+
+def ajustes_superposiciones(consultas):
+    """
+    Recorre las consultas AGENDADAS ordenadas por (medico, fecha_hora, id) y devuelve las
+    que hay que modificar para que no queden dos superpuestas del mismo médico: la
+    anterior se acorta hasta el inicio de la siguiente o, si entre ambas quedan menos de
+    `DURACION_MINIMA` minutos, la siguiente se cancela con una nota en `observaciones`.
+    """
+    modificadas = {}
+    anterior = None
+    for consulta in consultas:
+        if anterior is None or consulta.medico_id != anterior.medico_id or consulta.fecha_hora >= anterior.fecha_fin:
+            anterior = consulta
+            continue
+        hueco = int((consulta.fecha_hora - anterior.fecha_hora).total_seconds() // 60)
+        if hueco >= DURACION_MINIMA:
+            anterior.duracion = hueco
+            anterior.fecha_fin = anterior.fecha_hora + datetime.timedelta(minutes=hueco)
+            modificadas[anterior.pk] = anterior
+            anterior = consulta
+        else:
+            consulta.estado = 'CANCELADA'
+            nota = f'Cancelada al migrar: se superponía con la consulta N° {anterior.pk}.'
+            consulta.observaciones = f'{consulta.observaciones}\n{nota}'.strip()
+            modificadas[consulta.pk] = consulta
+    return list(modificadas.values())
+
+
+def resolver_superposiciones(apps, schema_editor):
+    # Antes de esta migración nada impedía superposiciones; se resuelven en vez de abortar
+    # para que la restricción de exclusión se pueda crear sobre los datos existentes.
+    ConsultaMedica = apps.get_model('gestion_clinica', 'ConsultaMedica')
+    consultas = (
+        ConsultaMedica.objects.filter(estado='AGENDADA')
+        .order_by('medico_id', 'fecha_hora', 'id')
+        .only('medico_id', 'fecha_hora', 'fecha_fin', 'duracion', 'estado', 'observaciones')
+    )
+    ConsultaMedica.objects.bulk_update(
+        ajustes_superposiciones(consultas.iterator(chunk_size=LOTE)),
+        ['duracion', 'fecha_fin', 'estado', 'observaciones'], batch_size=LOTE,
+    )
+
+
+def eliminar_triggers_sqlite(apps, schema_editor):
+    # En SQLite la restricción son triggers creados tras cada `migrate` (ver
+    # agenda.preparar_agenda_sqlite); se eliminan antes de deshacer las columnas.
+    if schema_editor.connection.vendor == 'sqlite':
+        for sufijo in ('_ai', '_au'):
+            schema_editor.execute(f'DROP TRIGGER IF EXISTS "{RESTRICCION}{sufijo}"')
+
+
+class ExtensionBtreeGist(BtreeGistExtension):
+    # `CreateExtension` solo revisa el motor al aplicar; en SQLite no hay extensiones.
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super().database_backwards(app_label, schema_editor, from_state, to_state)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestion_clinica', '0009_sincronizacion_incremental'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='consultamedica',
+            name='duracion',
+            field=models.PositiveSmallIntegerField(default=30, validators=[django.core.validators.MinValueValidator(5), django.core.validators.MaxValueValidator(480)]),
+        ),
+        migrations.AddField(
+            model_name='consultamedica',
+            name='fecha_fin',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+        migrations.RunPython(poblar_fecha_fin, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='consultamedica',
+            name='fecha_fin',
+            field=models.DateTimeField(editable=False),
+        ),
+        migrations.AddConstraint(
+            model_name='consultamedica',
+            constraint=models.CheckConstraint(condition=models.Q(('duracion__gte', 5), ('duracion__lte', 480)), name='consulta_duracion_valida'),
+        ),
+        migrations.CreateModel(
+            name='HorarioAtencion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dia_semana', models.PositiveSmallIntegerField(choices=[(0, 'Lunes'), (1, 'Martes'), (2, 'Miércoles'), (3, 'Jueves'), (4, 'Viernes'), (5, 'Sábado'), (6, 'Domingo')])),
+                ('hora_inicio', models.TimeField()),
+                ('hora_fin', models.TimeField()),
+                ('medico', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='horarios', to='gestion_clinica.medico')),
+            ],
+            options={
+                'verbose_name': 'Horario de Atención',
+                'verbose_name_plural': 'Horarios de Atención',
+                'ordering': ['medico', 'dia_semana', 'hora_inicio'],
+                'indexes': [models.Index(fields=['medico', 'dia_semana'], name='horario_medico_dia_idx')],
+                'constraints': [models.CheckConstraint(condition=models.Q(('hora_fin__gt', models.F('hora_inicio'))), name='horario_bloque_valido')],
+            },
+        ),
+        migrations.RunPython(resolver_superposiciones, migrations.RunPython.noop),
+        ExtensionBtreeGist(),
+        migrations.AddConstraint(
+            model_name='consultamedica',
+            constraint=gestion_clinica.models.RestriccionAgenda(condition=models.Q(('estado', 'AGENDADA')), expressions=[('medico', '='), (gestion_clinica.models.TsTzRange('fecha_hora', 'fecha_fin', django.contrib.postgres.fields.ranges.RangeBoundary()), '&&')], name=RESTRICCION, violation_error_message='El médico ya tiene una consulta agendada en ese horario.'),
+        ),
+        migrations.RunPython(migrations.RunPython.noop, eliminar_triggers_sqlite),
+    ]
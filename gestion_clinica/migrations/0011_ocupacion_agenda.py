@@ -0,0 +1,47 @@
+# Generated by Django 5.2.7 on 2026-10-17 00:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+from gestion_clinica.disponibilidad import a_bytes, mapas_por_dia
+
+
+def poblar_ocupacion(apps, schema_editor):
+    # Mismo cálculo que disponibilidad.reconstruir(), con los modelos históricos.
+    ConsultaMedica = apps.get_model('gestion_clinica', 'ConsultaMedica')
+    OcupacionAgenda = apps.get_model('gestion_clinica', 'OcupacionAgenda')
+    mapas = mapas_por_dia(
+        ConsultaMedica.objects.filter(estado='AGENDADA')
+        .values_list('medico_id', 'fecha_hora', 'fecha_fin').iterator()
+    )
+    OcupacionAgenda.objects.bulk_create(
+        [OcupacionAgenda(medico_id=medico_id, fecha=fecha, bloques=a_bytes(mapa))
+         for (medico_id, fecha), mapa in mapas.items()],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestion_clinica', '0010_agenda'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OcupacionAgenda',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField()),
+                ('bloques', models.BinaryField(max_length=36)),
+                ('medico', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ocupacion', to='gestion_clinica.medico')),
+            ],
+            options={
+                'verbose_name': 'Ocupación de Agenda',
+                'verbose_name_plural': 'Ocupación de Agendas',
+                'ordering': ['medico', 'fecha'],
+                'constraints': [models.UniqueConstraint(fields=('medico', 'fecha'), name='ocupacion_medico_fecha_unica')],
+            },
+        ),
+        migrations.RunPython(poblar_ocupacion, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.7 on 2026-10-17 00:09
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def poblar_stock_inicial(apps, schema_editor):
+    # Stock actual de cada medicamento como ajuste inicial: el libro queda cuadrado.
+    Medicamento = apps.get_model('gestion_clinica', 'Medicamento')
+    MovimientoStock = apps.get_model('gestion_clinica', 'MovimientoStock')
+    MovimientoStock.objects.bulk_create(
+        [
+            MovimientoStock(medicamento_id=pk, cantidad=stock, motivo='AJUSTE', stock_resultante=stock)
+            for pk, stock in Medicamento.objects.exclude(stock_disponible=0).values_list('pk', 'stock_disponible')
+        ],
+        batch_size=1000,
+    )
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestion_clinica', '0011_ocupacion_agenda'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MovimientoStock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('receta_id', models.BigIntegerField(blank=True, null=True)),
+                ('cantidad', models.IntegerField()),
+                ('motivo', models.CharField(choices=[('EMISION', 'Emisión de receta'), ('EDICION', 'Edición de receta'), ('ANULACION', 'Eliminación de receta'), ('AJUSTE', 'Ajuste manual')], max_length=20)),
+                ('stock_resultante', models.IntegerField()),
+                ('fecha', models.DateTimeField(auto_now_add=True)),
+                ('medicamento', models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='movimientos', to='gestion_clinica.medicamento')),
+            ],
+            options={
+                'verbose_name': 'Movimiento de Stock',
+                'verbose_name_plural': 'Movimientos de Stock',
+                'ordering': ['medicamento', 'id'],
+                'indexes': [models.Index(fields=['medicamento', 'id'], name='movimiento_medicamento_idx')],
+            },
+        ),
+        migrations.RunPython(poblar_stock_inicial, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.7 on 2026-10-17 00:13
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def poblar_consumo(apps, schema_editor):
+    # Mismo cálculo que consumo.reconstruir(), con los modelos históricos.
+    RecetaMedica = apps.get_model('gestion_clinica', 'RecetaMedica')
+    ConsumoDiario = apps.get_model('gestion_clinica', 'ConsumoDiario')
+    ConsumoDiario.objects.bulk_create(
+        [
+            ConsumoDiario(medicamento_id=medicamento_id, fecha=fecha, cantidad=cantidad)
+            for medicamento_id, fecha, cantidad in
+            RecetaMedica.objects.order_by().values('medicamento_id', 'fecha_emision')
+            .annotate(total=Sum('cantidad_total')).values_list('medicamento_id', 'fecha_emision', 'total')
+        ],
+        batch_size=1000,
+    )
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestion_clinica', '0012_stock_movimientos'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConsumoDiario',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField()),
+                ('cantidad', models.IntegerField(default=0)),
+                ('medicamento', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='consumos', to='gestion_clinica.medicamento')),
+            ],
+            options={
+                'verbose_name': 'Consumo Diario',
+                'verbose_name_plural': 'Consumos Diarios',
+                'ordering': ['medicamento', 'fecha'],
+                'constraints': [models.UniqueConstraint(fields=('medicamento', 'fecha'), name='consumo_medicamento_fecha_unico')],
+            },
+        ),
+        migrations.RunPython(poblar_consumo, migrations.RunPython.noop),
+    ]
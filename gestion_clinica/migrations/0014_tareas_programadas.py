@@ -0,0 +1,44 @@
+# Generated by Django 5.2.7 on 2026-10-17 00:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestion_clinica', '0013_consumo_diario'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EjecucionTarea',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nombre', models.CharField(max_length=100)),
+                ('estado', models.CharField(choices=[('EN_CURSO', 'En curso'), ('COMPLETADA', 'Completada'), ('FALLIDA', 'Fallida')], default='EN_CURSO', max_length=20)),
+                ('inicio', models.DateTimeField(auto_now_add=True)),
+                ('actualizado', models.DateTimeField(auto_now=True)),
+                ('fin', models.DateTimeField(blank=True, null=True)),
+                ('lotes', models.PositiveIntegerField(default=0)),
+                ('filas', models.PositiveIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+            ],
+            options={
+                'verbose_name': 'Ejecución de Tarea',
+                'verbose_name_plural': 'Ejecuciones de Tareas',
+                'ordering': ['-inicio'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='tratamiento',
+            index=models.Index(condition=models.Q(('activo', True), ('fecha_fin__isnull', False)), fields=['fecha_fin', 'id'], name='tratamiento_vencimiento_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ejecuciontarea',
+            index=models.Index(fields=['nombre', '-inicio'], name='tarea_nombre_inicio_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='ejecuciontarea',
+            constraint=models.UniqueConstraint(condition=models.Q(('estado', 'EN_CURSO')), fields=('nombre',), name='tarea_una_en_curso'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-17 00:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestion_clinica', '0014_tareas_programadas'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ejecuciontarea',
+            name='parametros',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AlterField(
+            model_name='ejecuciontarea',
+            name='estado',
+            field=models.CharField(choices=[('PENDIENTE', 'Pendiente'), ('EN_CURSO', 'En curso'), ('COMPLETADA', 'Completada'), ('FALLIDA', 'Fallida')], default='EN_CURSO', max_length=20),
+        ),
+    ]
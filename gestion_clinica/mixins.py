@@ -0,0 +1,422 @@
+"""
+Archivo: mixins.py
+Ubicación: Aplicación 'gestion_clinica'
+
+DESCRIPCIÓN GENERAL:
+--------------------
+Mixins reutilizables para los ViewSets de la API REST (`views.py`).
+
+Cada mixin agrega un comportamiento transversal sin que cada ViewSet tenga que
+reimplementarlo. Se combinan antes de `viewsets.ModelViewSet` en la herencia:
+
+    class ConsultaMedicaViewSet(CargaRelacionesMixin, viewsets.ModelViewSet):
+        ...
+
+MIXINS DISPONIBLES:
+-------------------
+- `CargaRelacionesMixin`: construye el queryset con `select_related` / `prefetch_related`
+  a partir de las relaciones que declara el serializador, de modo que cada página
+  del listado se resuelva con un número fijo de consultas SQL. También atiende
+  `?fields=` / `?expand=` (ver `seleccion_campos.py`).
+- `CargaMasivaMixin`: agrega `POST /api/<recurso>/lote/`, que recibe una lista de
+  objetos y los crea / actualiza en bloque (ver `carga_masiva.py`).
+- `ExportacionMixin`: agrega `GET /api/<recurso>/exportar/?formato=ndjson|csv`, que
+  transmite todas las filas filtradas sin paginar (ver `exportacion.py`).
+- `SincronizacionMixin`: agrega al listado el modo `?cambios_desde=<marca>`, que
+  devuelve solo las filas modificadas o eliminadas desde la marca (ver `sincronizacion.py`).
+- `LecturaPorIdsMixin`: agrega al listado el modo `?ids=1,2,3`, que devuelve esas filas
+  en el orden pedido con una sola consulta `IN`.
+- `CacheReferenciaMixin`: guarda en caché el listado y el detalle de los datos de
+  referencia, invalidados por versión de modelo (ver `cache_referencia.py`).
+- `GetCondicionalMixin`: `ETag` / `Last-Modified` en el listado y el detalle, con
+  `304 Not Modified` sin serializar si nada cambió (ver `condicional.py`).
+"""
+
+import json
+from datetime import datetime, time
+
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.utils import timezone
+from django.utils.http import parse_http_date_safe
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import OpenApiParameter, extend_schema
+from rest_framework import status
+from rest_framework.decorators import action
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.renderers import JSONRenderer
+from rest_framework.settings import api_settings
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+
+from . import cache_referencia
+from .carga_masiva import LoteInvalido, procesar_lote
+from .condicional import calcular_validadores, respuesta_no_modificada
+from .exportacion import FORMATOS, PARAM_FORMATO, FormatoInvalido, respuesta_exportacion
+from .paginacion import PARAM_ANTES, PARAM_DESPUES
+from .paginacion_api import CONTEO_EXACTO, modo_conteo
+from .planes_carga import plan_desde_serializer
+from .seleccion_campos import (
+    CLAVE_CONTEXTO as CLAVE_SELECCION, PARAM_CAMPOS, PARAM_EXPANDIR,
+    SeleccionInvalida, leer_seleccion, validar_seleccion,
+)
+from .sincronizacion import PARAM_CAMBIOS_DESDE, MarcaInvalida, obtener_cambios
+
+# `extend_schema` en un método reemplaza la documentación del mismo método en las clases
+# base, por eso cada acción de lectura que se redefine repite estos parámetros.
+PARAMETROS_SELECCION = [
+    OpenApiParameter(PARAM_CAMPOS, str, description='Campos a entregar, separados por comas '
+                     '(`paciente.nombre` para campos de una relación expandida).'),
+    OpenApiParameter(PARAM_EXPANDIR, str, description='Relaciones a entregar como objeto '
+                     'anidado, separadas por comas (`tratamiento.consulta`).'),
+]
+
+PARAMETRO_CAMBIOS_DESDE = OpenApiParameter(
+    PARAM_CAMBIOS_DESDE, str,
+    description='Sincronización incremental: `0`, una fecha ISO 8601 o la `marca` de la '
+                'respuesta anterior. Devuelve {cambios, eliminados, marca, hay_mas}.',
+)
+
+
+class CargaRelacionesMixin:
+    """
+    Aplica al queryset el plan de carga derivado de `get_serializer_class()`.
+
+    El plan se calcula una sola vez por clase de serializador y se reutiliza. En las
+    lecturas con `?fields=` / `?expand=` se calcula para los campos pedidos, limitando
+    las columnas y los JOIN al mínimo.
+    """
+
+    _planes_por_serializer = {}
+
+    @extend_schema(parameters=PARAMETROS_SELECCION)
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @extend_schema(parameters=PARAMETROS_SELECCION)
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+    def get_seleccion(self):
+        """
+        `Seleccion` de `?fields=` / `?expand=` en peticiones de lectura, o `None`.
+        """
+        if not hasattr(self, '_seleccion'):
+            self._seleccion = None
+            request = getattr(self, 'request', None)
+            if request is not None and request.method in SAFE_METHODS:
+                seleccion = leer_seleccion(request.query_params)
+                if seleccion is not None:
+                    try:
+                        validar_seleccion(seleccion, self.get_serializer_class())
+                    except SeleccionInvalida as exc:
+                        raise ValidationError({exc.parametro: str(exc)})
+                self._seleccion = seleccion
+        return self._seleccion
+
+    def campo_solicitado(self, nombre):
+        seleccion = self.get_seleccion()
+        return seleccion is None or seleccion.incluye(nombre)
+
+    def get_serializer_context(self):
+        contexto = super().get_serializer_context()
+        contexto[CLAVE_SELECCION] = self.get_seleccion()
+        return contexto
+
+    def _columnas_extra(self, modelo):
+        # Columnas que leen el cursor de `?ordering=` y la marca de `?cambios_desde=`.
+        nombres = self.request.query_params.get(api_settings.ORDERING_PARAM, '').split(',')
+        nombres = [nombre.strip().lstrip('-') for nombre in nombres] + ['fecha_modificacion']
+        locales = {campo.name for campo in modelo._meta.concrete_fields}
+        return [nombre for nombre in nombres if nombre in locales]
+
+    def get_plan_carga(self):
+        serializer_class = self.get_serializer_class()
+        seleccion = self.get_seleccion()
+        if seleccion is not None:
+            modelo = serializer_class.Meta.model
+            return plan_desde_serializer(
+                serializer_class, seleccion=seleccion, columnas_extra=self._columnas_extra(modelo),
+            )
+        plan = self._planes_por_serializer.get(serializer_class)
+        if plan is None:
+            plan = plan_desde_serializer(serializer_class)
+            self._planes_por_serializer[serializer_class] = plan
+        return plan
+
+    def get_queryset(self):
+        return self.get_plan_carga().aplicar(super().get_queryset())
+
+
+class CargaMasivaMixin:
+    """
+    Endpoint de carga masiva `POST <recurso>/lote/` con una lista de objetos.
+
+    `clave_lote` es el campo que identifica las filas existentes: `'id'` (por defecto)
+    actualiza los elementos que traen `id` y crea el resto; un campo único como `'rut'`
+    hace *upsert* por ese campo.
+
+    Responde 200 si todos los elementos se guardaron, 207 si solo algunos y 400 si
+    ninguno (o si el cuerpo no es una lista válida), siempre con el resultado por elemento.
+    """
+
+    clave_lote = 'id'
+
+    @action(detail=False, methods=['post'], url_path='lote')
+    def lote(self, request):
+        try:
+            resultado = procesar_lote(
+                self.get_serializer_class(), request.data,
+                clave=self.clave_lote, contexto=self.get_serializer_context(),
+            )
+        except LoteInvalido as exc:
+            return Response({'detail': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+        datos = resultado.como_dict()
+        if not datos['errores']:
+            codigo = status.HTTP_200_OK
+        elif datos['errores'] == len(datos['resultados']):
+            codigo = status.HTTP_400_BAD_REQUEST
+        else:
+            codigo = status.HTTP_207_MULTI_STATUS
+        return Response(datos, status=codigo)
+
+
+class SincronizacionMixin:
+    """
+    Modo de sincronización incremental del listado: con `?cambios_desde=<marca>` la
+    respuesta es `{cambios, eliminados, marca, hay_mas}` en lugar de la página habitual.
+    El tamaño de cada bloque sigue `?page_size=` (ver `paginacion_api.py`).
+    """
+
+    @extend_schema(parameters=[PARAMETRO_CAMBIOS_DESDE, *PARAMETROS_SELECCION])
+    def list(self, request, *args, **kwargs):
+        marca = request.query_params.get(PARAM_CAMBIOS_DESDE)
+        if marca is None:
+            return super().list(request, *args, **kwargs)
+        try:
+            lote = obtener_cambios(
+                self.get_queryset(), marca, tamano=self.paginator.get_page_size(request),
+            )
+        except MarcaInvalida as exc:
+            raise ValidationError({PARAM_CAMBIOS_DESDE: str(exc)})
+        return Response({
+            'cambios': self.get_serializer(lote.cambios, many=True).data,
+            'eliminados': lote.eliminados,
+            'marca': lote.marca,
+            'hay_mas': lote.hay_mas,
+        })
+
+
+class ExportacionMixin:
+    """
+    `GET <recurso>/exportar/?formato=ndjson|csv`: exporta en *streaming* todas las filas
+    que devolvería el listado con los mismos filtros, búsqueda y orden.
+    `nombre_exportacion` es el prefijo del archivo descargado.
+    """
+
+    nombre_exportacion = 'exportacion'
+
+    @extend_schema(
+        parameters=[OpenApiParameter(PARAM_FORMATO, str, enum=list(FORMATOS),
+                                     description='Formato del archivo (por defecto ndjson).'),
+                    *PARAMETROS_SELECCION],
+        responses={(200, 'application/x-ndjson'): OpenApiTypes.STR, (200, 'text/csv'): OpenApiTypes.STR},
+    )
+    @action(detail=False, methods=['get'], url_path='exportar', pagination_class=None)
+    def exportar(self, request):
+        queryset = self.filter_queryset(self.get_queryset())
+        try:
+            return respuesta_exportacion(
+                queryset, self.get_serializer(), request.query_params.get(PARAM_FORMATO),
+                self.nombre_exportacion,
+            )
+        except FormatoInvalido as exc:
+            raise ValidationError({PARAM_FORMATO: str(exc)})
+
+
+PARAM_IDS = 'ids'
+
+
+def ids_maximo():
+    return getattr(settings, 'API_IDS_MAXIMO', 100)
+
+
+class LecturaPorIdsMixin:
+    """
+    Lectura de varias filas por id en una petición: `GET <recurso>/?ids=3,1,2` responde
+    `{results, no_encontrados}` con las filas en el orden pedido (sin repetidos), en vez
+    de un `GET <recurso>/<id>/` por fila.
+
+    Usa el queryset del listado (plan de carga, `?fields=`, filtros) con un solo
+    `WHERE id IN (...)`. Admite hasta `API_IDS_MAXIMO` ids (100 por defecto).
+    Debe ir primero en la herencia: su documentación reemplaza la de los otros listados.
+    """
+
+    @extend_schema(parameters=[
+        OpenApiParameter(PARAM_IDS, str, description='Ids separados por comas; devuelve '
+                         '{results, no_encontrados} en el orden pedido.'),
+        PARAMETRO_CAMBIOS_DESDE, *PARAMETROS_SELECCION,
+    ])
+    def list(self, request, *args, **kwargs):
+        valor = request.query_params.get(PARAM_IDS)
+        if valor is None:
+            return super().list(request, *args, **kwargs)
+
+        ids = self._leer_ids(valor)
+        encontrados = self.filter_queryset(self.get_queryset()).in_bulk(ids)
+        serializador = self.get_serializer()
+        return Response({
+            'results': [serializador.to_representation(encontrados[pk]) for pk in ids if pk in encontrados],
+            'no_encontrados': [pk for pk in ids if pk not in encontrados],
+        })
+
+    def _leer_ids(self, valor):
+        campo_pk = self.get_queryset().model._meta.pk
+        try:
+            ids = [campo_pk.to_python(parte.strip()) for parte in valor.split(',') if parte.strip()]
+        except DjangoValidationError:
+            raise ValidationError({PARAM_IDS: 'Se esperaban ids numéricos separados por comas.'})
+        ids = list(dict.fromkeys(ids))
+        if len(ids) > ids_maximo():
+            raise ValidationError({PARAM_IDS: f'Se admiten como máximo {ids_maximo()} ids por petición.'})
+        return ids
+
+
+CABECERAS_CACHEADAS = ('ETag', 'Last-Modified', 'Cache-Control', 'Vary')
+
+
+class CacheReferenciaMixin:
+    """
+    Guarda en caché las respuestas 200 del listado y del detalle, por ruta completa
+    (parámetros incluidos) y bajo las versiones de los modelos de `grupo_cache`
+    (ver `cache_referencia.GRUPOS`). Agrega la cabecera `X-Cache: HIT|MISS`.
+
+    Va después de los mixins de listado en la herencia (los modos `?ids=` y
+    `?cambios_desde=` responden antes de llegar aquí y no se guardan) y antes de
+    `GetCondicionalMixin`, cuyos validadores se guardan con la respuesta.
+    """
+
+    grupo_cache = None
+
+    def _respuesta_cacheada(self, request, obtener_respuesta):
+        parametros = sorted((clave, sorted(valores)) for clave, valores in request.query_params.lists())
+        clave = json.dumps([
+            request.get_host(), request.path, self.action, request.accepted_renderer.format, parametros,
+        ])
+        respuestas = []
+
+        def calcular():
+            respuesta = obtener_respuesta()
+            respuestas.append(respuesta)
+            if respuesta.status_code != status.HTTP_200_OK:
+                return None
+            # Datos JSON planos (sin ReturnDict ni fechas): se guardan con cualquier backend.
+            return {
+                'datos': json.loads(JSONRenderer().render(respuesta.data)),
+                'cabeceras': {c: respuesta[c] for c in CABECERAS_CACHEADAS if c in respuesta},
+            }
+
+        guardado, acierto = cache_referencia.obtener(self.grupo_cache, clave, calcular)
+        if not acierto:
+            respuesta = respuestas[0]
+        else:
+            # Los validadores guardados permiten responder 304 sin consultar la base de datos.
+            ultima = parse_http_date_safe(guardado['cabeceras'].get('Last-Modified', ''))
+            respuesta = None
+            if 'ETag' in guardado['cabeceras']:
+                respuesta = respuesta_no_modificada(request._request, guardado['cabeceras']['ETag'], ultima)
+            if respuesta is None:
+                respuesta = Response(guardado['datos'])
+            for cabecera, valor in guardado['cabeceras'].items():
+                respuesta[cabecera] = valor
+        respuesta['X-Cache'] = 'HIT' if acierto else 'MISS'
+        return respuesta
+
+    def list(self, request, *args, **kwargs):
+        return self._respuesta_cacheada(
+            request, lambda: super(CacheReferenciaMixin, self).list(request, *args, **kwargs),
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return self._respuesta_cacheada(
+            request, lambda: super(CacheReferenciaMixin, self).retrieve(request, *args, **kwargs),
+        )
+
+
+def _depende_de_la_fecha(serializer_class, expandir):
+    # Los serializadores expandibles solo cuentan si la petición usa `?expand=`.
+    meta = getattr(serializer_class, 'Meta', None)
+    if getattr(meta, 'depende_de_la_fecha', False):
+        return True
+    return expandir and any(
+        _depende_de_la_fecha(expandible, expandir) for expandible in getattr(meta, 'expandibles', {}).values()
+    )
+
+
+class GetCondicionalMixin:
+    """
+    `ETag` y `Last-Modified` en el listado y el detalle, calculados con una consulta
+    (ver `condicional.py`). Si el cliente ya tiene la versión actual responde `304` sin
+    leer ni serializar las filas. El listado solo cuenta las filas filtradas con
+    `?contar=exacto`; en los demás modos los validadores salen de índices y el conteo
+    (estimado o ninguno) lo calcula la paginación como siempre.
+
+    Las páginas con cursor (`?despues=` / `?antes=`) no llevan validadores: son
+    navegación por el historial, no lo que se consulta periódicamente, y así siguen
+    costando una sola consulta.
+
+    Si el serializador (o, con `?expand=`, uno que se puede expandir) declara `depende_de_la_fecha =
+    True` en su `Meta` (p. ej. la edad del paciente), el `ETag` incluye el día actual y
+    `Last-Modified` es como mínimo la medianoche: la respuesta cambia al cambiar el día
+    aunque no cambie ninguna fila.
+
+    Va justo antes de `ModelViewSet` en la herencia, como `CacheReferenciaMixin`.
+    """
+
+    def _validadores(self, queryset, contar=True):
+        parametros = sorted((clave, sorted(valores)) for clave, valores in self.request.query_params.lists())
+        serializer_class = self.get_serializer_class()
+        variante = (serializer_class.__qualname__, self.request.accepted_renderer.format, parametros)
+        expandir = PARAM_EXPANDIR in self.request.query_params
+        hoy = timezone.localdate() if _depende_de_la_fecha(serializer_class, expandir) else None
+        if hoy is not None:
+            variante += (hoy.isoformat(),)
+        validadores = calcular_validadores(queryset, self.get_plan_carga().select_related, repr(variante), contar)
+        if hoy is not None:
+            medianoche = int(timezone.make_aware(datetime.combine(hoy, time.min)).timestamp())
+            validadores.ultima_modificacion = max(validadores.ultima_modificacion or 0, medianoche)
+        return validadores
+
+    def _condicional(self, validadores, obtener_respuesta):
+        respuesta = respuesta_no_modificada(
+            self.request._request, validadores.etag, validadores.ultima_modificacion,
+        )
+        if respuesta is None:
+            respuesta = obtener_respuesta()
+            if respuesta.status_code != status.HTTP_200_OK:
+                return respuesta
+        return validadores.aplicar(respuesta)
+
+    def list(self, request, *args, **kwargs):
+        if PARAM_DESPUES in request.query_params or PARAM_ANTES in request.query_params:
+            return super().list(request, *args, **kwargs)
+        exacto = modo_conteo(request) == CONTEO_EXACTO
+        validadores = self._validadores(self.filter_queryset(self.get_queryset()), contar=exacto)
+        if exacto:
+            # La paginación usa este total en vez de repetir el COUNT (ver paginacion_api.py).
+            self.conteo_conocido = validadores.total
+        return self._condicional(
+            validadores, lambda: super(GetCondicionalMixin, self).list(request, *args, **kwargs),
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        queryset = self.filter_queryset(self.get_queryset()).filter(
+            **{self.lookup_field: self.kwargs[lookup_url_kwarg]}
+        )
+        validadores = self._validadores(queryset)
+        obtener = lambda: super(GetCondicionalMixin, self).retrieve(request, *args, **kwargs)
+        if not validadores.total:
+            return obtener()
+        return self._condicional(validadores, obtener)
@@ -15,6 +15,7 @@ Los modelos están diseñados para cubrir todos los aspectos esenciales de una c
 - **Medicamentos** administrados por la clínica.
 - **Tratamientos** derivados de una consulta.
 - **Recetas médicas** vinculadas a tratamientos y medicamentos.
+- **Movimientos de stock** de los medicamentos (libro de solo inserción).
 
 La estructura sigue las buenas prácticas del ORM de Django:
 - Relaciones **ForeignKey** para conectar entidades relacionadas.
@@ -54,10 +55,72 @@ Este módulo constituye el **núcleo del sistema**, proporcionando la base estru
 serializadores, formularios y API REST del proyecto.
 """
 
-from django.db import models
+from datetime import timedelta
+
+from django.contrib.postgres.constraints import ExclusionConstraint
+from django.contrib.postgres.fields import DateTimeRangeField, RangeBoundary, RangeOperators
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, connections, models, transaction
+from django.db.models.base import DEFERRED
 from django.core.validators import MinValueValidator, MaxValueValidator
 
-class Especialidad(models.Model):
+from .normalizacion import documento_busqueda, normalizar_texto
+
+
+class SeguimientoCambiosMixin:
+    """
+    Recuerda los valores con que la instancia se leyó desde la base de datos,
+    para que las señales puedan saber qué cambió al guardar (por ejemplo,
+    a qué especialidad pertenecía un médico antes de reasignarlo).
+    """
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instancia = super().from_db(db, field_names, values)
+        instancia._valores_cargados = {
+            nombre: valor for nombre, valor in zip(field_names, values)
+            if valor is not DEFERRED
+        }
+        return instancia
+
+    def valor_original(self, attname, por_defecto=None):
+        """
+        Valor de `attname` al leerse (o tras el último guardado), o `por_defecto`.
+        """
+        return getattr(self, '_valores_cargados', {}).get(attname, por_defecto)
+
+    def actualizar_valores_cargados(self):
+        """
+        Toma los valores actuales como nueva referencia (se llama tras guardar).
+        """
+        self._valores_cargados = {
+            campo.attname: getattr(self, campo.attname)
+            for campo in self._meta.concrete_fields
+            if campo.attname in self.__dict__
+        }
+
+
+class CamposBusquedaMixin:
+    """
+    Recalcula en cada `save()` las columnas derivadas que usan los buscadores
+    (`campos_busqueda`), incluso cuando se guarda con `update_fields`.
+
+    Cada modelo que lo usa debe definir `actualizar_campos_busqueda()`, que asigna esas
+    columnas desde los campos de la instancia (sin guardar).
+
+    `bulk_create()` y `QuerySet.update()` no pasan por `save()`: tras usarlos hay que
+    llamar a `busqueda.reindexar()` sobre las filas afectadas.
+    """
+    campos_busqueda = ('texto_busqueda',)
+
+    def save(self, *args, **kwargs):
+        self.actualizar_campos_busqueda()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, *self.campos_busqueda}
+        super().save(*args, **kwargs)
+
+
+class Especialidad(SeguimientoCambiosMixin, models.Model):
     """
     Modelo para representar las especialidades médicas disponibles en la clínica.
     """
@@ -65,17 +128,25 @@ class Especialidad(models.Model):
     descripcion = models.TextField(blank=True)
     activa = models.BooleanField(default=True)
     fecha_creacion = models.DateTimeField(auto_now_add=True)
+    # Contador almacenado, mantenido por señales al guardar/eliminar médicos (ver contadores.py).
+    total_medicos_activos = models.PositiveIntegerField(default=0, editable=False)
+    # Última modificación; `?cambios_desde=` de la API sincroniza por este campo (ver sincronizacion.py).
+    fecha_modificacion = models.DateTimeField(auto_now=True)
     
     class Meta:
         verbose_name = 'Especialidad'
         verbose_name_plural = 'Especialidades'
         ordering = ['nombre']
+        indexes = [
+            # Sincronización incremental: cambios posteriores a una marca, en orden estable.
+            models.Index(fields=['fecha_modificacion', 'id'], name='especialidad_modificacion_idx'),
+        ]
     
     def __str__(self):
         return self.nombre
 
 
-class Paciente(models.Model):
+class Paciente(CamposBusquedaMixin, SeguimientoCambiosMixin, models.Model):
     """
     Modelo para representar a los pacientes de la clínica.
     Incluye CHOICE para tipo de previsión.
@@ -99,11 +170,32 @@ class Paciente(models.Model):
     prevision = models.CharField(max_length=20, choices=PREVISION_CHOICES, default='FONASA')
     activo = models.BooleanField(default=True)
     fecha_registro = models.DateTimeField(auto_now_add=True)
+    # "apellidos nombre" sin tildes y en minúsculas, para búsquedas por prefijo (ver save()).
+    nombre_normalizado = models.CharField(max_length=310, blank=True, editable=False)
+    # Términos del buscador de texto completo de la API (ver busqueda.py).
+    texto_busqueda = models.TextField(blank=True, editable=False)
+    # Última modificación; `?cambios_desde=` de la API sincroniza por este campo (ver sincronizacion.py).
+    fecha_modificacion = models.DateTimeField(auto_now=True)
     
     class Meta:
         verbose_name = 'Paciente'
         verbose_name_plural = 'Pacientes'
         ordering = ['apellido_paterno', 'apellido_materno', 'nombre']
+        indexes = [
+            # Orden del listado (+ id como desempate de la paginación keyset).
+            models.Index(fields=['apellido_paterno', 'apellido_materno', 'nombre', 'id'],
+                         name='paciente_orden_idx'),
+            # Combos y búsquedas que solo muestran pacientes activos.
+            models.Index(fields=['apellido_paterno', 'apellido_materno', 'nombre', 'id'],
+                         name='paciente_activo_orden_idx', condition=models.Q(activo=True)),
+            # Buscador de pacientes activos por RUT o nombre (prefijo, ver autocompletar.py).
+            models.Index(fields=['nombre_normalizado'], name='paciente_busqueda_idx',
+                         opclasses=['varchar_pattern_ops'], condition=models.Q(activo=True)),
+            models.Index(fields=['rut'], name='paciente_rut_busqueda_idx',
+                         opclasses=['varchar_pattern_ops'], condition=models.Q(activo=True)),
+            # Sincronización incremental: cambios posteriores a una marca, en orden estable.
+            models.Index(fields=['fecha_modificacion', 'id'], name='paciente_modificacion_idx'),
+        ]
     
     def __str__(self):
         return f"{self.nombre} {self.apellido_paterno} - {self.rut}"
@@ -112,8 +204,16 @@ class Paciente(models.Model):
     def nombre_completo(self):
         return f"{self.nombre} {self.apellido_paterno} {self.apellido_materno}"
 
+    campos_busqueda = ('nombre_normalizado', 'texto_busqueda')
+
+    def actualizar_campos_busqueda(self):
+        self.nombre_normalizado = normalizar_texto(
+            f"{self.apellido_paterno} {self.apellido_materno} {self.nombre}"
+        )
+        self.texto_busqueda = documento_busqueda(self.nombre_normalizado, self.rut)
 
-class Medico(models.Model):
+
+class Medico(CamposBusquedaMixin, SeguimientoCambiosMixin, models.Model):
     """
     Modelo para representar a los médicos de la clínica.
     Incluye CHOICE para tipo de jornada.
@@ -136,11 +236,29 @@ class Medico(models.Model):
     jornada = models.CharField(max_length=20, choices=JORNADA_CHOICES, default='COMPLETA')
     activo = models.BooleanField(default=True)
     fecha_ingreso = models.DateField()
+    # "apellidos nombre" sin tildes y en minúsculas, para búsquedas por prefijo (ver save()).
+    nombre_normalizado = models.CharField(max_length=310, blank=True, editable=False)
+    # Términos del buscador de texto completo de la API (ver busqueda.py).
+    texto_busqueda = models.TextField(blank=True, editable=False)
+    # Última modificación; `?cambios_desde=` de la API sincroniza por este campo (ver sincronizacion.py).
+    fecha_modificacion = models.DateTimeField(auto_now=True)
     
     class Meta:
         verbose_name = 'Médico'
         verbose_name_plural = 'Médicos'
         ordering = ['apellido_paterno', 'apellido_materno', 'nombre']
+        indexes = [
+            models.Index(fields=['apellido_paterno', 'apellido_materno', 'nombre', 'id'],
+                         name='medico_orden_idx'),
+            models.Index(fields=['apellido_paterno', 'apellido_materno', 'nombre', 'id'],
+                         name='medico_activo_orden_idx', condition=models.Q(activo=True)),
+            models.Index(fields=['nombre_normalizado'], name='medico_busqueda_idx',
+                         opclasses=['varchar_pattern_ops'], condition=models.Q(activo=True)),
+            models.Index(fields=['rut'], name='medico_rut_busqueda_idx',
+                         opclasses=['varchar_pattern_ops'], condition=models.Q(activo=True)),
+            # Sincronización incremental: cambios posteriores a una marca, en orden estable.
+            models.Index(fields=['fecha_modificacion', 'id'], name='medico_modificacion_idx'),
+        ]
     
     def __str__(self):
         return f"Dr(a). {self.nombre} {self.apellido_paterno} - {self.especialidad.nombre}"
@@ -149,8 +267,70 @@ class Medico(models.Model):
     def nombre_completo(self):
         return f"Dr(a). {self.nombre} {self.apellido_paterno} {self.apellido_materno}"
 
+    campos_busqueda = ('nombre_normalizado', 'texto_busqueda')
+
+    def actualizar_campos_busqueda(self):
+        self.nombre_normalizado = normalizar_texto(
+            f"{self.apellido_paterno} {self.apellido_materno} {self.nombre}"
+        )
+        especialidad = self.especialidad.nombre if self.especialidad_id else ''
+        self.texto_busqueda = documento_busqueda(self.nombre_normalizado, self.rut, especialidad)
+
+
+# Agenda (ver agenda.py): duración máxima de una consulta, en minutos. Acota la búsqueda
+# de superposiciones por el índice (medico, fecha_hora).
+DURACION_MAXIMA_CONSULTA = 480
+# Restricción de la base de datos que impide que un médico tenga dos consultas AGENDADAS
+# superpuestas (exclusión GiST en PostgreSQL, triggers en SQLite).
+RESTRICCION_AGENDA = 'consulta_agenda_sin_superposicion'
+MENSAJE_CONFLICTO_AGENDA = 'El médico ya tiene una consulta agendada en ese horario.'
+
+
+# `tstzrange(inicio, fin, '[)')` de PostgreSQL, para la restricción de la agenda.
+class TsTzRange(models.Func):
+    function = 'TSTZRANGE'
+    output_field = DateTimeRangeField()
 
-class ConsultaMedica(models.Model):
+
+class RestriccionAgenda(ExclusionConstraint):
+    """
+    `ExclusionConstraint` que solo se crea en PostgreSQL. En SQLite la reemplazan los
+    triggers de `agenda.preparar_agenda_sqlite`, por lo que aquí no genera SQL ni valida.
+    """
+
+    @staticmethod
+    def _es_postgresql(connection):
+        return connection.vendor == 'postgresql'
+
+    def constraint_sql(self, model, schema_editor):
+        if self._es_postgresql(schema_editor.connection):
+            return super().constraint_sql(model, schema_editor)
+
+    def create_sql(self, model, schema_editor):
+        if self._es_postgresql(schema_editor.connection):
+            return super().create_sql(model, schema_editor)
+
+    def remove_sql(self, model, schema_editor):
+        if self._es_postgresql(schema_editor.connection):
+            return super().remove_sql(model, schema_editor)
+
+    def validate(self, model, instance, exclude=None, using=DEFAULT_DB_ALIAS):
+        if self._es_postgresql(connections[using]):
+            super().validate(model, instance, exclude=exclude, using=using)
+
+
+class ConflictoAgenda(IntegrityError):
+    """
+    La base de datos rechazó la consulta porque el médico ya tiene otra consulta
+    agendada en ese horario (por ejemplo, dos reservas simultáneas del mismo bloque).
+    """
+
+    @staticmethod
+    def corresponde(exc):
+        return RESTRICCION_AGENDA in str(exc)
+
+
+class ConsultaMedica(SeguimientoCambiosMixin, models.Model):
     """
     Modelo para representar las consultas médicas realizadas.
     Relaciona pacientes con médicos.
@@ -170,18 +350,123 @@ class ConsultaMedica(models.Model):
     diagnostico = models.TextField(blank=True)
     observaciones = models.TextField(blank=True)
     estado = models.CharField(max_length=20, choices=ESTADO_CHOICES, default='AGENDADA')
+    # Duración en minutos; `fecha_fin` se calcula en save() (ver agenda.py).
+    duracion = models.PositiveSmallIntegerField(
+        default=30, validators=[MinValueValidator(5), MaxValueValidator(DURACION_MAXIMA_CONSULTA)]
+    )
+    fecha_fin = models.DateTimeField(editable=False)
     fecha_creacion = models.DateTimeField(auto_now_add=True)
+    # Última modificación; `?cambios_desde=` de la API sincroniza por este campo (ver sincronizacion.py).
+    fecha_modificacion = models.DateTimeField(auto_now=True)
     
     class Meta:
         verbose_name = 'Consulta Médica'
         verbose_name_plural = 'Consultas Médicas'
         ordering = ['-fecha_hora']
+        constraints = [
+            models.CheckConstraint(
+                condition=models.Q(duracion__gte=5, duracion__lte=DURACION_MAXIMA_CONSULTA),
+                name='consulta_duracion_valida',
+            ),
+            # Solo las consultas AGENDADAS ocupan la agenda: el intervalo [fecha_hora,
+            # fecha_fin) de cada una no puede solaparse con otro del mismo médico.
+            RestriccionAgenda(
+                name=RESTRICCION_AGENDA,
+                expressions=[
+                    ('medico', RangeOperators.EQUAL),
+                    (TsTzRange('fecha_hora', 'fecha_fin', RangeBoundary()), RangeOperators.OVERLAPS),
+                ],
+                condition=models.Q(estado='AGENDADA'),
+                violation_error_message=MENSAJE_CONFLICTO_AGENDA,
+            ),
+        ]
+        indexes = [
+            # Agenda de un médico / historial de un paciente por rango de fechas.
+            models.Index(fields=['medico', 'fecha_hora'], name='consulta_medico_fecha_idx'),
+            models.Index(fields=['paciente', 'fecha_hora'], name='consulta_paciente_fecha_idx'),
+            # Filtro por estado (p. ej. AGENDADA) dentro de un rango de fechas.
+            models.Index(fields=['estado', 'fecha_hora'], name='consulta_estado_fecha_idx'),
+            # Orden del listado y rangos de fecha sin otros filtros.
+            models.Index(fields=['-fecha_hora', '-id'], name='consulta_fecha_id_idx'),
+            # Sincronización incremental: cambios posteriores a una marca, en orden estable.
+            models.Index(fields=['fecha_modificacion', 'id'], name='consulta_modificacion_idx'),
+        ]
     
     def __str__(self):
         return f"Consulta {self.id} - {self.paciente.nombre_completo} con {self.medico.nombre_completo}"
 
+    def actualizar_fecha_fin(self):
+        if self.fecha_hora is not None and self.duracion is not None:
+            self.fecha_fin = self.fecha_hora + timedelta(minutes=self.duracion)
+
+    def save(self, *args, **kwargs):
+        self.actualizar_fecha_fin()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'fecha_fin'}
+        try:
+            super().save(*args, **kwargs)
+        except IntegrityError as exc:
+            if ConflictoAgenda.corresponde(exc):
+                raise ConflictoAgenda(MENSAJE_CONFLICTO_AGENDA) from exc
+            raise
+
+
+class HorarioAtencion(models.Model):
+    """
+    Bloque de atención semanal de un médico. Si un médico tiene bloques propios, la
+    agenda usa solo esos; si no, los de su jornada (`AGENDA_JORNADAS` en settings).
+    """
+    DIA_CHOICES = [
+        (0, 'Lunes'), (1, 'Martes'), (2, 'Miércoles'), (3, 'Jueves'),
+        (4, 'Viernes'), (5, 'Sábado'), (6, 'Domingo'),
+    ]
+
+    medico = models.ForeignKey(Medico, on_delete=models.CASCADE, related_name='horarios')
+    dia_semana = models.PositiveSmallIntegerField(choices=DIA_CHOICES)
+    hora_inicio = models.TimeField()
+    hora_fin = models.TimeField()
 
-class Medicamento(models.Model):
+    class Meta:
+        verbose_name = 'Horario de Atención'
+        verbose_name_plural = 'Horarios de Atención'
+        ordering = ['medico', 'dia_semana', 'hora_inicio']
+        indexes = [
+            models.Index(fields=['medico', 'dia_semana'], name='horario_medico_dia_idx'),
+        ]
+        constraints = [
+            models.CheckConstraint(
+                condition=models.Q(hora_fin__gt=models.F('hora_inicio')), name='horario_bloque_valido',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.get_dia_semana_display()} {self.hora_inicio:%H:%M}-{self.hora_fin:%H:%M}"
+
+
+class OcupacionAgenda(models.Model):
+    """
+    Mapa de bits de la agenda de un médico en un día (hora local): el bit `i` de
+    `bloques` indica que el bloque de 5 minutos `i` está ocupado por una consulta
+    AGENDADA. Lo mantiene `disponibilidad.py` y lo usa la búsqueda de horarios libres.
+    """
+    medico = models.ForeignKey(Medico, on_delete=models.CASCADE, related_name='ocupacion')
+    fecha = models.DateField()
+    bloques = models.BinaryField(max_length=36)
+
+    class Meta:
+        verbose_name = 'Ocupación de Agenda'
+        verbose_name_plural = 'Ocupación de Agendas'
+        ordering = ['medico', 'fecha']
+        constraints = [
+            models.UniqueConstraint(fields=['medico', 'fecha'], name='ocupacion_medico_fecha_unica'),
+        ]
+
+    def __str__(self):
+        return f"Ocupación médico {self.medico_id} {self.fecha:%d/%m/%Y}"
+
+
+class Medicamento(CamposBusquedaMixin, SeguimientoCambiosMixin, models.Model):
     """
     Modelo para representar los medicamentos disponibles.
     """
@@ -194,15 +479,43 @@ class Medicamento(models.Model):
     stock_disponible = models.IntegerField(default=0, validators=[MinValueValidator(0)])
     activo = models.BooleanField(default=True)
     fecha_registro = models.DateTimeField(auto_now_add=True)
+    # Términos del buscador de texto completo de la API (ver busqueda.py).
+    texto_busqueda = models.TextField(blank=True, editable=False)
+    # Última modificación; `?cambios_desde=` de la API sincroniza por este campo (ver sincronizacion.py).
+    fecha_modificacion = models.DateTimeField(auto_now=True)
     
     class Meta:
         verbose_name = 'Medicamento'
         verbose_name_plural = 'Medicamentos'
         ordering = ['nombre']
+        indexes = [
+            models.Index(fields=['nombre', 'id'], name='medicamento_orden_idx'),
+            # Combos de recetas: solo medicamentos activos.
+            models.Index(fields=['nombre', 'id'], name='medicamento_activo_idx',
+                         condition=models.Q(activo=True)),
+            # Sincronización incremental: cambios posteriores a una marca, en orden estable.
+            models.Index(fields=['fecha_modificacion', 'id'], name='medicamento_modificacion_idx'),
+        ]
     
     def __str__(self):
         return f"{self.nombre} - {self.presentacion}"
 
+    def actualizar_campos_busqueda(self):
+        laboratorio = self.laboratorio.nombre if self.laboratorio_id else ''
+        self.texto_busqueda = documento_busqueda(self.nombre, self.principio_activo, laboratorio)
+
+    def save(self, *args, **kwargs):
+        # El stock de una fila existente solo cambia con UPDATE condicionales (ver stock.py):
+        # escribir el valor leído perdería las recetas emitidas entretanto. Un cambio de
+        # `stock_disponible` en la instancia se aplica como ajuste desde signals.py.
+        if not self._state.adding:
+            campos = kwargs.get('update_fields')
+            if campos is None:
+                campos = [campo.name for campo in self._meta.concrete_fields if not campo.primary_key]
+            kwargs['update_fields'] = [campo for campo in campos if campo != 'stock_disponible']
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
 
 class Tratamiento(models.Model):
     """
@@ -214,20 +527,54 @@ class Tratamiento(models.Model):
     fecha_fin = models.DateField(null=True, blank=True)
     indicaciones = models.TextField()
     activo = models.BooleanField(default=True)
+    # Última modificación; `?cambios_desde=` de la API sincroniza por este campo (ver sincronizacion.py).
+    fecha_modificacion = models.DateTimeField(auto_now=True)
     
     class Meta:
         verbose_name = 'Tratamiento'
         verbose_name_plural = 'Tratamientos'
         ordering = ['-fecha_inicio']
+        indexes = [
+            models.Index(fields=['-fecha_inicio', '-id'], name='tratamiento_fecha_id_idx'),
+            # Filtro activo=True (combo de RecetaMedicaForm, API ?activo=true&fecha_inicio=...).
+            models.Index(fields=['-fecha_inicio', '-id'], name='tratamiento_activo_idx',
+                         condition=models.Q(activo=True)),
+            # Barrido de tratamientos vencidos (ver barridos.py).
+            models.Index(fields=['fecha_fin', 'id'], name='tratamiento_vencimiento_idx',
+                         condition=models.Q(activo=True, fecha_fin__isnull=False)),
+            # Sincronización incremental: cambios posteriores a una marca, en orden estable.
+            models.Index(fields=['fecha_modificacion', 'id'], name='tratamiento_modificacion_idx'),
+        ]
     
     def __str__(self):
         return f"Tratamiento {self.id} - Consulta {self.consulta.id}"
 
 
+class MovimientoStockQuerySet(models.QuerySet):
+    """
+    Impide modificar o eliminar movimientos en bloque (el libro es de solo inserción).
+    """
+
+    def update(self, **kwargs):
+        raise TypeError('Los movimientos de stock no se modifican.')
+
+    def delete(self):
+        raise TypeError('Los movimientos de stock no se eliminan.')
+
+
+class StockInsuficiente(Exception):
+    """
+    No hay stock del medicamento para emitir (o aumentar) la receta. El descuento es un
+    UPDATE condicional (ver stock.py), así que también se detecta cuando otra receta
+    consumió el stock al mismo tiempo.
+    """
+
+
 class RecetaMedica(models.Model):
     """
     Modelo para representar recetas médicas emitidas en consultas.
     Relaciona tratamientos con medicamentos.
+    Emitir, editar o eliminar una receta mueve el stock de su medicamento (ver stock.py).
     """
     tratamiento = models.ForeignKey(Tratamiento, on_delete=models.CASCADE, related_name='recetas')
     medicamento = models.ForeignKey(Medicamento, on_delete=models.PROTECT, related_name='recetas')
@@ -237,16 +584,110 @@ class RecetaMedica(models.Model):
     cantidad_total = models.IntegerField(validators=[MinValueValidator(1)])
     instrucciones_especiales = models.TextField(blank=True)
     fecha_emision = models.DateField(auto_now_add=True)
+    # Última modificación; `?cambios_desde=` de la API sincroniza por este campo (ver sincronizacion.py).
+    fecha_modificacion = models.DateTimeField(auto_now=True)
     
     class Meta:
         verbose_name = 'Receta Médica'
         verbose_name_plural = 'Recetas Médicas'
         ordering = ['-fecha_emision']
+        indexes = [
+            # Orden del listado y filtro fecha_desde / fecha_hasta.
+            models.Index(fields=['-fecha_emision', '-id'], name='receta_fecha_id_idx'),
+            # Sincronización incremental: cambios posteriores a una marca, en orden estable.
+            models.Index(fields=['fecha_modificacion', 'id'], name='receta_modificacion_idx'),
+        ]
     
     def __str__(self):
         return f"Receta {self.id} - {self.medicamento.nombre}"
 
-class Laboratorio(models.Model):
+    def save(self, *args, **kwargs):
+        # La receta y el movimiento de stock (señales de signals.py) se confirman juntos.
+        nueva = self._state.adding
+        try:
+            with transaction.atomic():
+                super().save(*args, **kwargs)
+        except StockInsuficiente:
+            if nueva:
+                # La fila no llegó a guardarse: la instancia vuelve a ser nueva.
+                self.pk = None
+                self._state.adding = True
+            raise
+
+
+class MovimientoStock(models.Model):
+    """
+    Libro de movimientos de stock, de solo inserción: cada receta emitida, editada o
+    eliminada y cada ajuste manual agrega una fila con la cantidad (negativa si descuenta)
+    y el stock resultante. La suma de `cantidad` de un medicamento es su `stock_disponible`
+    (ver `stock.descuadres()`).
+    """
+    EMISION = 'EMISION'
+    EDICION = 'EDICION'
+    ANULACION = 'ANULACION'
+    AJUSTE = 'AJUSTE'
+    MOTIVO_CHOICES = [
+        (EMISION, 'Emisión de receta'),
+        (EDICION, 'Edición de receta'),
+        (ANULACION, 'Eliminación de receta'),
+        (AJUSTE, 'Ajuste manual'),
+    ]
+
+    # Sin restricción de clave foránea: el historial se conserva si se elimina el medicamento.
+    # El índice (medicamento, id) de Meta reemplaza al de la clave foránea.
+    medicamento = models.ForeignKey(Medicamento, on_delete=models.DO_NOTHING, db_constraint=False,
+                                    db_index=False, related_name='movimientos')
+    # Id de la receta (que puede haberse eliminado); vacío en los ajustes.
+    receta_id = models.BigIntegerField(null=True, blank=True)
+    cantidad = models.IntegerField()
+    motivo = models.CharField(max_length=20, choices=MOTIVO_CHOICES)
+    stock_resultante = models.IntegerField()
+    fecha = models.DateTimeField(auto_now_add=True)
+
+    objects = MovimientoStockQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Movimiento de Stock'
+        verbose_name_plural = 'Movimientos de Stock'
+        ordering = ['medicamento', 'id']
+        indexes = [
+            models.Index(fields=['medicamento', 'id'], name='movimiento_medicamento_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_motivo_display()} {self.cantidad:+d} medicamento {self.medicamento_id}"
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise TypeError('Los movimientos de stock no se modifican.')
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        raise TypeError('Los movimientos de stock no se eliminan.')
+
+
+class ConsumoDiario(models.Model):
+    """
+    Unidades recetadas de un medicamento por día de emisión (suma de `cantidad_total` de
+    sus recetas). Lo mantiene `consumo.py` al escribir recetas y lo usa la proyección de
+    días de stock restantes.
+    """
+    medicamento = models.ForeignKey(Medicamento, on_delete=models.CASCADE, related_name='consumos')
+    fecha = models.DateField()
+    cantidad = models.IntegerField(default=0)
+
+    class Meta:
+        verbose_name = 'Consumo Diario'
+        verbose_name_plural = 'Consumos Diarios'
+        ordering = ['medicamento', 'fecha']
+        constraints = [
+            models.UniqueConstraint(fields=['medicamento', 'fecha'], name='consumo_medicamento_fecha_unico'),
+        ]
+
+    def __str__(self):
+        return f"Consumo medicamento {self.medicamento_id} {self.fecha:%d/%m/%Y}: {self.cantidad}"
+
+class Laboratorio(SeguimientoCambiosMixin, models.Model):
     """
     Modelo para representar los laboratorios farmacéuticos.
     """
@@ -257,11 +698,106 @@ class Laboratorio(models.Model):
     email = models.EmailField(blank=True)
     activo = models.BooleanField(default=True)
     fecha_registro = models.DateTimeField(auto_now_add=True)
+    # Contador almacenado, mantenido por señales al guardar/eliminar medicamentos (ver contadores.py).
+    total_medicamentos_activos = models.PositiveIntegerField(default=0, editable=False)
+    # Última modificación; `?cambios_desde=` de la API sincroniza por este campo (ver sincronizacion.py).
+    fecha_modificacion = models.DateTimeField(auto_now=True)
     
     class Meta:
         verbose_name = 'Laboratorio'
         verbose_name_plural = 'Laboratorios'
         ordering = ['nombre']
+        indexes = [
+            # Sincronización incremental: cambios posteriores a una marca, en orden estable.
+            models.Index(fields=['fecha_modificacion', 'id'], name='laboratorio_modificacion_idx'),
+        ]
     
     def __str__(self):
-        return self.nombre
\ No newline at end of file
+        return self.nombre
+
+
+class EjecucionTarea(models.Model):
+    """
+    Ejecución de una tarea programada (ver tareas.py): estado y avance (lotes y filas),
+    actualizados tras cada lote. Una tarea no puede tener dos ejecuciones EN_CURSO.
+    Las ejecuciones PENDIENTES son solicitudes (con sus `parametros`) que toma el
+    siguiente `ejecutar_tareas`.
+    """
+    PENDIENTE = 'PENDIENTE'
+    EN_CURSO = 'EN_CURSO'
+    COMPLETADA = 'COMPLETADA'
+    FALLIDA = 'FALLIDA'
+    ESTADO_CHOICES = [
+        (PENDIENTE, 'Pendiente'),
+        (EN_CURSO, 'En curso'),
+        (COMPLETADA, 'Completada'),
+        (FALLIDA, 'Fallida'),
+    ]
+
+    nombre = models.CharField(max_length=100)
+    estado = models.CharField(max_length=20, choices=ESTADO_CHOICES, default=EN_CURSO)
+    # Argumentos de la tarea (solicitudes PENDIENTES, ver tareas.solicitar()).
+    parametros = models.JSONField(default=dict, blank=True)
+    inicio = models.DateTimeField(auto_now_add=True)
+    # Último avance registrado; una ejecución EN_CURSO sin avance se da por abandonada.
+    actualizado = models.DateTimeField(auto_now=True)
+    fin = models.DateTimeField(null=True, blank=True)
+    lotes = models.PositiveIntegerField(default=0)
+    filas = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+
+    class Meta:
+        verbose_name = 'Ejecución de Tarea'
+        verbose_name_plural = 'Ejecuciones de Tareas'
+        ordering = ['-inicio']
+        indexes = [
+            models.Index(fields=['nombre', '-inicio'], name='tarea_nombre_inicio_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['nombre'], condition=models.Q(estado='EN_CURSO'),
+                                    name='tarea_una_en_curso'),
+        ]
+
+    def __str__(self):
+        return f"{self.nombre} {self.inicio:%d/%m/%Y %H:%M} ({self.get_estado_display()})"
+
+
+class MetricaTablero(models.Model):
+    """
+    Contador almacenado para el tablero de inicio (ver metricas.py).
+    Se actualiza de forma incremental desde signals.py y se reconcilia
+    periódicamente con `python manage.py reconciliar_metricas`.
+    """
+    clave = models.CharField(max_length=60, primary_key=True)
+    valor = models.BigIntegerField(default=0)
+    actualizado = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Métrica del Tablero'
+        verbose_name_plural = 'Métricas del Tablero'
+        ordering = ['clave']
+
+    def __str__(self):
+        return f"{self.clave} = {self.valor}"
+
+
+class RegistroEliminado(models.Model):
+    """
+    Marca (*tombstone*) de una fila eliminada, para que la sincronización incremental
+    de la API (`?cambios_desde=`, ver sincronizacion.py) informe también las eliminaciones.
+    Se crea desde signals.py al eliminar cualquiera de los modelos de la clínica.
+    """
+    modelo = models.CharField(max_length=100)
+    objeto_id = models.BigIntegerField()
+    fecha_eliminacion = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Registro Eliminado'
+        verbose_name_plural = 'Registros Eliminados'
+        ordering = ['fecha_eliminacion']
+        indexes = [
+            models.Index(fields=['modelo', 'fecha_eliminacion', 'id'], name='eliminado_modelo_fecha_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.modelo} #{self.objeto_id} eliminado"
@@ -0,0 +1,60 @@
+"""
+Archivo: normalizacion.py
+Ubicación: Aplicación 'gestion_clinica'
+
+DESCRIPCIÓN GENERAL:
+--------------------
+Normalización de texto para búsquedas: minúsculas, sin tildes ni diéresis y con
+espacios simples. Así "Muñoz", "MUNOZ" y "muñoz " se comparan como "munoz".
+
+Se usa para poblar las columnas de búsqueda de los modelos (por ejemplo,
+`Paciente.nombre_normalizado`) y para normalizar lo que escribe el usuario, de modo
+que la comparación sea un simple prefijo indexable, sin depender de extensiones
+como `unaccent` en la base de datos.
+
+`terminos_busqueda()` y `documento_busqueda()` preparan el texto para el buscador de
+texto completo (`busqueda.py`): el documento almacenado y la consulta del usuario se
+parten en los mismos términos alfanuméricos, y el RUT se compacta
+('12.345.678-K' -> '12345678k') para que se pueda buscar escrito con o sin puntos.
+"""
+
+import re
+import unicodedata
+
+_RUT = re.compile(r'^\d[\d.]*-?[\dk]?$')
+_TERMINO = re.compile(r'[a-z0-9]+')
+
+
+def normalizar_texto(texto):
+    """
+    'José  Muñoz' -> 'jose munoz'
+    """
+    descompuesto = unicodedata.normalize('NFKD', texto or '')
+    sin_marcas = ''.join(c for c in descompuesto if not unicodedata.combining(c))
+    return ' '.join(sin_marcas.lower().split())
+
+
+def normalizar_rut(rut):
+    """
+    '12.345.678-k' -> '12345678-K' (sin puntos ni espacios, dígito verificador en mayúscula).
+    """
+    return ''.join((rut or '').split()).replace('.', '').upper()
+
+
+def terminos_busqueda(texto):
+    """
+    'Muñoz 12.345.678-K' -> ['munoz', '12345678k']
+    """
+    terminos = []
+    for palabra in normalizar_texto(texto).split():
+        if _RUT.match(palabra):
+            palabra = palabra.replace('.', '').replace('-', '')
+        terminos.extend(_TERMINO.findall(palabra))
+    return terminos
+
+
+def documento_busqueda(*partes):
+    """
+    Une los términos de todas las `partes` en el texto que se indexa para búsqueda.
+    """
+    return ' '.join(termino for parte in partes for termino in terminos_busqueda(parte))
@@ -0,0 +1,266 @@
+"""
+Archivo: paginacion.py
+Ubicación: Aplicación 'gestion_clinica'
+
+DESCRIPCIÓN GENERAL:
+--------------------
+Paginación por clave (*keyset* o *seek pagination*) para las vistas de listado.
+
+A diferencia de la paginación por número de página (`OFFSET`), aquí cada página se
+obtiene con un filtro `WHERE (campos de orden) > (valores de la última fila vista)`,
+por lo que el costo de la página 1 y de la página 10.000 es el mismo: la base de datos
+solo lee `tamano + 1` filas apoyándose en el índice del ordenamiento.
+
+CÓMO FUNCIONA:
+--------------
+- El orden se toma de `Meta.ordering` de cada modelo y se completa con `id` como
+  desempate, de modo que el orden sea total y ninguna fila se repita ni se pierda.
+- El cursor es la tupla de valores de orden de la fila frontera, serializada en JSON
+  y codificada en base64 (URL-safe), para que sea opaco para el usuario.
+- Los parámetros `?despues=<cursor>` y `?antes=<cursor>` avanzan o retroceden una página.
+  El resto de los parámetros GET (por ejemplo, filtros) se conservan en los enlaces.
+
+LIMITACIONES:
+-------------
+- Los campos de ordenamiento deben ser columnas propias del modelo y no nulas
+  (es el caso de todos los `Meta.ordering` del sistema).
+- No se entrega el número total de páginas: contarlo exigiría un `COUNT(*)` completo.
+"""
+
+import base64
+import binascii
+import json
+
+from django.db.models import Q
+from django.http import Http404, QueryDict
+
+TAMANO_PAGINA = 25
+
+PARAM_DESPUES = 'despues'
+PARAM_ANTES = 'antes'
+
+
+class CursorInvalido(ValueError):
+    """
+    El cursor recibido no se puede decodificar o no corresponde al ordenamiento.
+    """
+
+
+def ordenamiento_keyset(modelo, ordering=None):
+    """
+    Devuelve el ordenamiento como lista de tuplas `(campo, descendente)`.
+
+    Usa `Meta.ordering` del modelo (o el `ordering` indicado) y agrega `id` como
+    desempate con la misma dirección que el primer campo, para que un índice
+    compuesto `(campo, id)` pueda recorrerse en un solo sentido.
+    """
+    ordering = list(ordering or modelo._meta.ordering)
+    campos = []
+    for expresion in ordering:
+        descendente = expresion.startswith('-')
+        nombre = expresion.lstrip('-')
+        if nombre == 'pk':
+            nombre = modelo._meta.pk.name
+        campos.append((nombre, descendente))
+
+    pk = modelo._meta.pk.name
+    if not any(nombre == pk for nombre, _ in campos):
+        descendente = campos[0][1] if campos else False
+        campos.append((pk, descendente))
+    return campos
+
+
+def _valor_a_json(valor):
+    # isoformat() conserva los microsegundos (DjangoJSONEncoder los trunca a milisegundos).
+    if hasattr(valor, 'isoformat'):
+        return valor.isoformat()
+    return valor
+
+
+def codificar_cursor(modelo, campos, obj):
+    """
+    Codifica los valores de orden de `obj` como cursor opaco.
+    """
+    valores = [
+        _valor_a_json(getattr(obj, modelo._meta.get_field(nombre).attname))
+        for nombre, _ in campos
+    ]
+    crudo = json.dumps(valores, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(crudo).decode('ascii').rstrip('=')
+
+
+def decodificar_cursor(modelo, campos, cursor):
+    """
+    Decodifica un cursor y convierte cada valor al tipo Python del campo.
+    """
+    try:
+        relleno = '=' * (-len(cursor) % 4)
+        valores = json.loads(base64.urlsafe_b64decode(cursor + relleno))
+    except (binascii.Error, ValueError, TypeError):
+        raise CursorInvalido('Cursor inválido.')
+
+    if not isinstance(valores, list) or len(valores) != len(campos):
+        raise CursorInvalido('El cursor no corresponde al ordenamiento.')
+
+    try:
+        return [
+            modelo._meta.get_field(nombre).to_python(valor)
+            for (nombre, _), valor in zip(campos, valores)
+        ]
+    except Exception:
+        raise CursorInvalido('El cursor contiene valores inválidos.')
+
+
+def filtro_posterior(campos, valores, invertir=False):
+    """
+    Construye el `Q` que selecciona las filas posteriores a `valores` en el orden `campos`.
+
+    Para un orden `(a, b, id)` genera:
+        a > va  OR  (a = va AND b > vb)  OR  (a = va AND b = vb AND id > vid)
+    cambiando `>` por `<` en los campos descendentes (o en todos si `invertir`).
+
+    Se agrega además la condición redundante `a >= va`, que permite al planificador
+    usar el índice del primer campo como rango en lugar de evaluar el OR fila a fila.
+    """
+    condicion = Q()
+    iguales = Q()
+    for (nombre, descendente), valor in zip(campos, valores):
+        if descendente != invertir:
+            paso = Q(**{f'{nombre}__lt': valor})
+        else:
+            paso = Q(**{f'{nombre}__gt': valor})
+        condicion |= iguales & paso
+        iguales &= Q(**{nombre: valor})
+
+    (primero, descendente), valor = campos[0], valores[0]
+    rango = Q(**{f'{primero}__lte' if descendente != invertir else f'{primero}__gte': valor})
+    return rango & condicion
+
+
+def expresiones_orden(campos, invertir=False):
+    """
+    Convierte `[(campo, descendente), ...]` en argumentos para `order_by()`.
+    """
+    return [
+        f'-{nombre}' if descendente != invertir else nombre
+        for nombre, descendente in campos
+    ]
+
+
+class PaginaKeyset:
+    """
+    Página obtenida por keyset. Se itera igual que una lista de objetos.
+
+    Atributos útiles en templates:
+    - `object_list`: filas de la página.
+    - `has_next` / `has_previous`: si existen páginas siguiente / anterior.
+    - `url_siguiente` / `url_anterior` / `url_primera`: querystrings listos para `href`.
+    """
+
+    def __init__(self, object_list, has_next, has_previous,
+                 cursor_siguiente, cursor_anterior, parametros):
+        self.object_list = object_list
+        self.has_next = has_next
+        self.has_previous = has_previous
+        self.cursor_siguiente = cursor_siguiente
+        self.cursor_anterior = cursor_anterior
+        self._parametros = parametros
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __bool__(self):
+        return bool(self.object_list)
+
+    def _url(self, **cursor):
+        parametros = self._parametros.copy()
+        parametros.pop(PARAM_DESPUES, None)
+        parametros.pop(PARAM_ANTES, None)
+        for clave, valor in cursor.items():
+            parametros[clave] = valor
+        return '?' + parametros.urlencode()
+
+    @property
+    def url_siguiente(self):
+        if not self.has_next:
+            return None
+        return self._url(**{PARAM_DESPUES: self.cursor_siguiente})
+
+    @property
+    def url_anterior(self):
+        if not self.has_previous:
+            return None
+        return self._url(**{PARAM_ANTES: self.cursor_anterior})
+
+    @property
+    def url_primera(self):
+        return self._url()
+
+
+def obtener_pagina(queryset, despues=None, antes=None, tamano=TAMANO_PAGINA,
+                   ordering=None, parametros=None):
+    """
+    Obtiene una página del `queryset` usando keyset.
+
+    - Sin cursor: primera página.
+    - `despues`: página siguiente a la fila codificada en el cursor.
+    - `antes`: página anterior a la fila codificada en el cursor.
+
+    Ejecuta una sola consulta de `tamano + 1` filas (la fila extra indica si hay más).
+    Lanza `CursorInvalido` si el cursor no se puede interpretar.
+    """
+    modelo = queryset.model
+    campos = ordenamiento_keyset(modelo, ordering)
+    retroceder = bool(antes) and not despues
+    cursor = despues or antes
+
+    qs = queryset
+    if cursor:
+        valores = decodificar_cursor(modelo, campos, cursor)
+        qs = qs.filter(filtro_posterior(campos, valores, invertir=retroceder))
+    qs = qs.order_by(*expresiones_orden(campos, invertir=retroceder))
+
+    filas = list(qs[:tamano + 1])
+    hay_mas = len(filas) > tamano
+    filas = filas[:tamano]
+
+    if retroceder:
+        filas.reverse()
+        has_previous, has_next = hay_mas, True
+    else:
+        has_previous, has_next = bool(cursor), hay_mas
+
+    cursor_siguiente = codificar_cursor(modelo, campos, filas[-1]) if filas else None
+    cursor_anterior = codificar_cursor(modelo, campos, filas[0]) if filas else None
+
+    return PaginaKeyset(
+        filas,
+        has_next=has_next and cursor_siguiente is not None,
+        has_previous=has_previous and cursor_anterior is not None,
+        cursor_siguiente=cursor_siguiente,
+        cursor_anterior=cursor_anterior,
+        parametros=parametros if parametros is not None else QueryDict(mutable=True),
+    )
+
+
+def paginar_keyset(request, queryset, tamano=TAMANO_PAGINA, ordering=None):
+    """
+    Atajo para vistas HTML: lee `despues`/`antes` de `request.GET` y devuelve la página.
+
+    Un cursor inválido se responde con 404, igual que una página inexistente
+    en el `Paginator` estándar de Django.
+    """
+    try:
+        return obtener_pagina(
+            queryset,
+            despues=request.GET.get(PARAM_DESPUES),
+            antes=request.GET.get(PARAM_ANTES),
+            tamano=tamano,
+            ordering=ordering,
+            parametros=request.GET.copy(),
+        )
+    except CursorInvalido as exc:
+        raise Http404(str(exc))
@@ -0,0 +1,202 @@
+"""
+Archivo: paginacion_api.py
+Ubicación: Aplicación 'gestion_clinica'
+
+DESCRIPCIÓN GENERAL:
+--------------------
+Paginación de la API REST (`DEFAULT_PAGINATION_CLASS`).
+
+`PageNumberPagination` ejecuta en cada página un `COUNT(*)` completo y un `OFFSET`
+que crece con el número de página: recorrer todo el historial de `/api/consultas/`
+cuesta cada vez más por página. `PaginacionAPI` usa por defecto paginación por
+cursor (*keyset*, la misma de `paginacion.py`), cuyo costo no depende de la
+profundidad, y solo cuenta filas en la primera página.
+
+PARÁMETROS:
+-----------
+- `?despues=<cursor>` / `?antes=<cursor>`: página siguiente / anterior (los enlaces
+  `next` y `previous` de la respuesta ya los incluyen).
+- `?page_size=N`: tamaño de página (por defecto `PAGE_SIZE`, máximo
+  `API_TAMANO_PAGINA_MAXIMO`).
+- `?contar=estimado|exacto|no`: cómo calcular `count` (por defecto `API_CONTEO`).
+  `estimado` usa la estimación del planificador de PostgreSQL (`EXPLAIN`) y solo
+  ejecuta el `COUNT(*)` exacto si la estimación es menor que `API_CONTEO_EXACTO_HASTA`.
+  Las páginas con cursor no cuentan (`count: null`) salvo que se pida `contar`.
+- `?page=N`: modo por número de página de siempre (COUNT exacto + OFFSET), para
+  clientes existentes.
+
+El modo por número de página se usa también cuando el orden pedido no admite
+cursor: campos de otra tabla (`?ordering=especialidad__nombre`), columnas que aceptan
+nulos (`fecha_fin`) o el orden por relevancia de `?search=` (ver `busqueda.py`).
+
+La respuesta mantiene siempre la forma `{count, next, previous, results}`.
+"""
+
+import json
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.db import connections
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from .paginacion import PARAM_ANTES, PARAM_DESPUES, CursorInvalido, obtener_pagina
+
+PARAM_CONTAR = 'contar'
+CONTEO_EXACTO = 'exacto'
+CONTEO_ESTIMADO = 'estimado'
+CONTEO_NINGUNO = 'no'
+MODOS_CONTEO = (CONTEO_EXACTO, CONTEO_ESTIMADO, CONTEO_NINGUNO)
+
+
+def estimar_filas(queryset):
+    """
+    Filas que el planificador estima para `queryset` (solo PostgreSQL), o `None`.
+    """
+    if connections[queryset.db].vendor != 'postgresql':
+        return None
+    plan = json.loads(queryset.order_by().explain(format='json'))
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def contar(queryset, modo):
+    """
+    Total de filas según `modo` ('exacto', 'estimado' o 'no' -> `None`).
+    """
+    if modo == CONTEO_NINGUNO:
+        return None
+    if modo == CONTEO_ESTIMADO:
+        estimado = estimar_filas(queryset)
+        umbral = getattr(settings, 'API_CONTEO_EXACTO_HASTA', 1000)
+        if estimado is not None and estimado >= umbral:
+            return estimado
+    return queryset.count()
+
+
+def modo_conteo(request):
+    """
+    Modo de `?contar=` o, si no se indica, el por defecto: `API_CONTEO` en la primera
+    página y sin conteo en las páginas con cursor. Lanza `ValidationError` si no es válido.
+    """
+    modo = request.query_params.get(PARAM_CONTAR)
+    if modo is None:
+        # Solo la primera página cuenta por defecto: recorrer el historial no repite el COUNT.
+        con_cursor = request.query_params.get(PARAM_DESPUES) or request.query_params.get(PARAM_ANTES)
+        return CONTEO_NINGUNO if con_cursor else getattr(settings, 'API_CONTEO', CONTEO_ESTIMADO)
+    if modo not in MODOS_CONTEO:
+        raise ValidationError({PARAM_CONTAR: f'Valores válidos: {", ".join(MODOS_CONTEO)}.'})
+    return modo
+
+
+def _ordering_keyset(queryset):
+    """
+    Ordenamiento para la paginación por cursor o `False` si no es compatible.
+    `None` indica el `Meta.ordering` del modelo.
+    """
+    ordering = [str(expresion) for expresion in queryset.query.order_by]
+    if not ordering:
+        return None
+    meta = queryset.model._meta
+    for expresion in ordering:
+        nombre = expresion.lstrip('-')
+        if nombre == 'pk':
+            continue
+        try:
+            campo = meta.get_field(nombre)
+        except FieldDoesNotExist:
+            return False
+        if not campo.concrete or campo.null or campo.is_relation:
+            return False
+    return ordering
+
+
+class PaginacionAPI(PageNumberPagination):
+    """
+    Paginación por cursor con conteo opcional, y modo `?page=N` de compatibilidad.
+    """
+    page_size_query_param = 'page_size'
+
+    @property
+    def max_page_size(self):
+        return getattr(settings, 'API_TAMANO_PAGINA_MAXIMO', 500)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.modo_keyset = False
+        ordering = _ordering_keyset(queryset)
+        if self.page_query_param in request.query_params or ordering is False:
+            return super().paginate_queryset(queryset, request, view)
+
+        self.modo_keyset = True
+        despues = request.query_params.get(PARAM_DESPUES)
+        antes = request.query_params.get(PARAM_ANTES)
+
+        modo = modo_conteo(request)
+        # Con `?contar=exacto`, `GetCondicionalMixin` ya contó las filas al calcular el ETag.
+        conocido = getattr(view, 'conteo_conocido', None)
+        if modo == CONTEO_EXACTO and conocido is not None:
+            self.total = conocido
+        else:
+            self.total = contar(queryset, modo)
+
+        try:
+            self.pagina = obtener_pagina(
+                queryset, despues=despues, antes=antes,
+                tamano=self.get_page_size(request), ordering=ordering,
+            )
+        except CursorInvalido as exc:
+            raise NotFound(str(exc))
+        return list(self.pagina.object_list)
+
+    def _url_cursor(self, parametro, cursor):
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, PARAM_DESPUES)
+        url = remove_query_param(url, PARAM_ANTES)
+        url = remove_query_param(url, PARAM_CONTAR)
+        return replace_query_param(url, parametro, cursor)
+
+    def get_next_link(self):
+        if not self.modo_keyset:
+            return super().get_next_link()
+        if not self.pagina.has_next:
+            return None
+        return self._url_cursor(PARAM_DESPUES, self.pagina.cursor_siguiente)
+
+    def get_previous_link(self):
+        if not self.modo_keyset:
+            return super().get_previous_link()
+        if not self.pagina.has_previous:
+            return None
+        return self._url_cursor(PARAM_ANTES, self.pagina.cursor_anterior)
+
+    def get_paginated_response(self, data):
+        if not self.modo_keyset:
+            return super().get_paginated_response(data)
+        return Response(OrderedDict([
+            ('count', self.total),
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        respuesta = super().get_paginated_response_schema(schema)
+        respuesta['properties']['count']['nullable'] = True
+        return respuesta
+
+    def get_schema_operation_parameters(self, view):
+        parametros = super().get_schema_operation_parameters(view)
+        descripciones = [
+            (PARAM_DESPUES, 'Cursor de la página siguiente (enlace `next`).'),
+            (PARAM_ANTES, 'Cursor de la página anterior (enlace `previous`).'),
+            (PARAM_CONTAR, 'Cálculo de `count`: estimado, exacto o no.'),
+        ]
+        for nombre, descripcion in descripciones:
+            parametros.append({
+                'name': nombre, 'required': False, 'in': 'query',
+                'description': descripcion, 'schema': {'type': 'string'},
+            })
+        return parametros
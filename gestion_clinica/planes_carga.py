@@ -0,0 +1,335 @@
+"""
+Archivo: planes_carga.py
+Ubicación: Aplicación 'gestion_clinica'
+
+DESCRIPCIÓN GENERAL:
+--------------------
+Planes de carga de relaciones para las vistas HTML de listado.
+
+Cada template de listado recorre relaciones (`tratamiento.consulta.paciente`,
+`receta.medicamento`, `medico.especialidad`, ...). Si el queryset no las trae
+por adelantado, Django ejecuta una consulta adicional por cada fila (problema N+1).
+
+Un `PlanCarga` declara, para una vista concreta:
+- `select_related`: relaciones a resolver con JOIN en la misma consulta.
+- `only`: columnas que el template realmente muestra (el resto queda diferido,
+  por lo que textos largos como `diagnostico` u `observaciones` no viajan).
+
+Los campos de `Meta.ordering` y el `id` se agregan siempre a `only`, porque la
+paginación keyset (`paginacion.py`) los necesita para construir los cursores.
+
+Si se modifica un template de listado, su plan debe actualizarse en este archivo;
+las pruebas de conteo de consultas en `tests.py` detectan cualquier N+1 nuevo.
+
+PLANES DERIVADOS DE SERIALIZADORES (API REST):
+----------------------------------------------
+`plan_desde_serializer()` construye el plan a partir de lo que el serializador declara:
+- Campos con `source` con puntos (`source='medico.especialidad.nombre'`).
+- Serializadores anidados (`especialidad = EspecialidadSerializer()`).
+- Campos relacionados que no son solo la PK (`StringRelatedField`, etc.).
+- Para `SerializerMethodField`, que no se pueden inspeccionar, el diccionario
+  `Meta.relaciones` del serializador (`relaciones = {'consulta_info': ['consulta__paciente']}`).
+Las relaciones hacia adelante (FK/OneToOne) se cargan con `select_related` y las
+inversas o muchos-a-muchos con `prefetch_related`.
+
+Con una selección de campos (`?fields=` / `?expand=`, ver `seleccion_campos.py`) el plan
+se arma solo con los campos pedidos y además limita las columnas con `only`: las de cada
+campo, las que declara `Meta.columnas` para los campos calculados y las claves foráneas
+de cada JOIN. Si un campo lee algo que no se puede deducir (una propiedad sin
+`Meta.columnas`), esa tabla se carga completa.
+"""
+
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework import serializers
+
+from .paginacion import ordenamiento_keyset
+
+
+class PlanCarga:
+    """
+    Conjunto de relaciones y columnas que una vista necesita cargar.
+    """
+
+    def __init__(self, select_related=(), only=(), prefetch_related=()):
+        self.select_related = tuple(select_related)
+        self.only = tuple(only)
+        self.prefetch_related = tuple(prefetch_related)
+
+    def __repr__(self):
+        return (f'PlanCarga(select_related={list(self.select_related)}, '
+                f'prefetch_related={list(self.prefetch_related)}, only={list(self.only)})')
+
+    def aplicar(self, queryset):
+        """
+        Devuelve `queryset` con el plan aplicado.
+        """
+        if self.select_related:
+            queryset = queryset.select_related(*self.select_related)
+        if self.prefetch_related:
+            queryset = queryset.prefetch_related(*self.prefetch_related)
+        if self.only:
+            orden = [nombre for nombre, _ in ordenamiento_keyset(queryset.model)]
+            campos = list(dict.fromkeys(list(self.only) + orden))
+            queryset = queryset.only(*campos)
+        return queryset
+
+
+# Columnas usadas por la propiedad `nombre_completo` de Paciente y Medico.
+_NOMBRE = ('nombre', 'apellido_paterno', 'apellido_materno')
+
+
+def _con_prefijo(prefijo, campos):
+    return [f'{prefijo}__{campo}' for campo in campos]
+
+
+PLAN_LISTA_PACIENTES = PlanCarga(
+    only=['rut', *_NOMBRE, 'prevision', 'telefono', 'activo', 'fecha_registro'],
+)
+
+PLAN_LISTA_MEDICOS = PlanCarga(
+    select_related=['especialidad'],
+    only=[
+        'rut', *_NOMBRE, 'jornada', 'telefono', 'email', 'numero_registro',
+        'activo', 'fecha_ingreso', 'especialidad', 'especialidad__nombre',
+    ],
+)
+
+PLAN_LISTA_CONSULTAS = PlanCarga(
+    select_related=['paciente', 'medico__especialidad'],
+    only=[
+        'fecha_hora', 'estado', 'motivo_consulta',
+        'paciente', *_con_prefijo('paciente', _NOMBRE),
+        'medico', *_con_prefijo('medico', _NOMBRE),
+        'medico__especialidad', 'medico__especialidad__nombre',
+    ],
+)
+
+PLAN_LISTA_TRATAMIENTOS = PlanCarga(
+    select_related=['consulta__paciente', 'consulta__medico'],
+    only=[
+        'fecha_inicio', 'fecha_fin', 'activo', 'consulta',
+        'consulta__paciente', *_con_prefijo('consulta__paciente', _NOMBRE),
+        'consulta__medico', *_con_prefijo('consulta__medico', _NOMBRE),
+    ],
+)
+
+PLAN_LISTA_MEDICAMENTOS = PlanCarga(
+    select_related=['laboratorio'],
+    only=[
+        'nombre', 'principio_activo', 'presentacion', 'stock_disponible',
+        'requiere_receta', 'activo', 'laboratorio', 'laboratorio__nombre',
+    ],
+)
+
+PLAN_LISTA_RECETAS = PlanCarga(
+    select_related=['tratamiento__consulta__paciente', 'tratamiento__consulta__medico', 'medicamento'],
+    only=[
+        'dosis', 'frecuencia', 'duracion', 'cantidad_total', 'fecha_emision',
+        'medicamento', 'medicamento__nombre',
+        'tratamiento', 'tratamiento__consulta',
+        'tratamiento__consulta__paciente', *_con_prefijo('tratamiento__consulta__paciente', _NOMBRE),
+        'tratamiento__consulta__medico', *_con_prefijo('tratamiento__consulta__medico', _NOMBRE),
+    ],
+)
+
+
+# -----------------------------
+# Planes derivados de serializadores
+# -----------------------------
+
+def _clasificar_ruta(modelo, ruta):
+    """
+    Recorre `ruta` ('a__b__c') sobre el modelo y devuelve `(select, prefetch)`:
+    la parte de la ruta resoluble con JOIN y la que requiere prefetch.
+    Se detiene en el primer segmento que no es una relación (p. ej. una propiedad).
+    """
+    select, prefetch = [], []
+    actual = modelo
+    for parte in ruta.split('__'):
+        try:
+            campo = actual._meta.get_field(parte)
+        except FieldDoesNotExist:
+            break
+        if not campo.is_relation:
+            break
+        if campo.many_to_many or campo.one_to_many or prefetch:
+            prefetch.append(parte)
+        else:
+            select.append(parte)
+        actual = campo.related_model
+
+    ruta_select = '__'.join(select)
+    ruta_prefetch = '__'.join(select + prefetch) if prefetch else ''
+    return ruta_select, ruta_prefetch
+
+
+def _rutas_serializer(serializer, prefijo=''):
+    """
+    Devuelve las rutas de relación (formato ORM) que usa `serializer`.
+    """
+    rutas = []
+    for relacion in _relaciones_declaradas(serializer):
+        rutas.append(prefijo + relacion)
+
+    for campo in serializer.fields.values():
+        if campo.write_only or campo.source == '*':
+            continue
+        ruta = prefijo + '__'.join(campo.source_attrs)
+
+        if isinstance(campo, serializers.ListSerializer):
+            rutas.append(ruta)
+            rutas += _rutas_serializer(campo.child, ruta + '__')
+        elif isinstance(campo, serializers.BaseSerializer):
+            rutas.append(ruta)
+            rutas += _rutas_serializer(campo, ruta + '__')
+        elif isinstance(campo, serializers.ManyRelatedField):
+            # Incluso con PKs, la tabla intermedia se consulta por cada fila.
+            rutas.append(ruta)
+        elif isinstance(campo, serializers.PrimaryKeyRelatedField):
+            # DRF usa la columna `<campo>_id`: no requiere JOIN.
+            continue
+        elif isinstance(campo, serializers.RelatedField) or len(campo.source_attrs) > 1:
+            rutas.append(ruta)
+    return rutas
+
+
+def _relaciones_declaradas(serializer):
+    """
+    Rutas de `Meta.relaciones` de los campos presentes en `serializer`.
+    """
+    relaciones = getattr(getattr(serializer, 'Meta', None), 'relaciones', ())
+    if not isinstance(relaciones, dict):
+        return list(relaciones)
+    return [ruta for campo, rutas in relaciones.items() if campo in serializer.fields for ruta in rutas]
+
+
+def _agregar_columna(columnas, ruta, columna):
+    if columnas.get(ruta, set()) is not None:
+        columnas.setdefault(ruta, set()).add(columna)
+
+
+def _agregar_camino(columnas, modelo, ruta, camino, completa):
+    """
+    Registra en `columnas` (`{ruta de tabla: columnas o None = todas}`) lo que lee el
+    camino `a__b__c` desde `modelo`: la clave foránea de cada relación y la columna final.
+    Con `completa` (relaciones de `Meta.relaciones`, que un método puede leer libremente)
+    las tablas recorridas se cargan enteras.
+    """
+    actual = modelo
+    for parte in camino.split('__'):
+        try:
+            campo = actual._meta.get_field(parte)
+        except FieldDoesNotExist:
+            columnas[ruta] = None
+            return
+        if not campo.concrete or campo.many_to_many:
+            columnas[ruta] = None
+            return
+        _agregar_columna(columnas, ruta, parte)
+        if not campo.is_relation:
+            return
+        ruta = f'{ruta}__{parte}' if ruta else parte
+        actual = campo.related_model
+        if completa:
+            columnas[ruta] = None
+
+
+def _columnas_serializer(serializer, modelo, columnas, ruta=''):
+    meta = getattr(serializer, 'Meta', None)
+    declaradas = getattr(meta, 'columnas', {})
+    relaciones = getattr(meta, 'relaciones', None)
+    con_relaciones = relaciones if isinstance(relaciones, dict) else {}
+    for relacion in _relaciones_declaradas(serializer):
+        _agregar_camino(columnas, modelo, ruta, relacion, completa=True)
+
+    for nombre, campo in serializer.fields.items():
+        if campo.write_only:
+            continue
+        if nombre in declaradas:
+            for columna in declaradas[nombre]:
+                _agregar_camino(columnas, modelo, ruta, columna, completa=False)
+        elif campo.source == '*':
+            # Campo calculado: solo se conocen las relaciones que declara.
+            if nombre not in con_relaciones:
+                columnas[ruta] = None
+        elif isinstance(campo, serializers.BaseSerializer) and not isinstance(campo, serializers.ListSerializer):
+            camino = '__'.join(campo.source_attrs)
+            _agregar_camino(columnas, modelo, ruta, camino, completa=False)
+            anidado = _clasificar_ruta(modelo, camino)[0]
+            if anidado == camino:
+                _columnas_serializer(campo, _modelo_en(modelo, camino),
+                                     columnas, f'{ruta}__{camino}' if ruta else camino)
+            else:
+                columnas[ruta] = None
+        else:
+            # Con `source='medico.nombre_completo'` la tabla del médico se carga completa.
+            _agregar_camino(columnas, modelo, ruta, '__'.join(campo.source_attrs), completa=False)
+
+
+def _modelo_en(modelo, camino):
+    for parte in camino.split('__'):
+        modelo = modelo._meta.get_field(parte).related_model
+    return modelo
+
+
+def _only_desde_columnas(columnas):
+    """
+    Lista para `QuerySet.only()`, o `None` si la tabla principal debe cargarse completa.
+    Una tabla relacionada sin restricción se carga completa junto con todo lo que cuelga de ella.
+    """
+    if columnas.get('', set()) is None:
+        return None
+    only = []
+    for ruta in sorted(columnas):
+        partes = ruta.split('__') if ruta else []
+        if any(columnas.get('__'.join(partes[:n]), set()) is None for n in range(1, len(partes))):
+            continue
+        if columnas[ruta] is None:
+            only.append(ruta)
+        else:
+            only += [f'{ruta}__{c}' if ruta else c for c in sorted(columnas[ruta])]
+    return only
+
+
+def plan_desde_serializer(serializer_class, modelo=None, seleccion=None, columnas_extra=()):
+    """
+    Construye un `PlanCarga` con las relaciones que `serializer_class` recorre.
+
+    Con `seleccion` (ver seleccion_campos.py) el plan considera solo los campos pedidos y
+    limita las columnas; `columnas_extra` se cargan siempre (orden, sincronización).
+    """
+    serializer = serializer_class(seleccion=seleccion) if seleccion is not None else serializer_class()
+    modelo = modelo or serializer.Meta.model
+
+    select, prefetch = [], []
+    for ruta in _rutas_serializer(serializer):
+        ruta_select, ruta_prefetch = _clasificar_ruta(modelo, ruta)
+        if ruta_select:
+            select.append(ruta_select)
+        if ruta_prefetch:
+            prefetch.append(ruta_prefetch)
+
+    only = ()
+    if seleccion is not None:
+        columnas = {}
+        _columnas_serializer(serializer, modelo, columnas)
+        only = _only_desde_columnas(columnas) or ()
+        if only:
+            only = list(dict.fromkeys([modelo._meta.pk.name, *only, *columnas_extra]))
+
+    return PlanCarga(
+        select_related=_sin_prefijos(select),
+        prefetch_related=_sin_prefijos(prefetch),
+        only=only,
+    )
+
+
+def _sin_prefijos(rutas):
+    """
+    Elimina duplicados y rutas contenidas en otras más largas ('a' en 'a__b').
+    """
+    unicas = sorted(set(rutas))
+    return [
+        ruta for ruta in unicas
+        if not any(otra.startswith(ruta + '__') for otra in unicas)
+    ]
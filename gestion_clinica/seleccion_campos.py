@@ -0,0 +1,118 @@
+"""
+Archivo: seleccion_campos.py
+Ubicación: Aplicación 'gestion_clinica'
+
+DESCRIPCIÓN GENERAL:
+--------------------
+Campos a pedido en la API REST: `?fields=` y `?expand=` en todos los endpoints de
+lectura (listados, detalle, sincronización y exportación).
+
+Por defecto cada serializador entrega todas sus columnas y extras (`consulta_info`,
+`tratamiento_info`, `edad`, ...), con los JOIN que estos necesitan y textos largos como
+`diagnostico` u `observaciones`. Un cliente que solo necesita ids y nombres puede pedir:
+
+    GET /api/consultas/?fields=id,fecha_hora,paciente_nombre
+    GET /api/consultas/?expand=paciente              # `paciente` como objeto anidado
+    GET /api/recetas/?fields=id,dosis,tratamiento.consulta.paciente.rut
+
+- `?fields=`: lista separada por comas de los campos a entregar. Con puntos se eligen
+  campos de una relación expandida (la expande implícitamente).
+- `?expand=`: relaciones (`Meta.expandibles` del serializador) que se entregan como
+  objeto anidado en vez de su id; admite rutas con puntos (`tratamiento.consulta`).
+
+La selección no solo recorta el JSON: `CargaRelacionesMixin` (`mixins.py`) arma el
+plan de carga con los campos pedidos (`planes_carga.plan_desde_serializer`), así que el
+`SELECT` solo trae esas columnas (`only()`) y solo hace los JOIN que esos campos usan.
+
+Solo se aplica en peticiones de lectura (GET/HEAD); las escrituras validan y responden
+con el serializador completo.
+"""
+
+PARAM_CAMPOS = 'fields'
+PARAM_EXPANDIR = 'expand'
+CLAVE_CONTEXTO = 'seleccion_campos'
+
+
+class SeleccionInvalida(ValueError):
+    """
+    `?fields=` o `?expand=` nombra un campo o una relación que no existe.
+    `parametro` indica cuál de los dos.
+    """
+
+    def __init__(self, parametro, mensaje):
+        super().__init__(mensaje)
+        self.parametro = parametro
+
+
+class Seleccion:
+    """
+    Nodo de la selección: `campos` (`None` = todos) y las relaciones a expandir,
+    cada una con su propia `Seleccion`.
+    """
+
+    def __init__(self):
+        self.campos = None
+        self.expandir = {}
+
+    def incluye(self, nombre):
+        return self.campos is None or nombre in self.campos or nombre in self.expandir
+
+
+def _lista(valor):
+    if valor is None:
+        return None
+    return [parte.strip() for parte in valor.split(',') if parte.strip()]
+
+
+def leer_seleccion(params):
+    """
+    `Seleccion` a partir de los parámetros de la petición, o `None` si no se pidió ninguna.
+    """
+    campos = _lista(params.get(PARAM_CAMPOS))
+    expandir = _lista(params.get(PARAM_EXPANDIR))
+    if campos is None and expandir is None:
+        return None
+
+    raiz = Seleccion()
+    for ruta in expandir or ():
+        nodo = raiz
+        for relacion in ruta.split('.'):
+            nodo = nodo.expandir.setdefault(relacion, Seleccion())
+
+    for ruta in campos or ():
+        *relaciones, nombre = ruta.split('.')
+        nodo = raiz
+        for relacion in relaciones:
+            if nodo.campos is None:
+                nodo.campos = set()
+            nodo = nodo.expandir.setdefault(relacion, Seleccion())
+        if nodo.campos is None:
+            nodo.campos = set()
+        nodo.campos.add(nombre)
+    return raiz
+
+
+def validar_seleccion(seleccion, serializer_class, prefijo=''):
+    """
+    Lanza `SeleccionInvalida` si `seleccion` nombra campos que `serializer_class` no
+    tiene o relaciones que no están en su `Meta.expandibles`.
+    """
+    expandibles = getattr(serializer_class.Meta, 'expandibles', {})
+    disponibles = set(serializer_class().fields) | set(expandibles)
+
+    desconocidos = sorted((seleccion.campos or set()) - disponibles)
+    if desconocidos:
+        raise SeleccionInvalida(
+            PARAM_CAMPOS,
+            f'Campos desconocidos: {", ".join(prefijo + nombre for nombre in desconocidos)}. '
+            f'Disponibles{" en " + prefijo.rstrip(".") if prefijo else ""}: '
+            f'{", ".join(sorted(disponibles))}.',
+        )
+    for nombre, sub in seleccion.expandir.items():
+        if nombre not in expandibles:
+            opciones = ', '.join(sorted(expandibles)) or 'ninguna'
+            raise SeleccionInvalida(
+                PARAM_EXPANDIR,
+                f'No se puede expandir "{prefijo}{nombre}". Relaciones expandibles: {opciones}.',
+            )
+        validar_seleccion(sub, expandibles[nombre], f'{prefijo}{nombre}.')
@@ -44,39 +44,134 @@ Los serializadores actúan como el **puente entre la base de datos y el exterior
 entregue datos coherentes, validados y fácilmente interpretables por cualquier cliente.
 """
 
+from copy import copy
+
+from django.core.exceptions import ValidationError as DjangoValidationError
 from rest_framework import serializers
+from .agenda import errores_agenda
+from .contadores import usar_contadores_almacenados
 from .models import (
     Especialidad, Paciente, Medico, ConsultaMedica,
-    Tratamiento, Medicamento, RecetaMedica, Laboratorio
+    Tratamiento, Medicamento, RecetaMedica, Laboratorio, ConflictoAgenda, StockInsuficiente
 )
+from .seleccion_campos import CLAVE_CONTEXTO as CLAVE_SELECCION
+
+
+class RelacionPrecargadaField(serializers.PrimaryKeyRelatedField):
+    """
+    `PrimaryKeyRelatedField` que, al validar un lote (ver carga_masiva.py), toma el objeto
+    relacionado de los precargados en el contexto en vez de ejecutar un `SELECT` por fila.
+    Fuera de un lote se comporta igual que `PrimaryKeyRelatedField`.
+    """
+    CLAVE_CONTEXTO = 'relaciones_precargadas'
+
+    def to_internal_value(self, data):
+        precargadas = self.context.get(self.CLAVE_CONTEXTO)
+        if precargadas is None or self.field_name not in precargadas:
+            return super().to_internal_value(data)
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            pk = self.get_queryset().model._meta.pk.to_python(data)
+        except DjangoValidationError:
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            return precargadas[self.field_name][pk]
+        except KeyError:
+            self.fail('does_not_exist', pk_value=data)
+
+
+class SeleccionCamposMixin:
+    """
+    Entrega solo los campos pedidos con `?fields=` y reemplaza por el objeto anidado las
+    relaciones pedidas con `?expand=` (ver seleccion_campos.py).
+
+    Declaraciones opcionales en `Meta`:
+    - `expandibles`: `{campo: serializador}` de las claves foráneas que se pueden expandir.
+    - `columnas`: `{campo: [columnas]}` para los campos calculados (propiedades,
+      `SerializerMethodField`) que leen columnas del modelo, de modo que el plan de carga
+      pueda limitar el `SELECT` (ver planes_carga.py).
+    - `depende_de_la_fecha`: `True` si algún campo cambia con el día actual (la edad), para
+      que los validadores del GET condicional lo incluyan (ver `GetCondicionalMixin`).
+
+    El serializador raíz toma la selección del contexto de la vista; los expandidos la
+    reciben en `seleccion=`.
+    """
 
+    def __init__(self, *args, seleccion=None, **kwargs):
+        self._seleccion = seleccion
+        super().__init__(*args, **kwargs)
 
-class EspecialidadSerializer(serializers.ModelSerializer):
+    def get_seleccion(self):
+        if self._seleccion is not None:
+            return self._seleccion
+        raiz = self.root
+        if raiz is self or getattr(raiz, 'child', None) is self:
+            return self.context.get(CLAVE_SELECCION)
+        return None
+
+    def get_fields(self):
+        campos = super().get_fields()
+        seleccion = self.get_seleccion()
+        if seleccion is None:
+            return campos
+        expandibles = getattr(self.Meta, 'expandibles', {})
+        for nombre, sub in seleccion.expandir.items():
+            if nombre in expandibles:
+                campos[nombre] = expandibles[nombre](read_only=True, seleccion=sub)
+        return {nombre: campo for nombre, campo in campos.items() if seleccion.incluye(nombre)}
+
+
+class EspecialidadSerializer(SeleccionCamposMixin, serializers.ModelSerializer):
     """
     Serializador para el modelo Especialidad.
+
+    `cantidad_medicos` se toma de la anotación del ViewSet o del contador
+    almacenado (ver contadores.py); solo si no hay ninguno se cuenta con una consulta.
     """
     cantidad_medicos = serializers.SerializerMethodField()
     
     class Meta:
         model = Especialidad
-        fields = '__all__'
+        exclude = ['total_medicos_activos']
+        columnas = {'cantidad_medicos': ['total_medicos_activos']}
     
     def get_cantidad_medicos(self, obj):
+        anotado = getattr(obj, 'cantidad_medicos_activos', None)
+        if anotado is not None:
+            return anotado
+        if usar_contadores_almacenados():
+            return obj.total_medicos_activos
         return obj.medicos.filter(activo=True).count()
-class LaboratorioSerializer(serializers.ModelSerializer):
+class LaboratorioSerializer(SeleccionCamposMixin, serializers.ModelSerializer):
     """
     Serializador para el modelo Laboratorio.
+
+    `cantidad_medicamentos` sigue la misma estrategia que `cantidad_medicos`
+    de EspecialidadSerializer.
     """
     cantidad_medicamentos = serializers.SerializerMethodField()
     
     class Meta:
         model = Laboratorio
-        fields = '__all__'
+        exclude = ['total_medicamentos_activos']
+        columnas = {'cantidad_medicamentos': ['total_medicamentos_activos']}
     
     def get_cantidad_medicamentos(self, obj):
+        anotado = getattr(obj, 'cantidad_medicamentos_activos', None)
+        if anotado is not None:
+            return anotado
+        if usar_contadores_almacenados():
+            return obj.total_medicamentos_activos
         return obj.medicamentos.filter(activo=True).count()
 
-class PacienteSerializer(serializers.ModelSerializer):
+# Columnas derivadas para los buscadores (ver normalizacion.py / busqueda.py): no se exponen.
+COLUMNAS_BUSQUEDA_PERSONA = ['nombre_normalizado', 'texto_busqueda']
+# Columnas que lee la propiedad `nombre_completo` de Paciente y Medico.
+COLUMNAS_NOMBRE_COMPLETO = ['nombre', 'apellido_paterno', 'apellido_materno']
+
+
+class PacienteSerializer(SeleccionCamposMixin, serializers.ModelSerializer):
     """
     Serializador para el modelo Paciente.
     """
@@ -85,7 +180,10 @@ class PacienteSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = Paciente
-        fields = '__all__'
+        exclude = COLUMNAS_BUSQUEDA_PERSONA
+        columnas = {'nombre_completo': COLUMNAS_NOMBRE_COMPLETO, 'edad': ['fecha_nacimiento']}
+        # `edad` cambia con el día: el ETag lo incluye (ver GetCondicionalMixin).
+        depende_de_la_fecha = True
     
     def get_edad(self, obj):
         from datetime import date
@@ -95,19 +193,21 @@ class PacienteSerializer(serializers.ModelSerializer):
         )
 
 
-class MedicoSerializer(serializers.ModelSerializer):
+class MedicoSerializer(SeleccionCamposMixin, serializers.ModelSerializer):
     """
     Serializador para el modelo Medico.
     """
+    serializer_related_field = RelacionPrecargadaField
     nombre_completo = serializers.ReadOnlyField()
     especialidad_nombre = serializers.CharField(source='especialidad.nombre', read_only=True)
     
     class Meta:
         model = Medico
-        fields = '__all__'
+        exclude = COLUMNAS_BUSQUEDA_PERSONA
+        columnas = {'nombre_completo': COLUMNAS_NOMBRE_COMPLETO}
 
 
-class MedicoDetalleSerializer(serializers.ModelSerializer):
+class MedicoDetalleSerializer(SeleccionCamposMixin, serializers.ModelSerializer):
     """
     Serializador detallado para el modelo Medico con información de la especialidad.
     """
@@ -116,13 +216,15 @@ class MedicoDetalleSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = Medico
-        fields = '__all__'
+        exclude = COLUMNAS_BUSQUEDA_PERSONA
+        columnas = {'nombre_completo': COLUMNAS_NOMBRE_COMPLETO}
 
 
-class ConsultaMedicaSerializer(serializers.ModelSerializer):
+class ConsultaMedicaSerializer(SeleccionCamposMixin, serializers.ModelSerializer):
     """
     Serializador para el modelo ConsultaMedica.
     """
+    serializer_related_field = RelacionPrecargadaField
     paciente_nombre = serializers.CharField(source='paciente.nombre_completo', read_only=True)
     medico_nombre = serializers.CharField(source='medico.nombre_completo', read_only=True)
     especialidad = serializers.CharField(source='medico.especialidad.nombre', read_only=True)
@@ -130,18 +232,50 @@ class ConsultaMedicaSerializer(serializers.ModelSerializer):
     class Meta:
         model = ConsultaMedica
         fields = '__all__'
+        expandibles = {'paciente': PacienteSerializer, 'medico': MedicoSerializer}
 
+    def validate(self, attrs):
+        # En un lote la agenda se valida para todos los elementos juntos (ver carga_masiva.py).
+        if RelacionPrecargadaField.CLAVE_CONTEXTO in self.context:
+            return attrs
+        consulta = copy(self.instance) if self.instance is not None else ConsultaMedica()
+        for campo, valor in attrs.items():
+            setattr(consulta, campo, valor)
+        errores = errores_agenda(consulta)
+        if errores:
+            raise serializers.ValidationError(errores)
+        return attrs
 
-class MedicamentoSerializer(serializers.ModelSerializer):
+    def create(self, validated_data):
+        try:
+            return super().create(validated_data)
+        except ConflictoAgenda as exc:
+            raise serializers.ValidationError({'fecha_hora': [str(exc)]})
+
+    def update(self, instance, validated_data):
+        try:
+            return super().update(instance, validated_data)
+        except ConflictoAgenda as exc:
+            raise serializers.ValidationError({'fecha_hora': [str(exc)]})
+
+
+class MedicamentoSerializer(SeleccionCamposMixin, serializers.ModelSerializer):
     """
     Serializador para el modelo Medicamento.
     """
     class Meta:
         model = Medicamento
-        fields = '__all__'
+        exclude = ['texto_busqueda']
 
+    def update(self, instance, validated_data):
+        # Un cambio de stock se aplica como ajuste (ver stock.py) y puede no alcanzar.
+        try:
+            return super().update(instance, validated_data)
+        except StockInsuficiente as exc:
+            raise serializers.ValidationError({'stock_disponible': [str(exc)]})
 
-class TratamientoSerializer(serializers.ModelSerializer):
+
+class TratamientoSerializer(SeleccionCamposMixin, serializers.ModelSerializer):
     """
     Serializador para el modelo Tratamiento.
     """
@@ -150,6 +284,9 @@ class TratamientoSerializer(serializers.ModelSerializer):
     class Meta:
         model = Tratamiento
         fields = '__all__'
+        # Relaciones que recorre get_consulta_info (ver planes_carga.plan_desde_serializer).
+        relaciones = {'consulta_info': ['consulta__paciente', 'consulta__medico']}
+        expandibles = {'consulta': ConsultaMedicaSerializer}
     
     def get_consulta_info(self, obj):
         return {
@@ -160,20 +297,36 @@ class TratamientoSerializer(serializers.ModelSerializer):
         }
 
 
-class RecetaMedicaSerializer(serializers.ModelSerializer):
+class RecetaMedicaSerializer(SeleccionCamposMixin, serializers.ModelSerializer):
     """
     Serializador para el modelo RecetaMedica.
     """
+    serializer_related_field = RelacionPrecargadaField
     medicamento_nombre = serializers.CharField(source='medicamento.nombre', read_only=True)
     tratamiento_info = serializers.SerializerMethodField()
     
     class Meta:
         model = RecetaMedica
         fields = '__all__'
+        # Relaciones que recorre get_tratamiento_info.
+        relaciones = {'tratamiento_info': ['tratamiento__consulta__paciente']}
+        expandibles = {'tratamiento': TratamientoSerializer, 'medicamento': MedicamentoSerializer}
     
     def get_tratamiento_info(self, obj):
         return {
             'id': obj.tratamiento.id,
             'descripcion': obj.tratamiento.descripcion,
             'paciente': obj.tratamiento.consulta.paciente.nombre_completo
-        }
\ No newline at end of file
+        }
+
+    def create(self, validated_data):
+        try:
+            return super().create(validated_data)
+        except StockInsuficiente as exc:
+            raise serializers.ValidationError({'cantidad_total': [str(exc)]})
+
+    def update(self, instance, validated_data):
+        try:
+            return super().update(instance, validated_data)
+        except StockInsuficiente as exc:
+            raise serializers.ValidationError({'cantidad_total': [str(exc)]})
\ No newline at end of file
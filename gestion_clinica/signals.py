@@ -0,0 +1,187 @@
+"""
+Archivo: signals.py
+Ubicación: Aplicación 'gestion_clinica'
+
+DESCRIPCIÓN GENERAL:
+--------------------
+Receptores de señales del ORM (`post_save`, `post_delete`) que mantienen datos
+derivados sincronizados con las escrituras. Se registran en `apps.py` (`ready()`).
+
+- Contadores de médicos activos por especialidad y medicamentos activos por
+  laboratorio (ver `contadores.py`).
+- Texto de búsqueda de médicos y medicamentos cuando cambia el nombre de su
+  especialidad o laboratorio, y tablas FTS5 tras `migrate` en SQLite (ver `busqueda.py`).
+- Métricas del tablero de inicio (ver `metricas.py`).
+- Marcas de eliminación para la sincronización incremental de la API (ver `sincronizacion.py`).
+- Versiones de la caché de datos de referencia (ver `cache_referencia.py`).
+- Triggers de la agenda tras `migrate` en SQLite (ver `agenda.py`).
+- Mapa de ocupación de la agenda de cada médico (ver `disponibilidad.py`).
+- Stock de medicamentos y libro de movimientos al emitir, editar o eliminar recetas y
+  al ajustar el stock de un medicamento (ver `stock.py`).
+- Consumo diario de cada medicamento para la proyección de stock (ver `consumo.py`).
+
+Los receptores comparan con los valores leídos de la base de datos
+(`SeguimientoCambiosMixin`); el último receptor del archivo toma los valores actuales
+como nueva referencia, por lo que debe seguir registrándose al final.
+"""
+
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from . import cache_referencia, consumo, disponibilidad, metricas, stock
+from .agenda import preparar_agenda_sqlite
+from .busqueda import preparar_fts_sqlite, reindexar
+from .contadores import recalcular_medicamentos_por_laboratorio, recalcular_medicos_por_especialidad
+from .models import (
+    ConsultaMedica, Especialidad, Laboratorio, Medico, Medicamento, Paciente,
+    RecetaMedica, SeguimientoCambiosMixin, Tratamiento,
+)
+from .sincronizacion import registrar_eliminacion
+
+
+def _ids_afectados(instancia, attname):
+    return {instancia.valor_original(attname), getattr(instancia, attname)}
+
+
+@receiver(post_save, sender=Medico)
+@receiver(post_delete, sender=Medico)
+def actualizar_contador_especialidad(sender, instance, **kwargs):
+    recalcular_medicos_por_especialidad(_ids_afectados(instance, 'especialidad_id'))
+
+
+@receiver(post_save, sender=Medicamento)
+@receiver(post_delete, sender=Medicamento)
+def actualizar_contador_laboratorio(sender, instance, **kwargs):
+    recalcular_medicamentos_por_laboratorio(_ids_afectados(instance, 'laboratorio_id'))
+
+
+def _nombre_cambio(instancia):
+    # Sin valor original (instancia no leída de la BD) se asume que cambió.
+    original = instancia.valor_original('nombre')
+    return original is None or original != instancia.nombre
+
+
+@receiver(post_save, sender=Especialidad)
+def reindexar_medicos_de_especialidad(sender, instance, created, **kwargs):
+    if not created and _nombre_cambio(instance):
+        reindexar(Medico.objects.filter(especialidad=instance))
+
+
+@receiver(post_save, sender=Laboratorio)
+def reindexar_medicamentos_de_laboratorio(sender, instance, created, **kwargs):
+    if not created and _nombre_cambio(instance):
+        reindexar(Medicamento.objects.filter(laboratorio=instance))
+
+
+def preparar_busqueda_tras_migrar(sender, using='default', **kwargs):
+    preparar_fts_sqlite(using)
+
+
+def preparar_agenda_tras_migrar(sender, using='default', **kwargs):
+    preparar_agenda_sqlite(using)
+
+
+# Métricas del tablero: modelo -> (clave de la métrica, campo que indica "activo").
+METRICAS_ACTIVOS = metricas.ACTIVOS_POR_MODELO
+
+
+@receiver(post_save, sender=Paciente)
+@receiver(post_save, sender=Medico)
+@receiver(post_save, sender=Especialidad)
+def metricas_activos_guardado(sender, instance, created, raw=False, **kwargs):
+    if not raw:
+        clave, campo = METRICAS_ACTIVOS[sender]
+        metricas.delta_activo(clave, instance, campo, creado=created)
+
+
+@receiver(post_delete, sender=Paciente)
+@receiver(post_delete, sender=Medico)
+@receiver(post_delete, sender=Especialidad)
+def metricas_activos_eliminado(sender, instance, **kwargs):
+    clave, campo = METRICAS_ACTIVOS[sender]
+    metricas.delta_activo(clave, instance, campo, eliminado=True)
+
+
+@receiver(post_save, sender=ConsultaMedica)
+def metricas_consulta_guardada(sender, instance, created, raw=False, **kwargs):
+    if not raw:
+        metricas.delta_consulta(instance, creado=created)
+
+
+@receiver(post_delete, sender=ConsultaMedica)
+def metricas_consulta_eliminada(sender, instance, **kwargs):
+    metricas.delta_consulta(instance, eliminado=True)
+
+
+@receiver(post_save, sender=ConsultaMedica)
+def ocupacion_consulta_guardada(sender, instance, raw=False, **kwargs):
+    if not raw:
+        disponibilidad.actualizar(disponibilidad.dias_afectados(instance))
+
+
+@receiver(post_delete, sender=ConsultaMedica)
+def ocupacion_consulta_eliminada(sender, instance, **kwargs):
+    disponibilidad.actualizar(disponibilidad.dias_afectados(instance, eliminada=True))
+
+
+@receiver(pre_save, sender=RecetaMedica)
+@receiver(pre_delete, sender=RecetaMedica)
+def stock_receta_anterior(sender, instance, raw=False, **kwargs):
+    # Dentro de la transacción de RecetaMedica.save() / delete(): bloquea la fila guardada.
+    if not raw:
+        instance._stock_anterior = stock.anterior(instance)
+
+
+@receiver(post_save, sender=RecetaMedica)
+def stock_receta_guardada(sender, instance, raw=False, **kwargs):
+    if not raw:
+        movimientos = stock.movimientos(
+            instance.pk, instance._stock_anterior, (instance.medicamento_id, instance.cantidad_total),
+        )
+        stock.aplicar(movimientos)
+        consumo.registrar(consumo.deltas(instance.fecha_emision, movimientos))
+
+
+@receiver(post_delete, sender=RecetaMedica)
+def stock_receta_eliminada(sender, instance, **kwargs):
+    movimientos = stock.movimientos(instance.pk, instance._stock_anterior, None)
+    stock.aplicar(movimientos)
+    consumo.registrar(consumo.deltas(instance.fecha_emision, movimientos))
+
+
+@receiver(post_save, sender=Medicamento)
+def stock_medicamento_guardado(sender, instance, created, raw=False, **kwargs):
+    if not raw:
+        stock.ajustar(instance, created)
+
+
+@receiver(post_delete, sender=Especialidad)
+@receiver(post_delete, sender=Paciente)
+@receiver(post_delete, sender=Medico)
+@receiver(post_delete, sender=ConsultaMedica)
+@receiver(post_delete, sender=Tratamiento)
+@receiver(post_delete, sender=Medicamento)
+@receiver(post_delete, sender=RecetaMedica)
+@receiver(post_delete, sender=Laboratorio)
+def registrar_eliminado(sender, instance, **kwargs):
+    registrar_eliminacion(instance)
+
+
+@receiver(post_save, sender=Especialidad)
+@receiver(post_delete, sender=Especialidad)
+@receiver(post_save, sender=Laboratorio)
+@receiver(post_delete, sender=Laboratorio)
+@receiver(post_save, sender=Medicamento)
+@receiver(post_delete, sender=Medicamento)
+@receiver(post_save, sender=Medico)
+@receiver(post_delete, sender=Medico)
+def invalidar_cache_referencia(sender, instance, **kwargs):
+    cache_referencia.invalidar(sender)
+
+
+# Los receptores nuevos van antes de este comentario: el siguiente debe ser el último
+# receptor de post_save registrado (ver docstring del módulo).
+@receiver(post_save)
+def refrescar_valores_cargados(sender, instance, **kwargs):
+    if isinstance(instance, SeguimientoCambiosMixin):
+        instance.actualizar_valores_cargados()
@@ -0,0 +1,208 @@
+"""
+Archivo: sincronizacion.py
+Ubicación: Aplicación 'gestion_clinica'
+
+DESCRIPCIÓN GENERAL:
+--------------------
+Sincronización incremental de la API (`?cambios_desde=<marca>` en todos los ViewSets,
+ver `SincronizacionMixin` en `mixins.py`).
+
+Sin una fecha de modificación, los sistemas externos tenían que descargar las tablas
+completas para mantenerse al día. Ahora cada modelo guarda `fecha_modificacion`
+(`auto_now`, con índice `(fecha_modificacion, id)`) y cada eliminación deja un
+`RegistroEliminado`. Una petición de sincronización devuelve solo:
+
+    {
+        "cambios": [...],        # filas creadas o modificadas después de la marca
+        "eliminados": [4, 17],   # ids eliminados después de la marca
+        "marca": "eyJj...",      # enviar en ?cambios_desde= la próxima vez
+        "hay_mas": false         # true: repetir de inmediato con la nueva marca
+    }
+
+Ambas listas se recorren por keyset en orden `(fecha, id)` (ver `paginacion.py`), en
+bloques de `?page_size=` filas, así que el costo depende solo de lo que cambió.
+
+MARCAS:
+-------
+- `?cambios_desde=0`: desde el principio (sincronización inicial completa).
+- `?cambios_desde=<fecha ISO 8601>`: cambios posteriores a esa fecha.
+- `?cambios_desde=<marca>`: la `marca` opaca de la respuesta anterior.
+
+Una transacción larga puede confirmar una fila con una `fecha_modificacion` anterior a
+la de filas ya entregadas. Para no perderla, solo se entregan los cambios con más de
+`API_SINCRONIZACION_MARGEN` segundos de antigüedad (5 por defecto); los más recientes
+llegan en la sincronización siguiente.
+
+LIMITACIONES:
+-------------
+- Las escrituras que no pasan por `save()` ni por la carga masiva (`QuerySet.update`,
+  SQL directo) deben actualizar `fecha_modificacion` explícitamente, o no se sincronizan.
+- Los filtros y la búsqueda de la API no se aplican en este modo.
+- Las marcas de eliminación se conservan `API_SINCRONIZACION_RETENCION_DIAS` días
+  (`purgar_eliminados()`); un cliente cuya última marca sea más antigua debe volver a
+  sincronizar desde el principio.
+"""
+
+import base64
+import binascii
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import RegistroEliminado
+from .paginacion import expresiones_orden, filtro_posterior, ordenamiento_keyset
+
+PARAM_CAMBIOS_DESDE = 'cambios_desde'
+DESDE_EL_PRINCIPIO = '0'
+
+ORDEN_CAMBIOS = ['fecha_modificacion']
+ORDEN_ELIMINADOS = ['fecha_eliminacion']
+
+
+class MarcaInvalida(ValueError):
+    """
+    La marca recibida no es `0`, una fecha ISO 8601 ni una marca emitida por la API.
+    """
+
+
+def etiqueta_modelo(modelo):
+    return modelo._meta.label_lower
+
+
+def margen():
+    return timedelta(seconds=getattr(settings, 'API_SINCRONIZACION_MARGEN', 5))
+
+
+# -----------------------------
+# Marcas
+# -----------------------------
+
+def _posicion_a_json(posicion):
+    return None if posicion is None else [posicion[0].isoformat(), posicion[1]]
+
+
+def _posicion_desde_json(valor):
+    if valor is None:
+        return None
+    fecha = parse_datetime(valor[0])
+    if fecha is None or not isinstance(valor[1], int):
+        raise ValueError
+    return fecha, valor[1]
+
+
+def codificar_marca(cambios, eliminados):
+    """
+    Marca opaca con la última posición `(fecha, id)` entregada de cada lista.
+    """
+    crudo = json.dumps(
+        {'c': _posicion_a_json(cambios), 'e': _posicion_a_json(eliminados)},
+        separators=(',', ':'),
+    ).encode('utf-8')
+    return base64.urlsafe_b64encode(crudo).decode('ascii').rstrip('=')
+
+
+def decodificar_marca(marca):
+    """
+    Devuelve `(posicion_cambios, posicion_eliminados)`; `None` significa "desde el principio".
+    """
+    marca = (marca or '').strip()
+    if marca == DESDE_EL_PRINCIPIO:
+        return None, None
+
+    fecha = parse_datetime(marca.replace(' ', '+'))
+    if fecha is not None:
+        if timezone.is_naive(fecha):
+            fecha = timezone.make_aware(fecha)
+        # id 0: incluye todas las filas con fecha posterior a la indicada.
+        return (fecha, 0), (fecha, 0)
+
+    try:
+        relleno = '=' * (-len(marca) % 4)
+        datos = json.loads(base64.urlsafe_b64decode(marca + relleno))
+        return _posicion_desde_json(datos['c']), _posicion_desde_json(datos['e'])
+    except (binascii.Error, ValueError, TypeError, KeyError, IndexError):
+        raise MarcaInvalida('Marca de sincronización inválida.')
+
+
+# -----------------------------
+# Consulta de cambios
+# -----------------------------
+
+class LoteCambios:
+    """
+    Resultado de `obtener_cambios()`.
+    """
+
+    def __init__(self, cambios, eliminados, marca, hay_mas):
+        self.cambios = cambios
+        self.eliminados = eliminados
+        self.marca = marca
+        self.hay_mas = hay_mas
+
+
+def _siguientes(queryset, ordering, posicion, hasta, tamano):
+    campos = ordenamiento_keyset(queryset.model, ordering)
+    if posicion is not None:
+        queryset = queryset.filter(filtro_posterior(campos, list(posicion)))
+    filas = list(
+        queryset.filter(**{f'{ordering[0]}__lt': hasta})
+        .order_by(*expresiones_orden(campos))[:tamano + 1]
+    )
+    return filas[:tamano], len(filas) > tamano
+
+
+def obtener_cambios(queryset, marca, tamano):
+    """
+    Hasta `tamano` filas de `queryset` modificadas y hasta `tamano` ids de su modelo
+    eliminados después de `marca`. Lanza `MarcaInvalida` si la marca no se puede leer.
+    """
+    pos_cambios, pos_eliminados = decodificar_marca(marca)
+    hasta = timezone.now() - margen()
+
+    cambios, mas_cambios = _siguientes(queryset, ORDEN_CAMBIOS, pos_cambios, hasta, tamano)
+    eliminados, mas_eliminados = _siguientes(
+        RegistroEliminado.objects.filter(modelo=etiqueta_modelo(queryset.model))
+        .only('objeto_id', 'fecha_eliminacion'),
+        ORDEN_ELIMINADOS, pos_eliminados, hasta, tamano,
+    )
+
+    if cambios:
+        pos_cambios = (cambios[-1].fecha_modificacion, cambios[-1].pk)
+    if eliminados:
+        pos_eliminados = (eliminados[-1].fecha_eliminacion, eliminados[-1].pk)
+    return LoteCambios(
+        cambios=cambios,
+        eliminados=[registro.objeto_id for registro in eliminados],
+        marca=codificar_marca(pos_cambios, pos_eliminados),
+        hay_mas=mas_cambios or mas_eliminados,
+    )
+
+
+def registrar_eliminacion(instancia):
+    RegistroEliminado.objects.create(modelo=etiqueta_modelo(type(instancia)), objeto_id=instancia.pk)
+
+
+def purgar_eliminados(antes_de, tamano=1000, al_borrar=None):
+    """
+    Borra las marcas de eliminación anteriores a `antes_de`, de a `tamano` filas (cada
+    lote en su propia transacción; `al_borrar(filas)` tras cada uno). Los clientes que no
+    sincronicen desde antes de esa fecha deben hacer una sincronización completa. Lo
+    ejecuta a diario la tarea `purgar_eliminados` (ver `barridos.py`). Devuelve la
+    cantidad de filas borradas.
+    """
+    antiguas = RegistroEliminado.objects.filter(fecha_eliminacion__lt=antes_de)
+    total = 0
+    while True:
+        ids = list(antiguas.order_by('pk').values_list('pk', flat=True)[:tamano])
+        if not ids:
+            break
+        borradas = RegistroEliminado.objects.filter(pk__in=ids).delete()[0]
+        total += borradas
+        if al_borrar:
+            al_borrar(borradas)
+        if len(ids) < tamano:
+            break
+    return total
@@ -0,0 +1,253 @@
+"""
+Archivo: stock.py
+Ubicación: Aplicación 'gestion_clinica'
+
+DESCRIPCIÓN GENERAL:
+--------------------
+Movimientos del stock de medicamentos al emitir, editar o eliminar recetas, y libro
+de movimientos (`MovimientoStock`, de solo inserción).
+
+Leer el stock, restarle la receta y guardar el resultado (`medicamento.save()`) pierde
+descuentos cuando dos recetas del mismo medicamento se emiten a la vez: ambas leen el
+mismo valor. En su lugar cada movimiento es un UPDATE condicional:
+
+    UPDATE medicamento SET stock_disponible = stock_disponible - n
+    WHERE id = ... AND stock_disponible >= n
+
+La base de datos lo evalúa sobre el valor vigente (PostgreSQL espera a la transacción
+que tenga la fila y vuelve a evaluar la condición), sin bloqueos en la aplicación ni
+lecturas previas; si no actualiza ninguna fila, no hay stock suficiente y se lanza
+`StockInsuficiente` (la receta no se guarda). El bloqueo de la fila dura solo hasta el
+final de la transacción de la receta, que es corta.
+
+MOVIMIENTOS:
+------------
+- Emitir una receta descuenta `cantidad_total` (`EMISION`).
+- Editarla devuelve la cantidad anterior y descuenta la nueva, o solo la diferencia si
+  el medicamento no cambió (`EDICION`). La receta anterior se lee con `SELECT ... FOR
+  UPDATE`, así que dos ediciones simultáneas de la misma receta no se pisan.
+- Eliminarla (también en cascada con su tratamiento) devuelve su cantidad (`ANULACION`).
+- Cambiar `stock_disponible` de un medicamento (formulario, API, admin) aplica la
+  diferencia con el valor leído como ajuste (`AJUSTE`); `Medicamento.save()` nunca
+  escribe la columna directamente.
+
+`signals.py` llama a estas funciones al guardar y eliminar; la carga masiva de recetas
+(`carga_masiva.py`) usa `reservar_lote()` / `registrar_lote()`, que rechazan solo los
+elementos sin stock. Escribir el stock con SQL directo o `QuerySet.update()` no deja
+movimientos: `descuadres()` compara el libro con el stock de cada medicamento.
+"""
+
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Sum, Value, When
+from django.db.models.functions import Now
+
+from . import cache_referencia
+from .models import Medicamento, MovimientoStock, RecetaMedica, StockInsuficiente
+
+
+def _mensaje(medicamento_id, requerido, disponible=None):
+    fila = Medicamento.objects.filter(pk=medicamento_id).values_list('nombre', 'stock_disponible').first()
+    nombre, actual = fila if fila else (f'N° {medicamento_id}', 0)
+    disponible = actual if disponible is None else disponible
+    return f'Stock insuficiente de {nombre}: se requieren {requerido} y hay {disponible} disponibles.'
+
+
+# -----------------------------
+# Movimientos de una receta
+# -----------------------------
+
+def anterior(receta):
+    """
+    `(medicamento_id, cantidad_total)` guardados de `receta`, bloqueando su fila hasta el
+    final de la transacción; `None` si es nueva.
+    """
+    if receta._state.adding or receta.pk is None:
+        return None
+    return (
+        RecetaMedica.objects.select_for_update().filter(pk=receta.pk)
+        .values_list('medicamento_id', 'cantidad_total').first()
+    )
+
+
+def movimientos(receta_id, antes, despues):
+    """
+    Movimientos (sin guardar) que llevan el stock de una receta de `antes` a `despues`,
+    ambos `(medicamento_id, cantidad_total)` o `None` (receta nueva / eliminada).
+    """
+    if antes is None and despues is None:
+        return []
+    if antes is None:
+        return [MovimientoStock(medicamento_id=despues[0], receta_id=receta_id,
+                                cantidad=-despues[1], motivo=MovimientoStock.EMISION)]
+    if despues is None:
+        return [MovimientoStock(medicamento_id=antes[0], receta_id=receta_id,
+                                cantidad=antes[1], motivo=MovimientoStock.ANULACION)]
+    if antes[0] == despues[0]:
+        diferencia = antes[1] - despues[1]
+        if not diferencia:
+            return []
+        return [MovimientoStock(medicamento_id=antes[0], receta_id=receta_id,
+                                cantidad=diferencia, motivo=MovimientoStock.EDICION)]
+    return [
+        MovimientoStock(medicamento_id=antes[0], receta_id=receta_id,
+                        cantidad=antes[1], motivo=MovimientoStock.EDICION),
+        MovimientoStock(medicamento_id=despues[0], receta_id=receta_id,
+                        cantidad=-despues[1], motivo=MovimientoStock.EDICION),
+    ]
+
+
+def _netos(pendientes):
+    netos = {}
+    for movimiento in pendientes:
+        netos[movimiento.medicamento_id] = netos.get(movimiento.medicamento_id, 0) + movimiento.cantidad
+    return netos
+
+
+def _registrar(pendientes, finales, netos):
+    # El stock resultante de cada movimiento se reconstruye desde el final, en orden.
+    actual = {pk: finales[pk] - neto for pk, neto in netos.items()}
+    for movimiento in pendientes:
+        actual[movimiento.medicamento_id] += movimiento.cantidad
+        movimiento.stock_resultante = actual[movimiento.medicamento_id]
+    MovimientoStock.objects.bulk_create(pendientes)
+    cache_referencia.invalidar(cache_referencia.STOCK)
+
+
+def aplicar(pendientes):
+    """
+    Aplica `pendientes` (movimientos sin guardar) con un UPDATE condicional por
+    medicamento y los agrega al libro. Lanza `StockInsuficiente` (sin aplicar ninguno)
+    si alguno dejaría el stock negativo. Devuelve `{medicamento_id: stock resultante}`.
+    """
+    if not pendientes:
+        return {}
+    netos = _netos(pendientes)
+    with transaction.atomic():
+        # Orden fijo: dos recetas con los mismos medicamentos no se bloquean mutuamente.
+        for medicamento_id in sorted(netos):
+            neto = netos[medicamento_id]
+            actualizadas = Medicamento.objects.filter(
+                pk=medicamento_id, stock_disponible__gte=-neto,
+            ).update(stock_disponible=F('stock_disponible') + neto, fecha_modificacion=Now())
+            if not actualizadas:
+                raise StockInsuficiente(_mensaje(medicamento_id, -neto))
+        finales = dict(
+            Medicamento.objects.filter(pk__in=netos).order_by().values_list('pk', 'stock_disponible')
+        )
+        _registrar(pendientes, finales, netos)
+    return finales
+
+
+def ajustar(medicamento, creado):
+    """
+    Registra el stock inicial de un medicamento nuevo, o aplica como ajuste la diferencia
+    entre su `stock_disponible` y el valor leído (ver `Medicamento.save()`).
+    """
+    if creado:
+        if medicamento.stock_disponible:
+            MovimientoStock.objects.create(
+                medicamento=medicamento, cantidad=medicamento.stock_disponible,
+                motivo=MovimientoStock.AJUSTE, stock_resultante=medicamento.stock_disponible,
+            )
+        return
+    leido = medicamento.valor_original('stock_disponible')
+    if leido is None or leido == medicamento.stock_disponible:
+        return
+    finales = aplicar([MovimientoStock(
+        medicamento_id=medicamento.pk, cantidad=medicamento.stock_disponible - leido,
+        motivo=MovimientoStock.AJUSTE,
+    )])
+    medicamento.stock_disponible = finales[medicamento.pk]
+
+
+# -----------------------------
+# Carga masiva
+# -----------------------------
+
+def reservar_lote(recetas):
+    """
+    Asigna el stock a un lote de recetas (`[(indice, receta), ...]` en orden, nuevas o
+    existentes con sus datos nuevos) dentro de la transacción de la carga: bloquea las
+    recetas existentes y los medicamentos involucrados (en orden de id) y recorre el lote
+    descontando elemento por elemento. Devuelve `({indice: errores}, reservas)`; los
+    elementos con error no alcanzan stock y no deben guardarse, y las reservas se
+    aplican con `registrar_lote()` una vez guardadas las recetas.
+    """
+    existentes = [receta.pk for _, receta in recetas if receta.pk is not None]
+    antes = {}
+    if existentes:
+        antes = {
+            pk: (medicamento_id, cantidad) for pk, medicamento_id, cantidad in
+            RecetaMedica.objects.select_for_update().filter(pk__in=existentes)
+            .values_list('pk', 'medicamento_id', 'cantidad_total')
+        }
+    planes = [
+        (indice, receta, movimientos(receta.pk, antes.get(receta.pk),
+                                     (receta.medicamento_id, receta.cantidad_total)))
+        for indice, receta in recetas
+    ]
+    ids = {movimiento.medicamento_id for _, _, pendientes in planes for movimiento in pendientes}
+    disponible = dict(
+        Medicamento.objects.select_for_update().filter(pk__in=ids).order_by('pk')
+        .values_list('pk', 'stock_disponible')
+    )
+
+    errores, reservas = {}, []
+    for indice, receta, pendientes in planes:
+        netos = _netos(pendientes)
+        faltante = next((pk for pk, neto in netos.items() if disponible[pk] + neto < 0), None)
+        if faltante is not None:
+            errores[indice] = {'cantidad_total': [
+                _mensaje(faltante, -netos[faltante], disponible=disponible[faltante])
+            ]}
+            continue
+        for pk, neto in netos.items():
+            disponible[pk] += neto
+        reservas.append((receta, pendientes))
+    return errores, reservas
+
+
+def registrar_lote(reservas):
+    """
+    Aplica las reservas de `reservar_lote()` (con las recetas ya guardadas) en un UPDATE
+    sobre los medicamentos bloqueados y agrega sus movimientos al libro.
+    """
+    pendientes = []
+    for receta, movimientos_receta in reservas:
+        for movimiento in movimientos_receta:
+            movimiento.receta_id = receta.pk
+            pendientes.append(movimiento)
+    if not pendientes:
+        return
+    netos = _netos(pendientes)
+    Medicamento.objects.filter(pk__in=netos).update(
+        stock_disponible=Case(
+            *[When(pk=pk, then=F('stock_disponible') + Value(neto)) for pk, neto in netos.items()],
+            output_field=IntegerField(),
+        ),
+        fecha_modificacion=Now(),
+    )
+    finales = dict(
+        Medicamento.objects.filter(pk__in=netos).order_by().values_list('pk', 'stock_disponible')
+    )
+    _registrar(pendientes, finales, netos)
+
+
+# -----------------------------
+# Verificación
+# -----------------------------
+
+def descuadres():
+    """
+    `{medicamento_id: (stock_disponible, suma del libro)}` de los medicamentos cuyo stock
+    no coincide con la suma de sus movimientos.
+    """
+    libro = dict(
+        MovimientoStock.objects.order_by().values('medicamento_id')
+        .annotate(total=Sum('cantidad')).values_list('medicamento_id', 'total')
+    )
+    return {
+        pk: (stock, libro.get(pk, 0))
+        for pk, stock in Medicamento.objects.order_by().values_list('pk', 'stock_disponible')
+        if stock != libro.get(pk, 0)
+    }
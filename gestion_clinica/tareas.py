@@ -0,0 +1,257 @@
+"""
+Archivo: tareas.py
+Ubicación: Aplicación 'gestion_clinica'
+
+DESCRIPCIÓN GENERAL:
+--------------------
+Tareas programadas: registro de tareas periódicas, su ejecución con seguimiento en
+`EjecucionTarea` y la actualización por lotes que usan los barridos (ver `barridos.py`).
+
+Una tarea es una función registrada con `@tarea(nombre, cada=timedelta(...))` que recibe
+un `Avance` y la hora de referencia (`ahora`). Se ejecuta con
+`python manage.py ejecutar_tareas`: una vez (las pendientes o las indicadas) desde cron,
+o en un proceso propio con `--continuo`, que revisa cada `--intervalo` segundos qué
+tareas vencieron (la última ejecución completada tiene más de `cada`).
+
+Las vistas no ejecutan trabajo pesado dentro de la petición: `solicitar(nombre,
+**parametros)` deja una ejecución PENDIENTE que toma el siguiente `ejecutar_tareas`
+(que la pasa a la tarea como argumentos). Las tareas con `cada=None` solo se ejecutan
+cuando se solicitan o se nombran.
+
+EJECUCIONES:
+------------
+Cada ejecución crea una fila `EjecucionTarea` EN_CURSO que se actualiza tras cada lote
+(lotes, filas, `actualizado`) y termina COMPLETADA o FALLIDA (con el error). Una
+restricción única parcial impide dos ejecuciones EN_CURSO de la misma tarea, aunque se
+lancen desde procesos distintos (`TareaEnCurso`); una ejecución sin avance durante
+`TAREAS_ABANDONO_MINUTOS` (proceso terminado a la fuerza) se marca FALLIDA y deja de
+bloquear.
+
+ACTUALIZACIÓN POR LOTES:
+------------------------
+Un `UPDATE` de todas las filas vencidas de una tabla con mucho tráfico bloquearía esas
+filas (y a quien quiera editarlas) hasta terminar. `actualizar_por_lotes()` en cambio
+recorre las filas por índice (keyset), de a `TAREAS_TAMANO_LOTE`, y cada lote es una
+transacción corta:
+
+1) `SELECT ... FOR UPDATE SKIP LOCKED` de las filas del lote: las que otra transacción
+   está editando se saltan y quedan para la próxima ejecución, sin esperar.
+2) Un `UPDATE ... WHERE id IN (...)` con las mismas condiciones.
+3) Los datos derivados del lote (métricas, mapas de ocupación) con los valores leídos.
+
+Entre lotes se pausa `TAREAS_PAUSA_LOTES` segundos para no acaparar la base de datos.
+"""
+
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Max, Q
+from django.db.models.functions import Now
+from django.utils import timezone
+
+from .models import EjecucionTarea
+
+logger = logging.getLogger(__name__)
+
+REGISTRO = {}
+
+
+class TareaEnCurso(Exception):
+    """
+    La tarea ya tiene una ejecución EN_CURSO (en este u otro proceso).
+    """
+
+
+class Tarea:
+    def __init__(self, nombre, funcion, cada):
+        self.nombre = nombre
+        self.funcion = funcion
+        self.cada = cada
+        self.descripcion = ' '.join((funcion.__doc__ or '').strip().split('\n\n')[0].split())
+
+
+def tarea(nombre, cada=timedelta(days=1)):
+    """
+    Registra la función decorada como la tarea `nombre`, que vence cada `cada` (`None`:
+    solo a pedido).
+    """
+    def registrar(funcion):
+        REGISTRO[nombre] = Tarea(nombre, funcion, cada)
+        return funcion
+    return registrar
+
+
+def tareas_registradas():
+    # Las tareas se registran al importar sus módulos.
+    from . import analitica, barridos  # noqa: F401
+
+    return REGISTRO
+
+
+class Avance:
+    """
+    Avance de una ejecución: lo recibe cada tarea y `actualizar_por_lotes()` lo informa
+    tras cada lote (en `EjecucionTarea` y, si se indica, a `informar(avance)`).
+    """
+
+    def __init__(self, ejecucion, tamano=None, pausa=None, informar=None):
+        self.ejecucion = ejecucion
+        self.tamano = tamano or getattr(settings, 'TAREAS_TAMANO_LOTE', 500)
+        self.pausa = getattr(settings, 'TAREAS_PAUSA_LOTES', 0.05) if pausa is None else pausa
+        self.informar = informar
+        self.lotes = 0
+        self.filas = 0
+        self.inicio = time.monotonic()
+
+    @property
+    def filas_por_segundo(self):
+        segundos = time.monotonic() - self.inicio
+        return self.filas / segundos if segundos else 0.0
+
+    def lote(self, filas):
+        self.lotes += 1
+        self.filas += filas
+        EjecucionTarea.objects.filter(pk=self.ejecucion.pk).update(
+            lotes=self.lotes, filas=self.filas, actualizado=Now(),
+        )
+        if self.informar:
+            self.informar(self)
+
+
+# -----------------------------
+# Actualización por lotes
+# -----------------------------
+
+def actualizar_por_lotes(queryset, cambios, avance, orden='pk', campos=(), al_actualizar=None):
+    """
+    Aplica `queryset.update(**cambios)` de a `avance.tamano` filas, cada lote en su propia
+    transacción (ver el docstring del módulo). Recorre `queryset` por (`orden`, pk);
+    `al_actualizar(filas)` recibe en la misma transacción los `campos` (y pk) leídos de
+    las filas del lote. Devuelve la cantidad de filas actualizadas.
+    """
+    columnas = list(dict.fromkeys(['pk', orden, *campos]))
+    cursor = None
+    total = 0
+    while True:
+        with transaction.atomic():
+            pendientes = queryset
+            if cursor is not None:
+                pendientes = pendientes.filter(
+                    Q(**{f'{orden}__gt': cursor[0]}) | Q(**{orden: cursor[0], 'pk__gt': cursor[1]})
+                )
+            filas = list(
+                pendientes.select_for_update(skip_locked=True)
+                .order_by(orden, 'pk').values(*columnas)[:avance.tamano]
+            )
+            if not filas:
+                break
+            actualizadas = queryset.filter(pk__in=[fila['pk'] for fila in filas]).update(**cambios)
+            if al_actualizar:
+                al_actualizar(filas)
+        total += actualizadas
+        avance.lote(actualizadas)
+        if len(filas) < avance.tamano:
+            break
+        cursor = (filas[-1][orden], filas[-1]['pk'])
+        if avance.pausa:
+            time.sleep(avance.pausa)
+    return total
+
+
+# -----------------------------
+# Ejecución
+# -----------------------------
+
+def _liberar_abandonadas(nombre):
+    limite = timezone.now() - timedelta(minutes=getattr(settings, 'TAREAS_ABANDONO_MINUTOS', 30))
+    EjecucionTarea.objects.filter(
+        nombre=nombre, estado=EjecucionTarea.EN_CURSO, actualizado__lt=limite,
+    ).update(estado=EjecucionTarea.FALLIDA, fin=Now(), error='Abandonada (sin avance).')
+
+
+def solicitar(nombre, **parametros):
+    """
+    Deja pendiente una ejecución de `nombre` con `parametros` (valores JSON) y la
+    devuelve; si ya hay una pendiente con los mismos parámetros, devuelve esa. Lanza
+    `KeyError` si la tarea no existe.
+    """
+    tareas_registradas()[nombre]
+    pendiente = EjecucionTarea.objects.filter(nombre=nombre, estado=EjecucionTarea.PENDIENTE)
+    for solicitud in pendiente.order_by('pk'):
+        if solicitud.parametros == parametros:
+            return solicitud
+    return EjecucionTarea.objects.create(nombre=nombre, estado=EjecucionTarea.PENDIENTE, parametros=parametros)
+
+
+def _iniciar(nombre):
+    # Toma la solicitud pendiente más antigua o, si no hay, crea la ejecución.
+    with transaction.atomic():
+        solicitud = (
+            EjecucionTarea.objects.filter(nombre=nombre, estado=EjecucionTarea.PENDIENTE)
+            .order_by('pk').values_list('pk', flat=True).first()
+        )
+        if solicitud is not None and EjecucionTarea.objects.filter(
+            pk=solicitud, estado=EjecucionTarea.PENDIENTE,
+        ).update(estado=EjecucionTarea.EN_CURSO, inicio=Now(), actualizado=Now()):
+            return EjecucionTarea.objects.get(pk=solicitud)
+        return EjecucionTarea.objects.create(nombre=nombre)
+
+
+def ejecutar(nombre, ahora=None, tamano=None, pausa=None, informar=None):
+    """
+    Ejecuta la tarea `nombre` (con los parámetros de su solicitud pendiente más antigua,
+    si la hay) y devuelve su `EjecucionTarea`. Lanza `KeyError` si no existe,
+    `TareaEnCurso` si ya se está ejecutando y la excepción de la tarea si falla (la
+    ejecución queda FALLIDA).
+    """
+    registrada = tareas_registradas()[nombre]
+    _liberar_abandonadas(nombre)
+    try:
+        ejecucion = _iniciar(nombre)
+    except IntegrityError as exc:
+        raise TareaEnCurso(f'La tarea {nombre} ya se está ejecutando.') from exc
+
+    avance = Avance(ejecucion, tamano=tamano, pausa=pausa, informar=informar)
+    try:
+        registrada.funcion(avance, ahora=ahora or timezone.now(), **ejecucion.parametros)
+    except Exception as exc:
+        logger.exception('Falló la tarea %s', nombre)
+        ejecucion.estado, ejecucion.error = EjecucionTarea.FALLIDA, repr(exc)
+        raise
+    else:
+        ejecucion.estado = EjecucionTarea.COMPLETADA
+    finally:
+        ejecucion.lotes, ejecucion.filas, ejecucion.fin = avance.lotes, avance.filas, timezone.now()
+        ejecucion.save(update_fields=['estado', 'error', 'lotes', 'filas', 'fin', 'actualizado'])
+    return ejecucion
+
+
+def ultimas_completadas():
+    """
+    `{nombre: inicio}` de la última ejecución completada de cada tarea.
+    """
+    return dict(
+        EjecucionTarea.objects.filter(estado=EjecucionTarea.COMPLETADA).order_by()
+        .values('nombre').annotate(ultima=Max('inicio')).values_list('nombre', 'ultima')
+    )
+
+
+def pendientes(ahora=None):
+    """
+    Nombres de las tareas vencidas (sin ejecuciones completadas o con la última hace más
+    de `cada`) o con solicitudes pendientes.
+    """
+    ahora = ahora or timezone.now()
+    ultimas = ultimas_completadas()
+    solicitadas = set(
+        EjecucionTarea.objects.filter(estado=EjecucionTarea.PENDIENTE).values_list('nombre', flat=True)
+    )
+    return [
+        nombre for nombre, registrada in tareas_registradas().items()
+        if nombre in solicitadas or registrada.cada is not None and (
+            nombre not in ultimas or ultimas[nombre] <= ahora - registrada.cada
+        )
+    ]
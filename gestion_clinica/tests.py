@@ -1,3 +1,2253 @@
-from django.test import TestCase
+import csv
+import os
+import shutil
+import tempfile
+from datetime import date, datetime, time, timedelta
+from importlib import import_module
+from itertools import count
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import analitica, cache_referencia
+from .analitica import CSV, PARQUET, ExportacionNoDisponible, exportar
+from .cache_referencia import GRUPOS
+from .models import (
+    Especialidad, Paciente, Medico, ConsultaMedica,
+    Tratamiento, Medicamento, RecetaMedica, Laboratorio,
+    ConflictoAgenda, HorarioAtencion, OcupacionAgenda, MovimientoStock, StockInsuficiente, ConsumoDiario,
+    EjecucionTarea, MetricaTablero, RegistroEliminado,
+)
+from .paginacion import obtener_pagina, paginar_keyset, CursorInvalido
+from .tareas import ejecutar
+
+try:
+    import pyarrow.parquet
+except ImportError:  # pragma: no cover - depende del entorno
+    pyarrow = None
+
+# -----------------------------
+# Datos de prueba
+# -----------------------------
+
+def crear_especialidad(nombre='Cardiología'):
+    return Especialidad.objects.create(nombre=nombre)
+
+
+def crear_paciente(n, **extra):
+    datos = dict(
+        rut=f'{10000000 + n}-K', nombre=f'Nombre{n}', apellido_paterno='Pérez',
+        apellido_materno='Soto', fecha_nacimiento=date(1990, 1, 1),
+        telefono='912345678', direccion='Calle 1',
+    )
+    datos.update(extra)
+    return Paciente.objects.create(**datos)
+
+
+def crear_medico(n, especialidad, **extra):
+    datos = dict(
+        rut=f'{20000000 + n}-1', nombre=f'Medico{n}', apellido_paterno='González',
+        apellido_materno='Rojas', especialidad=especialidad, telefono='912345678',
+        email=f'medico{n}@clinica.cl', numero_registro=f'REG-{n}',
+        # Sin restricción de horario; las pruebas de la agenda eligen la jornada.
+        fecha_ingreso=date(2020, 1, 1), jornada='TURNO',
+    )
+    datos.update(extra)
+    return Medico.objects.create(**datos)
+
+
+# Horas distintas para que las consultas por defecto no se superpongan en la agenda.
+_HORAS_CONSULTA = count()
+
+
+def crear_consulta(paciente, medico, fecha_hora=None, **extra):
+    datos = dict(
+        paciente=paciente, medico=medico,
+        fecha_hora=fecha_hora or timezone.make_aware(
+            datetime(2025, 1, 1, 10, 0) + timedelta(hours=next(_HORAS_CONSULTA))
+        ),
+        motivo_consulta='Control',
+    )
+    datos.update(extra)
+    return ConsultaMedica.objects.create(**datos)
+
+
+def crear_laboratorio(nombre='Lab Chile'):
+    return Laboratorio.objects.create(nombre=nombre, pais='Chile')
+
+
+def crear_medicamento(n, laboratorio, **extra):
+    datos = dict(
+        nombre=f'Medicamento{n}', principio_activo='Paracetamol',
+        presentacion='Comprimido', concentracion='500mg',
+        laboratorio=laboratorio, stock_disponible=1000,
+    )
+    datos.update(extra)
+    return Medicamento.objects.create(**datos)
+
+
+def crear_tratamiento(consulta, **extra):
+    datos = dict(
+        consulta=consulta, descripcion='Reposo', fecha_inicio=date(2025, 1, 1),
+        indicaciones='Cada 8 horas',
+    )
+    datos.update(extra)
+    return Tratamiento.objects.create(**datos)
+
+
+def crear_receta(tratamiento, medicamento, **extra):
+    datos = dict(
+        tratamiento=tratamiento, medicamento=medicamento, dosis='1 comprimido',
+        frecuencia='Cada 8 horas', duracion='7 días', cantidad_total=21,
+    )
+    datos.update(extra)
+    return RecetaMedica.objects.create(**datos)
+
+
+# -----------------------------
+# Paginación keyset
+# -----------------------------
+
+class PaginacionKeysetTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        # Apellidos repetidos para forzar el desempate por id.
+        cls.pacientes = [crear_paciente(i, nombre='Ana') for i in range(7)]
+        cls.pacientes += [crear_paciente(10 + i, apellido_paterno='Acuña') for i in range(3)]
+
+    def test_recorre_todas_las_filas_sin_repetir(self):
+        esperado = list(Paciente.objects.order_by(
+            'apellido_paterno', 'apellido_materno', 'nombre', 'id'
+        ).values_list('id', flat=True))
+
+        vistos, cursor = [], None
+        while True:
+            pagina = obtener_pagina(Paciente.objects.all(), despues=cursor, tamano=3)
+            vistos += [p.id for p in pagina]
+            if not pagina.has_next:
+                break
+            cursor = pagina.cursor_siguiente
+        self.assertEqual(vistos, esperado)
+
+    def test_retroceder_devuelve_la_pagina_anterior(self):
+        primera = obtener_pagina(Paciente.objects.all(), tamano=4)
+        segunda = obtener_pagina(Paciente.objects.all(), despues=primera.cursor_siguiente, tamano=4)
+        anterior = obtener_pagina(Paciente.objects.all(), antes=segunda.cursor_anterior, tamano=4)
+
+        self.assertTrue(segunda.has_previous)
+        self.assertFalse(anterior.has_previous)
+        self.assertEqual([p.id for p in anterior], [p.id for p in primera])
+
+    def test_orden_descendente_con_fechas(self):
+        esp = crear_especialidad()
+        medico = crear_medico(1, esp)
+        base = timezone.make_aware(datetime(2025, 3, 1, 9, 0, 0, 123456))
+        for i in range(5):
+            crear_consulta(self.pacientes[0], medico, fecha_hora=base + timedelta(hours=i % 2),
+                           estado='REALIZADA')
+
+        primera = obtener_pagina(ConsultaMedica.objects.all(), tamano=2)
+        resto = obtener_pagina(ConsultaMedica.objects.all(), despues=primera.cursor_siguiente, tamano=10)
+        ids = [c.id for c in primera] + [c.id for c in resto]
+        self.assertEqual(ids, list(ConsultaMedica.objects.order_by('-fecha_hora', '-id')
+                                   .values_list('id', flat=True)))
+
+    def test_cursor_invalido(self):
+        with self.assertRaises(CursorInvalido):
+            obtener_pagina(Paciente.objects.all(), despues='no-es-un-cursor')
+
+    def test_enlaces_conservan_filtros(self):
+        request = RequestFactory().get('/pacientes/', {'prevision': 'FONASA'})
+        pagina = paginar_keyset(request, Paciente.objects.all(), tamano=3)
+        self.assertIn('prevision=FONASA', pagina.url_siguiente)
+        self.assertIn('despues=', pagina.url_siguiente)
+
+    def test_vistas_html_paginadas(self):
+        respuesta = self.client.get(reverse('paciente_lista'))
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertIn('page_obj', respuesta.context)
+
+        respuesta = self.client.get(reverse('medico_lista'), {'despues': 'x'})
+        self.assertEqual(respuesta.status_code, 404)
+
+
+# -----------------------------
+# Conteo de consultas SQL en listados
+# -----------------------------
+
+class ConteoConsultasMixin:
+    """
+    Verifica que una página ejecute un número fijo de consultas SQL,
+    sin importar cuántas filas muestre (detecta problemas N+1).
+    """
+
+    def contar_consultas(self, url, **params):
+        with CaptureQueriesContext(connection) as capturadas:
+            respuesta = self.client.get(url, params)
+        self.assertEqual(respuesta.status_code, 200)
+        return len(capturadas)
+
+    def assertConsultasConstantes(self, url, crear_fila, esperadas, filas=5, **params):
+        crear_fila()
+        con_una = self.contar_consultas(url, **params)
+        for _ in range(filas):
+            crear_fila()
+        con_varias = self.contar_consultas(url, **params)
+        self.assertEqual(con_una, con_varias,
+                         f'{url}: {con_una} consultas con 1 fila y {con_varias} con {filas + 1}')
+        self.assertEqual(con_varias, esperadas)
+
+
+class FabricaFilasMixin:
+    """
+    Crea filas completas (con todas sus relaciones) para las pruebas de conteo.
+    """
+
+    def setUp(self):
+        self.contador = 0
+
+    def _siguiente(self):
+        self.contador += 1
+        return self.contador
+
+    def _nueva_consulta(self):
+        n = self._siguiente()
+        esp = crear_especialidad(f'Especialidad {n}')
+        return crear_consulta(crear_paciente(n), crear_medico(n, esp))
+
+    def _nuevo_medicamento(self):
+        n = self._siguiente()
+        return crear_medicamento(n, crear_laboratorio(f'Lab {n}'))
+
+
+class ListadosSinNMasUnoTests(ConteoConsultasMixin, FabricaFilasMixin, TestCase):
+
+    def test_pacientes(self):
+        # PacienteFilter no consulta la BD al construirse (autocompletado bajo demanda).
+        self.assertConsultasConstantes(
+            reverse('paciente_lista'), lambda: crear_paciente(self._siguiente()), esperadas=1,
+        )
+
+    def test_medicos(self):
+        self.assertConsultasConstantes(
+            reverse('medico_lista'),
+            lambda: crear_medico(self._siguiente(), crear_especialidad(f'Esp {self.contador}')),
+            esperadas=1,
+        )
+
+    def test_consultas(self):
+        self.assertConsultasConstantes(reverse('consulta_lista'), self._nueva_consulta, esperadas=1)
+
+    def test_tratamientos(self):
+        self.assertConsultasConstantes(
+            reverse('tratamiento_lista'),
+            lambda: crear_tratamiento(self._nueva_consulta()),
+            esperadas=1,
+        )
+
+    def test_medicamentos(self):
+        self.assertConsultasConstantes(reverse('medicamento_lista'), self._nuevo_medicamento, esperadas=1)
+
+    def test_recetas(self):
+        self.assertConsultasConstantes(
+            reverse('receta_lista'),
+            lambda: crear_receta(crear_tratamiento(self._nueva_consulta()), self._nuevo_medicamento()),
+            esperadas=1,
+        )
+
+
+# COUNT exacto: el conteo estimado agrega un EXPLAIN (ver PaginacionApiTests).
+@override_settings(API_CONTEO='exacto')
+class ApiSinNMasUnoTests(ConteoConsultasMixin, FabricaFilasMixin, TestCase):
+    """
+    Cada endpoint de listado de la API debe costar COUNT + SELECT de la página,
+    sin consultas adicionales por fila.
+    """
+
+    def test_api_pacientes(self):
+        self.assertConsultasConstantes(
+            reverse('paciente-api-list'), lambda: crear_paciente(self._siguiente()), esperadas=2,
+        )
+
+    def test_api_medicos(self):
+        self.assertConsultasConstantes(
+            reverse('medico-api-list'),
+            lambda: crear_medico(self._siguiente(), crear_especialidad(f'Esp {self.contador}')),
+            esperadas=2,
+        )
+
+    def test_api_consultas(self):
+        self.assertConsultasConstantes(reverse('consulta-api-list'), self._nueva_consulta, esperadas=2)
+
+    def test_api_tratamientos(self):
+        self.assertConsultasConstantes(
+            reverse('tratamiento-api-list'),
+            lambda: crear_tratamiento(self._nueva_consulta()),
+            esperadas=2,
+        )
+
+    def test_api_medicamentos(self):
+        self.assertConsultasConstantes(reverse('medicamento-api-list'), self._nuevo_medicamento, esperadas=2)
+
+    def test_api_recetas(self):
+        self.assertConsultasConstantes(
+            reverse('receta-api-list'),
+            lambda: crear_receta(crear_tratamiento(self._nueva_consulta()), self._nuevo_medicamento()),
+            esperadas=2,
+        )
+
+
+# COUNT exacto: el conteo estimado agrega un EXPLAIN (ver PaginacionApiTests).
+@override_settings(API_CONTEO='exacto')
+class ContadoresReferenciaTests(ConteoConsultasMixin, FabricaFilasMixin, TestCase):
+
+    def test_api_especialidades_una_consulta_agrupada(self):
+        # COUNT + SELECT anotado.
+        self.assertConsultasConstantes(
+            reverse('especialidad-api-list'),
+            lambda: crear_medico(self._siguiente(), crear_especialidad(f'Esp {self.contador}')),
+            esperadas=2,
+        )
+
+    def test_api_laboratorios_una_consulta_agrupada(self):
+        self.assertConsultasConstantes(reverse('laboratorio-api-list'), self._nuevo_medicamento, esperadas=2)
+
+    def test_contador_almacenado_sigue_las_escrituras(self):
+        cardio, neuro = crear_especialidad('Cardio'), crear_especialidad('Neuro')
+        medico = crear_medico(1, cardio)
+        crear_medico(2, cardio, activo=False)
+        cardio.refresh_from_db()
+        self.assertEqual(cardio.total_medicos_activos, 1)
+
+        medico = Medico.objects.get(pk=medico.pk)
+        medico.especialidad = neuro
+        medico.save()
+        cardio.refresh_from_db()
+        neuro.refresh_from_db()
+        self.assertEqual((cardio.total_medicos_activos, neuro.total_medicos_activos), (0, 1))
+
+        medico.delete()
+        neuro.refresh_from_db()
+        self.assertEqual(neuro.total_medicos_activos, 0)
+
+    def test_modo_almacenado_y_respuestas_de_escritura(self):
+        lab = crear_laboratorio()
+        crear_medicamento(1, lab)
+        crear_medicamento(2, lab, activo=False)
+
+        url = reverse('laboratorio-api-detail', args=[lab.pk])
+        self.assertEqual(self.client.get(url).json()['cantidad_medicamentos'], 1)
+        with override_settings(CONTADORES_REFERENCIA_ALMACENADOS=True):
+            self.assertEqual(self.client.get(url).json()['cantidad_medicamentos'], 1)
+            self.assertNotIn('total_medicamentos_activos', self.client.get(url).json())
+
+        respuesta = self.client.patch(url, {'pais': 'Perú'}, content_type='application/json')
+        self.assertEqual(respuesta.json()['cantidad_medicamentos'], 1)
+
+
+# -----------------------------
+# Plan de índices (EXPLAIN)
+# -----------------------------
+
+@skipUnless(connection.vendor == 'postgresql', 'EXPLAIN específico de PostgreSQL')
+class PlanIndicesTests(TestCase):
+    """
+    Siembra un volumen grande de datos y verifica con EXPLAIN que las consultas de
+    filtros y ordenamientos habituales usen el índice creado para ellas (y no solo
+    cualquier índice aplicable, como el de la llave foránea).
+    """
+
+    CONSULTAS = 20000
+
+    @classmethod
+    def setUpTestData(cls):
+        esp = crear_especialidad()
+        lab = crear_laboratorio()
+        cls.medicos = Medico.objects.bulk_create(
+            Medico(rut=f'{20000000 + i}-1', nombre=f'M{i}', apellido_paterno=f'Ap{i % 97}',
+                   apellido_materno='X', especialidad=esp, telefono='9', email='m@c.cl',
+                   numero_registro=f'R{i}', fecha_ingreso=date(2020, 1, 1), activo=i % 5 != 0)
+            for i in range(2000)
+        )
+        cls.pacientes = Paciente.objects.bulk_create(
+            Paciente(rut=f'{10000000 + i}-K', nombre=f'P{i}', apellido_paterno=f'Ap{i % 331}',
+                     apellido_materno='Y', fecha_nacimiento=date(1980, 1, 1), telefono='9',
+                     direccion='Calle', activo=i % 7 != 0)
+            for i in range(2000)
+        )
+        inicio = timezone.make_aware(datetime(2023, 1, 1, 8, 0))
+        estados = [codigo for codigo, _ in ConsultaMedica.ESTADO_CHOICES]
+        consultas = ConsultaMedica.objects.bulk_create(
+            ConsultaMedica(paciente=cls.pacientes[i % 2000], medico=cls.medicos[i % 200],
+                           fecha_hora=inicio + timedelta(minutes=37 * i), motivo_consulta='Control',
+                           estado=estados[i % 4],
+                           fecha_fin=inicio + timedelta(minutes=37 * i + 30))
+            for i in range(cls.CONSULTAS)
+        )
+        tratamientos = Tratamiento.objects.bulk_create(
+            Tratamiento(consulta=c, descripcion='D', indicaciones='I',
+                        fecha_inicio=date(2023, 1, 1) + timedelta(days=i % 700), activo=i % 10 == 0)
+            for i, c in enumerate(consultas[::2])
+        )
+        medicamentos = Medicamento.objects.bulk_create(
+            Medicamento(nombre=f'Med{i}', principio_activo='X', presentacion='C', concentracion='1',
+                        laboratorio=lab, activo=i % 3 != 0)
+            for i in range(300)
+        )
+        RecetaMedica.objects.bulk_create(
+            RecetaMedica(tratamiento=t, medicamento=medicamentos[i % 300], dosis='1', frecuencia='1',
+                         duracion='1', cantidad_total=1)
+            for i, t in enumerate(tratamientos)
+        )
+        # fecha_emision es auto_now_add: se reparte en el tiempo para que el rango sea selectivo.
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "UPDATE gestion_clinica_recetamedica SET fecha_emision = DATE '2023-01-01' + (id % 700)::int"
+            )
+            cursor.execute('ANALYZE')
+
+    def assertUsaIndice(self, queryset, indice):
+        plan = queryset.explain()
+        self.assertIn(indice, plan, plan)
+
+    def test_consultas_por_medico_y_fecha(self):
+        medico = self.medicos[3]
+        self.assertUsaIndice(ConsultaMedica.objects.filter(
+            medico=medico, fecha_hora__gte=timezone.make_aware(datetime(2023, 6, 1))),
+            'consulta_medico_fecha_idx')
+
+    def test_consultas_por_paciente(self):
+        self.assertUsaIndice(ConsultaMedica.objects.filter(paciente=self.pacientes[10]).order_by('-fecha_hora'),
+                             'consulta_paciente_fecha_idx')
+
+    def test_consultas_por_estado_y_rango(self):
+        self.assertUsaIndice(ConsultaMedica.objects.filter(
+            estado='AGENDADA',
+            fecha_hora__gte=timezone.make_aware(datetime(2023, 3, 1)),
+            fecha_hora__lte=timezone.make_aware(datetime(2023, 3, 31)),
+        ), 'consulta_estado_fecha_idx')
+
+    def test_consultas_listado_ordenado(self):
+        self.assertUsaIndice(ConsultaMedica.objects.order_by('-fecha_hora', '-id')[:25], 'consulta_fecha_id_idx')
+
+    def test_recetas_por_rango_de_emision(self):
+        self.assertUsaIndice(RecetaMedica.objects.filter(
+            fecha_emision__gte=date(2023, 2, 1), fecha_emision__lte=date(2023, 2, 28)), 'receta_fecha_id_idx')
+
+    def test_tratamientos_activos(self):
+        self.assertUsaIndice(Tratamiento.objects.filter(activo=True, fecha_inicio=date(2023, 5, 1)),
+                             'tratamiento_activo_idx')
+        self.assertUsaIndice(Tratamiento.objects.filter(activo=True).order_by('-fecha_inicio', '-id')[:25],
+                             'tratamiento_activo_idx')
+
+    def test_pacientes_y_medicos_por_orden(self):
+        for modelo, prefijo in ((Paciente, 'paciente'), (Medico, 'medico')):
+            orden = ['apellido_paterno', 'apellido_materno', 'nombre', 'id']
+            self.assertUsaIndice(modelo.objects.order_by(*orden)[:25], f'{prefijo}_orden_idx')
+            self.assertUsaIndice(modelo.objects.filter(activo=True).order_by(*orden)[:25],
+                                 f'{prefijo}_activo_orden_idx')
+
+    def test_medicamentos_activos(self):
+        self.assertUsaIndice(Medicamento.objects.filter(activo=True).order_by('nombre', 'id')[:25],
+                             'medicamento_activo_idx')
+
+    def test_autocompletar_por_prefijo(self):
+        self.assertUsaIndice(Paciente.objects.filter(rut__istartswith='1000123'), 'paciente_rut_prefijo_idx')
+        self.assertUsaIndice(Paciente.objects.filter(apellido_paterno__istartswith='ap1'),
+                             'paciente_apellido_prefijo_idx')
+
+    def test_busqueda_texto_completo(self):
+        from .busqueda import buscar_texto
+
+        for modelo in (Paciente, Medico, Medicamento):
+            self.assertUsaIndice(buscar_texto(modelo.objects.all(), 'ap12 p1')[:10],
+                                 f'{modelo._meta.db_table}_')
+
+    def test_buscador_de_personas(self):
+        from .autocompletar import BUSQUEDAS
+
+        for clave, prefijo, rut in (('pacientes', 'paciente', '1000123'), ('medicos', 'medico', '2000123')):
+            busqueda = BUSQUEDAS[clave]
+            for q in ('ap1', rut):
+                self.assertUsaIndice(busqueda.base().filter(busqueda.filtro(q))[:20], f'{prefijo}_busqueda_idx')
+
+# -----------------------------
+# Autocompletado de filtros
+# -----------------------------
+
+class AutocompletarTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        crear_paciente(1, apellido_paterno='Muñoz')
+        crear_paciente(2, apellido_paterno='Muñoz')
+        crear_paciente(3, apellido_paterno='Morales')
+        crear_paciente(4, apellido_paterno='Álvarez')
+
+    def test_sugerencias_distintas_por_prefijo(self):
+        url = reverse('autocompletar', args=['paciente-apellido'])
+        self.assertEqual(self.client.get(url, {'q': 'mu'}).json(), {'resultados': ['Muñoz']})
+        self.assertEqual(self.client.get(url, {'q': 'M'}).json(), {'resultados': []})
+
+    def test_campo_no_registrado(self):
+        url = reverse('autocompletar', args=['paciente-direccion'])
+        self.assertEqual(self.client.get(url, {'q': 'ca'}).status_code, 404)
+
+    def test_filtro_por_prefijo_sin_consultas_al_construir(self):
+        from .filters import PacienteFilter
+
+        with self.assertNumQueries(0):
+            filtro = PacienteFilter({'apellido': 'mor'}, queryset=Paciente.objects.all())
+            filtro.form.as_p()
+        self.assertEqual([p.apellido_paterno for p in filtro.qs], ['Morales'])
+
+
+# -----------------------------
+# Selectores con búsqueda remota
+# -----------------------------
+
+class SelectoresRemotosTests(ConteoConsultasMixin, FabricaFilasMixin, TestCase):
+
+    def test_formulario_crear_no_depende_de_la_cantidad_de_registros(self):
+        self.assertConsultasConstantes(reverse('consulta_crear'), self._nueva_consulta, esperadas=0)
+
+    def test_formulario_editar_solo_carga_lo_seleccionado(self):
+        consulta = self._nueva_consulta()
+        url = reverse('consulta_editar', args=[consulta.pk])
+        self.assertConsultasConstantes(url, self._nueva_consulta, esperadas=1)
+        html = self.client.get(url).content.decode()
+        self.assertIn(f'name="paciente" value="{consulta.paciente_id}"', html)
+        self.assertIn(consulta.paciente.nombre_completo, html)
+
+    def test_busqueda_por_nombre_normalizado_y_rut(self):
+        crear_paciente(1, apellido_paterno='Muñoz', nombre='José')
+        crear_paciente(2, apellido_paterno='Muñoz', activo=False)
+        crear_paciente(3, apellido_paterno='Morales', rut='12.345.678-9')
+        url = reverse('buscar_entidad', args=['pacientes'])
+
+        resultados = self.client.get(url, {'q': 'MUNOZ'}).json()['resultados']
+        self.assertEqual([r['texto'] for r in resultados], ['José Muñoz Soto · 10000001-K'])
+        self.assertEqual(len(self.client.get(url, {'q': '12.345'}).json()['resultados']), 1)
+        self.assertEqual(len(self.client.get(url, {'q': '10000001-k'}).json()['resultados']), 1)
+        self.assertEqual(self.client.get(url, {'q': 'm'}).json(), {'resultados': []})
+
+    def test_busqueda_acotada_y_entidad_no_registrada(self):
+        from .autocompletar import LIMITE_RESULTADOS_BUSQUEDA
+
+        esp = crear_especialidad()
+        for n in range(LIMITE_RESULTADOS_BUSQUEDA + 5):
+            crear_medico(n, esp)
+        url = reverse('buscar_entidad', args=['medicos'])
+        with self.assertNumQueries(1):
+            resultados = self.client.get(url, {'q': 'gonz'}).json()['resultados']
+        self.assertEqual(len(resultados), LIMITE_RESULTADOS_BUSQUEDA)
+        self.assertEqual(self.client.get(reverse('buscar_entidad', args=['recetas']), {'q': 'ab'}).status_code, 404)
+
+    def test_nombre_normalizado_se_actualiza_con_update_fields(self):
+        paciente = crear_paciente(1)
+        paciente.apellido_paterno = 'Ñúñez'
+        paciente.save(update_fields=['apellido_paterno'])
+        paciente.refresh_from_db()
+        self.assertEqual(paciente.nombre_normalizado, 'nunez soto nombre1')
+
+
+class FormulariosSinNMasUnoTests(ConteoConsultasMixin, FabricaFilasMixin, TestCase):
+    """
+    Los formularios de tratamiento y receta no recorren las consultas/tratamientos
+    elegibles: solo cargan la opción seleccionada y el catálogo de medicamentos.
+    """
+
+    def _consulta_realizada(self):
+        return self._nueva_consulta_con(estado='REALIZADA')
+
+    def _nueva_consulta_con(self, **extra):
+        n = self._siguiente()
+        return crear_consulta(crear_paciente(n), crear_medico(n, crear_especialidad(f'Esp {n}')), **extra)
+
+    def _receta_completa(self):
+        return crear_receta(crear_tratamiento(self._consulta_realizada()), self._nuevo_medicamento())
+
+    def test_tratamiento_crear(self):
+        self.assertConsultasConstantes(reverse('tratamiento_crear'), self._consulta_realizada, esperadas=0)
+
+    def test_tratamiento_editar(self):
+        tratamiento = crear_tratamiento(self._consulta_realizada())
+        url = reverse('tratamiento_editar', args=[tratamiento.pk])
+        # Tratamiento + etiqueta de la consulta seleccionada.
+        self.assertConsultasConstantes(url, self._consulta_realizada, esperadas=2)
+        html = self.client.get(url).content.decode()
+        self.assertIn(f'Consulta #{tratamiento.consulta_id} · ', html)
+        self.assertIn(f'name="consulta" value="{tratamiento.consulta_id}"', html)
+
+    def test_receta_crear(self):
+        # Solo el catálogo de medicamentos activos.
+        self.assertConsultasConstantes(reverse('receta_crear'), self._receta_completa, esperadas=1)
+
+    def test_receta_editar(self):
+        receta = self._receta_completa()
+        url = reverse('receta_editar', args=[receta.pk])
+        self.assertConsultasConstantes(url, self._receta_completa, esperadas=3)
+        self.assertIn(f'Tratamiento #{receta.tratamiento_id} · ', self.client.get(url).content.decode())
+
+    def test_validacion_respeta_las_opciones_elegibles(self):
+        from .forms import TratamientoForm
+
+        agendada = self._nueva_consulta_con(estado='AGENDADA')
+        realizada = self._consulta_realizada()
+        datos = {'descripcion': 'D', 'indicaciones': 'I', 'fecha_inicio': '2025-01-01', 'activo': 'on'}
+        self.assertFalse(TratamientoForm({**datos, 'consulta': agendada.pk}).is_valid())
+        self.assertTrue(TratamientoForm({**datos, 'consulta': realizada.pk}).is_valid())
+
+    def test_busqueda_de_tratamientos_por_numero_o_paciente(self):
+        tratamiento = crear_tratamiento(self._consulta_realizada())
+        crear_tratamiento(self._consulta_realizada(), activo=False)
+        url = reverse('buscar_entidad', args=['tratamientos'])
+        por_numero = self.client.get(url, {'q': str(tratamiento.pk).zfill(2)}).json()['resultados']
+        self.assertIn(tratamiento.pk, [r['id'] for r in por_numero])
+        por_paciente = self.client.get(url, {'q': 'perez'}).json()['resultados']
+        self.assertEqual([r['id'] for r in por_paciente], [tratamiento.pk])
+
+
+# -----------------------------
+# Búsqueda de texto completo (?search=)
+# -----------------------------
+
+class BusquedaTextoTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.cardio = crear_especialidad('Cardiología')
+        cls.munoz = crear_paciente(1, apellido_paterno='Muñoz', nombre='José', rut='12.345.678-9')
+        cls.morales = crear_paciente(2, apellido_paterno='Morales', nombre='Josefina')
+        crear_paciente(3, apellido_paterno='Muñoz', nombre='Ana')
+        cls.medico = crear_medico(1, cls.cardio)
+        cls.lab = crear_laboratorio('Laboratorio Andrómaco')
+        cls.paracetamol = crear_medicamento(1, cls.lab, nombre='Paracetamol')
+
+    def buscar(self, nombre_url, texto):
+        respuesta = self.client.get(reverse(nombre_url), {'search': texto})
+        self.assertEqual(respuesta.status_code, 200)
+        return [fila['id'] for fila in respuesta.json()['results']]
+
+    def test_pacientes_sin_tildes_por_prefijo_y_rut(self):
+        self.assertEqual(self.buscar('paciente-api-list', 'MUNOZ jo'), [self.munoz.pk])
+        # Mismo puntaje: se desempata con el orden por defecto (apellidos).
+        self.assertEqual(self.buscar('paciente-api-list', 'jos'), [self.morales.pk, self.munoz.pk])
+        self.assertEqual(self.buscar('paciente-api-list', '12.345.67'), [self.munoz.pk])
+        self.assertEqual(self.buscar('paciente-api-list', '123456789'), [self.munoz.pk])
+        self.assertEqual(self.buscar('paciente-api-list', 'munoz morales'), [])
+
+    def test_no_expone_columnas_de_busqueda(self):
+        fila = self.client.get(reverse('paciente-api-detail', args=[self.munoz.pk])).json()
+        self.assertNotIn('texto_busqueda', fila)
+        self.assertNotIn('nombre_normalizado', fila)
+
+    def test_medicos_por_especialidad_y_renombre(self):
+        self.assertEqual(self.buscar('medico-api-list', 'cardio'), [self.medico.pk])
+        especialidad = Especialidad.objects.get(pk=self.cardio.pk)
+        especialidad.nombre = 'Neurología'
+        especialidad.save()
+        self.assertEqual(self.buscar('medico-api-list', 'cardio'), [])
+        self.assertEqual(self.buscar('medico-api-list', 'neuro'), [self.medico.pk])
+
+    def test_medicamentos_por_laboratorio(self):
+        self.assertEqual(self.buscar('medicamento-api-list', 'andromaco para'), [self.paracetamol.pk])
+
+    def test_reindexar_tras_bulk_create(self):
+        from .busqueda import reindexar
+
+        Paciente.objects.bulk_create([
+            Paciente(rut='9999999-9', nombre='Íñigo', apellido_paterno='Zúñiga', apellido_materno='X',
+                     fecha_nacimiento=date(1990, 1, 1), telefono='9', direccion='C'),
+        ])
+        self.assertEqual(self.buscar('paciente-api-list', 'zuniga'), [])
+        reindexar(Paciente.objects.filter(texto_busqueda=''))
+        self.assertEqual(len(self.buscar('paciente-api-list', 'zuniga inigo')), 1)
+
+    def test_modelos_sin_texto_busqueda_usan_search_fields(self):
+        respuesta = self.client.get(reverse('especialidad-api-list'), {'search': 'cardio'})
+        self.assertEqual([fila['id'] for fila in respuesta.json()['results']], [self.cardio.pk])
+
+
+# -----------------------------
+# Métricas del tablero de inicio
+# -----------------------------
+
+class MetricasTableroTests(FabricaFilasMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def metricas(self):
+        from .metricas import _leer
+
+        return _leer(timezone.localdate())
+
+    def test_home_no_depende_de_la_cantidad_de_filas(self):
+        for _ in range(5):
+            self._nueva_consulta()
+        cache.clear()
+        with self.assertNumQueries(1):
+            self.client.get(reverse('home'))
+        with self.assertNumQueries(0):
+            respuesta = self.client.get(reverse('home'))
+        self.assertEqual(respuesta.context['total_consultas'], 5)
+        self.assertEqual(respuesta.context['total_pacientes'], 5)
+
+    def test_contadores_siguen_las_escrituras(self):
+        paciente = crear_paciente(1)
+        medico = crear_medico(1, crear_especialidad())
+        ahora = timezone.now()
+        consulta = crear_consulta(paciente, medico, fecha_hora=ahora)
+        datos = self.metricas()
+        self.assertEqual((datos['total_pacientes'], datos['total_medicos'],
+                          datos['total_especialidades'], datos['total_consultas']), (1, 1, 1, 1))
+        self.assertEqual({f['estado']: f['total'] for f in datos['consultas_hoy']}['AGENDADA'], 1)
+
+        consulta = ConsultaMedica.objects.get(pk=consulta.pk)
+        consulta.estado = 'REALIZADA'
+        consulta.save()
+        hoy = {f['estado']: f['total'] for f in self.metricas()['consultas_hoy']}
+        self.assertEqual((hoy['AGENDADA'], hoy['REALIZADA']), (0, 1))
+
+        consulta.fecha_hora = ahora - timedelta(days=2)
+        consulta.save()
+        self.assertEqual(self.metricas()['total_consultas_hoy'], 0)
+
+        paciente = Paciente.objects.get(pk=paciente.pk)
+        paciente.activo = False
+        paciente.save()
+        consulta.delete()
+        datos = self.metricas()
+        self.assertEqual((datos['total_pacientes'], datos['total_consultas']), (0, 0))
+
+    def test_cache_se_invalida_al_confirmar(self):
+        self.client.get(reverse('home'))
+        with self.captureOnCommitCallbacks(execute=True):
+            crear_paciente(1)
+        self.assertEqual(self.client.get(reverse('home')).context['total_pacientes'], 1)
+
+    def test_reconciliar_corrige_operaciones_masivas(self):
+        from .metricas import reconciliar
+
+        crear_paciente(1)
+        Paciente.objects.bulk_create([
+            Paciente(rut='9999999-9', nombre='A', apellido_paterno='B', apellido_materno='C',
+                     fecha_nacimiento=date(1990, 1, 1), telefono='9', direccion='D'),
+        ])
+        self.assertEqual(self.metricas()['total_pacientes'], 1)
+        self.assertEqual(reconciliar(), {'pacientes_activos': (1, 2)})
+        self.assertEqual(self.metricas()['total_pacientes'], 2)
+        self.assertEqual(reconciliar(), {})
+
+    def test_comando_reconciliar_elimina_dias_obsoletos(self):
+        from io import StringIO
+
+        consulta = self._nueva_consulta()
+        ConsultaMedica.objects.filter(pk=consulta.pk).update(estado='CANCELADA')
+        salida = StringIO()
+        call_command('reconciliar_metricas', stdout=salida)
+        self.assertIn(':AGENDADA: 1 -> 0', salida.getvalue())
+        self.assertIn(':CANCELADA: None -> 1', salida.getvalue())
+
+
+# -----------------------------
+# Paginación de la API
+# -----------------------------
+
+class PaginacionApiTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        paciente = crear_paciente(1)
+        medico = crear_medico(1, crear_especialidad())
+        inicio = timezone.make_aware(datetime(2025, 1, 1, 8, 0))
+        # Varias consultas con la misma fecha (realizadas, fuera de la agenda): el id desempata.
+        cls.consultas = [
+            crear_consulta(paciente, medico, fecha_hora=inicio + timedelta(hours=i // 3), estado='REALIZADA')
+            for i in range(23)
+        ]
+
+    def test_recorre_todo_el_historial_por_cursor(self):
+        url = reverse('consulta-api-list') + '?page_size=5'
+        vistos, paginas = [], 0
+        while url:
+            datos = self.client.get(url).json()
+            vistos += [fila['id'] for fila in datos['results']]
+            self.assertEqual(datos['count'], 23 if paginas == 0 else None)
+            url = datos['next']
+            paginas += 1
+        self.assertEqual(paginas, 5)
+        esperados = [c.pk for c in sorted(self.consultas, key=lambda c: (c.fecha_hora, c.pk), reverse=True)]
+        self.assertEqual(vistos, esperados)
+
+    def test_pagina_anterior(self):
+        primera = self.client.get(reverse('consulta-api-list'), {'page_size': 5}).json()
+        segunda = self.client.get(primera['next']).json()
+        self.assertEqual(self.client.get(segunda['previous']).json()['results'], primera['results'])
+
+    def test_paginas_profundas_sin_conteo(self):
+        primera = self.client.get(reverse('consulta-api-list'), {'page_size': 5}).json()
+        with self.assertNumQueries(1):
+            self.client.get(primera['next'])
+
+    @override_settings(API_TAMANO_PAGINA_MAXIMO=7)
+    def test_tamano_maximo(self):
+        datos = self.client.get(reverse('consulta-api-list'), {'page_size': 1000}).json()
+        self.assertEqual(len(datos['results']), 7)
+
+    @skipUnless(connection.vendor == 'postgresql', 'EXPLAIN específico de PostgreSQL')
+    def test_conteo_estimado_sin_count(self):
+        with override_settings(API_CONTEO_EXACTO_HASTA=0):
+            with CaptureQueriesContext(connection) as capturadas:
+                datos = self.client.get(reverse('consulta-api-list'), {'contar': 'estimado'}).json()
+        self.assertIsInstance(datos['count'], int)
+        self.assertFalse(any('COUNT(' in q['sql'] for q in capturadas.captured_queries))
+        self.assertTrue(any(q['sql'].startswith('EXPLAIN') for q in capturadas.captured_queries))
+
+    def test_conteo_bajo_el_umbral_es_exacto_y_contar_no(self):
+        url = reverse('consulta-api-list')
+        self.assertEqual(self.client.get(url, {'contar': 'estimado'}).json()['count'], 23)
+        self.assertIsNone(self.client.get(url, {'contar': 'no'}).json()['count'])
+        self.assertEqual(self.client.get(url, {'contar': 'otro'}).status_code, 400)
+
+    def test_modo_numero_de_pagina_y_ordenes_sin_cursor(self):
+        datos = self.client.get(reverse('consulta-api-list'), {'page': 2}).json()
+        self.assertEqual((datos['count'], len(datos['results'])), (23, 10))
+        self.assertIn('page=3', datos['next'])
+        # Orden por una relación: no admite cursor, se pagina por número.
+        datos = self.client.get(reverse('medico-api-list'), {'ordering': 'especialidad__nombre'}).json()
+        self.assertEqual(datos['count'], 1)
+
+    def test_cursor_invalido(self):
+        self.assertEqual(self.client.get(reverse('consulta-api-list'), {'despues': 'xx'}).status_code, 404)
+
+
+# -----------------------------
+# Carga masiva
+# -----------------------------
+
+class CargaMasivaTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.especialidad = crear_especialidad()
+        cls.paciente = crear_paciente(1)
+        cls.medico = crear_medico(1, cls.especialidad)
+
+    def setUp(self):
+        cache.clear()
+
+    def consulta(self, n, **extra):
+        datos = {
+            'paciente': self.paciente.pk, 'medico': self.medico.pk,
+            'fecha_hora': timezone.make_aware(datetime(2025, 3, 1, 8, 0) + timedelta(minutes=15 * n)).isoformat(),
+            'duracion': 15, 'motivo_consulta': f'Control {n}',
+        }
+        datos.update(extra)
+        return datos
+
+    def paciente_datos(self, rut, nombre='Ana', **extra):
+        datos = {
+            'rut': rut, 'nombre': nombre, 'apellido_paterno': 'Muñoz', 'apellido_materno': 'Lagos',
+            'fecha_nacimiento': '1985-05-05', 'telefono': '911111111', 'direccion': 'Av. 2',
+        }
+        datos.update(extra)
+        return datos
+
+    def enviar(self, url_name, lote):
+        return self.client.post(reverse(url_name), lote, content_type='application/json')
+
+    def test_consultas_en_numero_fijo_de_consultas_sql(self):
+        conteos = []
+        for cantidad in (2, 20):
+            inicio = cantidad * 100
+            with CaptureQueriesContext(connection) as capturadas:
+                respuesta = self.enviar('consulta-api-lote', [self.consulta(inicio + n) for n in range(cantidad)])
+            self.assertEqual(respuesta.status_code, 200)
+            self.assertEqual(respuesta.json()['creados'], cantidad)
+            conteos.append(len(capturadas))
+        self.assertEqual(conteos[0], conteos[1])
+        self.assertEqual(ConsultaMedica.objects.count(), 22)
+
+    def test_errores_por_elemento(self):
+        lote = [
+            self.consulta(1),
+            self.consulta(2, paciente=999999),
+            self.consulta(3, motivo_consulta=''),
+            'no es un objeto',
+            self.consulta(4, id=123456),
+        ]
+        respuesta = self.enviar('consulta-api-lote', lote)
+        self.assertEqual(respuesta.status_code, 207)
+        datos = respuesta.json()
+        self.assertEqual((datos['creados'], datos['errores']), (1, 4))
+        estados = [r['estado'] for r in datos['resultados']]
+        self.assertEqual(estados, ['creado', 'error', 'error', 'error', 'error'])
+        self.assertIn('paciente', datos['resultados'][1]['errores'])
+        self.assertIn('motivo_consulta', datos['resultados'][2]['errores'])
+        self.assertIn('id', datos['resultados'][4]['errores'])
+        self.assertEqual(ConsultaMedica.objects.count(), 1)
+
+    def test_actualiza_consultas_con_id_y_metricas(self):
+        from .metricas import _leer
+
+        existente = crear_consulta(self.paciente, self.medico)
+        respuesta = self.enviar('consulta-api-lote', [
+            self.consulta(1, id=existente.pk, estado='REALIZADA', fecha_hora=timezone.now().isoformat()),
+            self.consulta(2, fecha_hora=timezone.now().isoformat()),
+        ])
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual([r['estado'] for r in respuesta.json()['resultados']], ['actualizado', 'creado'])
+        existente.refresh_from_db()
+        self.assertEqual(existente.estado, 'REALIZADA')
+        hoy = _leer(timezone.localdate())
+        self.assertEqual(hoy['total_consultas'], 2)
+        self.assertEqual({f['estado']: f['total'] for f in hoy['consultas_hoy']},
+                         {'AGENDADA': 1, 'REALIZADA': 1, 'CANCELADA': 0, 'NO_ASISTIO': 0})
+
+    def test_upsert_pacientes_por_rut(self):
+        respuesta = self.enviar('paciente-api-lote', [
+            self.paciente_datos(self.paciente.rut, nombre='Renombrado'),
+            self.paciente_datos('7777777-7'),
+            self.paciente_datos('7777777-7', nombre='Repetido'),
+        ])
+        self.assertEqual(respuesta.status_code, 207)
+        self.assertEqual([r['estado'] for r in respuesta.json()['resultados']],
+                         ['actualizado', 'creado', 'error'])
+        self.paciente.refresh_from_db()
+        self.assertEqual(self.paciente.nombre, 'Renombrado')
+        nuevo = Paciente.objects.get(rut='7777777-7')
+        self.assertEqual(nuevo.nombre_normalizado, 'munoz lagos ana')
+        # Los campos de búsqueda se calculan aunque no se pase por save().
+        datos = self.client.get(reverse('paciente-api-list'), {'search': 'munoz ana'}).json()
+        self.assertEqual([p['rut'] for p in datos['results']], ['7777777-7'])
+
+    def test_upsert_medicos_por_numero_de_registro(self):
+        otra = crear_especialidad('Pediatría')
+        base = {
+            'nombre': 'Luis', 'apellido_paterno': 'Vera', 'apellido_materno': 'Paz',
+            'telefono': '922222222', 'email': 'luis@clinica.cl', 'fecha_ingreso': '2021-01-01',
+        }
+        respuesta = self.enviar('medico-api-lote', [
+            dict(base, rut=self.medico.rut, numero_registro=self.medico.numero_registro, especialidad=otra.pk),
+            dict(base, rut='30000000-1', numero_registro='REG-NUEVO', especialidad=otra.pk),
+            # RUT de otro médico con un número de registro distinto.
+            dict(base, rut=self.medico.rut, numero_registro='REG-OTRO', especialidad=otra.pk),
+        ])
+        self.assertEqual(respuesta.status_code, 207)
+        resultados = respuesta.json()['resultados']
+        self.assertEqual([r['estado'] for r in resultados], ['actualizado', 'creado', 'error'])
+        self.assertIn('rut', resultados[2]['errores'])
+        self.medico.refresh_from_db()
+        self.assertEqual(self.medico.especialidad, otra)
+        otra.refresh_from_db()
+        self.especialidad.refresh_from_db()
+        self.assertEqual((otra.total_medicos_activos, self.especialidad.total_medicos_activos), (2, 0))
+
+    def test_cuerpo_invalido(self):
+        self.assertEqual(self.enviar('consulta-api-lote', {'paciente': 1}).status_code, 400)
+        with override_settings(API_LOTE_MAXIMO=2):
+            respuesta = self.enviar('consulta-api-lote', [self.consulta(n) for n in range(3)])
+        self.assertEqual(respuesta.status_code, 400)
+        todos_mal = self.enviar('consulta-api-lote', [self.consulta(1, medico=None)])
+        self.assertEqual(todos_mal.status_code, 400)
+        self.assertEqual(todos_mal.json()['errores'], 1)
+
+    def test_benchmark(self):
+        from io import StringIO
+
+        salida = StringIO()
+        call_command('benchmark_carga_masiva', cantidad=4, tamano_lote=2, stdout=salida)
+        self.assertIn('Aceleración', salida.getvalue())
+        self.assertEqual(ConsultaMedica.objects.count(), 0)
+
+
+# -----------------------------
+# Sincronización incremental
+# -----------------------------
+
+@override_settings(API_SINCRONIZACION_MARGEN=0)
+class SincronizacionTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.especialidad = crear_especialidad()
+        cls.medico = crear_medico(1, cls.especialidad)
+        cls.pacientes = [crear_paciente(n) for n in range(5)]
+
+    def sincronizar(self, url_name, marca, **params):
+        respuesta = self.client.get(reverse(url_name), {'cambios_desde': marca, **params})
+        self.assertEqual(respuesta.status_code, 200)
+        return respuesta.json()
+
+    def sincronizar_todo(self, url_name, marca='0', page_size=2):
+        cambios, eliminados = [], []
+        while True:
+            datos = self.sincronizar(url_name, marca, page_size=page_size)
+            cambios += [fila['id'] for fila in datos['cambios']]
+            eliminados += datos['eliminados']
+            marca = datos['marca']
+            if not datos['hay_mas']:
+                return cambios, eliminados, marca
+
+    def test_sincronizacion_inicial_y_solo_cambios_despues(self):
+        cambios, eliminados, marca = self.sincronizar_todo('paciente-api-list')
+        self.assertEqual(sorted(cambios), sorted(p.pk for p in self.pacientes))
+        self.assertEqual(eliminados, [])
+        # Sin cambios: nada que descargar.
+        self.assertEqual(self.sincronizar_todo('paciente-api-list', marca)[:2], ([], []))
+
+        modificado, eliminado = self.pacientes[1], self.pacientes[3]
+        modificado.telefono = '900000000'
+        modificado.save()
+        id_eliminado = eliminado.pk
+        eliminado.delete()
+        nuevo = crear_paciente(99)
+        cambios, eliminados, _ = self.sincronizar_todo('paciente-api-list', marca)
+        self.assertEqual(cambios, [modificado.pk, nuevo.pk])
+        self.assertEqual(eliminados, [id_eliminado])
+
+    def test_numero_fijo_de_consultas(self):
+        for _ in range(3):
+            crear_consulta(self.pacientes[0], self.medico)
+        with self.assertNumQueries(2):
+            self.client.get(reverse('consulta-api-list'), {'cambios_desde': '0'})
+
+    def test_eliminaciones_en_cascada_y_carga_masiva(self):
+        consulta = crear_consulta(self.pacientes[0], self.medico)
+        id_tratamiento = crear_tratamiento(consulta).pk
+        marca = self.sincronizar('tratamiento-api-list', '0')['marca']
+        consulta.delete()
+        self.assertEqual(self.sincronizar('tratamiento-api-list', marca)['eliminados'], [id_tratamiento])
+
+        otra = crear_consulta(self.pacientes[0], self.medico)
+        marca = self.sincronizar('consulta-api-list', '0')['marca']
+        self.client.post(reverse('consulta-api-lote'), [{
+            'id': otra.pk, 'paciente': self.pacientes[0].pk, 'medico': self.medico.pk,
+            'fecha_hora': otra.fecha_hora.isoformat(), 'motivo_consulta': 'Cambiado',
+        }], content_type='application/json')
+        cambios = self.sincronizar('consulta-api-list', marca)['cambios']
+        self.assertEqual([(c['id'], c['motivo_consulta']) for c in cambios], [(otra.pk, 'Cambiado')])
+
+    def test_contador_de_especialidad_avanza_la_fecha(self):
+        marca = self.sincronizar('especialidad-api-list', '0')['marca']
+        crear_medico(2, self.especialidad)
+        cambios = self.sincronizar('especialidad-api-list', marca)['cambios']
+        self.assertEqual([(c['id'], c['cantidad_medicos']) for c in cambios], [(self.especialidad.pk, 2)])
+
+    def test_fecha_iso_margen_y_marca_invalida(self):
+        url = reverse('paciente-api-list')
+        futuro = (timezone.now() + timedelta(days=1)).isoformat()
+        self.assertEqual(self.sincronizar('paciente-api-list', futuro)['cambios'], [])
+        with override_settings(API_SINCRONIZACION_MARGEN=60):
+            # Cambios demasiado recientes: se entregan en la siguiente sincronización.
+            self.assertEqual(self.sincronizar('paciente-api-list', '0')['cambios'], [])
+        self.assertEqual(self.client.get(url, {'cambios_desde': 'no-es-marca'}).status_code, 400)
+
+    def test_purga_de_marcas_antiguas(self):
+        ids = [paciente.pk for paciente in self.pacientes[:3]]
+        for paciente in self.pacientes[:3]:
+            paciente.delete()
+        antiguas = RegistroEliminado.objects.order_by('pk')[:2].values_list('pk', flat=True)
+        RegistroEliminado.objects.filter(pk__in=list(antiguas)).update(
+            fecha_eliminacion=timezone.now() - timedelta(days=91),
+        )
+        with override_settings(API_SINCRONIZACION_RETENCION_DIAS=90):
+            ejecucion = ejecutar('purgar_eliminados', tamano=1, pausa=0)
+        self.assertEqual((ejecucion.filas, ejecucion.lotes), (2, 2))
+        self.assertEqual(list(RegistroEliminado.objects.values_list('objeto_id', flat=True)), ids[2:])
+
+
+# -----------------------------
+# Exportación en streaming
+# -----------------------------
+
+class ExportacionTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        especialidad = crear_especialidad()
+        cls.medicos = [crear_medico(n, especialidad) for n in range(2)]
+        paciente = crear_paciente(1)
+        medicamento = crear_medicamento(1, crear_laboratorio())
+        for n in range(6):
+            consulta = crear_consulta(paciente, cls.medicos[n % 2],
+                                      fecha_hora=timezone.make_aware(datetime(2025, 2, 1 + n, 9, 0)))
+            crear_receta(crear_tratamiento(consulta), medicamento)
+
+    def exportar(self, url_name, **params):
+        respuesta = self.client.get(reverse(url_name), params)
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertTrue(respuesta.streaming)
+        return respuesta, b''.join(respuesta.streaming_content).decode('utf-8')
+
+    def test_ndjson_con_filtros(self):
+        import json
+
+        respuesta, contenido = self.exportar('consulta-api-exportar', medico=self.medicos[0].pk)
+        self.assertEqual(respuesta['Content-Type'], 'application/x-ndjson')
+        self.assertIn('consultas-', respuesta['Content-Disposition'])
+        filas = [json.loads(linea) for linea in contenido.splitlines()]
+        self.assertEqual(len(filas), 3)
+        self.assertEqual({f['medico'] for f in filas}, {self.medicos[0].pk})
+        self.assertEqual(filas[0]['especialidad'], 'Cardiología')
+
+    def test_csv_aplana_campos_anidados(self):
+        import io
+
+        respuesta, contenido = self.exportar('receta-api-exportar', formato='csv')
+        self.assertTrue(respuesta['Content-Type'].startswith('text/csv'))
+        filas = list(csv.DictReader(io.StringIO(contenido)))
+        self.assertEqual(len(filas), 6)
+        self.assertIn('tratamiento_info.paciente', filas[0])
+        self.assertEqual(filas[0]['medicamento_nombre'], 'Medicamento1')
+
+    def test_csv_sin_filas_y_formato_invalido(self):
+        _, contenido = self.exportar('tratamiento-api-exportar', formato='csv', activo='false')
+        self.assertEqual(len(contenido.splitlines()), 1)
+        self.assertIn('consulta_info', contenido)
+        self.assertEqual(self.client.get(reverse('consulta-api-exportar'), {'formato': 'xml'}).status_code, 400)
+
+    def test_una_consulta_sin_importar_la_cantidad_de_filas(self):
+        with CaptureQueriesContext(connection) as capturadas:
+            self.exportar('receta-api-exportar')
+        self.assertEqual(len(capturadas), 1)
+
+
+# -----------------------------
+# Campos a pedido (?fields= / ?expand=)
+# -----------------------------
+
+@override_settings(API_CONTEO='exacto')
+class SeleccionCamposTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        especialidad = crear_especialidad()
+        medico = crear_medico(1, especialidad)
+        medicamento = crear_medicamento(1, crear_laboratorio())
+        for n in range(3):
+            consulta = crear_consulta(crear_paciente(n), medico, diagnostico='Texto largo ' * 50)
+            crear_receta(crear_tratamiento(consulta), medicamento)
+
+    def get(self, url_name, **params):
+        with CaptureQueriesContext(connection) as capturadas:
+            respuesta = self.client.get(reverse(url_name), params)
+        self.assertEqual(respuesta.status_code, 200, respuesta.content)
+        # La última consulta es el SELECT de la página (la primera, el COUNT).
+        return respuesta.json(), capturadas[-1]['sql']
+
+    def test_fields_recorta_columnas_y_joins(self):
+        datos, sql = self.get('consulta-api-list', fields='id,fecha_hora,estado')
+        self.assertEqual(set(datos['results'][0]), {'id', 'fecha_hora', 'estado'})
+        self.assertNotIn('JOIN', sql)
+        self.assertNotIn('diagnostico', sql)
+
+        _, sql_completo = self.get('consulta-api-list')
+        self.assertIn('JOIN', sql_completo)
+        self.assertIn('diagnostico', sql_completo)
+
+    def test_campos_calculados_usan_sus_columnas(self):
+        datos, sql = self.get('paciente-api-list', fields='id,nombre_completo,edad')
+        self.assertEqual(set(datos['results'][0]), {'id', 'nombre_completo', 'edad'})
+        self.assertIn('fecha_nacimiento', sql)
+        self.assertNotIn('direccion', sql)
+
+        with CaptureQueriesContext(connection) as capturadas:
+            datos, sql = self.get('tratamiento-api-list', fields='id,consulta_info')
+        self.assertEqual(len(capturadas), 2)
+        self.assertTrue(datos['results'][0]['consulta_info']['paciente'].startswith('Nombre'))
+        self.assertNotIn('indicaciones', sql)
+
+    def test_expand_y_campos_anidados(self):
+        datos, sql = self.get('consulta-api-list', expand='paciente')
+        self.assertEqual(datos['results'][0]['paciente']['rut'][-2:], '-K')
+        self.assertIn('medico_nombre', datos['results'][0])
+
+        datos, sql = self.get('receta-api-list', fields='id,tratamiento.consulta.paciente.rut')
+        fila = datos['results'][0]
+        self.assertEqual(set(fila), {'id', 'tratamiento'})
+        self.assertEqual(set(fila['tratamiento']), {'consulta'})
+        self.assertEqual(set(fila['tratamiento']['consulta']['paciente']), {'rut'})
+        self.assertNotIn('gestion_clinica_medicamento', sql)
+        self.assertNotIn('"gestion_clinica_paciente"."direccion"', sql)
+
+    def test_consultas_constantes_con_expand(self):
+        with CaptureQueriesContext(connection) as capturadas:
+            self.client.get(reverse('receta-api-list'), {'expand': 'tratamiento.consulta.medico,medicamento'})
+        self.assertEqual(len(capturadas), 2)
+
+    def test_especialidades_sin_conteo_si_no_se_pide(self):
+        _, sql = self.get('especialidad-api-list', fields='id,nombre')
+        self.assertNotIn('COUNT', sql)
+
+    def test_nombres_invalidos(self):
+        respuesta = self.client.get(reverse('consulta-api-list'), {'fields': 'id,inexistente'})
+        self.assertEqual(respuesta.status_code, 400)
+        self.assertIn('fields', respuesta.json())
+        respuesta = self.client.get(reverse('consulta-api-list'), {'expand': 'especialidad'})
+        self.assertEqual(respuesta.status_code, 400)
+        self.assertIn('expand', respuesta.json())
+
+    def test_exportacion_y_escrituras(self):
+        import io
+
+        respuesta = self.client.get(reverse('receta-api-exportar'), {'formato': 'csv', 'fields': 'id,dosis'})
+        contenido = b''.join(respuesta.streaming_content).decode('utf-8')
+        self.assertEqual(next(csv.reader(io.StringIO(contenido))), ['id', 'dosis'])
+
+        consulta = ConsultaMedica.objects.first()
+        respuesta = self.client.patch(
+            reverse('consulta-api-detail', args=[consulta.pk]) + '?fields=id',
+            {'estado': 'REALIZADA'}, content_type='application/json',
+        )
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertIn('motivo_consulta', respuesta.json())
+
+
+# -----------------------------
+# Lectura por ids (?ids=)
+# -----------------------------
+
+class LecturaPorIdsTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        especialidad = crear_especialidad()
+        medico = crear_medico(1, especialidad)
+        medicamento = crear_medicamento(1, crear_laboratorio())
+        cls.recetas = [
+            crear_receta(crear_tratamiento(crear_consulta(crear_paciente(n), medico)), medicamento)
+            for n in range(4)
+        ]
+
+    def test_orden_pedido_y_no_encontrados(self):
+        ids = [self.recetas[2].pk, self.recetas[0].pk, 999999, self.recetas[2].pk]
+        with CaptureQueriesContext(connection) as capturadas:
+            respuesta = self.client.get(reverse('receta-api-list'), {'ids': ','.join(map(str, ids))})
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(len(capturadas), 1)
+        self.assertIn(' IN ', capturadas[0]['sql'])
+        datos = respuesta.json()
+        self.assertEqual([r['id'] for r in datos['results']], [self.recetas[2].pk, self.recetas[0].pk])
+        self.assertEqual(datos['no_encontrados'], [999999])
+        self.assertIn('tratamiento_info', datos['results'][0])
+
+    def test_con_fields_y_filtros(self):
+        ids = ','.join(str(r.pk) for r in self.recetas)
+        paciente = self.recetas[1].tratamiento.consulta.paciente
+        respuesta = self.client.get(reverse('paciente-api-list'), {'ids': paciente.pk, 'fields': 'id,rut'})
+        self.assertEqual(respuesta.json()['results'], [{'id': paciente.pk, 'rut': paciente.rut}])
+        respuesta = self.client.get(reverse('receta-api-list'), {'ids': ids, 'paciente': paciente.pk})
+        self.assertEqual([r['id'] for r in respuesta.json()['results']], [self.recetas[1].pk])
+        self.assertEqual(len(respuesta.json()['no_encontrados']), 3)
+
+    @override_settings(API_IDS_MAXIMO=3)
+    def test_ids_invalidos_o_demasiados(self):
+        url = reverse('consulta-api-list')
+        self.assertEqual(self.client.get(url, {'ids': '1,x'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'ids': '1,2,3,4'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'ids': '1,2,3,3'}).status_code, 200)
+
+
+# -----------------------------
+# Caché de datos de referencia
+# -----------------------------
+
+class CacheReferenciaTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.especialidad = crear_especialidad()
+        self.url = reverse('especialidad-api-list')
+
+    def get(self, url, **params):
+        with CaptureQueriesContext(connection) as capturadas:
+            respuesta = self.client.get(url, params)
+        self.assertEqual(respuesta.status_code, 200)
+        return respuesta, len(capturadas)
+
+    def assertCacheFunciona(self):
+        respuesta, _ = self.get(self.url)
+        self.assertEqual(respuesta['X-Cache'], 'MISS')
+        respuesta, consultas = self.get(self.url)
+        self.assertEqual(respuesta['X-Cache'], 'HIT')
+        self.assertEqual(consultas, 0)
+        self.assertEqual(respuesta.json()['results'][0]['nombre'], 'Cardiología')
+
+        # Guardar un médico cambia `cantidad_medicos`: la versión de Medico invalida la respuesta.
+        crear_medico(1, self.especialidad)
+        respuesta, _ = self.get(self.url)
+        self.assertEqual(respuesta['X-Cache'], 'MISS')
+        self.assertEqual(respuesta.json()['results'][0]['cantidad_medicos'], 1)
+
+        self.especialidad.nombre = 'Neurología'
+        self.especialidad.save()
+        respuesta, _ = self.get(reverse('especialidad-api-detail', args=[self.especialidad.pk]))
+        self.assertEqual(respuesta.json()['nombre'], 'Neurología')
+
+        from io import StringIO
+        from .cache_referencia import estadisticas
+
+        salida = StringIO()
+        call_command('estadisticas_cache', stdout=salida)
+        self.assertIn('api-especialidades', salida.getvalue())
+        self.assertEqual(estadisticas()['api-especialidades']['aciertos'], 1)
+        self.assertEqual(estadisticas()['api-especialidades']['fallos'], 3)
+
+    def test_memoria_local(self):
+        self.assertCacheFunciona()
+
+    def test_archivo(self):
+        directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directorio, ignore_errors=True)
+        with override_settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directorio,
+        }}):
+            self.assertCacheFunciona()
+
+    def test_parametros_en_la_clave_y_modos_sin_cache(self):
+        crear_especialidad('Pediatría')
+        self.get(self.url, search='Pedia')
+        respuesta, _ = self.get(self.url, search='Cardio')
+        self.assertEqual(respuesta['X-Cache'], 'MISS')
+        self.assertEqual([e['nombre'] for e in respuesta.json()['results']], ['Cardiología'])
+
+        respuesta, _ = self.get(self.url, ids=self.especialidad.pk)
+        self.assertNotIn('X-Cache', respuesta)
+        respuesta, _ = self.get(self.url, cambios_desde='0')
+        self.assertNotIn('X-Cache', respuesta)
+
+    def test_opciones_de_formularios(self):
+        crear_medicamento(1, crear_laboratorio())
+        self.get(reverse('receta_crear'))
+        respuesta, consultas = self.get(reverse('receta_crear'))
+        self.assertEqual(consultas, 0)
+        self.assertContains(respuesta, 'Medicamento1')
+
+        crear_medicamento(2, crear_laboratorio('Otro'))
+        self.assertContains(self.get(reverse('receta_crear'))[0], 'Medicamento2')
+
+
+# -----------------------------
+# GET condicional (ETag / Last-Modified)
+# -----------------------------
+
+class GetCondicionalTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        especialidad = crear_especialidad()
+        self.paciente = crear_paciente(1)
+        self.medico = crear_medico(1, especialidad)
+        self.consulta = crear_consulta(self.paciente, self.medico)
+        crear_consulta(self.paciente, self.medico, estado='REALIZADA')
+        self.url = reverse('consulta-api-list')
+
+    def etag(self, url, **params):
+        respuesta = self.client.get(url, params)
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(respuesta['Cache-Control'], 'private, no-cache')
+        return respuesta['ETag']
+
+    def test_listado_304_sin_leer_filas(self):
+        etag = self.etag(self.url, estado='AGENDADA')
+        self.assertTrue(etag.startswith('W/"'))
+        with self.assertNumQueries(1):
+            respuesta = self.client.get(self.url, {'estado': 'AGENDADA'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(respuesta.status_code, 304)
+        self.assertEqual(respuesta.content, b'')
+        self.assertEqual(respuesta['ETag'], etag)
+
+        # Otro filtro u otro formato es otra representación.
+        self.assertNotEqual(self.etag(self.url, estado='REALIZADA'), etag)
+        self.assertEqual(self.client.get(self.url, {'estado': 'AGENDADA', 'fields': 'id'},
+                                         HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_cambios_invalidan_el_etag(self):
+        etag = self.etag(self.url, estado='AGENDADA')
+        self.consulta.motivo_consulta = 'Dolor'
+        self.consulta.save()
+        nuevo = self.etag(self.url, estado='AGENDADA')
+        self.assertNotEqual(nuevo, etag)
+
+        # Una fila que sale del filtro también cambia el listado.
+        self.consulta.estado = 'REALIZADA'
+        self.consulta.save()
+        self.assertNotEqual(self.etag(self.url, estado='AGENDADA'), nuevo)
+
+        etag = self.etag(self.url)
+        ConsultaMedica.objects.filter(estado='REALIZADA').first().delete()
+        self.assertNotEqual(self.etag(self.url), etag)
+
+    def test_conteo_segun_modo(self):
+        # Sin conteo exacto, los validadores no recorren las filas filtradas.
+        with CaptureQueriesContext(connection) as capturadas:
+            datos = self.client.get(self.url, {'contar': 'no'}).json()
+        self.assertIsNone(datos['count'])
+        self.assertFalse(any('COUNT(' in q['sql'] for q in capturadas.captured_queries))
+
+        # Con ?contar=exacto, el COUNT del ETag es el `count` de la página.
+        with CaptureQueriesContext(connection) as capturadas:
+            datos = self.client.get(self.url, {'contar': 'exacto', 'estado': 'AGENDADA'}).json()
+        self.assertEqual(datos['count'], 1)
+        self.assertEqual(sum('COUNT(' in q['sql'] for q in capturadas.captured_queries), 1)
+        etag = self.etag(self.url, contar='exacto')
+        self.consulta.delete()
+        self.assertNotEqual(self.etag(self.url, contar='exacto'), etag)
+
+    def test_cambio_en_tabla_relacionada(self):
+        # `paciente_nombre` sale de la tabla de pacientes.
+        etag = self.etag(self.url)
+        self.paciente.nombre = 'Otro'
+        self.paciente.save()
+        respuesta = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertIn('Otro', respuesta.json()['results'][0]['paciente_nombre'])
+
+    def test_if_modified_since_y_detalle(self):
+        respuesta = self.client.get(self.url)
+        respuesta = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=respuesta['Last-Modified'])
+        self.assertEqual(respuesta.status_code, 304)
+
+        url = reverse('consulta-api-detail', args=[self.consulta.pk])
+        etag = self.etag(url)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.client.get(reverse('consulta-api-detail', args=[0])).status_code, 404)
+
+    def test_edad_del_paciente_cambia_con_el_dia(self):
+        url = reverse('paciente-api-detail', args=[self.paciente.pk])
+        respuesta = self.client.get(url)
+        etag, ultima = respuesta['ETag'], respuesta['Last-Modified']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        # Consultas sin ?expand= no dependen del día.
+        consultas = self.etag(self.url)
+
+        manana = timezone.localdate() + timedelta(days=1)
+        with mock.patch('django.utils.timezone.localdate', return_value=manana):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+            self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=ultima).status_code, 200)
+            self.assertEqual(self.etag(self.url), consultas)
+
+    def test_datos_de_referencia_304_desde_la_cache(self):
+        url = reverse('especialidad-api-list')
+        etag = self.etag(url)
+        with self.assertNumQueries(0):
+            respuesta = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(respuesta.status_code, 304)
+        crear_especialidad('Pediatría')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+# -----------------------------
+# Perfiles de conexión a la base de datos
+# -----------------------------
+
+class ConexionesTests(TestCase):
+    base = {'ENGINE': 'django.db.backends.postgresql', 'NAME': 'db', 'OPTIONS': {'sslmode': 'prefer'}}
+
+    def test_perfiles(self):
+        from django.core.exceptions import ImproperlyConfigured
+        from clinica_salud_vital.conexiones import perfil_conexiones, perfil_en_uso, pool_disponible
+
+        nueva = perfil_conexiones(self.base, 'nueva')
+        self.assertEqual(nueva['CONN_MAX_AGE'], 0)
+        self.assertEqual(perfil_en_uso(nueva), 'nueva')
+
+        persistente = perfil_conexiones(self.base, 'persistente', edad_maxima=60, verificar=True)
+        self.assertEqual((persistente['CONN_MAX_AGE'], persistente['CONN_HEALTH_CHECKS']), (60, True))
+        self.assertEqual(persistente['OPTIONS'], {'sslmode': 'prefer'})
+        self.assertEqual(perfil_en_uso(persistente), 'persistente')
+
+        if pool_disponible():
+            pool = perfil_conexiones(self.base, 'pool', pool={'max_size': 4})
+            self.assertEqual((pool['CONN_MAX_AGE'], pool['OPTIONS']['pool']), (0, {'max_size': 4}))
+        else:
+            with self.assertRaisesMessage(ImproperlyConfigured, 'psycopg'):
+                perfil_conexiones(self.base, 'pool')
+        with self.assertRaises(ImproperlyConfigured):
+            perfil_conexiones(self.base, 'otro')
+        self.assertNotIn('CONN_MAX_AGE', self.base)
+
+    def test_estadisticas_y_benchmark(self):
+        from io import StringIO
+
+        salida = StringIO()
+        call_command('estadisticas_conexiones', stdout=salida)
+        self.assertIn('Perfil:', salida.getvalue())
+        if connection.vendor == 'postgresql':
+            self.assertIn('Conexiones en el servidor', salida.getvalue())
+
+        original = dict(connection.settings_dict)
+        salida = StringIO()
+        call_command('benchmark_conexiones', peticiones=6, hilos=2, perfiles='nueva,persistente',
+                     url=reverse('especialidad-api-list') + '?ids=1', stdout=salida)
+        self.assertIn('nueva        6 peticiones', salida.getvalue())
+        self.assertIn('persistente  6 peticiones', salida.getvalue())
+        self.assertEqual(connection.settings_dict, original)
+
+
+# -----------------------------
+# Agenda de médicos
+# -----------------------------
+
+def lunes(hora, minuto=0):
+    return timezone.make_aware(datetime(2025, 3, 3, hora, minuto))
+
+
+class AgendaTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.paciente = crear_paciente(1)
+        cls.medico = crear_medico(1, crear_especialidad(), jornada='COMPLETA')
+
+    def agendar(self, fecha_hora, **extra):
+        datos = {'paciente': self.paciente.pk, 'medico': self.medico.pk,
+                 'fecha_hora': fecha_hora.isoformat(), 'motivo_consulta': 'Control'}
+        datos.update(extra)
+        return self.client.post(reverse('consulta-api-list'), datos, content_type='application/json')
+
+    def test_superposicion_y_horario_en_la_api(self):
+        primera = self.agendar(lunes(10))
+        self.assertEqual(primera.status_code, 201)
+        self.assertEqual(ConsultaMedica.objects.get().fecha_fin, lunes(10, 30))
+
+        choque = self.agendar(lunes(10, 15))
+        self.assertEqual(choque.status_code, 400)
+        self.assertIn(f'N° {primera.json()["id"]}', choque.json()['fecha_hora'][0])
+        self.assertEqual(self.agendar(lunes(10, 30), duracion=60).status_code, 201)
+        self.assertEqual(self.agendar(lunes(12, 45)).status_code, 400)  # termina a las 13:15
+        self.assertEqual(self.agendar(lunes(9) + timedelta(days=5)).status_code, 400)  # sábado
+
+        # Horarios propios reemplazan a los de la jornada.
+        HorarioAtencion.objects.create(medico=self.medico, dia_semana=5, hora_inicio=time(9), hora_fin=time(12))
+        self.assertEqual(self.agendar(lunes(9) + timedelta(days=5)).status_code, 201)
+        self.assertEqual(self.agendar(lunes(15)).status_code, 400)
+
+    def test_cancelar_libera_el_bloque_y_editar_otros_campos(self):
+        consulta = crear_consulta(self.paciente, self.medico, fecha_hora=lunes(10))
+        self.assertEqual(self.agendar(lunes(10)).status_code, 400)
+        url = reverse('consulta-api-detail', args=[consulta.pk])
+        respuesta = self.client.patch(url, {'diagnostico': 'Sano'}, content_type='application/json')
+        self.assertEqual(respuesta.status_code, 200)
+        self.client.patch(url, {'estado': 'CANCELADA'}, content_type='application/json')
+        self.assertEqual(self.agendar(lunes(10)).status_code, 201)
+
+    def test_restriccion_de_la_base_de_datos(self):
+        crear_consulta(self.paciente, self.medico, fecha_hora=lunes(10))
+        crear_consulta(self.paciente, self.medico, fecha_hora=lunes(10, 30))
+        crear_consulta(self.paciente, crear_medico(2, self.medico.especialidad), fecha_hora=lunes(10))
+        crear_consulta(self.paciente, self.medico, fecha_hora=lunes(10), estado='CANCELADA')
+        with self.assertRaises(ConflictoAgenda), transaction.atomic():
+            crear_consulta(self.paciente, self.medico, fecha_hora=lunes(10, 45))
+        otra = crear_consulta(self.paciente, self.medico, fecha_hora=lunes(11))
+        otra.fecha_hora = lunes(9, 45)
+        with self.assertRaises(ConflictoAgenda), transaction.atomic():
+            otra.save()
+
+    def test_migracion_resuelve_superposiciones_previas(self):
+        ajustes_superposiciones = import_module('gestion_clinica.migrations.0010_agenda').ajustes_superposiciones
+
+        def consulta(pk, medico_id, inicio):
+            return ConsultaMedica(pk=pk, medico_id=medico_id, fecha_hora=inicio, duracion=30,
+                                  fecha_fin=inicio + timedelta(minutes=30), estado='AGENDADA')
+
+        filas = [
+            consulta(1, 1, lunes(10)), consulta(2, 1, lunes(10, 20)), consulta(3, 1, lunes(10, 22)),
+            consulta(4, 1, lunes(11)), consulta(5, 2, lunes(10)), consulta(6, 2, lunes(10, 10)),
+        ]
+        modificadas = {fila.pk: fila for fila in ajustes_superposiciones(filas)}
+
+        self.assertEqual(sorted(modificadas), [1, 3, 5])
+        self.assertEqual((modificadas[1].duracion, modificadas[1].fecha_fin), (20, lunes(10, 20)))
+        self.assertEqual(modificadas[3].estado, 'CANCELADA')
+        self.assertIn('N° 2', modificadas[3].observaciones)
+        self.assertEqual((modificadas[5].duracion, modificadas[5].fecha_fin), (10, lunes(10, 10)))
+
+    def test_validacion_acotada(self):
+        from .agenda import errores_agenda
+
+        for dia in range(60):
+            crear_consulta(self.paciente, self.medico, fecha_hora=lunes(8) - timedelta(days=dia), estado='REALIZADA')
+        consulta = ConsultaMedica(paciente=self.paciente, medico=self.medico, fecha_hora=lunes(10), duracion=30)
+        with CaptureQueriesContext(connection) as capturadas:
+            self.assertEqual(errores_agenda(consulta), {})
+        self.assertEqual(len(capturadas), 2)  # horarios del médico + superposiciones
+
+    def test_lote(self):
+        crear_consulta(self.paciente, self.medico, fecha_hora=lunes(10))
+        elementos = [
+            {'paciente': self.paciente.pk, 'medico': self.medico.pk, 'motivo_consulta': 'Control',
+             'fecha_hora': fecha.isoformat()}
+            for fecha in (lunes(11), lunes(11, 15), lunes(10, 15), lunes(20), lunes(11, 30))
+        ]
+        with CaptureQueriesContext(connection) as capturadas:
+            respuesta = self.client.post(reverse('consulta-api-lote'), elementos, content_type='application/json')
+        estados = [r['estado'] for r in respuesta.json()['resultados']]
+        self.assertEqual(estados, ['creado', 'error', 'error', 'error', 'creado'])
+        # Una consulta de horarios y una de superposiciones para todo el lote (más una
+        # para recalcular el mapa de ocupación, ver disponibilidad.py).
+        lecturas = [q['sql'] for q in capturadas.captured_queries if q['sql'].startswith('SELECT')]
+        self.assertEqual(sum('horarioatencion' in sql for sql in lecturas), 1)
+        self.assertEqual(sum('FROM "gestion_clinica_consultamedica"' in sql for sql in lecturas), 2)
+
+    def test_vista_de_creacion(self):
+        crear_consulta(self.paciente, self.medico, fecha_hora=lunes(10))
+        respuesta = self.client.post(reverse('consulta_crear'), {
+            'paciente': self.paciente.pk, 'medico': self.medico.pk, 'fecha_hora': '2025-03-03T10:00',
+            'duracion': '30', 'motivo_consulta': 'Control',
+        }, follow=True)
+        self.assertContains(respuesta, 'El médico ya tiene la consulta')
+        self.assertEqual(ConsultaMedica.objects.count(), 1)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Concurrencia real solo con PostgreSQL')
+class AgendaConcurrenciaTests(TransactionTestCase):
+
+    def test_reservas_simultaneas_del_mismo_bloque(self):
+        import threading
+        from time import sleep
+
+        from django.db import connections
+
+        paciente = crear_paciente(1)
+        medico = crear_medico(1, crear_especialidad())
+        insertada = threading.Event()
+        resultados = {}
+
+        def reservar(nombre, esperar):
+            try:
+                with transaction.atomic():
+                    if esperar:
+                        insertada.wait(5)
+                    crear_consulta(paciente, medico, fecha_hora=lunes(10))
+                    if not esperar:
+                        insertada.set()
+                        # La otra transacción queda esperando en la restricción hasta el commit.
+                        sleep(0.3)
+                resultados[nombre] = 'ok'
+            except ConflictoAgenda:
+                resultados[nombre] = 'conflicto'
+            finally:
+                connections.close_all()
+
+        hilos = [threading.Thread(target=reservar, args=('a', False)),
+                 threading.Thread(target=reservar, args=('b', True))]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        self.assertEqual(resultados, {'a': 'ok', 'b': 'conflicto'})
+        self.assertEqual(ConsultaMedica.objects.filter(estado='AGENDADA').count(), 1)
+
+    def test_mapa_de_ocupacion_con_reservas_simultaneas(self):
+        import threading
+        from time import sleep
+
+        from django.db import connections
+
+        from .disponibilidad import de_bytes
+
+        paciente = crear_paciente(1)
+        medico = crear_medico(1, crear_especialidad())
+        insertada = threading.Event()
+
+        def reservar(hora, esperar):
+            try:
+                with transaction.atomic():
+                    if esperar:
+                        insertada.wait(5)
+                    crear_consulta(paciente, medico, fecha_hora=lunes(hora))
+                    if not esperar:
+                        insertada.set()
+                        sleep(0.3)
+            finally:
+                connections.close_all()
+
+        hilos = [threading.Thread(target=reservar, args=(9, False)),
+                 threading.Thread(target=reservar, args=(10, True))]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        # La segunda escritura espera el bloqueo de la fila del día y ve la consulta de la primera.
+        fila = OcupacionAgenda.objects.get(medico=medico, fecha=lunes(0).date())
+        self.assertEqual(de_bytes(fila.bloques), (0b111111 << 108) | (0b111111 << 120))
+
+
+# -----------------------------
+# Horarios libres
+# -----------------------------
+
+class DisponibilidadTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.paciente = crear_paciente(1)
+        cls.especialidad = crear_especialidad()
+        cls.medico_a = crear_medico(1, cls.especialidad, jornada='COMPLETA')
+        cls.medico_b = crear_medico(2, cls.especialidad, jornada='COMPLETA')
+        crear_medico(3, cls.especialidad, jornada='COMPLETA', activo=False)
+
+    def mapa(self, medico, fecha):
+        from .disponibilidad import de_bytes
+
+        fila = OcupacionAgenda.objects.filter(medico=medico, fecha=fecha).first()
+        return de_bytes(fila.bloques) if fila else 0
+
+    def libres(self, duracion, limite=10, ahora=None, dias=0):
+        from .disponibilidad import horarios_libres
+
+        fecha = lunes(0).date()
+        ahora = ahora or lunes(0) - timedelta(days=1)
+        return [
+            (libre['medico'].pk, timezone.localtime(libre['inicio']).strftime('%H:%M'))
+            for libre in horarios_libres(self.especialidad, fecha, fecha + timedelta(days=dias),
+                                         duracion=duracion, limite=limite, ahora=ahora)
+        ]
+
+    def test_mapa_se_mantiene_con_las_escrituras(self):
+        fecha = lunes(0).date()
+        consulta = crear_consulta(self.paciente, self.medico_a, fecha_hora=lunes(9))
+        self.assertEqual(self.mapa(self.medico_a, fecha), 0b111111 << 108)  # 09:00-09:30
+        consulta.fecha_hora, consulta.duracion = lunes(10, 2), 10
+        consulta.save()
+        self.assertEqual(self.mapa(self.medico_a, fecha), 0b111 << 120)  # 10:00-10:15 (bloques tocados)
+        consulta.estado = 'CANCELADA'
+        consulta.save()
+        self.assertEqual(self.mapa(self.medico_a, fecha), 0)
+        consulta.estado = 'AGENDADA'
+        consulta.save()
+        consulta.delete()
+        self.assertEqual(self.mapa(self.medico_a, fecha), 0)
+
+        # Una consulta que cruza la medianoche ocupa los dos días.
+        crear_consulta(self.paciente, self.medico_a, fecha_hora=lunes(23, 45), duracion=30)
+        self.assertEqual(self.mapa(self.medico_a, fecha), 0b111 << 285)
+        self.assertEqual(self.mapa(self.medico_a, fecha + timedelta(days=1)), 0b111)
+
+    def test_primeros_horarios_libres_de_la_especialidad(self):
+        from .agenda import errores_agenda
+
+        a, b = self.medico_a.pk, self.medico_b.pk
+        crear_consulta(self.paciente, self.medico_a, fecha_hora=lunes(8))
+        crear_consulta(self.paciente, self.medico_a, fecha_hora=lunes(8, 30))
+        crear_consulta(self.paciente, self.medico_b, fecha_hora=lunes(8), duracion=20)
+        self.assertEqual(self.libres(30, limite=4), [(b, '08:20'), (b, '08:50'), (a, '09:00'), (b, '09:20')])
+        # Sin cruzar la pausa de 13:00 a 14:00 de la jornada completa.
+        self.assertEqual(self.libres(240), [(b, '08:20'), (a, '09:00'), (a, '14:00'), (b, '14:00')])
+        self.assertEqual(self.libres(300), [])
+        self.assertEqual(self.libres(300, limite=1, dias=7), [(a, '08:00')])  # el martes
+        self.assertEqual(self.libres(240, limite=5, dias=7)[4], (a, '08:00'))
+        self.assertEqual(self.libres(301, dias=7), [])
+
+        for medico, hora in self.libres(45, limite=20):
+            inicio = lunes(*map(int, hora.split(':')))
+            consulta = ConsultaMedica(paciente=self.paciente, medico_id=medico, fecha_hora=inicio, duracion=45)
+            self.assertEqual(errores_agenda(consulta), {}, (medico, hora))
+
+    def test_no_ofrece_horarios_pasados(self):
+        self.assertEqual(
+            self.libres(30, limite=3, ahora=lunes(10, 2)),
+            [(self.medico_a.pk, '10:05'), (self.medico_b.pk, '10:05'), (self.medico_a.pk, '10:35')],
+        )
+
+    def test_api(self):
+        hoy = timezone.localdate()
+        proximo_lunes = hoy + timedelta(days=7 - hoy.weekday())
+        url = reverse('agenda_disponibles')
+        parametros = {'especialidad': self.especialidad.pk, 'desde': proximo_lunes.isoformat(),
+                      'hasta': proximo_lunes.isoformat(), 'duracion': 60, 'limite': 3}
+        with CaptureQueriesContext(connection) as capturadas:
+            respuesta = self.client.get(url, parametros)
+        self.assertEqual(respuesta.status_code, 200)
+        resultados = respuesta.json()['resultados']
+        self.assertEqual([r['medico'] for r in resultados], [self.medico_a.pk, self.medico_b.pk, self.medico_a.pk])
+        self.assertEqual(resultados[0]['inicio'][:16], f'{proximo_lunes.isoformat()}T08:00')
+        self.assertEqual(resultados[0]['fin'][:16], f'{proximo_lunes.isoformat()}T09:00')
+        self.assertFalse(any('consultamedica' in q['sql'] for q in capturadas.captured_queries))
+
+        self.assertEqual(self.client.get(url).status_code, 400)
+        parametros.update(hasta=(proximo_lunes - timedelta(days=1)).isoformat())
+        self.assertIn('hasta', self.client.get(url, parametros).json()['errores'])
+
+    def test_carga_masiva_y_reconstruccion(self):
+        from io import StringIO
+
+        fecha = lunes(0).date()
+        elementos = [
+            {'paciente': self.paciente.pk, 'medico': self.medico_b.pk, 'motivo_consulta': 'Control',
+             'fecha_hora': hora.isoformat(), 'duracion': 15}
+            for hora in (lunes(9), lunes(9, 15))
+        ]
+        respuesta = self.client.post(reverse('consulta-api-lote'), elementos, content_type='application/json')
+        self.assertEqual(respuesta.json()['creados'], 2)
+        self.assertEqual(self.mapa(self.medico_b, fecha), 0b111111 << 108)
+
+        OcupacionAgenda.objects.all().delete()
+        call_command('reconstruir_ocupacion', stdout=StringIO())
+        self.assertEqual(self.mapa(self.medico_b, fecha), 0b111111 << 108)
+
+
+# -----------------------------
+# Stock de medicamentos
+# -----------------------------
+
+class StockTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        consulta = crear_consulta(crear_paciente(1), crear_medico(1, crear_especialidad()))
+        cls.tratamiento = crear_tratamiento(consulta)
+        cls.laboratorio = crear_laboratorio()
+
+    def setUp(self):
+        cache.clear()
+
+    def medicamento(self, stock, n=1):
+        return crear_medicamento(n, self.laboratorio, stock_disponible=stock)
+
+    def stock(self, medicamento):
+        return Medicamento.objects.get(pk=medicamento.pk).stock_disponible
+
+    def libro(self, medicamento):
+        return list(MovimientoStock.objects.filter(medicamento=medicamento)
+                    .values_list('motivo', 'cantidad', 'stock_resultante'))
+
+    def test_emitir_editar_y_eliminar_mueven_el_stock(self):
+        from .stock import descuadres
+
+        a, b = self.medicamento(50, 1), self.medicamento(10, 2)
+        receta = crear_receta(self.tratamiento, a, cantidad_total=20)
+        self.assertEqual(self.stock(a), 30)
+        receta.cantidad_total = 25
+        receta.save()
+        self.assertEqual(self.stock(a), 25)
+        receta.medicamento, receta.cantidad_total = b, 4
+        receta.save()
+        self.assertEqual((self.stock(a), self.stock(b)), (50, 6))
+        receta.delete()
+        self.assertEqual(self.stock(b), 10)
+        self.assertEqual(self.libro(a), [('AJUSTE', 50, 50), ('EMISION', -20, 30), ('EDICION', -5, 25), ('EDICION', 25, 50)])
+        self.assertEqual(self.libro(b), [('AJUSTE', 10, 10), ('EDICION', -4, 6), ('ANULACION', 4, 10)])
+        self.assertEqual(descuadres(), {})
+
+    def test_movimientos_solo_invalidan_la_cache_de_medicamentos(self):
+        medicamento = self.medicamento(50)
+        grupos = ('api-medicamentos', 'api-laboratorios', 'opciones-medicamentos')
+        antes = {grupo: [cache_referencia.version(modelo) for modelo in GRUPOS[grupo]] for grupo in grupos}
+        crear_receta(self.tratamiento, medicamento, cantidad_total=5)
+        despues = {grupo: [cache_referencia.version(modelo) for modelo in GRUPOS[grupo]] for grupo in grupos}
+        self.assertNotEqual(despues['api-medicamentos'], antes['api-medicamentos'])
+        self.assertEqual(despues['api-laboratorios'], antes['api-laboratorios'])
+        self.assertEqual(despues['opciones-medicamentos'], antes['opciones-medicamentos'])
+
+    def test_stock_insuficiente_no_guarda_la_receta(self):
+        medicamento = self.medicamento(5)
+        with self.assertRaises(StockInsuficiente):
+            crear_receta(self.tratamiento, medicamento, cantidad_total=6)
+        self.assertFalse(RecetaMedica.objects.exists())
+        self.assertEqual(self.stock(medicamento), 5)
+
+        datos = {
+            'tratamiento': self.tratamiento.pk, 'medicamento': medicamento.pk, 'dosis': '1',
+            'frecuencia': 'Cada 8 horas', 'duracion': '2 días', 'cantidad_total': 6,
+        }
+        respuesta = self.client.post(reverse('receta-api-list'), datos, content_type='application/json')
+        self.assertEqual(respuesta.status_code, 400)
+        self.assertIn('Stock insuficiente', respuesta.json()['cantidad_total'][0])
+        respuesta = self.client.post(reverse('receta_crear'), datos)
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertIn('Stock insuficiente', respuesta.content.decode())
+        self.assertEqual(self.libro(medicamento), [('AJUSTE', 5, 5)])
+
+    def test_guardar_medicamento_no_pisa_el_stock(self):
+        medicamento = self.medicamento(100)
+        leido = Medicamento.objects.get(pk=medicamento.pk)
+        crear_receta(self.tratamiento, medicamento, cantidad_total=30)
+        leido.nombre = 'Renombrado'
+        leido.save()
+        self.assertEqual(self.stock(medicamento), 70)
+        # Un cambio de stock se aplica como diferencia con el valor leído.
+        leido.stock_disponible += 10
+        leido.save()
+        self.assertEqual((self.stock(medicamento), leido.stock_disponible), (80, 80))
+        self.assertEqual(self.libro(medicamento)[-1], ('AJUSTE', 10, 80))
+
+    def test_eliminar_tratamiento_devuelve_el_stock(self):
+        medicamento = self.medicamento(30)
+        for _ in range(3):
+            crear_receta(self.tratamiento, medicamento, cantidad_total=10)
+        self.assertEqual(self.stock(medicamento), 0)
+        Tratamiento.objects.filter(pk=self.tratamiento.pk).delete()
+        self.assertEqual(self.stock(medicamento), 30)
+
+    def test_libro_de_solo_insercion(self):
+        movimiento = MovimientoStock.objects.get(medicamento=self.medicamento(5))
+        for operacion in (movimiento.save, movimiento.delete, MovimientoStock.objects.all().delete,
+                          lambda: MovimientoStock.objects.update(cantidad=0)):
+            with self.assertRaises(TypeError):
+                operacion()
+
+    def test_carga_masiva_rechaza_solo_las_que_no_alcanzan(self):
+        from .stock import descuadres
+
+        medicamento = self.medicamento(10)
+        lote = [
+            {'tratamiento': self.tratamiento.pk, 'medicamento': medicamento.pk, 'dosis': '1',
+             'frecuencia': 'Diaria', 'duracion': '1 día', 'cantidad_total': cantidad}
+            for cantidad in (4, 7, 5)
+        ]
+        respuesta = self.client.post(reverse('receta-api-lote'), lote, content_type='application/json')
+        cuerpo = respuesta.json()
+        self.assertEqual((cuerpo['creados'], cuerpo['errores']), (2, 1))
+        self.assertIn('cantidad_total', cuerpo['resultados'][1]['errores'])
+        self.assertEqual(self.stock(medicamento), 1)
+        creada = cuerpo['resultados'][0]['id']
+        respuesta = self.client.post(reverse('receta-api-lote'), [{**lote[0], 'id': creada, 'cantidad_total': 5}],
+                                     content_type='application/json')
+        self.assertEqual(respuesta.json()['actualizados'], 1)
+        self.assertEqual(self.stock(medicamento), 0)
+        self.assertEqual(self.libro(medicamento)[-1], ('EDICION', -1, 0))
+        self.assertEqual(descuadres(), {})
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Concurrencia real solo con PostgreSQL')
+class StockConcurrenciaTests(TransactionTestCase):
+
+    def test_recetas_simultaneas_del_mismo_medicamento(self):
+        import threading
+
+        from django.db import connections
+
+        from .stock import descuadres
+
+        tratamiento = crear_tratamiento(crear_consulta(crear_paciente(1), crear_medico(1, crear_especialidad())))
+        medicamento = crear_medicamento(1, crear_laboratorio(), stock_disponible=100)
+        hilos, cantidad = 24, 7
+        partida = threading.Barrier(hilos)
+        resultados = []
+
+        def emitir():
+            try:
+                partida.wait(5)
+                crear_receta(tratamiento, medicamento, cantidad_total=cantidad)
+                resultados.append('ok')
+            except StockInsuficiente:
+                resultados.append('sin stock')
+            finally:
+                connections.close_all()
+
+        trabajadores = [threading.Thread(target=emitir) for _ in range(hilos)]
+        for trabajador in trabajadores:
+            trabajador.start()
+        for trabajador in trabajadores:
+            trabajador.join()
+        emitidas = 100 // cantidad
+        self.assertEqual(resultados.count('ok'), emitidas)
+        self.assertEqual(resultados.count('sin stock'), hilos - emitidas)
+        self.assertEqual(Medicamento.objects.get(pk=medicamento.pk).stock_disponible, 100 - emitidas * cantidad)
+        self.assertEqual(RecetaMedica.objects.count(), emitidas)
+        self.assertEqual(descuadres(), {})
+
+
+class ConsumoTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        consulta = crear_consulta(crear_paciente(1), crear_medico(1, crear_especialidad()))
+        cls.tratamiento = crear_tratamiento(consulta)
+        cls.laboratorio = crear_laboratorio()
+
+    def consumo(self, medicamento):
+        return dict(ConsumoDiario.objects.filter(medicamento=medicamento).values_list('fecha', 'cantidad'))
+
+    def test_se_mantiene_al_escribir_recetas(self):
+        from io import StringIO
+
+        hoy = date.today()
+        a = crear_medicamento(1, self.laboratorio)
+        b = crear_medicamento(2, self.laboratorio)
+        receta = crear_receta(self.tratamiento, a, cantidad_total=10)
+        crear_receta(self.tratamiento, a, cantidad_total=5)
+        self.assertEqual(self.consumo(a), {hoy: 15})
+        receta.medicamento, receta.cantidad_total = b, 4
+        receta.save()
+        self.assertEqual((self.consumo(a), self.consumo(b)), ({hoy: 5}, {hoy: 4}))
+        receta.delete()
+        self.assertEqual(self.consumo(b), {hoy: 0})
+
+        lote = [{'tratamiento': self.tratamiento.pk, 'medicamento': b.pk, 'dosis': '1',
+                 'frecuencia': 'Diaria', 'duracion': '1 día', 'cantidad_total': 3}] * 2
+        self.client.post(reverse('receta-api-lote'), lote, content_type='application/json')
+        self.assertEqual(self.consumo(b), {hoy: 6})
+
+        ConsumoDiario.objects.all().delete()
+        call_command('reconstruir_consumo', stdout=StringIO())
+        self.assertEqual((self.consumo(a), self.consumo(b)), ({hoy: 5}, {hoy: 6}))
+
+    def test_proyeccion_ordenada_por_dias_restantes(self):
+        from .consumo import proyeccion
+
+        hoy = timezone.localdate()
+        lento = crear_medicamento(1, self.laboratorio, stock_disponible=100)
+        rapido = crear_medicamento(2, self.laboratorio, stock_disponible=30)
+        agotado = crear_medicamento(3, self.laboratorio, stock_disponible=0)
+        sin_consumo = crear_medicamento(4, self.laboratorio, stock_disponible=5)
+        ConsumoDiario.objects.bulk_create([
+            ConsumoDiario(medicamento=lento, fecha=hoy - timedelta(days=2), cantidad=30),
+            ConsumoDiario(medicamento=rapido, fecha=hoy, cantidad=45),
+            # Fuera de la ventana de 30 días.
+            ConsumoDiario(medicamento=sin_consumo, fecha=hoy - timedelta(days=30), cantidad=90),
+        ])
+        resultados = proyeccion(ventana=30, hoy=hoy)
+        self.assertEqual([r['medicamento'] for r in resultados], [agotado.pk, rapido.pk, lento.pk, sin_consumo.pk])
+        self.assertEqual(resultados[1]['dias_restantes'], 20.0)
+        self.assertEqual(resultados[1]['fecha_agotamiento'], hoy + timedelta(days=20))
+        self.assertEqual((resultados[2]['consumo_diario'], resultados[2]['dias_restantes']), (1.0, 100.0))
+        self.assertIsNone(resultados[3]['dias_restantes'])
+        self.assertEqual([r['medicamento'] for r in proyeccion(dias_maximos=30, hoy=hoy)], [agotado.pk, rapido.pk])
+
+    def test_endpoint_en_una_consulta(self):
+        for n in range(20):
+            crear_receta(self.tratamiento, crear_medicamento(n, self.laboratorio, stock_disponible=50 + n),
+                         cantidad_total=n + 1)
+        with CaptureQueriesContext(connection) as capturadas:
+            respuesta = self.client.get(reverse('stock_proyeccion'), {'ventana': 7, 'limite': 5})
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(len(capturadas), 1)
+        resultados = respuesta.json()['resultados']
+        self.assertEqual(len(resultados), 5)
+        # Mismo stock restante (49); el de mayor consumo se agota primero.
+        self.assertEqual(resultados[0]['nombre'], 'Medicamento19')
+        self.assertEqual(self.client.get(reverse('stock_proyeccion'), {'ventana': 0}).status_code, 400)
+
+
+# -----------------------------
+# Exportación analítica columnar
+# -----------------------------
+
+class AnaliticaMixin:
+
+    def setUp(self):
+        super().setUp()
+        self.destino = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.destino, ignore_errors=True)
+        especialidad = crear_especialidad()
+        self.paciente = crear_paciente(1)
+        self.medico = crear_medico(1, especialidad)
+        self.medicamento = crear_medicamento(1, crear_laboratorio())
+        self.consultas = [
+            crear_consulta(self.paciente, self.medico,
+                           fecha_hora=timezone.make_aware(datetime(2025, mes, 10, 9 + n, 0)))
+            for n, mes in enumerate((1, 1, 2, 3))
+        ]
+
+    def exportar(self, **opciones):
+        opciones.setdefault('formato', CSV)
+        opciones.setdefault('procesos', 1)
+        return exportar(base=self.destino, **opciones)
+
+    def leer_csv(self, *partes):
+        with open(os.path.join(self.destino, *partes), encoding='utf-8') as archivo:
+            return list(csv.DictReader(archivo))
+
+
+class AnaliticaTests(AnaliticaMixin, TestCase):
+
+    def test_particiones_por_mes(self):
+        informe = self.exportar()
+        self.assertEqual(informe['consultas']['escritas'], ['2025-01', '2025-02', '2025-03'])
+        filas = self.leer_csv('consultas', 'mes=2025-01', 'parte.csv')
+        self.assertEqual(sorted(int(f['id']) for f in filas), [c.pk for c in self.consultas[:2]])
+        self.assertEqual(filas[0]['especialidad'], 'Cardiología')
+        self.assertNotIn('texto_busqueda', self.leer_csv('medicamentos', 'parte.csv')[0])
+
+    def test_incremental_solo_reescribe_lo_que_cambio(self):
+        self.exportar()
+        informe = self.exportar()
+        self.assertEqual(informe['consultas'], {'escritas': [], 'eliminadas': [], 'sin_cambios': 3})
+
+        consulta = ConsultaMedica.objects.get(pk=self.consultas[2].pk)
+        consulta.diagnostico = 'Actualizado'
+        consulta.save()
+        ConsultaMedica.objects.filter(pk=self.consultas[3].pk).delete()
+        informe = self.exportar(tablas=['consultas'])
+        self.assertEqual(informe['consultas'], {'escritas': ['2025-02'], 'eliminadas': ['2025-03'], 'sin_cambios': 1})
+        self.assertEqual(self.leer_csv('consultas', 'mes=2025-02', 'parte.csv')[0]['diagnostico'], 'Actualizado')
+        self.assertFalse(os.path.exists(os.path.join(self.destino, 'consultas', 'mes=2025-03')))
+
+    def test_relaciones_modificadas_reescriben_particiones(self):
+        self.exportar()
+        especialidad = Especialidad.objects.get(pk=self.medico.especialidad_id)
+        especialidad.nombre = 'Cardiología Adultos'
+        especialidad.save()
+        informe = self.exportar(tablas=['consultas'])
+        self.assertEqual(informe['consultas']['escritas'], ['2025-01', '2025-02', '2025-03'])
+        self.assertEqual(self.leer_csv('consultas', 'mes=2025-01', 'parte.csv')[0]['especialidad'],
+                         'Cardiología Adultos')
+
+    def test_stock_y_contadores_no_reescriben_particiones(self):
+        tratamiento = crear_tratamiento(self.consultas[0])
+        for mes in (1, 2):
+            receta = crear_receta(tratamiento, self.medicamento)
+            RecetaMedica.objects.filter(pk=receta.pk).update(fecha_emision=date(2025, mes, 5))
+        self.exportar()
+
+        # La receta nueva mueve el stock del medicamento y el médico nuevo, los
+        # contadores de la especialidad: ninguno cambia lo exportado en meses anteriores.
+        crear_receta(tratamiento, self.medicamento)
+        crear_medico(2, self.medico.especialidad)
+        informe = self.exportar(tablas=['consultas', 'recetas'])
+        self.assertEqual(informe['consultas'], {'escritas': [], 'eliminadas': [], 'sin_cambios': 3})
+        self.assertEqual(informe['recetas']['escritas'], [timezone.localdate().strftime('%Y-%m')])
+        self.assertEqual(informe['recetas']['sin_cambios'], 2)
+
+    @skipUnless(pyarrow, 'requiere pyarrow')
+    def test_parquet(self):
+        self.exportar(formato=PARQUET)
+        tabla = pyarrow.parquet.read_table(os.path.join(self.destino, 'consultas', 'mes=2025-01', 'parte.parquet'))
+        self.assertEqual(tabla.num_rows, 2)
+        self.assertEqual(str(tabla.schema.field('fecha_hora').type), 'timestamp[us, tz=UTC]')
+
+    def test_parquet_sin_pyarrow(self):
+        if analitica.parquet_disponible():
+            self.skipTest('pyarrow instalado')
+        with self.assertRaises(ExportacionNoDisponible):
+            self.exportar(formato=PARQUET)
+        self.assertEqual(self.client.post(reverse('analitica_exportar')).status_code, 400)
+
+    def test_api_manifiesto_y_descarga(self):
+        url = reverse('analitica_exportar') + '?formato=csv&tabla=consultas'
+        with self.settings(ANALITICA_DIRECTORIO=self.destino, ANALITICA_PROCESOS=1):
+            # La petición solo deja la exportación pendiente; la escribe ejecutar_tareas.
+            respuesta = self.client.post(url)
+            self.assertEqual(respuesta.status_code, 202)
+            self.assertEqual(self.client.post(url).json()['solicitud'], respuesta.json()['solicitud'])
+            self.assertFalse(os.path.exists(os.path.join(self.destino, analitica.ARCHIVO_MANIFIESTO)))
+            self.assertEqual(self.client.post(reverse('analitica_exportar') + '?tabla=otra').status_code, 400)
+            ejecucion = ejecutar('exportar_analitica')
+            self.assertEqual((ejecucion.pk, ejecucion.estado, ejecucion.lotes, ejecucion.filas),
+                             (respuesta.json()['solicitud'], EjecucionTarea.COMPLETADA, 3, 4))
+            manifiesto = self.client.get(reverse('analitica_manifiesto')).json()
+            self.assertEqual(manifiesto['formato'], 'csv')
+            enero = manifiesto['tablas']['consultas'][0]
+            self.assertEqual((enero['particion'], enero['filas']), ('2025-01', 2))
+            descarga = self.client.get(enero['url'])
+            self.assertEqual(descarga.status_code, 200)
+            self.assertIn(b'motivo_consulta', b''.join(descarga.streaming_content))
+            self.assertEqual(self.client.get(reverse('analitica_descargar', args=['consultas', '2030-01'])).status_code, 404)
+            # En el manifiesto pero sin archivo.
+            os.remove(os.path.join(self.destino, 'consultas', 'mes=2025-01', 'parte.csv'))
+            self.assertEqual(self.client.get(enero['url']).status_code, 404)
+
+
+class AnaliticaProcesosTests(AnaliticaMixin, TransactionTestCase):
+
+    def test_escritores_en_paralelo(self):
+        informe = self.exportar(procesos=2)
+        self.assertEqual(len(informe['consultas']['escritas']), 3)
+        self.assertEqual(len(self.leer_csv('consultas', 'mes=2025-01', 'parte.csv')), 2)
+
+
+# -----------------------------
+# Tareas programadas
+# -----------------------------
+
+class TareasTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.medico = crear_medico(1, crear_especialidad())
+        cls.paciente = crear_paciente(1)
+
+    def test_consultas_vencidas_pasan_a_no_asistio_por_lotes(self):
+        from . import disponibilidad, metricas
+
+        vencidas = [crear_consulta(self.paciente, self.medico) for _ in range(5)]
+        futura = crear_consulta(self.paciente, self.medico, fecha_hora=timezone.now() + timedelta(days=2))
+        realizada = crear_consulta(self.paciente, self.medico, estado='REALIZADA')
+        antes = vencidas[0].fecha_modificacion
+
+        ejecucion = ejecutar('consultas_no_asistio', tamano=2, pausa=0)
+        self.assertEqual((ejecucion.estado, ejecucion.filas, ejecucion.lotes), (EjecucionTarea.COMPLETADA, 5, 3))
+        self.assertEqual(ConsultaMedica.objects.filter(estado='NO_ASISTIO').count(), 5)
+        futura.refresh_from_db()
+        realizada.refresh_from_db()
+        self.assertEqual((futura.estado, realizada.estado), ('AGENDADA', 'REALIZADA'))
+        vencidas[0].refresh_from_db()
+        self.assertGreater(vencidas[0].fecha_modificacion, antes)
+
+        # Métricas y mapas de ocupación al día, sin señales.
+        dia = timezone.localdate(vencidas[0].fecha_hora)
+        claves = [metricas.clave_consultas_dia(dia, estado) for estado in ('AGENDADA', 'NO_ASISTIO')]
+        almacenadas = dict(MetricaTablero.objects.filter(clave__in=claves).values_list('clave', 'valor'))
+        self.assertEqual([almacenadas.get(clave, 0) for clave in claves], [0, 5])
+        self.assertEqual([metricas.valores_reales().get(clave, 0) for clave in claves], [0, 5])
+        ocupacion = OcupacionAgenda.objects.get(medico=self.medico, fecha=dia)
+        self.assertEqual(bytes(ocupacion.bloques), disponibilidad.VACIO)
+
+    def test_tratamientos_vencidos_se_desactivan(self):
+        from .tareas import pendientes
+
+        consulta = crear_consulta(self.paciente, self.medico)
+        hoy = timezone.localdate()
+        vencido = crear_tratamiento(consulta, fecha_fin=hoy - timedelta(days=1))
+        vigente = crear_tratamiento(consulta, fecha_fin=hoy)
+        sin_fin = crear_tratamiento(consulta)
+
+        self.assertIn('tratamientos_vencidos', pendientes())
+        ejecutar('tratamientos_vencidos', pausa=0)
+        self.assertEqual(
+            dict(Tratamiento.objects.values_list('pk', 'activo')),
+            {vencido.pk: False, vigente.pk: True, sin_fin.pk: True},
+        )
+        self.assertNotIn('tratamientos_vencidos', pendientes())
+        self.assertIn('tratamientos_vencidos', pendientes(timezone.now() + timedelta(days=1)))
+
+    def test_una_ejecucion_en_curso_por_tarea(self):
+        from .tareas import TareaEnCurso
+
+        en_curso = EjecucionTarea.objects.create(nombre='tratamientos_vencidos')
+        with self.assertRaises(TareaEnCurso):
+            ejecutar('tratamientos_vencidos', pausa=0)
+
+        # Sin avance durante TAREAS_ABANDONO_MINUTOS: se da por abandonada.
+        EjecucionTarea.objects.filter(pk=en_curso.pk).update(actualizado=timezone.now() - timedelta(hours=1))
+        self.assertEqual(ejecutar('tratamientos_vencidos', pausa=0).estado, EjecucionTarea.COMPLETADA)
+        en_curso.refresh_from_db()
+        self.assertEqual(en_curso.estado, EjecucionTarea.FALLIDA)
+
+    def test_tarea_fallida_y_comando(self):
+        from io import StringIO
+
+        from . import tareas
+
+        def fallar(avance, ahora):
+            raise ValueError('sin datos')
+
+        tareas.tareas_registradas()
+        tareas.REGISTRO['falla'] = tareas.Tarea('falla', fallar, timedelta(days=1))
+        self.addCleanup(tareas.REGISTRO.pop, 'falla')
+        with self.assertLogs('gestion_clinica.tareas', 'ERROR'), self.assertRaises(ValueError):
+            tareas.ejecutar('falla')
+        fallida = EjecucionTarea.objects.get(nombre='falla')
+        self.assertEqual(fallida.estado, EjecucionTarea.FALLIDA)
+        self.assertIn('sin datos', fallida.error)
+
+        crear_consulta(self.paciente, self.medico)
+        salida = StringIO()
+        call_command('ejecutar_tareas', 'consultas_no_asistio', pausa=0, stdout=salida)
+        self.assertIn('consultas_no_asistio: 1 filas en 1 lotes', salida.getvalue())
+        self.assertFalse(ConsultaMedica.objects.filter(estado='AGENDADA').exists())
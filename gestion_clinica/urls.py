@@ -67,6 +67,15 @@ urlpatterns = [
     # Página de inicio
     path('', views.home, name='home'),
     
+    # Sugerencias por prefijo para los filtros (antes del router para no colisionar)
+    path('api/autocompletar/<slug:campo>/', views.autocompletar, name='autocompletar'),
+    path('api/buscar/<slug:entidad>/', views.buscar_entidad, name='buscar_entidad'),
+    path('api/agenda/disponibles/', views.agenda_disponibles, name='agenda_disponibles'),
+    path('api/stock/proyeccion/', views.stock_proyeccion, name='stock_proyeccion'),
+    path('api/analitica/', views.analitica_manifiesto, name='analitica_manifiesto'),
+    path('api/analitica/exportar/', views.analitica_exportar, name='analitica_exportar'),
+    path('api/analitica/<slug:tabla>/<slug:particion>/', views.analitica_descargar, name='analitica_descargar'),
+
     # URLs de la API REST
     path('api/', include(router.urls)),
     
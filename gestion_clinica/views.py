@@ -11,12 +11,28 @@ Este módulo reúne dos capas de presentación del sistema:
 CÓMO ESTÁ ORGANIZADO:
 ---------------------
 - Sección "VIEWSETS PARA API REST":
-  • Cada ViewSet hereda de `ModelViewSet` e incluye:
+  • Cada ViewSet hereda de `ModelViewSet` (más los mixins de `mixins.py`) e incluye:
     - `queryset`: conjunto base de datos.
     - `serializer_class`: traducción a/desde JSON.
     - `filterset_class`: filtros declarativos con django-filter.
-    - `search_fields`: búsqueda textual.
+    - `search_fields`: búsqueda textual. En Paciente, Medico y Medicamento `?search=` usa
+      el índice de texto completo de `busqueda.py` sobre esos mismos campos.
     - `ordering_fields`: campos permitidos para ordenamiento.
+  • `SincronizacionMixin` agrega a todos los listados `?cambios_desde=<marca>`
+    (solo filas modificadas o eliminadas, ver `sincronizacion.py`).
+  • `LecturaPorIdsMixin` agrega a todos los listados `?ids=1,2,3` (varias filas por id
+    en una consulta, en el orden pedido).
+  • `CacheReferenciaMixin` guarda en caché el listado y el detalle de especialidades,
+    laboratorios y medicamentos (ver `cache_referencia.py`).
+  • `GetCondicionalMixin` agrega `ETag` / `Last-Modified` al listado y al detalle y
+    responde `304` sin serializar si nada cambió (ver `condicional.py`).
+  • `ExportacionMixin` agrega `GET /api/<recurso>/exportar/` (NDJSON o CSV en streaming,
+    ver `exportacion.py`) en consultas, tratamientos y recetas.
+  • `CargaMasivaMixin` agrega `POST /api/<recurso>/lote/` (carga masiva, ver `carga_masiva.py`)
+    en pacientes, médicos, consultas y recetas.
+  • `CargaRelacionesMixin` agrega `select_related`/`prefetch_related` según las
+    relaciones que recorre el serializador, evitando consultas N+1 en los listados,
+    y atiende `?fields=` / `?expand=` (ver `seleccion_campos.py`).
   • DRF generará rutas a través del `DefaultRouter` configurado en `urls.py`.
 
 - Sección "VISTAS BASADAS EN TEMPLATES":
@@ -38,15 +54,21 @@ EXTENSIONES SUGERIDAS (OPCIONAL):
 - **Formularios Django**: reemplazar acceso directo a `request.POST` por `ModelForm` para validación y limpieza.
 """
 
+import os
+
 from django.db.models.deletion import ProtectedError
 from datetime import datetime
 from django.utils import timezone
 from rest_framework import viewsets
 from django.shortcuts import render, redirect, get_object_or_404
+from django.urls import reverse
+from django.http import FileResponse, Http404, JsonResponse
+from django.views.decorators.http import require_GET, require_POST
 from django.contrib import messages
 from .models import (
     Especialidad, Paciente, Medico, ConsultaMedica,
-    Tratamiento, Medicamento, RecetaMedica, Laboratorio
+    Tratamiento, Medicamento, RecetaMedica, Laboratorio,
+    ConflictoAgenda, DURACION_MAXIMA_CONSULTA, StockInsuficiente
 )
 from .serializers import (
     EspecialidadSerializer, PacienteSerializer, MedicoSerializer,
@@ -59,17 +81,34 @@ from .filters import (
     MedicamentoFilter, RecetaMedicaFilter, LaboratorioFilter
 )
 from django.db.models import Count
+from . import analitica, tareas
+from .agenda import errores_agenda
+from .consumo import proyeccion
+from .disponibilidad import horarios_libres
+from .autocompletar import buscar, contexto_selector, sugerencias
+from .contadores import anotar_cantidad_medicamentos, anotar_cantidad_medicos, usar_contadores_almacenados
+from .metricas import metricas_tablero
+from .mixins import (
+    CacheReferenciaMixin, CargaMasivaMixin, CargaRelacionesMixin, ExportacionMixin, GetCondicionalMixin,
+    LecturaPorIdsMixin, SincronizacionMixin,
+)
+from .paginacion import paginar_keyset
+from .planes_carga import (
+    PLAN_LISTA_PACIENTES, PLAN_LISTA_MEDICOS, PLAN_LISTA_CONSULTAS,
+    PLAN_LISTA_TRATAMIENTOS, PLAN_LISTA_MEDICAMENTOS, PLAN_LISTA_RECETAS
+)
 from .forms import (
     EspecialidadForm, PacienteForm, MedicoForm,
     ConsultaMedicaForm, TratamientoForm,
-    MedicamentoForm, RecetaMedicaForm, LaboratorioForm
+    MedicamentoForm, RecetaMedicaForm, LaboratorioForm, HorariosLibresForm, ProyeccionStockForm
 )
 
 # =============================================
 # VIEWSETS PARA API REST
 # =============================================
 
-class EspecialidadViewSet(viewsets.ModelViewSet):
+class EspecialidadViewSet(LecturaPorIdsMixin, SincronizacionMixin, CargaRelacionesMixin,
+                          CacheReferenciaMixin, GetCondicionalMixin, viewsets.ModelViewSet):
     """
     ViewSet para gestionar especialidades médicas vía API.
     """
@@ -80,8 +119,17 @@ class EspecialidadViewSet(viewsets.ModelViewSet):
     context_object_name = 'especialidades'
     search_fields = ['nombre', 'descripcion']
     ordering_fields = ['nombre', 'fecha_creacion']
+    grupo_cache = 'api-especialidades'
+
+    def get_queryset(self):
+        # Un solo COUNT agrupado para toda la página en vez de uno por especialidad.
+        qs = super().get_queryset()
+        if usar_contadores_almacenados() or not self.campo_solicitado('cantidad_medicos'):
+            return qs
+        return anotar_cantidad_medicos(qs)
 
-class LaboratorioViewSet(viewsets.ModelViewSet):
+class LaboratorioViewSet(LecturaPorIdsMixin, SincronizacionMixin, CargaRelacionesMixin,
+                         CacheReferenciaMixin, GetCondicionalMixin, viewsets.ModelViewSet):
     """
     ViewSet para gestionar laboratorios vía API.
     """
@@ -92,10 +140,19 @@ class LaboratorioViewSet(viewsets.ModelViewSet):
     context_object_name = 'laboratorios'
     search_fields = ['nombre', 'pais']
     ordering_fields = ['nombre', 'pais']
+    grupo_cache = 'api-laboratorios'
 
-class PacienteViewSet(viewsets.ModelViewSet):
+    def get_queryset(self):
+        qs = super().get_queryset()
+        if usar_contadores_almacenados() or not self.campo_solicitado('cantidad_medicamentos'):
+            return qs
+        return anotar_cantidad_medicamentos(qs)
+
+class PacienteViewSet(LecturaPorIdsMixin, SincronizacionMixin, CargaMasivaMixin,
+                      CargaRelacionesMixin, GetCondicionalMixin, viewsets.ModelViewSet):
     """
     ViewSet para gestionar pacientes vía API.
+    `POST /api/pacientes/lote/` hace upsert por RUT.
     """
     queryset = Paciente.objects.all()
     serializer_class = PacienteSerializer
@@ -103,25 +160,30 @@ class PacienteViewSet(viewsets.ModelViewSet):
     template_name = 'paciente/lista.html'
     search_fields = ['nombre', 'apellido_paterno', 'apellido_materno', 'rut']
     ordering_fields = ['apellido_paterno', 'fecha_registro']
+    clave_lote = 'rut'
 
 
-class MedicoViewSet(viewsets.ModelViewSet):
+class MedicoViewSet(LecturaPorIdsMixin, SincronizacionMixin, CargaMasivaMixin,
+                    CargaRelacionesMixin, GetCondicionalMixin, viewsets.ModelViewSet):
     """
     ViewSet para gestionar médicos vía API.
-    Permite filtrar por especialidad.
+    Permite filtrar por especialidad. `POST /api/medicos/lote/` hace upsert por número de registro.
     """
     queryset = Medico.objects.all()
     serializer_class = MedicoSerializer
     filterset_class = MedicoFilter
     template_name = 'medico/lista.html'
-    search_fields = ['nombre', 'apellido_paterno', 'apellido_materno', 'especialidad__nombre']
+    search_fields = ['nombre', 'apellido_paterno', 'apellido_materno', 'rut', 'especialidad__nombre']
     ordering_fields = ['apellido_paterno', 'especialidad__nombre']
+    clave_lote = 'numero_registro'
 
 
-class ConsultaMedicaViewSet(viewsets.ModelViewSet):
+class ConsultaMedicaViewSet(LecturaPorIdsMixin, SincronizacionMixin, ExportacionMixin, CargaMasivaMixin,
+                            CargaRelacionesMixin, GetCondicionalMixin, viewsets.ModelViewSet):
     """
     ViewSet para gestionar consultas médicas vía API.
     Permite filtrar por médico, paciente y especialidad.
+    `POST /api/consultas/lote/` crea (o actualiza, si traen `id`) varias consultas.
     """
     queryset = ConsultaMedica.objects.all()
     serializer_class = ConsultaMedicaSerializer
@@ -129,9 +191,11 @@ class ConsultaMedicaViewSet(viewsets.ModelViewSet):
     template_name = 'consulta/lista.html'
     search_fields = ['paciente__nombre', 'medico__nombre', 'diagnostico']
     ordering_fields = ['fecha_hora', 'estado']
+    nombre_exportacion = 'consultas'
 
 
-class TratamientoViewSet(viewsets.ModelViewSet):
+class TratamientoViewSet(LecturaPorIdsMixin, SincronizacionMixin, ExportacionMixin,
+                         CargaRelacionesMixin, GetCondicionalMixin, viewsets.ModelViewSet):
     """
     ViewSet para gestionar tratamientos vía API.
     """
@@ -141,9 +205,11 @@ class TratamientoViewSet(viewsets.ModelViewSet):
     template_name = 'tratamiento/lista.html'
     search_fields = ['descripcion', 'indicaciones']
     ordering_fields = ['fecha_inicio', 'fecha_fin']
+    nombre_exportacion = 'tratamientos'
 
 
-class MedicamentoViewSet(viewsets.ModelViewSet):
+class MedicamentoViewSet(LecturaPorIdsMixin, SincronizacionMixin, CargaRelacionesMixin,
+                         CacheReferenciaMixin, GetCondicionalMixin, viewsets.ModelViewSet):
     """
     ViewSet para gestionar medicamentos vía API.
     """
@@ -151,13 +217,16 @@ class MedicamentoViewSet(viewsets.ModelViewSet):
     serializer_class = MedicamentoSerializer
     filterset_class = MedicamentoFilter
     template_name = 'medicamento/lista.html'
-    search_fields = ['nombre', 'principio_activo', 'laboratorio_nombre']
-    ordering_fields = ['nombre', 'laboratorio_nombre']
+    search_fields = ['nombre', 'principio_activo', 'laboratorio__nombre']
+    ordering_fields = ['nombre', 'laboratorio__nombre']
+    grupo_cache = 'api-medicamentos'
 
 
-class RecetaMedicaViewSet(viewsets.ModelViewSet):
+class RecetaMedicaViewSet(LecturaPorIdsMixin, SincronizacionMixin, ExportacionMixin, CargaMasivaMixin,
+                          CargaRelacionesMixin, GetCondicionalMixin, viewsets.ModelViewSet):
     """
     ViewSet para gestionar recetas médicas vía API.
+    `POST /api/recetas/lote/` crea (o actualiza, si traen `id`) varias recetas.
     """
     queryset = RecetaMedica.objects.all()
     serializer_class = RecetaMedicaSerializer
@@ -165,6 +234,7 @@ class RecetaMedicaViewSet(viewsets.ModelViewSet):
     template_name = 'receta/lista.html'
     search_fields = ['medicamento__nombre', 'dosis']
     ordering_fields = ['fecha_emision']
+    nombre_exportacion = 'recetas'
 
 
 # =============================================
@@ -175,13 +245,146 @@ def home(request):
     """
     Vista principal del sistema.
     """
-    context = {
-        'total_pacientes': Paciente.objects.filter(activo=True).count(),
-        'total_medicos': Medico.objects.filter(activo=True).count(),
-        'total_especialidades': Especialidad.objects.filter(activa=True).count(),
-        'total_consultas': ConsultaMedica.objects.count(),
+    # Contadores incrementales + caché (ver metricas.py): sin COUNT(*) por visita.
+    return render(request, 'home.html', metricas_tablero())
+
+
+# =============================================
+# AUTOCOMPLETADO DE FILTROS (JSON)
+# =============================================
+
+def autocompletar(request, campo):
+    """
+    Sugerencias por prefijo para los campos de texto de los filtros (ver autocompletar.py).
+    Uso: /api/autocompletar/paciente-rut/?q=12
+    """
+    try:
+        resultados = sugerencias(campo, request.GET.get('q', ''))
+    except KeyError:
+        raise Http404('Campo no disponible para autocompletar.')
+    return JsonResponse({'resultados': resultados})
+
+
+def buscar_entidad(request, entidad):
+    """
+    Búsqueda acotada para los selectores de paciente/médico (ver autocompletar.py).
+    Uso: /api/buscar/pacientes/?q=12.345  o  /api/buscar/medicos/?q=gonzalez
+    """
+    try:
+        resultados = buscar(entidad, request.GET.get('q', ''))
+    except KeyError:
+        raise Http404('Entidad no disponible para búsqueda.')
+    return JsonResponse({'resultados': resultados})
+
+
+@require_GET
+def agenda_disponibles(request):
+    """
+    Primeros horarios libres de los médicos activos de una especialidad (ver disponibilidad.py).
+    Uso: /api/agenda/disponibles/?especialidad=3&desde=2025-03-03&hasta=2025-04-30&duracion=30&limite=10
+    """
+    form = HorariosLibresForm(request.GET)
+    if not form.is_valid():
+        return JsonResponse({'errores': form.errors}, status=400)
+    datos = form.cleaned_data
+    libres = horarios_libres(
+        datos['especialidad'], datos['desde'], datos['hasta'],
+        duracion=datos['duracion'], limite=datos['limite'],
+    )
+    return JsonResponse({
+        'especialidad': datos['especialidad'].pk,
+        'duracion': datos['duracion'],
+        'resultados': [
+            {
+                'medico': libre['medico'].pk,
+                'medico_nombre': libre['medico'].nombre_completo,
+                'inicio': timezone.localtime(libre['inicio']),
+                'fin': timezone.localtime(libre['fin']),
+            }
+            for libre in libres
+        ],
+    })
+
+
+@require_GET
+def stock_proyeccion(request):
+    """
+    Medicamentos activos ordenados por días de stock restantes según su consumo (ver consumo.py).
+    Uso: /api/stock/proyeccion/?ventana=30&dias_maximos=14&limite=50
+    """
+    form = ProyeccionStockForm(request.GET)
+    if not form.is_valid():
+        return JsonResponse({'errores': form.errors}, status=400)
+    datos = form.cleaned_data
+    return JsonResponse({
+        'ventana': datos['ventana'],
+        'resultados': proyeccion(datos['ventana'], datos['dias_maximos'], datos['limite']),
+    })
+
+
+# =============================================
+# EXPORTACIÓN ANALÍTICA (ver analitica.py)
+# =============================================
+
+@require_GET
+def analitica_manifiesto(request):
+    """
+    Particiones disponibles de la exportación columnar, con su URL de descarga.
+    Uso: GET /api/analitica/
+    """
+    manifiesto = analitica.leer_manifiesto()
+    formato = manifiesto.get('formato')
+    tablas = {
+        tabla: [
+            dict(resumen, particion=particion or None, url=request.build_absolute_uri(
+                reverse('analitica_descargar', args=[tabla, particion or 'todo'])))
+            for particion, resumen in sorted(particiones.items())
+        ]
+        for tabla, particiones in manifiesto.get('tablas', {}).items()
     }
-    return render(request, 'home.html', context)
+    return JsonResponse({'formato': formato, 'generado': manifiesto.get('generado'), 'tablas': tablas})
+
+
+@require_GET
+def analitica_descargar(request, tabla, particion):
+    """
+    Descarga el archivo de una partición. Uso: GET /api/analitica/consultas/2025-01/
+    (`todo` para las tablas sin particionar, como medicamentos).
+    """
+    manifiesto = analitica.leer_manifiesto()
+    particion = '' if particion == 'todo' else particion
+    if particion not in manifiesto.get('tablas', {}).get(tabla, {}):
+        raise Http404('Partición no disponible.')
+    ruta = analitica.ruta_particion(analitica.directorio(), tabla, particion, manifiesto['formato'])
+    if not os.path.isfile(ruta):
+        # En el manifiesto pero sin archivo (exportación en curso o en otro directorio).
+        raise Http404('Partición no disponible.')
+    nombre = f"{tabla}-{particion or 'todo'}.{manifiesto['formato']}"
+    return FileResponse(open(ruta, 'rb'), as_attachment=True, filename=nombre)
+
+
+@require_POST
+def analitica_exportar(request):
+    """
+    Solicita actualizar la exportación (solo las particiones que cambiaron) y responde
+    202: la escribe la tarea `exportar_analitica` en el proceso de
+    `python manage.py ejecutar_tareas`, no esta petición.
+    Uso: POST /api/analitica/exportar/?tabla=consultas&formato=parquet
+    """
+    tablas = sorted(set(request.GET.getlist('tabla')))
+    formato = request.GET.get('formato', analitica.PARQUET)
+    if any(tabla not in analitica.TABLAS for tabla in tablas):
+        return JsonResponse({'detail': 'Tabla no disponible.'}, status=400)
+    if formato not in analitica.FORMATOS:
+        return JsonResponse({'detail': f'Formatos válidos: {", ".join(analitica.FORMATOS)}.'}, status=400)
+    if formato == analitica.PARQUET and not analitica.parquet_disponible():
+        return JsonResponse({'detail': 'El formato Parquet requiere pyarrow (pip install pyarrow).'}, status=400)
+    solicitud = tareas.solicitar('exportar_analitica', tablas=tablas or None, formato=formato)
+    return JsonResponse({
+        'solicitud': solicitud.pk,
+        'estado': solicitud.estado,
+        'manifiesto': request.build_absolute_uri(reverse('analitica_manifiesto')),
+    }, status=202)
 
 
 # =============================================
@@ -248,9 +451,11 @@ def especialidad_eliminar(request, pk):
 def paciente_lista(request):
     qs = Paciente.objects.all()
     filtro = PacienteFilter(request.GET, queryset=Paciente.objects.all())
+    pagina = paginar_keyset(request, PLAN_LISTA_PACIENTES.aplicar(filtro.qs))
     return render(request, 'paciente/lista.html', {
         'filter': filtro,
-        'pacientes': filtro.qs,
+        'pacientes': pagina.object_list,
+        'page_obj': pagina,
     })
 def paciente_crear(request):
     if request.method == 'POST':
@@ -347,10 +552,10 @@ def paciente_eliminar(request, pk):
 
 def medico_lista(request):
     """
-    Lista todos los médicos.
+    Lista los médicos paginados por keyset (ver `paginacion.py`).
     """
-    medicos = Medico.objects.all()
-    return render(request, 'medico/lista.html', {'medicos': medicos})
+    pagina = paginar_keyset(request, PLAN_LISTA_MEDICOS.aplicar(Medico.objects.all()))
+    return render(request, 'medico/lista.html', {'medicos': pagina.object_list, 'page_obj': pagina})
 
 
 def medico_crear(request):
@@ -406,17 +611,45 @@ Agregar este código al archivo views.py
 # =============================================
 
 def consulta_lista(request):
-    consultas = ConsultaMedica.objects.select_related('paciente', 'medico').order_by('-fecha_hora')
-    return render(request, 'consulta/lista.html', {'consultas': consultas})
+    pagina = paginar_keyset(request, PLAN_LISTA_CONSULTAS.aplicar(ConsultaMedica.objects.all()))
+    return render(request, 'consulta/lista.html', {'consultas': pagina.object_list, 'page_obj': pagina})
+
+def _leer_duracion(request, por_defecto):
+    try:
+        duracion = int(request.POST.get('duracion') or por_defecto)
+    except ValueError:
+        return None
+    return duracion if 5 <= duracion <= DURACION_MAXIMA_CONSULTA else None
+
+
+def _guardar_consulta(request, consulta):
+    """
+    Guarda `consulta` si respeta la agenda del médico (ver agenda.py); si no, agrega
+    los errores a `messages` y devuelve `False`.
+    """
+    errores = errores_agenda(consulta)
+    for mensajes in errores.values():
+        for mensaje in mensajes:
+            messages.error(request, mensaje)
+    if errores:
+        return False
+    try:
+        consulta.save()
+    except ConflictoAgenda as exc:
+        messages.error(request, str(exc))
+        return False
+    return True
+
 
 # CREAR
 def consulta_crear(request):
+    paciente = medico = None
     if request.method == 'POST':
         # 1) Buscar FK
         paciente_id = request.POST.get('paciente')
         medico_id = request.POST.get('medico')
         paciente = get_object_or_404(Paciente, pk=paciente_id, activo=True)
-        medico = get_object_or_404(Medico, pk=medico_id, activo=True)
+        medico = get_object_or_404(Medico.objects.select_related('especialidad'), pk=medico_id, activo=True)
 
         # 2) Parsear fecha y hora ("YYYY-MM-DDTHH:MM")
         fecha_str = request.POST.get('fecha_hora')  # ej. "2025-10-16T10:30"
@@ -432,36 +665,42 @@ def consulta_crear(request):
                 messages.error(request, 'Formato de fecha/hora inválido.')
                 dt = None
 
-            if dt:
-                ConsultaMedica.objects.create(
+            duracion = _leer_duracion(request, ConsultaMedica._meta.get_field('duracion').default)
+            if duracion is None:
+                messages.error(request, f'La duración debe estar entre 5 y {DURACION_MAXIMA_CONSULTA} minutos.')
+            elif dt:
+                consulta = ConsultaMedica(
                     paciente=paciente,
                     medico=medico,
                     fecha_hora=dt,
+                    duracion=duracion,
                     motivo_consulta=request.POST.get('motivo_consulta', '').strip(),
                     diagnostico=request.POST.get('diagnostico', '').strip(),
                     observaciones=request.POST.get('observaciones', '').strip(),
                     estado=request.POST.get('estado', 'AGENDADA'),
                 )
-                messages.success(request, 'Consulta creada exitosamente.')
-                return redirect('consulta_lista')
+                if _guardar_consulta(request, consulta):
+                    messages.success(request, 'Consulta creada exitosamente.')
+                    return redirect('consulta_lista')
 
-    # GET o POST con errores → volver a mostrar combos
-    pacientes = Paciente.objects.filter(activo=True).order_by('apellido_paterno', 'nombre')
-    medicos = Medico.objects.filter(activo=True).order_by('apellido_paterno', 'nombre')
+    # GET o POST con errores → volver a mostrar el formulario. Los selectores buscan
+    # en /api/buscar/...; aquí solo se renderiza lo ya elegido (si hubo POST).
     return render(request, 'consulta/crear.html', {
-        'pacientes': pacientes,
-        'medicos': medicos,
+        'selector_paciente': contexto_selector('pacientes', paciente),
+        'selector_medico': contexto_selector('medicos', medico),
     })
 
 # EDITAR
 def consulta_editar(request, pk):
-    consulta = get_object_or_404(ConsultaMedica, pk=pk)
+    consulta = get_object_or_404(
+        ConsultaMedica.objects.select_related('paciente', 'medico__especialidad'), pk=pk
+    )
 
     if request.method == 'POST':
         paciente_id = request.POST.get('paciente')
         medico_id = request.POST.get('medico')
         paciente = get_object_or_404(Paciente, pk=paciente_id, activo=True)
-        medico = get_object_or_404(Medico, pk=medico_id, activo=True)
+        medico = get_object_or_404(Medico.objects.select_related('especialidad'), pk=medico_id, activo=True)
 
         fecha_str = request.POST.get('fecha_hora')
         try:
@@ -472,24 +711,26 @@ def consulta_editar(request, pk):
             messages.error(request, 'Formato de fecha/hora inválido.')
             dt = None
 
-        if dt:
+        duracion = _leer_duracion(request, consulta.duracion)
+        if duracion is None:
+            messages.error(request, f'La duración debe estar entre 5 y {DURACION_MAXIMA_CONSULTA} minutos.')
+        elif dt:
             consulta.paciente = paciente
             consulta.medico = medico
             consulta.fecha_hora = dt
+            consulta.duracion = duracion
             consulta.motivo_consulta = request.POST.get('motivo_consulta', '').strip()
             consulta.diagnostico = request.POST.get('diagnostico', '').strip()
             consulta.observaciones = request.POST.get('observaciones', '').strip()
             consulta.estado = request.POST.get('estado', 'AGENDADA')
-            consulta.save()
-            messages.success(request, 'Consulta actualizada exitosamente.')
-            return redirect('consulta_lista')
+            if _guardar_consulta(request, consulta):
+                messages.success(request, 'Consulta actualizada exitosamente.')
+                return redirect('consulta_lista')
 
-    pacientes = Paciente.objects.filter(activo=True).order_by('apellido_paterno', 'nombre')
-    medicos = Medico.objects.filter(activo=True).order_by('apellido_paterno', 'nombre')
     return render(request, 'consulta/editar.html', {
         'consulta': consulta,
-        'pacientes': pacientes,
-        'medicos': medicos,
+        'selector_paciente': contexto_selector('pacientes', consulta.paciente),
+        'selector_medico': contexto_selector('medicos', consulta.medico),
     })
 
 # ELIMINAR
@@ -506,10 +747,10 @@ def consulta_eliminar(request, pk):
 
 def tratamiento_lista(request):
     """
-    Lista todos los tratamientos.
+    Lista los tratamientos paginados por keyset (ver `paginacion.py`).
     """
-    tratamientos = Tratamiento.objects.all()
-    return render(request, 'tratamiento/lista.html', {'tratamientos': tratamientos})
+    pagina = paginar_keyset(request, PLAN_LISTA_TRATAMIENTOS.aplicar(Tratamiento.objects.all()))
+    return render(request, 'tratamiento/lista.html', {'tratamientos': pagina.object_list, 'page_obj': pagina})
 
 def tratamiento_crear(request):
     if request.method == 'POST':
@@ -555,10 +796,10 @@ def tratamiento_eliminar(request, pk):
 
 def medicamento_lista(request):
     """
-    Lista todos los medicamentos.
+    Lista los medicamentos paginados por keyset (ver `paginacion.py`).
     """
-    medicamentos = Medicamento.objects.all()
-    return render(request, 'medicamento/lista.html', {'medicamentos': medicamentos})
+    pagina = paginar_keyset(request, PLAN_LISTA_MEDICAMENTOS.aplicar(Medicamento.objects.all()))
+    return render(request, 'medicamento/lista.html', {'medicamentos': pagina.object_list, 'page_obj': pagina})
 
 
 def medicamento_crear(request):
@@ -578,9 +819,13 @@ def medicamento_editar(request, pk):
     if request.method == 'POST':
         form = MedicamentoForm(request.POST, instance=medicamento)
         if form.is_valid():
-            form.save()
-            messages.success(request, 'Medicamento actualizado exitosamente.')
-            return redirect('medicamento_lista')
+            try:
+                form.save()
+            except StockInsuficiente as exc:
+                messages.error(request, str(exc))
+            else:
+                messages.success(request, 'Medicamento actualizado exitosamente.')
+                return redirect('medicamento_lista')
     else:
         form = MedicamentoForm(instance=medicamento)
     return render(request, 'medicamento/editar.html', {'form': form, 'medicamento': medicamento})
@@ -609,19 +854,23 @@ def medicamento_eliminar(request, pk):
 
 def receta_lista(request):
     """
-    Lista todas las recetas médicas.
+    Lista las recetas médicas paginadas por keyset (ver `paginacion.py`).
     """
-    recetas = RecetaMedica.objects.all()
-    return render(request, 'receta/lista.html', {'recetas': recetas})
+    pagina = paginar_keyset(request, PLAN_LISTA_RECETAS.aplicar(RecetaMedica.objects.all()))
+    return render(request, 'receta/lista.html', {'recetas': pagina.object_list, 'page_obj': pagina})
 
 
 def receta_crear(request):
     if request.method == 'POST':
         form = RecetaMedicaForm(request.POST)
         if form.is_valid():
-            form.save()
-            messages.success(request, 'Receta médica creada exitosamente.')
-            return redirect('receta_lista')
+            try:
+                form.save()
+            except StockInsuficiente as exc:
+                messages.error(request, str(exc))
+            else:
+                messages.success(request, 'Receta médica creada exitosamente.')
+                return redirect('receta_lista')
     else:
         form = RecetaMedicaForm()
     return render(request, 'receta/crear.html', {'form': form})
@@ -632,9 +881,13 @@ def receta_editar(request, pk):
     if request.method == 'POST':
         form = RecetaMedicaForm(request.POST, instance=receta)
         if form.is_valid():
-            form.save()
-            messages.success(request, 'Receta médica actualizada exitosamente.')
-            return redirect('receta_lista')
+            try:
+                form.save()
+            except StockInsuficiente as exc:
+                messages.error(request, str(exc))
+            else:
+                messages.success(request, 'Receta médica actualizada exitosamente.')
+                return redirect('receta_lista')
     else:
         form = RecetaMedicaForm(instance=receta)
     return render(request, 'receta/editar.html', {'form': form, 'receta': receta})
@@ -0,0 +1,100 @@
+/*
+ * Autocompletado por prefijo para campos de filtro.
+ *
+ * Cualquier <input data-autocompletar="/api/autocompletar/<campo>/"> pide sugerencias
+ * al servidor mientras el usuario escribe (mínimo 2 caracteres, con espera de 250 ms)
+ * y las muestra en un <datalist> asociado. Nada se consulta al cargar la página.
+ *
+ * Los selectores remotos (<input data-selector-remoto="/api/buscar/<entidad>/"
+ * data-destino="<id del input oculto>">) usan el mismo mecanismo, pero el servidor
+ * responde {id, texto}: al elegir una sugerencia se copia su id al <input type="hidden">.
+ * Mientras el texto no corresponda a una sugerencia elegida, el campo queda inválido.
+ */
+(function () {
+  'use strict';
+
+  var MIN_CARACTERES = 2;
+  var ESPERA_MS = 250;
+
+  function debounce(fn, ms) {
+    var temporizador;
+    return function () {
+      var args = arguments, self = this;
+      clearTimeout(temporizador);
+      temporizador = setTimeout(function () { fn.apply(self, args); }, ms);
+    };
+  }
+
+  function crearDatalist(input) {
+    var lista = document.createElement('datalist');
+    lista.id = (input.id || input.name) + '-sugerencias';
+    input.insertAdjacentElement('afterend', lista);
+    input.setAttribute('list', lista.id);
+    return lista;
+  }
+
+  function pintar(lista, valores) {
+    lista.innerHTML = '';
+    valores.forEach(function (valor) {
+      var opcion = document.createElement('option');
+      opcion.value = valor;
+      lista.appendChild(opcion);
+    });
+  }
+
+  function consultarAlEscribir(input, urlBase, alRecibir) {
+    var ultimo = null;
+    var controlador = null;
+
+    input.addEventListener('input', debounce(function () {
+      var q = input.value.trim();
+      if (q.length < MIN_CARACTERES || q === ultimo) { return; }
+      ultimo = q;
+      if (controlador) { controlador.abort(); }
+      controlador = new AbortController();
+
+      var url = urlBase + '?q=' + encodeURIComponent(q);
+      fetch(url, { signal: controlador.signal, headers: { 'Accept': 'application/json' } })
+        .then(function (r) { return r.ok ? r.json() : { resultados: [] }; })
+        .then(function (datos) { alRecibir(datos.resultados || []); })
+        .catch(function () { /* petición cancelada o sin red */ });
+    }, ESPERA_MS));
+  }
+
+  function activar(input) {
+    var lista = crearDatalist(input);
+    consultarAlEscribir(input, input.dataset.autocompletar, function (valores) {
+      pintar(lista, valores);
+    });
+  }
+
+  function activarSelector(input) {
+    var lista = crearDatalist(input);
+    var destino = document.getElementById(input.dataset.destino);
+    var idPorTexto = {};
+    if (destino.value) { idPorTexto[input.value] = destino.value; }
+
+    function validar() {
+      input.setCustomValidity(destino.value ? '' : 'Seleccione una opción de la lista.');
+    }
+
+    consultarAlEscribir(input, input.dataset.selectorRemoto, function (resultados) {
+      idPorTexto = {};
+      pintar(lista, resultados.map(function (r) {
+        idPorTexto[r.texto] = r.id;
+        return r.texto;
+      }));
+    });
+
+    input.addEventListener('input', function () {
+      destino.value = idPorTexto.hasOwnProperty(input.value) ? idPorTexto[input.value] : '';
+      validar();
+    });
+    validar();
+  }
+
+  document.addEventListener('DOMContentLoaded', function () {
+    document.querySelectorAll('input[data-autocompletar]').forEach(activar);
+    document.querySelectorAll('input[data-selector-remoto]').forEach(activarSelector);
+  });
+})();